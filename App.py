@@ -1,18 +1,34 @@
 import os
 import sys
+import asyncio
+import atexit
 import logging
 import time
 import base64
-from datetime import datetime
+import binascii
+import functools
+import queue
+import re
+import socket
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, time as dt_time
+from enum import Enum, IntEnum
 import pytz
 import random
 import sqlite3
 import json
+import requests
 
 from flask import Flask, request, abort
 import telebot
 from telebot import types
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED
 from apscheduler.triggers.cron import CronTrigger
 
 # PostgreSQL support
@@ -25,6 +41,14 @@ except ImportError:
     logger_temp = logging.getLogger(__name__)
     logger_temp.warning("psycopg2 not available, PostgreSQL features disabled")
 
+# asyncpg support (pool for the async data access layer)
+try:
+    import asyncpg
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    asyncpg = None
+    ASYNCPG_AVAILABLE = False
+
 # ────────────────────────────────────────────────
 #               Logging Setup
 # ────────────────────────────────────────────────
@@ -118,6 +142,32 @@ except ValueError as e:
 
 TIMEZONE = pytz.timezone("Asia/Riyadh")
 
+# Webhook updates slower than this are logged with their timing breakdown
+try:
+    SLOW_UPDATE_THRESHOLD_SECONDS = float(os.environ.get("SLOW_UPDATE_THRESHOLD_SECONDS", "1.0"))
+except ValueError:
+    logger.warning("⚠️ Invalid SLOW_UPDATE_THRESHOLD_SECONDS, using default 1.0")
+    SLOW_UPDATE_THRESHOLD_SECONDS = 1.0
+
+# Scheduled sends of each chat are shifted by a deterministic offset in
+# [0, SEND_JITTER_WINDOW_SECONDS) so chats sharing a default time do not
+# all fire in the same second (0 disables spreading)
+try:
+    SEND_JITTER_WINDOW_SECONDS = max(0, int(os.environ.get("SEND_JITTER_WINDOW_SECONDS", "300")))
+except ValueError:
+    logger.warning("⚠️ Invalid SEND_JITTER_WINDOW_SECONDS, using default 300")
+    SEND_JITTER_WINDOW_SECONDS = 300
+
+# Outbound Bot API budget shared by all traffic, and the part of it that
+# scheduled and low-priority sends must leave for interactive replies
+try:
+    API_RATE_LIMIT_PER_SECOND = float(os.environ.get("API_RATE_LIMIT_PER_SECOND", "30"))
+    API_INTERACTIVE_RESERVE = float(os.environ.get("API_INTERACTIVE_RESERVE", "5"))
+except ValueError:
+    logger.warning("⚠️ Invalid API_RATE_LIMIT_PER_SECOND/API_INTERACTIVE_RESERVE, using defaults 30/5")
+    API_RATE_LIMIT_PER_SECOND = 30.0
+    API_INTERACTIVE_RESERVE = 5.0
+
 WEBHOOK_PATH = "/webhook"
 RENDER_HOSTNAME = os.environ.get('RENDER_EXTERNAL_HOSTNAME', 'bot-8c0e.onrender.com')
 WEBHOOK_URL = f"https://{RENDER_HOSTNAME}{WEBHOOK_PATH}"
@@ -136,18 +186,657 @@ bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
 scheduler = BackgroundScheduler(timezone=TIMEZONE)
 scheduler.start()
 
+# ────────────────────────────────────────────────
+#               Metrics
+# ────────────────────────────────────────────────
+
+# Minimal Prometheus text exposition (format 0.0.4) without an extra
+# dependency. Metrics register themselves on creation and are rendered
+# by the /metrics endpoint.
+
+METRICS_NAMESPACE = "azkar"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SCHEDULER_LAG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+metrics_lock = threading.Lock()
+metrics_registry = []
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: str = "") -> str:
+    pairs = []
+    for name, value in zip(labelnames, labelvalues):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic counter, exposed as <namespace>_<name>_total."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = f"{METRICS_NAMESPACE}_{name}_total"
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        metrics_registry.append(self)
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with metrics_lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        return self.values.get(labelvalues, 0)
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with metrics_lock:
+            items = sorted(self.values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram, exposed as _bucket/_sum/_count series."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = f"{METRICS_NAMESPACE}_{name}"
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.values = {}  # labelvalues -> [per-bucket counts (+Inf last), sum, count]
+        metrics_registry.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with metrics_lock:
+            state = self.values.get(labelvalues)
+            if state is None:
+                state = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *labelvalues) -> int:
+        state = self.values.get(labelvalues)
+        return state[2] if state else 0
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with metrics_lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self.values.items())
+        for labelvalues, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Gauge:
+    """Gauge whose samples are read from a callback at scrape time."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple, read):
+        self.name = f"{METRICS_NAMESPACE}_{name}"
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.read = read  # () -> {labelvalues: value}
+        metrics_registry.append(self)
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labelvalues, value in sorted(self.read().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+def render_metrics() -> str:
+    """Render every registered metric in Prometheus text format."""
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+WEBHOOK_UPDATES = Counter("webhook_updates", "Updates received on the webhook", ("update_type",))
+HANDLER_SECONDS = Histogram("handler_duration_seconds", "Update handler latency", ("handler",))
+MESSAGES_SENT = Counter("messages_sent", "Outbound scheduled messages", ("category", "result"))
+TELEGRAM_ERRORS = Counter("telegram_errors", "Telegram API errors on outbound sends", ("error_class",))
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Database access latency", ("function",))
+SCHEDULER_JOB_LAG = Histogram("scheduler_job_lag_seconds", "Delay between scheduled and actual job start",
+                              ("job",), buckets=SCHEDULER_LAG_BUCKETS)
+SCHEDULER_JOBS_MISSED = Counter("scheduler_jobs_missed", "Jobs skipped past their misfire grace time", ("job",))
+CACHE_REQUESTS = Counter("cache_requests", "Cache lookups", ("cache", "result"))
+
+def timed_db_query(func):
+    """Decorator recording the latency of a database access function."""
+    if asyncio.iscoroutinefunction(func):
+        # Coroutines share a thread, so only the histogram is recorded
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                DB_QUERY_SECONDS.observe(time.perf_counter() - start, func.__qualname__)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        depth = getattr(update_timing, "db_depth", 0)
+        update_timing.db_depth = depth + 1
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            update_timing.db_depth = depth
+            DB_QUERY_SECONDS.observe(elapsed, func.__name__)
+            if depth == 0:
+                add_timing_segment("db", elapsed)
+    return wrapper
+
+def classify_telegram_error_code(error: Exception) -> str:
+    """Map a Telegram API error to a coarse class for metrics."""
+    code = getattr(error, "error_code", None)
+    if code == 400:
+        return "bad_request"
+    if code == 403:
+        return "forbidden"
+    if code == 429:
+        return "rate_limited"
+    if isinstance(code, int) and code >= 500:
+        return "server_error"
+    return "other"
+
+def record_send(category: str, result: str, error: Exception = None, chat_id: int = None,
+                latency: float = None):
+    """
+    Count an outbound send attempt and, on failure, its error class.
+    Attempts addressed to a chat are also appended to the delivery log,
+    with the time the API call took when the caller measured it.
+    """
+    MESSAGES_SENT.inc(category, result)
+    if error is not None:
+        TELEGRAM_ERRORS.inc(classify_telegram_error_code(error))
+    if chat_id is not None:
+        delivery_log.append(chat_id, category, result, getattr(error, "error_code", None), latency)
+
+def update_type_of(update: types.Update) -> str:
+    """Return the name of the populated payload field of an update."""
+    for field in ("message", "edited_message", "callback_query", "my_chat_member",
+                  "chat_member", "channel_post", "inline_query"):
+        if getattr(update, field, None) is not None:
+            return field
+    return "other"
+
+def job_kind(job_id: str) -> str:
+    """Strip the trailing chat_id from a job ID to keep label cardinality bounded."""
+    prefix, _, suffix = job_id.rpartition("_")
+    if prefix and suffix.lstrip("-").isdigit():
+        return prefix
+    return job_id
+
+def on_scheduler_event(event):
+    """Record scheduler lag on submission and count missed runs."""
+    if event.code == EVENT_JOB_SUBMITTED:
+        now = datetime.now(TIMEZONE)
+        for run_time in event.scheduled_run_times:
+            SCHEDULER_JOB_LAG.observe(max((now - run_time).total_seconds(), 0.0), job_kind(event.job_id))
+    elif event.code == EVENT_JOB_MISSED:
+        SCHEDULER_JOBS_MISSED.inc(job_kind(event.job_id))
+
+scheduler.add_listener(on_scheduler_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
+
+def instrument_bot_handlers():
+    """
+    Wrap every registered telebot handler so its latency is recorded per handler.
+    Safe to call more than once.
+    """
+    handler_lists = (bot.message_handlers, bot.edited_message_handlers,
+                     bot.callback_query_handlers, bot.my_chat_member_handlers,
+                     bot.chat_member_handlers)
+    for handlers in handler_lists:
+        for handler in handlers:
+            func = handler["function"]
+            if getattr(func, "_timed", False):
+                continue
+
+            def timed(update, _func=func):
+                if getattr(update_timing, "segments", None) is not None and update_timing.handler is None:
+                    update_timing.handler = _func.__name__
+                start = time.perf_counter()
+                try:
+                    return _func(update)
+                finally:
+                    HANDLER_SECONDS.observe(time.perf_counter() - start, _func.__name__)
+
+            timed._timed = True
+            timed.__name__ = func.__name__
+            handler["function"] = timed
+
+# ────────────────────────────────────────────────
+#               Update Timing
+# ────────────────────────────────────────────────
+
+# Each webhook update is timed end to end and split into DB time (outermost
+# timed_db_query calls), Telegram API time (every Bot API request) and the
+# remainder, attributed to the handler. State lives in a thread-local so
+# scheduled jobs running on other threads never pollute an update's budget.
+
+HANDLER_STATS_WINDOW = 512  # Samples kept per handler for percentiles
+HANDLER_QUANTILES = (0.5, 0.9, 0.99)
+
+update_timing = threading.local()
+api_sessions = threading.local()  # One requests.Session per thread, as telebot does
+
+class RecentLatencySummary:
+    """Summary with quantiles over the last HANDLER_STATS_WINDOW samples per label."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), window: int = HANDLER_STATS_WINDOW):
+        self.name = f"{METRICS_NAMESPACE}_{name}"
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.window = window
+        self.samples = {}  # labelvalues -> deque of recent values
+        self.totals = {}   # labelvalues -> [sum, count] over all samples
+        metrics_registry.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        with metrics_lock:
+            samples = self.samples.get(labelvalues)
+            if samples is None:
+                samples = self.samples[labelvalues] = deque(maxlen=self.window)
+                self.totals[labelvalues] = [0.0, 0]
+            samples.append(value)
+            totals = self.totals[labelvalues]
+            totals[0] += value
+            totals[1] += 1
+
+    def percentiles(self) -> dict:
+        """Return {labelvalues: {quantile: seconds}} over the recent window."""
+        with metrics_lock:
+            snapshot = {labels: sorted(samples) for labels, samples in self.samples.items()}
+        result = {}
+        for labels, values in snapshot.items():
+            result[labels] = {q: values[min(int(q * len(values)), len(values) - 1)] for q in HANDLER_QUANTILES}
+        return result
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} summary"]
+        percentiles = self.percentiles()
+        with metrics_lock:
+            totals = {labels: tuple(t) for labels, t in self.totals.items()}
+        for labelvalues in sorted(percentiles):
+            for q, value in percentiles[labelvalues].items():
+                labels = _format_labels(self.labelnames, labelvalues, f'quantile="{q}"')
+                lines.append(f"{self.name}{labels} {value}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {totals[labelvalues][0]}")
+            lines.append(f"{self.name}_count{labels} {totals[labelvalues][1]}")
+        return lines
+
+UPDATE_SECONDS = RecentLatencySummary("update_duration_seconds", "End-to-end webhook update latency (recent window)", ("handler",))
+UPDATE_SEGMENT_SECONDS = Histogram("update_segment_seconds", "Webhook update time by segment", ("segment",))
+
+def add_timing_segment(segment: str, seconds: float):
+    """Attribute time to a segment of the update being processed on this thread, if any."""
+    segments = getattr(update_timing, "segments", None)
+    if segments is not None:
+        segments[segment] = segments.get(segment, 0.0) + seconds
+
+def timed_api_request(method, url, **kwargs):
+    """
+    Request sender for telebot (apihelper.CUSTOM_REQUEST_SENDER) that
+    waits for the calling lane's share of the rate budget and attributes
+    Bot API round trips to the current update.
+    """
+    session = getattr(api_sessions, "session", None)
+    if session is None:
+        session = api_sessions.session = requests.Session()
+    acquire_api_slot()
+    start = time.perf_counter()
+    try:
+        return session.request(method, url, **kwargs)
+    finally:
+        add_timing_segment("api", time.perf_counter() - start)
+
+telebot.apihelper.CUSTOM_REQUEST_SENDER = timed_api_request
+
+def process_update_timed(update: types.Update):
+    """
+    Process a webhook update, recording its latency breakdown and logging it
+    when it takes longer than SLOW_UPDATE_THRESHOLD_SECONDS.
+    """
+    update_timing.segments = {"db": 0.0, "api": 0.0}
+    update_timing.handler = None
+    start = time.perf_counter()
+    try:
+        bot.process_new_updates([update])
+    finally:
+        total = time.perf_counter() - start
+        segments = update_timing.segments
+        handler = update_timing.handler or "unhandled"
+        update_timing.segments = None
+        update_timing.handler = None
+        record_update_timing(update, handler, total, segments)
+
+def record_update_timing(update: types.Update, handler: str, total: float, segments: dict):
+    """Record an update's breakdown and log it if it was slow."""
+    breakdown = {
+        "handler": max(total - segments["db"] - segments["api"], 0.0),
+        "db": segments["db"],
+        "api": segments["api"],
+    }
+    UPDATE_SECONDS.observe(total, handler)
+    for segment, seconds in breakdown.items():
+        UPDATE_SEGMENT_SECONDS.observe(seconds, segment)
+    
+    if total >= SLOW_UPDATE_THRESHOLD_SECONDS:
+        logger.warning(
+            f"🐢 Slow update {getattr(update, 'update_id', '?')} ({update_type_of(update)}) "
+            f"handled by {handler}: total={total * 1000:.0f}ms "
+            f"handler={breakdown['handler'] * 1000:.0f}ms db={breakdown['db'] * 1000:.0f}ms "
+            f"api={breakdown['api'] * 1000:.0f}ms"
+        )
+
+# ────────────────────────────────────────────────
+#               Outbound Priority Lanes
+# ────────────────────────────────────────────────
+
+# Every Bot API call takes a token from one shared bucket. Calls are
+# sorted into lanes: interactive (webhook handlers: callback answers,
+# panel edits), scheduled (timed azkar and reminders) and low (diverse
+# azkar). A lower lane may only take a token while more than its reserve
+# is left, so a 05:00 broadcast can never drain the budget that admin
+# replies need.
+
+API_LANE_INTERACTIVE = 0
+API_LANE_SCHEDULED = 1
+API_LANE_LOW = 2
+API_LANE_NAMES = {API_LANE_INTERACTIVE: "interactive", API_LANE_SCHEDULED: "scheduled", API_LANE_LOW: "low"}
+
+api_lane_context = threading.local()
+
+class PriorityRateLimiter:
+    """Token bucket where each lane must leave a reserve of tokens for the lanes above it."""
+
+    def __init__(self, rate: float, burst: float, reserves: dict, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        if burst < 1 + max(reserves.values(), default=0):
+            # The bucket could never hold enough tokens for that lane, which would wait forever
+            raise ValueError(f"burst {burst} cannot cover the largest lane reserve plus one token")
+        self.rate = rate
+        self.burst = burst
+        self.reserves = reserves  # lane -> tokens that must remain after taking one
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = burst
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def try_acquire(self, lane: int) -> float:
+        """Take a token if the lane may; otherwise return the seconds to wait."""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            needed = 1 + self.reserves.get(lane, 0)
+            if self.tokens >= needed:
+                self.tokens -= 1
+                return 0.0
+            return (needed - self.tokens) / self.rate
+
+    def acquire(self, lane: int) -> float:
+        """Block until the lane gets a token; return the time spent waiting."""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire(lane)
+            if wait <= 0:
+                return waited
+            self.sleep(wait)
+            waited += wait
+
+def api_budget(rate: float, reserve: float) -> tuple:
+    """
+    Turn the configured rate and interactive reserve into a usable budget,
+    logging a warning for each value that had to be adjusted. The bucket
+    holds one second of tokens (at least one), and the low lane needs
+    1 + 2 * reserve of them, so the reserve is capped to fit.
+    
+    Returns:
+        tuple: (rate, burst, reserve)
+    """
+    if rate <= 0:
+        logger.warning(f"⚠️ API_RATE_LIMIT_PER_SECOND must be positive, got {rate:g}; using default 30")
+        rate = 30.0
+    burst = max(rate, 1.0)
+    max_reserve = (burst - 1) / 2
+    if not 0 <= reserve <= max_reserve:
+        clamped = min(max(reserve, 0.0), max_reserve)
+        logger.warning(f"⚠️ API_INTERACTIVE_RESERVE {reserve:g} does not fit a burst of {burst:g} "
+                       f"(allowed 0-{max_reserve:g}); using {clamped:g}")
+        reserve = clamped
+    return rate, burst, reserve
+
+def build_api_limiter(rate: float, reserve: float) -> PriorityRateLimiter:
+    """Create the shared limiter with the lane reserves derived from the interactive reserve."""
+    rate, burst, reserve = api_budget(rate, reserve)
+    return PriorityRateLimiter(
+        rate=rate,
+        burst=burst,
+        reserves={
+            API_LANE_INTERACTIVE: 0,
+            API_LANE_SCHEDULED: reserve,
+            API_LANE_LOW: reserve * 2,
+        },
+    )
+
+api_limiter = build_api_limiter(API_RATE_LIMIT_PER_SECOND, API_INTERACTIVE_RESERVE)
+
+API_CALLS = Counter("api_calls", "Outbound Bot API calls", ("lane",))
+API_LANE_WAIT_SECONDS = Histogram("api_lane_wait_seconds", "Time spent waiting for the rate budget", ("lane",))
+
+def current_api_lane() -> int:
+    """Return the lane of the calling thread: explicit, else interactive inside an update."""
+    lane = getattr(api_lane_context, "lane", None)
+    if lane is not None:
+        return lane
+    if getattr(update_timing, "segments", None) is not None:
+        return API_LANE_INTERACTIVE
+    return API_LANE_SCHEDULED
+
+def with_api_lane(lane: int):
+    """Decorator running a function's Bot API calls in the given lane."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = getattr(api_lane_context, "lane", None)
+            api_lane_context.lane = lane
+            try:
+                return func(*args, **kwargs)
+            finally:
+                api_lane_context.lane = previous
+        return wrapper
+    return decorator
+
+def acquire_api_slot():
+    """Wait for the current lane's turn before a Bot API call."""
+    lane = current_api_lane()
+    name = API_LANE_NAMES[lane]
+    waited = api_limiter.acquire(lane)
+    API_CALLS.inc(name)
+    if waited:
+        API_LANE_WAIT_SECONDS.observe(waited, name)
+
 # ────────────────────────────────────────────────
 #               Database
 # ────────────────────────────────────────────────
 
 DB_FILE = "bot_settings.db"
 
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+# SQLite tuning for several workers sharing one file: WAL lets readers run
+# alongside the writer, synchronous=NORMAL is durable under WAL except on
+# power loss, and the busy timeout makes writers wait for the lock instead
+# of failing with "database is locked".
+try:
+    SQLITE_BUSY_TIMEOUT_MS = max(0, int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")))
+except ValueError:
+    logger.warning("⚠️ Invalid SQLITE_BUSY_TIMEOUT_MS, using default 5000")
+    SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_MMAP_SIZE = 64 * 1024 * 1024
+SQLITE_CACHED_STATEMENTS = 256
+
+# Bound parameters per statement. SQLite before 3.32 allows at most 999, so
+# batched statements on either backend are sized against this.
+SQL_MAX_PARAMETERS = 999
+
+def connect_sqlite() -> sqlite3.Connection:
+    """Open a tuned connection to DB_FILE."""
+    conn = sqlite3.connect(DB_FILE, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=SQLITE_CACHED_STATEMENTS)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    return conn
+
+# Boolean chat settings packed into chat_settings.flags: bit i is set when
+# CHAT_SETTING_FLAGS[i] is enabled. The per-flag columns are still written
+# on every change so an older release can read them, but only flags is read.
+CHAT_SETTING_FLAGS = (
+    ("is_enabled", 1),
+    ("morning_azkar", 1),
+    ("evening_azkar", 1),
+    ("friday_sura", 1),
+    ("friday_dua", 1),
+    ("sleep_message", 1),
+    ("delete_service_messages", 1),
+    ("media_enabled", 0),
+    ("send_media_with_morning", 0),
+    ("send_media_with_evening", 0),
+    ("send_media_with_friday", 0),
+)
+CHAT_FLAG_BITS = {key: 1 << bit for bit, (key, _) in enumerate(CHAT_SETTING_FLAGS)}
+CHAT_FLAGS_MASK = (1 << len(CHAT_SETTING_FLAGS)) - 1
+CHAT_FLAGS_DEFAULT = sum(CHAT_FLAG_BITS[key] for key, default in CHAT_SETTING_FLAGS if default)  # 127
+
+# Backfill expression computing flags from the per-flag columns
+CHAT_FLAGS_FROM_COLUMNS_SQL = " + ".join(
+    f"CASE WHEN COALESCE({key}, {default}) <> 0 THEN {CHAT_FLAG_BITS[key]} ELSE 0 END"
+    for key, default in CHAT_SETTING_FLAGS
+)
+
+def chat_flags_sql(*keys, column: str = "flags") -> str:
+    """
+    SQL condition that every given flag is set, for filtering chat_settings
+    rows with one bitwise test, e.g. chat_flags_sql("is_enabled", column="s.flags").
+    """
+    mask = 0
+    for key in keys:
+        mask |= CHAT_FLAG_BITS[key]
+    return f"({column} & {mask}) = {mask}"
+
+# SET clause that disables a chat in both representations
+CHAT_DISABLE_SQL = f"is_enabled = 0, flags = flags & {CHAT_FLAGS_MASK ^ CHAT_FLAG_BITS['is_enabled']}"
+
+# ────────────────────────────────────────────────
+#               Schema Migrations
+# ────────────────────────────────────────────────
+
+# Numbered migrations for each backend. schema_version records the applied
+# versions, so a worker boot against an up-to-date database costs a single
+# SELECT. New schema changes are appended as the next version for both
+# backends, so a version number means the same schema on each; a change
+# that only applies to one backend gets an entry without steps on the
+# other. Existing entries are never edited.
+#
+# A step is either an SQL string or a callable taking the cursor.
+
+SchemaMigration = namedtuple("SchemaMigration", ["version", "description", "steps"])
+
+SCHEMA_VERSION_LOCK_ID = 7_403_221  # pg_advisory_xact_lock key serializing migrating workers
+
+def table_columns(c, table: str, is_postgres: bool) -> set:
+    """Column names of a table, empty when the table does not exist."""
+    if is_postgres:
+        c.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+        return {row[0] for row in c.fetchall()}
+    c.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in c.fetchall()}
+
+def add_missing_columns(table: str, columns: tuple, is_postgres: bool, on_added=None):
+    """
+    Build a migration step adding columns a pre-versioning database may lack.
     
-    # Main chat settings table
-    c.execute('''
+    Args:
+        table (str): Table name
+        columns (tuple): (name, definition) pairs
+        is_postgres (bool): Backend the step runs on
+        on_added (callable): Called with the cursor and the column name after
+            each column actually added, e.g. to backfill it
+    """
+    def step(c):
+        existing = table_columns(c, table, is_postgres)
+        for name, definition in columns:
+            if name in existing:
+                continue
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+            logger.info(f"Added {name} column to {table}")
+            if on_added:
+                on_added(c, name)
+    return step
+
+def backfill_chat_flags(c, column: str):
+    """Compute chat_settings.flags from the per-flag columns once it is added."""
+    if column == "flags":
+        c.execute(f"UPDATE chat_settings SET flags = {CHAT_FLAGS_FROM_COLUMNS_SQL}")
+
+# Tables carrying the per-row updated_at stamp (milliseconds since the epoch)
+# kept by the v4 triggers. db_sync.py reconciles diverged SQLite and
+# PostgreSQL copies of these rows by it. A write that sets updated_at itself,
+# as db_sync.py does when copying a row, keeps its value.
+STAMPED_TABLES = ("chat_settings", "diverse_azkar_settings", "ramadan_settings",
+                  "hajj_eid_settings", "fasting_reminders", "admins")
+
+SQLITE_NOW_MS_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+def sqlite_updated_at_steps(table: str) -> tuple:
+    """Migration steps adding updated_at to a SQLite table with the triggers maintaining it."""
+    touch = f"BEGIN UPDATE {table} SET updated_at = {SQLITE_NOW_MS_SQL} WHERE rowid = NEW.rowid; END"
+    return (
+        add_missing_columns(table, (("updated_at", "INTEGER DEFAULT 0"),), is_postgres=False),
+        f"CREATE TRIGGER IF NOT EXISTS {table}_touch_insert AFTER INSERT ON {table} "
+        f"FOR EACH ROW WHEN NEW.updated_at = 0 {touch}",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_touch_update AFTER UPDATE ON {table} "
+        f"FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at {touch}",
+    )
+
+def postgres_updated_at_steps(table: str) -> tuple:
+    """Migration steps adding updated_at to a PostgreSQL table with the trigger maintaining it."""
+    return (
+        add_missing_columns(table, (("updated_at", "BIGINT DEFAULT 0"),), is_postgres=True),
+        f"DROP TRIGGER IF EXISTS {table}_touch ON {table}",
+        f"CREATE TRIGGER {table}_touch BEFORE INSERT OR UPDATE ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION touch_updated_at()",
+    )
+
+POSTGRES_TOUCH_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+    BEGIN
+        IF (TG_OP = 'INSERT' AND COALESCE(NEW.updated_at, 0) = 0)
+           OR (TG_OP = 'UPDATE' AND NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at) THEN
+            NEW.updated_at := (EXTRACT(EPOCH FROM clock_timestamp()) * 1000)::BIGINT;
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+'''
+
+SQLITE_MIGRATIONS = (
+    SchemaMigration(1, "Initial tables", (
+        '''
         CREATE TABLE IF NOT EXISTS chat_settings (
             chat_id INTEGER PRIMARY KEY,
             is_enabled INTEGER DEFAULT 1,
@@ -164,24 +853,27 @@ def init_db():
             media_type TEXT DEFAULT 'images',
             send_media_with_morning INTEGER DEFAULT 0,
             send_media_with_evening INTEGER DEFAULT 0,
-            send_media_with_friday INTEGER DEFAULT 0
+            send_media_with_friday INTEGER DEFAULT 0,
+            flags INTEGER DEFAULT 127
         )
-    ''')
-    
-    # Diverse azkar settings table for interval-based sending
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS diverse_azkar_settings (
             chat_id INTEGER PRIMARY KEY,
             enabled INTEGER DEFAULT 0,
             interval_minutes INTEGER DEFAULT 60,
             media_type TEXT DEFAULT 'text',
             last_sent_timestamp INTEGER DEFAULT 0,
+            enable_audio INTEGER DEFAULT 1,
+            enable_images INTEGER DEFAULT 1,
+            enable_pdf INTEGER DEFAULT 1,
+            enable_text INTEGER DEFAULT 1,
+            next_due INTEGER DEFAULT NULL,
+            sent_count INTEGER DEFAULT 0,
             FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
         )
-    ''')
-    
-    # Ramadan settings table
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS ramadan_settings (
             chat_id INTEGER PRIMARY KEY,
             ramadan_enabled INTEGER DEFAULT 1,
@@ -191,10 +883,8 @@ def init_db():
             media_type TEXT DEFAULT 'images',
             FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
         )
-    ''')
-    
-    # Hajj and Eid settings table
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS hajj_eid_settings (
             chat_id INTEGER PRIMARY KEY,
             arafah_day_enabled INTEGER DEFAULT 1,
@@ -205,10 +895,8 @@ def init_db():
             media_type TEXT DEFAULT 'images',
             FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
         )
-    ''')
-    
-    # Fasting reminders settings table
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS fasting_reminders (
             chat_id INTEGER PRIMARY KEY,
             monday_thursday_enabled INTEGER DEFAULT 1,
@@ -216,10 +904,8 @@ def init_db():
             reminder_time TEXT DEFAULT '21:00',
             FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
         )
-    ''')
-    
-    # Admin/supervisor information table
-    c.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS admins (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
@@ -231,260 +917,1051 @@ def init_db():
             added_at INTEGER DEFAULT (strftime('%s', 'now')),
             UNIQUE(user_id, chat_id)
         )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized with all tables")
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            message_index INTEGER NOT NULL,
+            media_type TEXT,
+            due_at INTEGER NOT NULL,
+            deadline_at INTEGER,
+            claimed_by TEXT,
+            claimed_until INTEGER DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            UNIQUE(chat_id, category, due_at, message_index)
+        )
+        ''',
+    )),
+    # Databases created before schema versioning may lack some columns
+    SchemaMigration(2, "Columns added before schema versioning", (
+        add_missing_columns("diverse_azkar_settings", (
+            ("enable_audio", "INTEGER DEFAULT 1"),
+            ("enable_images", "INTEGER DEFAULT 1"),
+            ("enable_pdf", "INTEGER DEFAULT 1"),
+            ("enable_text", "INTEGER DEFAULT 1"),
+            ("next_due", "INTEGER DEFAULT NULL"),
+            ("sent_count", "INTEGER DEFAULT 0"),
+        ), is_postgres=False),
+        add_missing_columns("outbox", (("deadline_at", "INTEGER"),), is_postgres=False),
+        add_missing_columns("chat_settings", (("flags", f"INTEGER DEFAULT {CHAT_FLAGS_DEFAULT}"),),
+                            is_postgres=False, on_added=backfill_chat_flags),
+    )),
+    # Lookups by user_id are covered by the UNIQUE(user_id, chat_id) index and
+    # chat_id < 0 scans by the primary key; these cover the remaining hot paths.
+    SchemaMigration(3, "Indexes for enabled chats and per-chat admin lookups", (
+        f"CREATE INDEX IF NOT EXISTS idx_chat_settings_enabled ON chat_settings(chat_id) "
+        f"WHERE {chat_flags_sql('is_enabled')}",
+        "CREATE INDEX IF NOT EXISTS idx_admins_chat ON admins(chat_id, is_primary_admin, user_id)",
+    )),
+    SchemaMigration(4, "Per-row updated_at stamps for reconciling backends",
+                    tuple(step for table in STAMPED_TABLES for step in sqlite_updated_at_steps(table))),
+    # Only SQLite has it: writes made while PostgreSQL is down, see WriteJournal
+    SchemaMigration(5, "Journal of writes awaiting PostgreSQL", (
+        '''
+        CREATE TABLE IF NOT EXISTS pg_write_journal (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            statements TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+        ''',
+    )),
+    SchemaMigration(6, "Delivery log and its day rollups", (
+        '''
+        CREATE TABLE IF NOT EXISTS delivery_log (
+            sent_at INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            result INTEGER NOT NULL,
+            error_code INTEGER,
+            latency_ms INTEGER,
+            messages INTEGER NOT NULL DEFAULT 1
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_delivery_log_sent_at ON delivery_log(sent_at)",
+        '''
+        CREATE TABLE IF NOT EXISTS delivery_daily (
+            chat_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            result INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            messages INTEGER NOT NULL DEFAULT 0,
+            latency_ms_sum INTEGER NOT NULL DEFAULT 0,
+            latency_samples INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, day, category, result)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_delivery_daily_day ON delivery_daily(day)",
+    )),
+    SchemaMigration(7, "Replay claims on the write journal", (
+        add_missing_columns("pg_write_journal", (("claimed_by", "TEXT"), ("claimed_until", "INTEGER")),
+                            is_postgres=False),
+    )),
+    SchemaMigration(8, "Settled marker on outbox rows", (
+        add_missing_columns("outbox", (("settled_at", "INTEGER"),), is_postgres=False),
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(id) WHERE settled_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_settled ON outbox(settled_at) WHERE settled_at IS NOT NULL",
+    )),
+)
+
+POSTGRES_MIGRATIONS = (
+    SchemaMigration(1, "Initial tables", (
+        '''
+        CREATE TABLE IF NOT EXISTS chat_settings (
+            chat_id BIGINT PRIMARY KEY,
+            is_enabled INTEGER DEFAULT 1,
+            morning_azkar INTEGER DEFAULT 1,
+            evening_azkar INTEGER DEFAULT 1,
+            friday_sura INTEGER DEFAULT 1,
+            friday_dua INTEGER DEFAULT 1,
+            sleep_message INTEGER DEFAULT 1,
+            delete_service_messages INTEGER DEFAULT 1,
+            morning_time TEXT DEFAULT '05:00',
+            evening_time TEXT DEFAULT '18:00',
+            sleep_time TEXT DEFAULT '22:00',
+            media_enabled INTEGER DEFAULT 0,
+            media_type TEXT DEFAULT 'images',
+            send_media_with_morning INTEGER DEFAULT 0,
+            send_media_with_evening INTEGER DEFAULT 0,
+            send_media_with_friday INTEGER DEFAULT 0,
+            flags INTEGER DEFAULT 127
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS diverse_azkar_settings (
+            chat_id BIGINT PRIMARY KEY,
+            enabled INTEGER DEFAULT 0,
+            interval_minutes INTEGER DEFAULT 60,
+            media_type TEXT DEFAULT 'text',
+            last_sent_timestamp BIGINT DEFAULT 0,
+            enable_audio INTEGER DEFAULT 1,
+            enable_images INTEGER DEFAULT 1,
+            enable_pdf INTEGER DEFAULT 1,
+            enable_text INTEGER DEFAULT 1,
+            next_due BIGINT DEFAULT NULL,
+            sent_count INTEGER DEFAULT 0,
+            FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ramadan_settings (
+            chat_id BIGINT PRIMARY KEY,
+            ramadan_enabled INTEGER DEFAULT 1,
+            laylat_alqadr_enabled INTEGER DEFAULT 1,
+            last_ten_days_enabled INTEGER DEFAULT 1,
+            iftar_dua_enabled INTEGER DEFAULT 1,
+            media_type TEXT DEFAULT 'images',
+            FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS hajj_eid_settings (
+            chat_id BIGINT PRIMARY KEY,
+            arafah_day_enabled INTEGER DEFAULT 1,
+            eid_eve_enabled INTEGER DEFAULT 1,
+            eid_day_enabled INTEGER DEFAULT 1,
+            eid_adha_enabled INTEGER DEFAULT 1,
+            hajj_enabled INTEGER DEFAULT 1,
+            media_type TEXT DEFAULT 'images',
+            FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS fasting_reminders (
+            chat_id BIGINT PRIMARY KEY,
+            monday_thursday_enabled INTEGER DEFAULT 1,
+            arafah_reminder_enabled INTEGER DEFAULT 1,
+            reminder_time TEXT DEFAULT '21:00',
+            FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS admins (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            is_primary_admin INTEGER DEFAULT 0,
+            added_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW()),
+            UNIQUE(user_id, chat_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            category TEXT NOT NULL,
+            message_index INTEGER NOT NULL,
+            media_type TEXT,
+            due_at BIGINT NOT NULL,
+            deadline_at BIGINT,
+            claimed_by TEXT,
+            claimed_until BIGINT DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            UNIQUE(chat_id, category, due_at, message_index)
+        )
+        ''',
+    )),
+    # Databases created before schema versioning may lack some columns
+    SchemaMigration(2, "Columns added before schema versioning", (
+        add_missing_columns("diverse_azkar_settings", (
+            ("enable_audio", "INTEGER DEFAULT 1"),
+            ("enable_images", "INTEGER DEFAULT 1"),
+            ("enable_pdf", "INTEGER DEFAULT 1"),
+            ("enable_text", "INTEGER DEFAULT 1"),
+            ("next_due", "BIGINT DEFAULT NULL"),
+            ("sent_count", "INTEGER DEFAULT 0"),
+        ), is_postgres=True),
+        add_missing_columns("outbox", (("deadline_at", "BIGINT"),), is_postgres=True),
+        add_missing_columns("chat_settings", (("flags", f"INTEGER DEFAULT {CHAT_FLAGS_DEFAULT}"),),
+                            is_postgres=True, on_added=backfill_chat_flags),
+    )),
+    SchemaMigration(3, "Indexes for enabled chats and per-chat admin lookups", (
+        f"CREATE INDEX IF NOT EXISTS idx_chat_settings_enabled ON chat_settings(chat_id) "
+        f"WHERE {chat_flags_sql('is_enabled')}",
+        "CREATE INDEX IF NOT EXISTS idx_admins_chat ON admins(chat_id, is_primary_admin, user_id)",
+    )),
+    SchemaMigration(4, "Per-row updated_at stamps for reconciling backends",
+                    (POSTGRES_TOUCH_FUNCTION,) +
+                    tuple(step for table in STAMPED_TABLES for step in postgres_updated_at_steps(table))),
+    # The journal is kept in SQLite; this entry keeps the versions in step
+    SchemaMigration(5, "Journal of writes awaiting PostgreSQL", ()),
+    # Rows are appended in sent_at order, so a BRIN index covers retention
+    # pruning at a fraction of a B-tree's size and insert cost
+    SchemaMigration(6, "Delivery log and its day rollups", (
+        '''
+        CREATE TABLE IF NOT EXISTS delivery_log (
+            sent_at BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            category TEXT NOT NULL,
+            result SMALLINT NOT NULL,
+            error_code SMALLINT,
+            latency_ms INTEGER,
+            messages SMALLINT NOT NULL DEFAULT 1
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_delivery_log_sent_at ON delivery_log USING BRIN (sent_at)",
+        '''
+        CREATE TABLE IF NOT EXISTS delivery_daily (
+            chat_id BIGINT NOT NULL,
+            day INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            result SMALLINT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            messages INTEGER NOT NULL DEFAULT 0,
+            latency_ms_sum BIGINT NOT NULL DEFAULT 0,
+            latency_samples INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, day, category, result)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_delivery_daily_day ON delivery_daily(day)",
+    )),
+    SchemaMigration(7, "Replay claims on the write journal", ()),
+    SchemaMigration(8, "Settled marker on outbox rows", (
+        add_missing_columns("outbox", (("settled_at", "BIGINT"),), is_postgres=True),
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(id) WHERE settled_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_settled ON outbox(settled_at) WHERE settled_at IS NOT NULL",
+    )),
+)
 
-def migrate_db():
-    """Apply database migrations for new fields."""
-    conn = sqlite3.connect(DB_FILE)
+def run_schema_migrations(conn, migrations: tuple, is_postgres: bool) -> int:
+    """
+    Bring a database up to the last of `migrations`. When it is already
+    there this is a single SELECT on schema_version. Otherwise the pending
+    migrations run in one transaction holding a write lock, so concurrently
+    booting workers apply each version exactly once.
+    
+    Args:
+        conn: Open database connection
+        migrations (tuple): SchemaMigration entries in version order
+        is_postgres (bool): Whether conn is a PostgreSQL connection
+        
+    Returns:
+        int: Schema version after the run
+    """
+    target = migrations[-1].version
     c = conn.cursor()
+    try:
+        c.execute("SELECT MAX(version) FROM schema_version")
+        current = c.fetchone()[0] or 0
+    except Exception:
+        conn.rollback()  # No schema_version table yet
+        current = 0
+    if current == target:
+        return current
     
+    placeholder = "%s" if is_postgres else "?"
+    if is_postgres:
+        c.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_VERSION_LOCK_ID,))
+    else:
+        conn.isolation_level = None  # Explicit transaction so DDL and version rows commit together
+        c.execute("BEGIN IMMEDIATE")
     try:
-        # Check if media format fields exist in diverse_azkar_settings
-        c.execute("PRAGMA table_info(diverse_azkar_settings)")
-        columns = [col[1] for col in c.fetchall()]
-        
-        # Add new media format fields if they don't exist
-        if 'enable_audio' not in columns:
-            c.execute("ALTER TABLE diverse_azkar_settings ADD COLUMN enable_audio INTEGER DEFAULT 1")
-            logger.info("Added enable_audio column to diverse_azkar_settings")
-        
-        if 'enable_images' not in columns:
-            c.execute("ALTER TABLE diverse_azkar_settings ADD COLUMN enable_images INTEGER DEFAULT 1")
-            logger.info("Added enable_images column to diverse_azkar_settings")
-        
-        if 'enable_pdf' not in columns:
-            c.execute("ALTER TABLE diverse_azkar_settings ADD COLUMN enable_pdf INTEGER DEFAULT 1")
-            logger.info("Added enable_pdf column to diverse_azkar_settings")
-        
-        if 'enable_text' not in columns:
-            c.execute("ALTER TABLE diverse_azkar_settings ADD COLUMN enable_text INTEGER DEFAULT 1")
-            logger.info("Added enable_text column to diverse_azkar_settings")
-        
-        conn.commit()
-        logger.info("Database migration completed successfully")
-    except Exception as e:
-        logger.error(f"Error during database migration: {e}", exc_info=True)
-        try:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at BIGINT NOT NULL
+            )
+        ''')
+        # Another worker may have migrated while we waited for the lock
+        c.execute("SELECT MAX(version) FROM schema_version")
+        current = c.fetchone()[0] or 0
+        for migration in migrations:
+            if migration.version <= current:
+                continue
+            for step in migration.steps:
+                if callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            c.execute(
+                f"INSERT INTO schema_version (version, description, applied_at) VALUES ({placeholder}, {placeholder}, {placeholder})",
+                (migration.version, migration.description, int(time.time()))
+            )
+            logger.info(f"Applied schema migration {migration.version}: {migration.description}")
+            current = migration.version
+        if is_postgres:
+            conn.commit()
+        else:
+            c.execute("COMMIT")
+        return current
+    except Exception:
+        if is_postgres:
             conn.rollback()
-            logger.warning("Database migration rolled back")
-        except Exception:
-            pass
-    finally:
-        if conn:
-            conn.close()
-
-init_db()
-migrate_db()
+        else:
+            c.execute("ROLLBACK")
+        raise
 
-def init_postgres_db():
-    """Initialize PostgreSQL database tables if DATABASE_URL is configured."""
-    if not (DATABASE_URL and POSTGRES_AVAILABLE):
-        return
-    
+def migrate_sqlite_schema() -> int:
+    """Switch DB_FILE to WAL (persistent in the file) and apply pending SQLite migrations."""
+    conn = connect_sqlite()
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
-            with conn.cursor() as c:
-                # Main chat settings table
-                c.execute('''
-                    CREATE TABLE IF NOT EXISTS chat_settings (
-                        chat_id BIGINT PRIMARY KEY,
-                        is_enabled INTEGER DEFAULT 1,
-                        morning_azkar INTEGER DEFAULT 1,
-                        evening_azkar INTEGER DEFAULT 1,
-                        friday_sura INTEGER DEFAULT 1,
-                        friday_dua INTEGER DEFAULT 1,
-                        sleep_message INTEGER DEFAULT 1,
-                        delete_service_messages INTEGER DEFAULT 1,
-                        morning_time TEXT DEFAULT '05:00',
-                        evening_time TEXT DEFAULT '18:00',
-                        sleep_time TEXT DEFAULT '22:00',
-                        media_enabled INTEGER DEFAULT 0,
-                        media_type TEXT DEFAULT 'images',
-                        send_media_with_morning INTEGER DEFAULT 0,
-                        send_media_with_evening INTEGER DEFAULT 0,
-                        send_media_with_friday INTEGER DEFAULT 0
-                    )
-                ''')
-                
-                # Diverse azkar settings table
-                c.execute('''
-                    CREATE TABLE IF NOT EXISTS diverse_azkar_settings (
-                        chat_id BIGINT PRIMARY KEY,
-                        enabled INTEGER DEFAULT 0,
-                        interval_minutes INTEGER DEFAULT 60,
-                        media_type TEXT DEFAULT 'text',
-                        last_sent_timestamp BIGINT DEFAULT 0,
-                        FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
-                    )
-                ''')
-                
-                # Ramadan settings table
-                c.execute('''
-                    CREATE TABLE IF NOT EXISTS ramadan_settings (
-                        chat_id BIGINT PRIMARY KEY,
-                        ramadan_enabled INTEGER DEFAULT 1,
-                        laylat_alqadr_enabled INTEGER DEFAULT 1,
-                        last_ten_days_enabled INTEGER DEFAULT 1,
-                        iftar_dua_enabled INTEGER DEFAULT 1,
-                        media_type TEXT DEFAULT 'images',
-                        FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
-                    )
-                ''')
-                
-                # Hajj and Eid settings table
-                c.execute('''
-                    CREATE TABLE IF NOT EXISTS hajj_eid_settings (
-                        chat_id BIGINT PRIMARY KEY,
-                        arafah_day_enabled INTEGER DEFAULT 1,
-                        eid_eve_enabled INTEGER DEFAULT 1,
-                        eid_day_enabled INTEGER DEFAULT 1,
-                        eid_adha_enabled INTEGER DEFAULT 1,
-                        hajj_enabled INTEGER DEFAULT 1,
-                        media_type TEXT DEFAULT 'images',
-                        FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
-                    )
-                ''')
-                
-                # Fasting reminders settings table
-                c.execute('''
-                    CREATE TABLE IF NOT EXISTS fasting_reminders (
-                        chat_id BIGINT PRIMARY KEY,
-                        monday_thursday_enabled INTEGER DEFAULT 1,
-                        arafah_reminder_enabled INTEGER DEFAULT 1,
-                        reminder_time TEXT DEFAULT '21:00',
-                        FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id)
-                    )
-                ''')
-                
-                # Admin/supervisor information table
-                c.execute('''
-                    CREATE TABLE IF NOT EXISTS admins (
-                        id SERIAL PRIMARY KEY,
-                        user_id BIGINT NOT NULL,
-                        chat_id BIGINT NOT NULL,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        is_primary_admin INTEGER DEFAULT 0,
-                        added_at BIGINT DEFAULT EXTRACT(EPOCH FROM NOW()),
-                        UNIQUE(user_id, chat_id)
-                    )
-                ''')
-                
-                conn.commit()
-                logger.info("✓ PostgreSQL database initialized with all tables")
-    except Exception as e:
-        logger.error(f"Failed to initialize PostgreSQL database: {e}", exc_info=True)
-        logger.info("Continuing with SQLite fallback")
-
-# Initialize PostgreSQL if available
-init_postgres_db()
+        conn.execute("PRAGMA journal_mode=WAL")
+        version = run_schema_migrations(conn, SQLITE_MIGRATIONS, is_postgres=False)
+        logger.info(f"SQLite schema at version {version}")
+        return version
+    finally:
+        conn.close()
 
-def migrate_postgres_db():
-    """Apply database migrations for PostgreSQL."""
+def migrate_postgres_schema():
+    """Apply pending PostgreSQL migrations if DATABASE_URL is configured."""
     if not (DATABASE_URL and POSTGRES_AVAILABLE):
-        return
+        return None
     
     try:
-        with psycopg2.connect(DATABASE_URL) as conn:
-            with conn.cursor() as c:
-                # Check if media format fields exist in diverse_azkar_settings
-                c.execute("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name='diverse_azkar_settings'
-                """)
-                columns = [col[0] for col in c.fetchall()]
-                
-                # Add new media format fields if they don't exist
-                if 'enable_audio' not in columns:
-                    c.execute("ALTER TABLE diverse_azkar_settings ADD COLUMN enable_audio INTEGER DEFAULT 1")
-                    logger.info("Added enable_audio column to diverse_azkar_settings (PostgreSQL)")
-                
-                if 'enable_images' not in columns:
-                    c.execute("ALTER TABLE diverse_azkar_settings ADD COLUMN enable_images INTEGER DEFAULT 1")
-                    logger.info("Added enable_images column to diverse_azkar_settings (PostgreSQL)")
-                
-                if 'enable_pdf' not in columns:
-                    c.execute("ALTER TABLE diverse_azkar_settings ADD COLUMN enable_pdf INTEGER DEFAULT 1")
-                    logger.info("Added enable_pdf column to diverse_azkar_settings (PostgreSQL)")
-                
-                if 'enable_text' not in columns:
-                    c.execute("ALTER TABLE diverse_azkar_settings ADD COLUMN enable_text INTEGER DEFAULT 1")
-                    logger.info("Added enable_text column to diverse_azkar_settings (PostgreSQL)")
-                
-                conn.commit()
-                logger.info("PostgreSQL database migration completed")
+        conn = psycopg2.connect(DATABASE_URL)
+        try:
+            version = run_schema_migrations(conn, POSTGRES_MIGRATIONS, is_postgres=True)
+            logger.info(f"✓ PostgreSQL schema at version {version}")
+            return version
+        finally:
+            conn.close()
     except Exception as e:
-        logger.error(f"Error during PostgreSQL database migration: {e}", exc_info=True)
+        logger.error(f"Failed to migrate PostgreSQL database: {e}", exc_info=True)
+        return None
 
-# Run migrations
-migrate_postgres_db()
+migrate_sqlite_schema()
+migrate_postgres_schema()
 
 # ────────────────────────────────────────────────
 #               Database Helper Functions
 # ────────────────────────────────────────────────
 
+def connect_postgres():
+    """Open a PostgreSQL connection, giving up after PG_CONNECT_TIMEOUT_SECONDS."""
+    return psycopg2.connect(DATABASE_URL, connect_timeout=PG_CONNECT_TIMEOUT_SECONDS)
+
 def get_db_connection():
     """
-    Get database connection - PostgreSQL if available, otherwise SQLite.
+    Get database connection - PostgreSQL if configured, otherwise SQLite.
+    
+    There is no fallback from PostgreSQL to SQLite: while PostgreSQL is
+    marked down this raises DatabaseUnavailable without trying to connect,
+    and a failed connect marks it down (see PostgreSQL Health).
     
     Returns:
         tuple: (connection, cursor, is_postgres)
     """
     if DATABASE_URL and POSTGRES_AVAILABLE:
+        if not postgres_health.is_up():
+            raise DatabaseUnavailable("PostgreSQL is marked down")
         try:
-            conn = psycopg2.connect(DATABASE_URL)
-            cursor = conn.cursor()
-            return conn, cursor, True
-        except Exception as e:
-            logger.warning(f"PostgreSQL connection failed, using SQLite: {e}")
+            conn = connect_postgres()
+        except psycopg2.OperationalError as e:
+            postgres_health.mark_down(e)
+            raise DatabaseUnavailable(f"PostgreSQL connection failed: {e}") from e
+        return conn, conn.cursor(), True
     
-    # Fallback to SQLite
-    conn = sqlite3.connect(DB_FILE)
+    conn = connect_sqlite()
     cursor = conn.cursor()
     return conn, cursor, False
 
-# ────────────────────────────────────────────────
-#               Helper Functions
-# ────────────────────────────────────────────────
+class SQLiteWriter:
+    """
+    The process's single SQLite writer. Writes submitted from any thread
+    are queued and a dedicated thread commits whatever has accumulated as
+    one transaction, so threads never contend for the write lock among
+    themselves and the per-commit fsync is shared by the whole batch.
+    Each write runs in its own savepoint: a failing write is rolled back
+    and reported to its caller without affecting the rest of the batch.
+    """
 
-# ────────────────────────────────────────────────
-#               Helper Functions
-# ────────────────────────────────────────────────
+    def __init__(self, batch_max: int = 256):
+        self.batch_max = batch_max
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.conn = None
+        self.db_file = None
 
-def validate_time_format(time_str: str) -> tuple:
+    def submit(self, statements: list) -> Future:
+        """
+        Queue one write: a list of (sql, params) run atomically.
+        
+        Returns:
+            Future: Resolves to each statement's rowcount, or its rows for a
+                statement with RETURNING
+        """
+        future = Future()
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self.thread.start()
+        self.queue.put((statements, future))
+        return future
+
+    def execute(self, statements: list) -> list:
+        """Submit a write and wait for it to be committed."""
+        return self.submit(statements).result()
+
+    def close(self):
+        """Stop the writer thread after the queued writes and close its connection."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join()
+        elif self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self.conn is None or self.db_file != DB_FILE:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = connect_sqlite()
+            self.conn.isolation_level = None  # Transactions are managed explicitly
+            self.db_file = DB_FILE
+        return self.conn
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) == self.batch_max:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(batch)
+            if item is None:
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+                return
+
+    def _write_batch(self, batch: list):
+        SQLITE_WRITE_BATCH_SIZE.observe(len(batch))
+        outcomes = []
+        try:
+            c = self._connection().cursor()
+            c.execute("BEGIN IMMEDIATE")
+            for statements, future in batch:
+                c.execute("SAVEPOINT write")
+                try:
+                    counts = []
+                    for sql, params in statements:
+                        c.execute(sql, params)
+                        counts.append(c.rowcount if c.description is None else c.fetchall())
+                    c.execute("RELEASE write")
+                    outcomes.append((future, counts, None))
+                except sqlite3.Error as e:
+                    c.execute("ROLLBACK TO write")
+                    c.execute("RELEASE write")
+                    outcomes.append((future, None, e))
+            c.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"SQLite write batch of {len(batch)} failed: {e}", exc_info=True)
+            if self.conn is not None and self.conn.in_transaction:
+                try:
+                    self.conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for future, counts, error in outcomes:
+            if error is None:
+                future.set_result(counts)
+            else:
+                future.set_exception(error)
+
+SQLITE_WRITE_BATCH_SIZE = Histogram("sqlite_write_batch_size", "Writes committed per SQLite writer transaction",
+                                    (), buckets=(1, 2, 5, 10, 25, 50, 100, 250))
+sqlite_writer = SQLiteWriter()
+
+def db_write(statements: list, journal: bool = True) -> list:
     """
-    Validate time string format and return hour and minute.
+    Run write statements as one transaction. SQL uses {p} for parameter
+    placeholders. On SQLite the write goes through the writer thread. While
+    PostgreSQL is down the write is journaled and replayed on recovery.
     
     Args:
-        time_str (str): Time string in HH:MM format
+        statements (list): (sql, params) pairs
+        journal (bool): False for writes that only make sense now, such as
+            claims whose rows the caller needs; these raise
+            DatabaseUnavailable instead of being journaled
         
     Returns:
-        tuple: (hour, minute, is_valid, error_message)
-               If valid: (h, m, True, None)
-               If invalid: (None, None, False, error_message)
+        list: Rowcount of each statement (the fetched rows for a statement
+            that returns rows), -1 for a journaled write
     """
-    if not time_str:
-        return (None, None, False, "Empty time string")
-    
-    if ':' not in time_str:
-        return (None, None, False, "Missing ':' separator")
-    
-    parts = time_str.split(":")
-    if len(parts) != 2:
-        return (None, None, False, f"Invalid format: expected HH:MM, got '{time_str}'")
-    
+    if not (DATABASE_URL and POSTGRES_AVAILABLE):
+        return sqlite_writer.execute([(sql.format(p="?"), params) for sql, params in statements])
+    if not journal:
+        return postgres_write(statements)
+    if not postgres_health.journal_write(statements):
+        try:
+            return postgres_write(statements)
+        except DatabaseUnavailable:
+            if not postgres_health.journal_write(statements):
+                raise  # PostgreSQL came back in the meantime; let the caller retry
+    return [-1] * len(statements)
+
+def postgres_write(statements: list) -> list:
+    """
+    Run {p} statements as one PostgreSQL transaction, returning what
+    db_write returns. A lost connection
+    marks PostgreSQL down and raises DatabaseUnavailable; any other error
+    (a deadlock, a statement timeout) is rolled back and raised as is.
+    """
+    conn, c, _ = get_db_connection()
     try:
-        h = int(parts[0])
-        m = int(parts[1])
-    except ValueError:
-        return (None, None, False, f"Non-numeric values in '{time_str}'")
-    
+        counts = []
+        for sql, params in statements:
+            c.execute(sql.format(p="%s"), params)
+            counts.append(c.rowcount if c.description is None else c.fetchall())
+        conn.commit()
+        return counts
+    except QUERY_RECONNECT_ERRORS as e:
+        if not connection_lost(e, conn):
+            conn.rollback()
+            raise
+        postgres_health.mark_down(e)
+        raise DatabaseUnavailable(f"PostgreSQL connection lost: {e}") from e
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# ────────────────────────────────────────────────
+#               PostgreSQL Health
+# ────────────────────────────────────────────────
+
+# With DATABASE_URL set, PostgreSQL is the only store of record. A failed
+# connect used to fall back to the local SQLite file, splitting state
+# between the two, and made every call during an outage wait out a connect
+# timeout first. Now the first connection error marks PostgreSQL down.
+# While it is down:
+#   - get_db_connection raises DatabaseUnavailable at once
+#   - PreparedQuery reads are answered from the rows last read from
+#     PostgreSQL, and a miss raises DatabaseUnavailable
+#   - db_write appends to a journal table in the local SQLite file, which
+#     survives a restart
+# A background probe reconnects with doubling intervals. Once a connect
+# succeeds, the probe replays the journal in order and only then marks
+# PostgreSQL up; workers share the journal and replay it one at a time.
+# Only a lost connection marks PostgreSQL down, not a deadlock or a
+# statement timeout on a working one. Reads served during an outage do not reflect the writes
+# journaled during it. Write-behind buffers (deliveries, deactivations)
+# stay in memory until PostgreSQL is back. The outbox pauses: queued
+# messages are journaled, scheduled sends that cannot read their settings
+# are parked in memory, and drains claim nothing until recovery.
+
+PG_CONNECT_TIMEOUT_SECONDS = 5
+PG_PROBE_BASE_SECONDS = 2
+PG_PROBE_MAX_SECONDS = 60
+READ_CACHE_MAX_ENTRIES = 50_000
+JOURNAL_REPLAY_BATCH = 100
+JOURNAL_CLAIM_SECONDS = 300  # A replaying process's claim, renewed with every batch
+JOURNAL_CLAIM_WAIT_SECONDS = 1  # Recheck interval while another process replays
+
+DB_UP = "up"
+DB_DOWN = "down"
+DB_RECOVERING = "recovering"  # Reachable again, journal still replaying
+
+class DatabaseUnavailable(Exception):
+    """PostgreSQL is down and the request cannot be answered without it."""
+
+class ReadCache:
+    """Bounded LRU of PreparedQuery results read from PostgreSQL, served while it is down."""
+
+    def __init__(self, max_entries: int = READ_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached result; raise DatabaseUnavailable on a miss."""
+        with self.lock:
+            hit = key in self.entries
+            if hit:
+                self.entries.move_to_end(key)
+                value = self.entries[key]
+        CACHE_REQUESTS.inc("postgres_read", "hit" if hit else "miss")
+        if not hit:
+            raise DatabaseUnavailable(f"PostgreSQL is down and {key[0]} {key[1]} is not cached")
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+class WriteJournal:
+    """
+    PostgreSQL writes made while it was down, in order, in the local SQLite
+    file that all workers share. Every worker's probe replays it, one worker
+    at a time: a batch is only claimed while no other worker holds an
+    unexpired claim, so each entry is applied once and in journal order.
+    Entries are deleted a batch at a time after being applied, so a crash
+    during replay can apply the last batch twice.
+    """
+
+    def __init__(self, owner: str = None):
+        self.owner = owner
+
+    def claimant(self) -> str:
+        """This process's claim name, read per call so forked workers differ."""
+        return self.owner or f"{socket.gethostname()}:{os.getpid()}"
+
+    def claim(self) -> list:
+        """
+        Claim the oldest JOURNAL_REPLAY_BATCH entries for this process.
+        
+        Returns:
+            list: (id, statements) rows in order, empty when nothing is
+                pending or another process is replaying
+        """
+        owner = self.claimant()
+        now = int(time.time())
+        sqlite_writer.execute([('''
+            UPDATE pg_write_journal SET claimed_by = ?, claimed_until = ?
+            WHERE id IN (SELECT id FROM pg_write_journal ORDER BY id LIMIT ?)
+              AND NOT EXISTS (SELECT 1 FROM pg_write_journal WHERE claimed_by != ? AND claimed_until > ?)
+        ''', (owner, now + JOURNAL_CLAIM_SECONDS, JOURNAL_REPLAY_BATCH, owner, now))])
+        reader = connect_sqlite()
+        try:
+            return reader.execute("SELECT id, statements FROM pg_write_journal WHERE claimed_by = ? ORDER BY id",
+                                  (owner,)).fetchall()
+        finally:
+            reader.close()
+
+    def append(self, statements: list):
+        """Journal one db_write: (sql, params) pairs with {p} placeholders."""
+        sqlite_writer.execute([("INSERT INTO pg_write_journal (statements, created_at) VALUES (?, ?)",
+                                (json.dumps(statements), int(time.time())))])
+
+    def pending(self) -> int:
+        """Number of writes waiting to be replayed."""
+        conn = connect_sqlite()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM pg_write_journal").fetchone()[0]
+        finally:
+            conn.close()
+
+    def replay(self, conn) -> int:
+        """
+        Apply the journaled writes to a PostgreSQL connection in order, each
+        as its own transaction. A write PostgreSQL rejects is logged and
+        dropped. An OperationalError stops the replay, releases the claim
+        and is raised.
+        
+        Returns:
+            int: Number of writes applied, 0 while another process replays
+        """
+        applied = 0
+        while True:
+            batch = self.claim()
+            if not batch:
+                return applied
+            done = []
+            try:
+                for entry_id, payload in batch:
+                    c = conn.cursor()
+                    try:
+                        for sql, params in json.loads(payload):
+                            c.execute(sql.format(p="%s"), params)
+                        conn.commit()
+                        applied += 1
+                        JOURNAL_REPLAYED.inc("applied")
+                    except QUERY_RECONNECT_ERRORS:
+                        raise
+                    except psycopg2.Error as e:
+                        conn.rollback()
+                        JOURNAL_REPLAYED.inc("dropped")
+                        logger.error(f"Dropped journaled write {entry_id}, rejected by PostgreSQL: {e}")
+                    done.append((entry_id,))
+            finally:
+                # Entries left unapplied by an error are released for the next replay
+                sqlite_writer.execute([("DELETE FROM pg_write_journal WHERE id = ?", params) for params in done] + [
+                    ("UPDATE pg_write_journal SET claimed_by = NULL, claimed_until = NULL WHERE claimed_by = ?",
+                     (self.claimant(),))])
+
+class PostgresHealth:
+    """Up/down/recovering state of the configured PostgreSQL database."""
+
+    def __init__(self, journal: WriteJournal, base_interval: float = PG_PROBE_BASE_SECONDS,
+                 max_interval: float = PG_PROBE_MAX_SECONDS):
+        self.journal = journal
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.state = DB_UP
+        self.lock = threading.Lock()
+        self.probe_thread = None
+        self.stopping = threading.Event()
+
+    def is_up(self) -> bool:
+        return self.state == DB_UP
+
+    def mark_down(self, error):
+        """Stop using PostgreSQL until a probe reconnects; starts the probe thread."""
+        with self.lock:
+            if self.state == DB_DOWN:
+                return
+            self.state = DB_DOWN
+            if self.probe_thread is None or not self.probe_thread.is_alive():
+                self.probe_thread = threading.Thread(target=self._probe_loop, name="pg-probe", daemon=True)
+                self.probe_thread.start()
+        DB_HEALTH_TRANSITIONS.inc(DB_DOWN)
+        logger.error(f"PostgreSQL marked down, failing fast and journaling writes: {error}")
+
+    def journal_write(self, statements: list) -> bool:
+        """Journal a write unless PostgreSQL is up; returns whether it was journaled."""
+        with self.lock:
+            # Holding the lock orders appends against the final check in probe()
+            if self.state == DB_UP:
+                return False
+            self.journal.append(statements)
+            return True
+
+    def probe(self) -> bool:
+        """
+        One reconnect attempt. On success the journal is replayed and
+        PostgreSQL marked up.
+        
+        Returns:
+            bool: Whether PostgreSQL is up afterwards
+        """
+        try:
+            conn = connect_postgres()
+        except psycopg2.Error as e:
+            logger.debug(f"PostgreSQL probe failed: {e}")
+            return False
+        with self.lock:
+            if self.state == DB_UP:
+                conn.close()
+                return True
+            self.state = DB_RECOVERING
+        DB_HEALTH_TRANSITIONS.inc(DB_RECOVERING)
+        replayed = 0
+        try:
+            while True:
+                applied = self.journal.replay(conn)
+                replayed += applied
+                with self.lock:
+                    # Entries claimed by another process count as pending, so
+                    # no worker writes directly before the whole journal is in
+                    if self.state == DB_RECOVERING and self.journal.pending() == 0:
+                        self.state = DB_UP
+                        break
+                    if self.state == DB_DOWN:
+                        return False
+                if not applied and self.stopping.wait(JOURNAL_CLAIM_WAIT_SECONDS):
+                    with self.lock:
+                        self.state = DB_DOWN
+                    return False
+        except QUERY_RECONNECT_ERRORS as e:
+            with self.lock:
+                self.state = DB_DOWN
+            DB_HEALTH_TRANSITIONS.inc(DB_DOWN)
+            logger.warning(f"PostgreSQL replay of the journal failed, retrying later: {e}")
+            return False
+        finally:
+            conn.close()
+        DB_HEALTH_TRANSITIONS.inc(DB_UP)
+        logger.info(f"✓ PostgreSQL is back, replayed {replayed} journaled writes")
+        return True
+
+    def _probe_loop(self):
+        interval = self.base_interval
+        while not self.stopping.wait(interval):
+            if self.is_up() or self.probe():
+                return
+            interval = min(interval * 2, self.max_interval)
+
+    def state_counts(self) -> dict:
+        return {(state,): int(state == self.state) for state in (DB_UP, DB_DOWN, DB_RECOVERING)}
+
+read_cache = ReadCache()
+postgres_health = PostgresHealth(WriteJournal())
+
+DB_HEALTH_TRANSITIONS = Counter("postgres_health_transitions", "PostgreSQL health state changes", ("state",))
+JOURNAL_REPLAYED = Counter("write_journal_replayed", "Journaled writes replayed on recovery", ("outcome",))
+DB_HEALTH_STATE = Gauge("postgres_health_state", "1 for PostgreSQL's current health state", ("state",),
+                        lambda: postgres_health.state_counts())
+
+# ────────────────────────────────────────────────
+#               Query Layer
+# ────────────────────────────────────────────────
+
+# Errors that may mean a lost connection; connection_lost() decides
+QUERY_RECONNECT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError) if POSTGRES_AVAILABLE else ()
+
+# OperationalErrors raised for one failed statement on a working connection
+QUERY_STATEMENT_ERRORS = ((psycopg2.extensions.TransactionRollbackError, psycopg2.extensions.QueryCanceledError)
+                          if POSTGRES_AVAILABLE else ())
+# SQLSTATEs of a server going away: shutdown, crash, not accepting connections
+POSTGRES_SHUTDOWN_CODES = ("57P01", "57P02", "57P03")
+
+def connection_lost(error: Exception, conn=None) -> bool:
+    """
+    Whether a QUERY_RECONNECT_ERRORS error means the connection is gone.
+    OperationalError also covers failures of a single statement on a
+    working connection (deadlock, serialization failure, statement
+    timeout), which must not mark PostgreSQL down.
+    """
+    if conn is not None and conn.closed:
+        return True
+    if isinstance(error, QUERY_STATEMENT_ERRORS):
+        return False
+    if isinstance(error, psycopg2.InterfaceError):
+        return True
+    pgcode = getattr(error, "pgcode", None)
+    return pgcode is None or pgcode.startswith("08") or pgcode in POSTGRES_SHUTDOWN_CODES
+
+class QueryConnection:
+    """A thread's persistent connection and the statements prepared on it."""
+
+    def __init__(self):
+        self.conn, self.cursor, self.is_postgres = get_db_connection()
+        if self.is_postgres:
+            self.conn.autocommit = True  # Hot queries are single statements
+        self.db_file = DB_FILE
+        self.prepared = set()
+
+    def usable(self) -> bool:
+        """Whether the connection still matches the configured database."""
+        if self.is_postgres:
+            return not self.conn.closed
+        # A SQLite connection opened before DATABASE_URL was set is not reused
+        return self.db_file == DB_FILE and not (DATABASE_URL and POSTGRES_AVAILABLE)
+
+query_local = threading.local()
+
+def query_connection() -> QueryConnection:
+    """Return the calling thread's query connection, opening it if needed."""
+    qc = getattr(query_local, "connection", None)
+    if qc is None or not qc.usable():
+        close_query_connection()
+        qc = query_local.connection = QueryConnection()
+    return qc
+
+def close_query_connection():
+    """Close the calling thread's query connection, if any."""
+    qc = getattr(query_local, "connection", None)
+    query_local.connection = None
+    if qc is not None:
+        try:
+            qc.conn.close()
+        except Exception:
+            pass
+
+def numbered_placeholders(sql: str) -> str:
+    """Replace each {p} with PostgreSQL's positional $1, $2, ..."""
+    parts = sql.split("{p}")
+    return parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+
+class PreparedQuery:
+    """
+    A hot query defined once, with {p} for each parameter, and run on the
+    calling thread's persistent connection. PostgreSQL PREPAREs it on first
+    use per connection and afterwards only receives EXECUTE and the
+    parameters. On SQLite the fixed text is looked up in the connection's
+    statement cache, so it is compiled once. Rows are returned as
+    row_type(*row).
+    """
+
+    def __init__(self, name: str, sql: str, row_type=tuple):
+        self.name = name
+        self.row_type = row_type
+        parts = sql.split("{p}")
+        self.sqlite_sql = "?".join(parts)
+        self.numbered_sql = numbered_placeholders(sql)
+        self.prepare_sql = f"PREPARE {name} AS {self.numbered_sql}"
+        args = ", ".join(["%s"] * (len(parts) - 1))
+        self.execute_sql = f"EXECUTE {name} ({args})" if args else f"EXECUTE {name}"
+
+    def _fetch(self, params: tuple, fetch):
+        if not postgres_health.is_up():
+            return read_cache.get((self.name, params))
+        for attempt in (1, 2):
+            try:
+                qc = query_connection()
+            except DatabaseUnavailable:
+                return read_cache.get((self.name, params))
+            try:
+                if qc.is_postgres:
+                    if self.name not in qc.prepared:
+                        qc.cursor.execute(self.prepare_sql)
+                        qc.prepared.add(self.name)
+                    qc.cursor.execute(self.execute_sql, params)
+                    result = fetch(qc.cursor)
+                    read_cache.put((self.name, params), result)
+                    return result
+                qc.cursor.execute(self.sqlite_sql, params)
+                result = fetch(qc.cursor)
+                if qc.conn.in_transaction:
+                    qc.conn.commit()
+                return result
+            except QUERY_RECONNECT_ERRORS as e:
+                lost = connection_lost(e, qc.conn)
+                close_query_connection()
+                if not lost:
+                    raise
+                if attempt == 2:
+                    postgres_health.mark_down(e)
+                    return read_cache.get((self.name, params))
+            except Exception:
+                close_query_connection()  # Leave no failed transaction behind
+                raise
+
+    def one(self, *params):
+        """Return the first row, or None."""
+        row = self._fetch(params, lambda cursor: cursor.fetchone())
+        return None if row is None else self.row_type(*row)
+
+    def all(self, *params) -> list:
+        """Return every row."""
+        return [self.row_type(*row) for row in self._fetch(params, lambda cursor: cursor.fetchall())]
+
+    def scalar(self, *params):
+        """Return the first column of the first row, or None."""
+        row = self._fetch(params, lambda cursor: cursor.fetchone())
+        return None if row is None else row[0]
+
+class SettingsRowQuery:
+    """
+    Get-or-create of a chat's row in a per-chat settings table.
+    
+    PostgreSQL reads or creates the row in one statement. SQLite cannot
+    put an INSERT in a CTE, so it reads first and on a miss has the writer
+    thread insert the row before reading it again, which keeps reads of
+    existing rows off the write lock. Both inserts ignore a row a
+    concurrent first touch created, so neither backend races.
+    """
+
+    def __init__(self, table: str, row_type, columns: tuple):
+        columns = ", ".join(columns)
+        self.fetch_or_create = PreparedQuery(f"fetch_or_create_{table}", f"""
+            WITH created AS (
+                INSERT INTO {table} (chat_id) VALUES ({{p}})
+                ON CONFLICT (chat_id) DO NOTHING
+                RETURNING {columns}
+            )
+            SELECT {columns} FROM created
+            UNION ALL
+            SELECT {columns} FROM {table} WHERE chat_id = {{p}}
+        """, row_type)
+        self.fetch = PreparedQuery(f"fetch_{table}", f"SELECT {columns} FROM {table} WHERE chat_id = {{p}}", row_type)
+        self.insert_sql = f"INSERT INTO {table} (chat_id) VALUES (?) ON CONFLICT (chat_id) DO NOTHING"
+        self.create = PreparedQuery(f"create_{table}", f"""
+            INSERT INTO {table} (chat_id) VALUES ({{p}})
+            ON CONFLICT (chat_id) DO UPDATE SET chat_id = EXCLUDED.chat_id
+            RETURNING {columns}
+        """, row_type)
+
+    def get(self, chat_id: int):
+        """Return the chat's row, inserting the column defaults on first touch."""
+        # While PostgreSQL is down its queries are answered from the read cache
+        try:
+            is_postgres = not postgres_health.is_up() or query_connection().is_postgres
+        except DatabaseUnavailable:
+            is_postgres = True
+        if not is_postgres:
+            row = self.fetch.one(chat_id)
+            if row is None:
+                sqlite_writer.execute([(self.insert_sql, (chat_id,))])
+                row = self.fetch.one(chat_id)
+            return row
+        row = self.fetch_or_create.one(chat_id, chat_id)
+        if row is None:
+            # A first touch that lost the race to an insert committed after
+            # the statement's snapshot
+            row = self.create.one(chat_id)
+        return row
+
+# ────────────────────────────────────────────────
+#               Helper Functions
+# ────────────────────────────────────────────────
+
+def validate_time_format(time_str: str) -> tuple:
+    """
+    Validate time string format and return hour and minute.
+    
+    Args:
+        time_str (str): Time string in HH:MM format
+        
+    Returns:
+        tuple: (hour, minute, is_valid, error_message)
+               If valid: (h, m, True, None)
+               If invalid: (None, None, False, error_message)
+    """
+    if not time_str:
+        return (None, None, False, "Empty time string")
+    
+    if ':' not in time_str:
+        return (None, None, False, "Missing ':' separator")
+    
+    parts = time_str.split(":")
+    if len(parts) != 2:
+        return (None, None, False, f"Invalid format: expected HH:MM, got '{time_str}'")
+    
+    try:
+        h = int(parts[0])
+        m = int(parts[1])
+    except ValueError:
+        return (None, None, False, f"Non-numeric values in '{time_str}'")
+    
     if not (0 <= h <= 23):
         return (None, None, False, f"Invalid hour: {h} (must be 0-23)")
     
@@ -493,6 +1970,8 @@ def validate_time_format(time_str: str) -> tuple:
     
     return (h, m, True, None)
 
+USER_ADMIN_COUNT_QUERY = PreparedQuery("user_admin_count", "SELECT COUNT(*) FROM admins WHERE user_id = {p}")
+
 def is_user_admin_in_any_group(user_id: int) -> bool:
     """
     Check if a user is an administrator in any group that has the bot.
@@ -506,56 +1985,29 @@ def is_user_admin_in_any_group(user_id: int) -> bool:
     This function:
     - First checks the admins database for efficiency
     - Falls back to Telegram API check if database is empty or user not found
-    - Connects to PostgreSQL database if DATABASE_URL is available, falls back to SQLite
+    - Uses PostgreSQL if DATABASE_URL is configured, otherwise SQLite
     
-    Note: Database connections are opened and closed for each call. This is by design
-    to avoid connection state issues in the multi-threaded Flask + Gunicorn environment.
-    For high-volume scenarios, consider implementing connection pooling.
+    Note: The admins lookup runs on the calling thread's own query connection,
+    so connections are never shared between Flask + Gunicorn threads.
     """
     try:
         # First, check the admins database for efficiency
-        # Note: Connection is opened/closed per call to avoid threading issues
-        conn, c, is_postgres = get_db_connection()
+        count = USER_ADMIN_COUNT_QUERY.scalar(user_id)
         
-        try:
-            placeholder = "%s" if is_postgres else "?"
-            c.execute(f'''
-                SELECT COUNT(*) FROM admins 
-                WHERE user_id = {placeholder}
-            ''', (user_id,))
-            
-            count = c.fetchone()[0]
-            
-            if count > 0:
-                logger.debug(f"User {user_id} found in admins database ({count} groups)")
-                return True
-        finally:
-            conn.close()
+        if count > 0:
+            logger.debug(f"User {user_id} found in admins database ({count} groups)")
+            return True
         
         # If not found in database, fall back to Telegram API check
         # This ensures we don't miss admins who haven't used /start yet
-        chat_ids = []
-        
-        # Try PostgreSQL first if available
-        if DATABASE_URL and POSTGRES_AVAILABLE:
-            try:
-                with psycopg2.connect(DATABASE_URL) as conn:
-                    with conn.cursor() as cursor:
-                        # Get all group chat_ids (negative IDs indicate groups)
-                        cursor.execute("SELECT chat_id FROM chat_settings WHERE chat_id < 0")
-                        chat_ids = [row[0] for row in cursor.fetchall()]
-                        logger.debug(f"Retrieved {len(chat_ids)} group chat_ids from PostgreSQL")
-            except Exception as e:
-                logger.warning(f"PostgreSQL query failed, falling back to SQLite: {e}")
-                # Fall through to SQLite fallback
-        
-        # Fallback to SQLite if PostgreSQL not available or failed
-        if not chat_ids:
-            with sqlite3.connect(DB_FILE) as conn:
-                c = conn.cursor()
-                c.execute("SELECT chat_id FROM chat_settings WHERE chat_id < 0")
-                chat_ids = [row[0] for row in c.fetchall()]
-            logger.debug(f"Retrieved {len(chat_ids)} group chat_ids from SQLite")
+        conn, c, is_postgres = get_db_connection()
+        try:
+            # Get all group chat_ids (negative IDs indicate groups)
+            c.execute("SELECT chat_id FROM chat_settings WHERE chat_id < 0")
+            chat_ids = [row[0] for row in c.fetchall()]
+        finally:
+            conn.close()
+        logger.debug(f"Retrieved {len(chat_ids)} group chat_ids")
         
         # Check admin status in each group via Telegram API
         for chat_id in chat_ids:
@@ -588,54 +2040,80 @@ def is_user_admin_in_any_group(user_id: int) -> bool:
         logger.error(f"Error in is_user_admin_in_any_group: {e}", exc_info=True)
         return False
 
-def get_chat_settings(chat_id: int) -> dict:
-    """Get chat settings from database (PostgreSQL preferred, SQLite fallback)."""
-    conn, c, is_postgres = get_db_connection()
-    
+class ChatSettings(MutableMapping):
+    """
+    One chat_settings row. Boolean settings stay packed in `flags` and are
+    decoded bit by bit on access; the object reads and writes like the
+    settings dict it replaces.
+    """
+
+    __slots__ = ("chat_id", "flags", "morning_time", "evening_time", "sleep_time", "media_type")
+
+    VALUE_KEYS = ("chat_id", "morning_time", "evening_time", "sleep_time", "media_type")
+    KEYS = (
+        "chat_id", "is_enabled", "morning_azkar", "evening_azkar", "friday_sura",
+        "friday_dua", "sleep_message", "delete_service_messages", "morning_time",
+        "evening_time", "sleep_time", "media_enabled", "media_type",
+        "send_media_with_morning", "send_media_with_evening", "send_media_with_friday",
+    )
+
+    def __init__(self, chat_id, flags, morning_time="05:00", evening_time="18:00",
+                 sleep_time="22:00", media_type="images"):
+        self.chat_id = chat_id
+        self.flags = CHAT_FLAGS_DEFAULT if flags is None else flags
+        self.morning_time = morning_time
+        self.evening_time = evening_time
+        self.sleep_time = sleep_time
+        self.media_type = media_type
+
+    def __getitem__(self, key):
+        bit = CHAT_FLAG_BITS.get(key)
+        if bit is not None:
+            return bool(self.flags & bit)
+        if key in self.VALUE_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        bit = CHAT_FLAG_BITS.get(key)
+        if bit is not None:
+            self.flags = self.flags | bit if value else self.flags & ~bit
+        elif key in self.VALUE_KEYS:
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        raise TypeError("chat settings keys cannot be removed")
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f"ChatSettings({dict(self)!r})"
+
+CHAT_SETTINGS_ROW = SettingsRowQuery("chat_settings", ChatSettings, ChatSettings.__slots__)
+
+def chat_settings_from_row(settings: ChatSettings) -> ChatSettings:
+    """Report a chat queued for deactivation as disabled before the flush reaches the row."""
+    if settings["is_enabled"] and is_deactivation_pending(settings.chat_id):
+        settings["is_enabled"] = False
+    return settings
+
+@timed_db_query
+def get_chat_settings(chat_id: int) -> ChatSettings:
+    """Get chat settings from database (PostgreSQL if configured, otherwise SQLite)."""
     try:
-        # Use appropriate placeholder for database type
-        placeholder = "%s" if is_postgres else "?"
-        c.execute(f"SELECT * FROM chat_settings WHERE chat_id = {placeholder}", (chat_id,))
-        row = c.fetchone()
-        
-        if row is None:
-            # Create default settings for new chat
-            c.execute(f"INSERT INTO chat_settings (chat_id) VALUES ({placeholder})", (chat_id,))
-            conn.commit()
-            
-            # Fetch the newly created row instead of recursion
-            c.execute(f"SELECT * FROM chat_settings WHERE chat_id = {placeholder}", (chat_id,))
-            row = c.fetchone()
-        
-        # Handle both old and new schema for backward compatibility
-        result = {
-            "chat_id": row[0],
-            "is_enabled": bool(row[1]),
-            "morning_azkar": bool(row[2]),
-            "evening_azkar": bool(row[3]),
-            "friday_sura": bool(row[4]),
-            "friday_dua": bool(row[5]),
-            "sleep_message": bool(row[6]),
-            "delete_service_messages": bool(row[7]),
-            "morning_time": row[8],
-            "evening_time": row[9],
-            "sleep_time": row[10],
-            "media_enabled": bool(row[11]) if len(row) > 11 else False,
-            "media_type": row[12] if len(row) > 12 else "images",
-            "send_media_with_morning": bool(row[13]) if len(row) > 13 else False,
-            "send_media_with_evening": bool(row[14]) if len(row) > 14 else False,
-            "send_media_with_friday": bool(row[15]) if len(row) > 15 else False,
-        }
-        return result
+        return chat_settings_from_row(CHAT_SETTINGS_ROW.get(chat_id))
     except Exception as e:
         logger.error(f"Error getting chat settings: {e}", exc_info=True)
         raise
-    finally:
-        if conn:
-            conn.close()
 
-def update_chat_setting(chat_id: int, key: str, value):
-    """Update chat setting in database (PostgreSQL preferred, SQLite fallback)."""
+def chat_setting_statements(chat_id: int, key: str, value) -> list:
+    """Build the write that sets one chat setting, or None for an unknown key."""
     allowed_keys = {
         "is_enabled", "morning_azkar", "evening_azkar",
         "friday_sura", "friday_dua", "sleep_message",
@@ -646,240 +2124,897 @@ def update_chat_setting(chat_id: int, key: str, value):
     }
     if key not in allowed_keys:
         logger.error(f"Invalid setting key: {key}")
-        return
+        return None
 
-    conn, c, is_postgres = get_db_connection()
+    # Convert value to appropriate type based on key
+    if key in ["morning_time", "evening_time", "sleep_time", "media_type"]:
+        # String values - no conversion needed
+        final_value = value
+    else:
+        # Boolean/integer values - convert to int
+        final_value = int(value)
     
+    bit = CHAT_FLAG_BITS.get(key)
+    if bit is not None:
+        # Keep the packed flags and the per-flag column in step
+        flags_update = f"flags | {bit}" if final_value else f"flags & {CHAT_FLAGS_MASK ^ bit}"
+        return [(f"UPDATE chat_settings SET {key} = {{p}}, flags = {flags_update} WHERE chat_id = {{p}}",
+                 (final_value, chat_id))]
+    return [(f"UPDATE chat_settings SET {key} = {{p}} WHERE chat_id = {{p}}", (final_value, chat_id))]
+
+@timed_db_query
+def update_chat_setting(chat_id: int, key: str, value):
+    """Update chat setting in database (PostgreSQL if configured, otherwise SQLite)."""
     try:
-        # Convert value to appropriate type based on key
-        if key in ["morning_time", "evening_time", "sleep_time", "media_type"]:
-            # String values - no conversion needed
-            final_value = value
-        else:
-            # Boolean/integer values - convert to int
-            final_value = int(value)
-        
-        # Use appropriate placeholder for database type
-        placeholder = "%s" if is_postgres else "?"
-        c.execute(f"UPDATE chat_settings SET {key} = {placeholder} WHERE chat_id = {placeholder}", (final_value, chat_id))
-        conn.commit()
+        statements = chat_setting_statements(chat_id, key, value)
+        if statements is None:
+            return
+        db_write(statements)
         logger.info(f"Updated {key} = {value} for chat {chat_id}")
     except Exception as e:
         logger.error(f"Error updating chat setting: {e}", exc_info=True)
-        if conn:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
         raise
-    finally:
-        if conn:
-            conn.close()
 
 # ────────────────────────────────────────────────
 #               Diverse Azkar Settings Functions
 # ────────────────────────────────────────────────
 
+DiverseAzkarRow = namedtuple("DiverseAzkarRow", (
+    "chat_id", "enabled", "interval_minutes", "media_type", "last_sent_timestamp",
+    "enable_audio", "enable_images", "enable_pdf", "enable_text", "next_due", "sent_count",
+))
+DIVERSE_AZKAR_ROW = SettingsRowQuery("diverse_azkar_settings", DiverseAzkarRow, DiverseAzkarRow._fields)
+
+def diverse_azkar_settings_from_row(row: DiverseAzkarRow) -> dict:
+    """Build the diverse azkar settings dict from its row."""
+    result = {
+        "chat_id": row.chat_id,
+        "enabled": bool(row.enabled),
+        "interval_minutes": row.interval_minutes,
+        "media_type": row.media_type,
+        "last_sent_timestamp": row.last_sent_timestamp,
+        "enable_audio": bool(row.enable_audio),
+        "enable_images": bool(row.enable_images),
+        "enable_pdf": bool(row.enable_pdf),
+        "enable_text": bool(row.enable_text),
+        "next_due": row.next_due,
+        "sent_count": row.sent_count
+    }
+    # Deliveries waiting in the write-behind buffer are newer than the row
+    buffered = buffered_last_sent(row.chat_id)
+    if buffered is not None:
+        result["last_sent_timestamp"] = max(result["last_sent_timestamp"] or 0, buffered)
+    return result
+
+@timed_db_query
 def get_diverse_azkar_settings(chat_id: int) -> dict:
     """Get diverse azkar settings for a chat, creating default if not exists."""
-    conn, c, is_postgres = get_db_connection()
-    
     try:
-        placeholder = "%s" if is_postgres else "?"
-        c.execute(f"SELECT * FROM diverse_azkar_settings WHERE chat_id = {placeholder}", (chat_id,))
-        row = c.fetchone()
-        
-        if row is None:
-            # Create default settings for new chat
-            c.execute(f"INSERT INTO diverse_azkar_settings (chat_id) VALUES ({placeholder})", (chat_id,))
-            conn.commit()
-            
-            # Fetch the newly created row instead of recursion
-            c.execute(f"SELECT * FROM diverse_azkar_settings WHERE chat_id = {placeholder}", (chat_id,))
-            row = c.fetchone()
-        
-        result = {
-            "chat_id": row[0],
-            "enabled": bool(row[1]),
-            "interval_minutes": row[2],
-            "media_type": row[3],
-            "last_sent_timestamp": row[4],
-            "enable_audio": bool(row[5]) if len(row) > 5 else True,
-            "enable_images": bool(row[6]) if len(row) > 6 else True,
-            "enable_pdf": bool(row[7]) if len(row) > 7 else True,
-            "enable_text": bool(row[8]) if len(row) > 8 else True
-        }
-        return result
+        return diverse_azkar_settings_from_row(DIVERSE_AZKAR_ROW.get(chat_id))
     except Exception as e:
         logger.error(f"Error getting diverse azkar settings: {e}", exc_info=True)
         raise
-    finally:
-        if conn:
-            conn.close()
 
-def update_diverse_azkar_setting(chat_id: int, key: str, value):
-    """Update a specific diverse azkar setting."""
+def diverse_azkar_setting_statements(chat_id: int, key: str, value) -> list:
+    """Build the write that sets one diverse azkar setting, or None for an unknown key."""
     # Whitelist validation to prevent SQL injection
     allowed_keys = {"enabled", "interval_minutes", "media_type", "last_sent_timestamp", 
                     "enable_audio", "enable_images", "enable_pdf", "enable_text"}
     if key not in allowed_keys:
         logger.error(f"Invalid diverse azkar setting key: {key}")
-        return
+        return None
     
-    conn, c, is_postgres = get_db_connection()
+    # Convert value based on key type
+    if key == "media_type":
+        final_value = value
+    else:
+        final_value = int(value)
     
+    # Create the row if missing, then update it; safe to use f-string as key is whitelisted above
+    return [
+        ("INSERT INTO diverse_azkar_settings (chat_id) VALUES ({p}) ON CONFLICT (chat_id) DO NOTHING", (chat_id,)),
+        (f"UPDATE diverse_azkar_settings SET {key} = {{p}} WHERE chat_id = {{p}}", (final_value, chat_id)),
+    ]
+
+@timed_db_query
+def update_diverse_azkar_setting(chat_id: int, key: str, value):
+    """Update a specific diverse azkar setting."""
     try:
-        placeholder = "%s" if is_postgres else "?"
-        
-        # Ensure settings exist
-        c.execute(f"SELECT chat_id FROM diverse_azkar_settings WHERE chat_id = {placeholder}", (chat_id,))
-        if not c.fetchone():
-            c.execute(f"INSERT INTO diverse_azkar_settings (chat_id) VALUES ({placeholder})", (chat_id,))
-        
-        # Convert value based on key type
-        if key == "media_type":
-            final_value = value
-        else:
-            final_value = int(value)
-        
-        # Safe to use f-string here as key is validated against whitelist above
-        c.execute(f"UPDATE diverse_azkar_settings SET {key} = {placeholder} WHERE chat_id = {placeholder}", (final_value, chat_id))
-        conn.commit()
+        statements = diverse_azkar_setting_statements(chat_id, key, value)
+        if statements is None:
+            return
+        db_write(statements)
         logger.info(f"Updated diverse azkar {key} = {value} for chat {chat_id}")
     except Exception as e:
         logger.error(f"Error updating diverse azkar setting: {e}", exc_info=True)
-        if conn:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
         raise
-    finally:
-        if conn:
-            conn.close()
 
 # ────────────────────────────────────────────────
-#               Ramadan Settings Functions
+#               Delivery Write-Behind Buffer
 # ────────────────────────────────────────────────
 
-def get_ramadan_settings(chat_id: int) -> dict:
-    """Get Ramadan settings for a chat, creating default if not exists."""
-    conn, c, is_postgres = get_db_connection()
-    
-    try:
-        placeholder = "%s" if is_postgres else "?"
-        c.execute(f"SELECT * FROM ramadan_settings WHERE chat_id = {placeholder}", (chat_id,))
-        row = c.fetchone()
-        
-        if row is None:
-            # Create default settings for new chat
-            c.execute(f"INSERT INTO ramadan_settings (chat_id) VALUES ({placeholder})", (chat_id,))
-            conn.commit()
-            
-            # Fetch the newly created row instead of recursion
-            c.execute(f"SELECT * FROM ramadan_settings WHERE chat_id = {placeholder}", (chat_id,))
-            row = c.fetchone()
-        
-        result = {
-            "chat_id": row[0],
-            "ramadan_enabled": bool(row[1]),
-            "laylat_alqadr_enabled": bool(row[2]),
-            "last_ten_days_enabled": bool(row[3]),
-            "iftar_dua_enabled": bool(row[4]),
-            "media_type": row[5]
-        }
-        return result
-    except Exception as e:
-        logger.error(f"Error getting ramadan settings: {e}", exc_info=True)
-        raise
-    finally:
-        if conn:
-            conn.close()
+# Successful diverse azkar sends used to open a connection and commit once
+# per message just to bump last_sent_timestamp. They now land in an
+# in-memory buffer that coalesces per chat (latest timestamp, number of
+# sends) and is flushed as one batch every few seconds and at exit.
 
-def update_ramadan_setting(chat_id: int, key: str, value):
-    """Update a specific Ramadan setting."""
-    # Whitelist validation to prevent SQL injection
-    allowed_keys = {
-        "ramadan_enabled", "laylat_alqadr_enabled",
-        "last_ten_days_enabled", "iftar_dua_enabled", "media_type"
-    }
-    if key not in allowed_keys:
-        logger.error(f"Invalid ramadan setting key: {key}")
-        return
+DELIVERY_FLUSH_SECONDS = 5
+
+delivery_buffer = {}  # chat_id -> [last_sent_timestamp, sends since last flush]
+delivery_buffer_lock = threading.Lock()
+
+def record_diverse_delivery(chat_id: int, timestamp: int = None):
+    """Buffer a successful diverse azkar delivery for the next flush."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    with delivery_buffer_lock:
+        entry = delivery_buffer.get(chat_id)
+        if entry is None:
+            delivery_buffer[chat_id] = [timestamp, 1]
+        else:
+            entry[0] = max(entry[0], timestamp)
+            entry[1] += 1
+
+def buffered_last_sent(chat_id: int):
+    """Return the buffered (not yet flushed) last_sent_timestamp of a chat, if any."""
+    with delivery_buffer_lock:
+        entry = delivery_buffer.get(chat_id)
+        return entry[0] if entry else None
+
+# The buffer is written with one multi-row UPDATE ... FROM (VALUES ...) per
+# chunk; CASE stands in for MAX/GREATEST, whose names differ per backend
+DELIVERY_BUFFER_ROWS = SQL_MAX_PARAMETERS // 3
+
+def delivery_buffer_statements(rows: list) -> list:
+    """
+    Build the db_write statements applying buffered deliveries.
     
-    conn, c, is_postgres = get_db_connection()
+    Args:
+        rows (list): (chat_id, last_sent_timestamp, sends) tuples
+    """
+    statements = []
+    for start in range(0, len(rows), DELIVERY_BUFFER_ROWS):
+        chunk = rows[start:start + DELIVERY_BUFFER_ROWS]
+        statements.append((f"""
+            WITH v (chat_id, ts, n) AS (VALUES {", ".join(["({p}, {p}, {p})"] * len(chunk))})
+            UPDATE diverse_azkar_settings
+            SET last_sent_timestamp = CASE WHEN COALESCE(last_sent_timestamp, 0) > v.ts
+                                           THEN last_sent_timestamp ELSE v.ts END,
+                sent_count = COALESCE(sent_count, 0) + v.n
+            FROM v
+            WHERE diverse_azkar_settings.chat_id = v.chat_id
+        """, tuple(value for row in chunk for value in row)))
+    return statements
+
+@timed_db_query
+def flush_delivery_buffer() -> int:
+    """
+    Write all buffered deliveries in one batch. On failure the entries are
+    merged back into the buffer and retried on the next flush.
+    
+    Returns:
+        int: Number of chats written
+    """
+    global delivery_buffer
+    if not delivery_buffer:
+        return 0
+    if DATABASE_URL and POSTGRES_AVAILABLE and not postgres_health.is_up():
+        return 0  # Stays buffered until PostgreSQL is back
+    with delivery_buffer_lock:
+        pending, delivery_buffer = delivery_buffer, {}
+    if not pending:
+        return 0
     
+    rows = [(chat_id, timestamp, count) for chat_id, (timestamp, count) in pending.items()]
     try:
-        placeholder = "%s" if is_postgres else "?"
-        
-        # Ensure settings exist
-        c.execute(f"SELECT chat_id FROM ramadan_settings WHERE chat_id = {placeholder}", (chat_id,))
-        if not c.fetchone():
-            c.execute(f"INSERT INTO ramadan_settings (chat_id) VALUES ({placeholder})", (chat_id,))
-        
-        # Convert value based on key type
-        if key == "media_type":
-            final_value = value
-        else:
-            final_value = int(value)
-        
-        # Safe to use f-string here as key is validated against whitelist above
-        c.execute(f"UPDATE ramadan_settings SET {key} = {placeholder} WHERE chat_id = {placeholder}", (final_value, chat_id))
-        conn.commit()
-        logger.info(f"Updated ramadan {key} = {value} for chat {chat_id}")
+        db_write(delivery_buffer_statements(rows))
+        logger.debug(f"Flushed deliveries for {len(rows)} chats")
+        return len(rows)
     except Exception as e:
-        logger.error(f"Error updating ramadan setting: {e}", exc_info=True)
-        if conn:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
-        raise
-    finally:
-        if conn:
-            conn.close()
+        logger.error(f"Error flushing {len(rows)} buffered deliveries, will retry: {e}", exc_info=True)
+        with delivery_buffer_lock:
+            for chat_id, (timestamp, count) in pending.items():
+                entry = delivery_buffer.get(chat_id)
+                if entry is None:
+                    delivery_buffer[chat_id] = [timestamp, count]
+                else:
+                    entry[0] = max(entry[0], timestamp)
+                    entry[1] += count
+        return 0
+
+scheduler.add_job(
+    flush_delivery_buffer,
+    "interval",
+    seconds=DELIVERY_FLUSH_SECONDS,
+    id="delivery_flush",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+atexit.register(flush_delivery_buffer)
 
 # ────────────────────────────────────────────────
-#               Hajj & Eid Settings Functions
+#               Delivery Log
 # ────────────────────────────────────────────────
 
-def get_hajj_eid_settings(chat_id: int) -> dict:
-    """Get Hajj and Eid settings for a chat, creating default if not exists."""
-    conn, c, is_postgres = get_db_connection()
+# Every send attempt addressed to a chat is appended to delivery_log: when,
+# which category, the result, the Telegram error code, the API latency and
+# the number of messages. Appends land in a bounded in-memory buffer that is
+# written every DELIVERY_FLUSH_SECONDS as multi-row INSERTs, together with
+# upserts that add the same rows to delivery_daily, one row per chat, day,
+# category and result. Both go through db_write as one transaction, so the
+# rollups always match the log and an outage journals them like any write.
+# Raw rows are pruned after DELIVERY_LOG_RETENTION_DAYS, rollups after
+# DELIVERY_ROLLUP_RETENTION_DAYS; per-chat stats read only the rollups.
+
+try:
+    DELIVERY_LOG_RETENTION_DAYS = int(os.getenv("DELIVERY_LOG_RETENTION_DAYS", "30"))
+    DELIVERY_ROLLUP_RETENTION_DAYS = int(os.getenv("DELIVERY_ROLLUP_RETENTION_DAYS", "400"))
+    if DELIVERY_LOG_RETENTION_DAYS <= 0 or DELIVERY_ROLLUP_RETENTION_DAYS <= 0:
+        raise ValueError("retention must be positive")
+except ValueError:
+    logger.warning("⚠️ Invalid DELIVERY_LOG_RETENTION_DAYS/DELIVERY_ROLLUP_RETENTION_DAYS, using defaults 30/400")
+    DELIVERY_LOG_RETENTION_DAYS = 30
+    DELIVERY_ROLLUP_RETENTION_DAYS = 400
+DELIVERY_LOG_MAX_BUFFER = 50_000
+DELIVERY_PRUNE_SLICE_SECONDS = 3600  # Each DELETE removes at most an hour of log
+
+# Stored as small integers; the names match the MESSAGES_SENT result label
+DELIVERY_RESULT_CODES = {"sent": 0, "failed": 1, "circuit_open": 2, "expired": 3}
+DELIVERY_RESULT_NAMES = {code: name for name, code in DELIVERY_RESULT_CODES.items()}
+
+DELIVERY_LOG_COLUMNS = ("sent_at", "chat_id", "category", "result", "error_code", "latency_ms", "messages")
+DELIVERY_DAILY_COLUMNS = ("chat_id", "day", "category", "result", "attempts", "messages",
+                          "latency_ms_sum", "latency_samples")
+DELIVERY_LOG_ROW_SQL = "(" + ", ".join(["{p}"] * len(DELIVERY_LOG_COLUMNS)) + ")"
+DELIVERY_DAILY_ROW_SQL = "(" + ", ".join(["{p}"] * len(DELIVERY_DAILY_COLUMNS)) + ")"
+# Rows per multi-row INSERT
+DELIVERY_LOG_INSERT_ROWS = SQL_MAX_PARAMETERS // len(DELIVERY_LOG_COLUMNS)
+DELIVERY_DAILY_INSERT_ROWS = SQL_MAX_PARAMETERS // len(DELIVERY_DAILY_COLUMNS)
+DELIVERY_DAILY_UPSERT_SQL = """
+    ON CONFLICT (chat_id, day, category, result) DO UPDATE SET
+        attempts = delivery_daily.attempts + excluded.attempts,
+        messages = delivery_daily.messages + excluded.messages,
+        latency_ms_sum = delivery_daily.latency_ms_sum + excluded.latency_ms_sum,
+        latency_samples = delivery_daily.latency_samples + excluded.latency_samples
+"""
+
+DELIVERY_LOG_WRITTEN = Counter("delivery_log_written", "Delivery log rows written", ())
+DELIVERY_LOG_DROPPED = Counter("delivery_log_dropped", "Delivery log rows dropped from a full buffer", ())
+DELIVERY_LOG_PRUNED = Counter("delivery_log_pruned", "Delivery log rows deleted past retention", ())
+
+def delivery_day(timestamp: int) -> int:
+    """Return the day number (days since 1970-01-01) of a Unix timestamp on the TIMEZONE calendar."""
+    offset = datetime.fromtimestamp(timestamp, TIMEZONE).utcoffset()
+    return (timestamp + int(offset.total_seconds())) // 86400
+
+def delivery_log_statements(rows: list) -> list:
+    """
+    Build the db_write statements that append rows to delivery_log and add
+    them to delivery_daily: chunked multi-row INSERTs for the log and one
+    upsert per (chat, day, category, result) for the rollups.
     
-    try:
-        placeholder = "%s" if is_postgres else "?"
-        c.execute(f"SELECT * FROM hajj_eid_settings WHERE chat_id = {placeholder}", (chat_id,))
-        row = c.fetchone()
+    Args:
+        rows (list): Tuples in DELIVERY_LOG_COLUMNS order
+    """
+    statements = []
+    for start in range(0, len(rows), DELIVERY_LOG_INSERT_ROWS):
+        chunk = rows[start:start + DELIVERY_LOG_INSERT_ROWS]
+        statements.append((
+            f"INSERT INTO delivery_log ({', '.join(DELIVERY_LOG_COLUMNS)}) VALUES "
+            + ", ".join([DELIVERY_LOG_ROW_SQL] * len(chunk)),
+            tuple(value for row in chunk for value in row)))
+    
+    totals = {}  # (chat_id, day, category, result) -> [attempts, messages, latency_ms_sum, latency_samples]
+    for sent_at, chat_id, category, result, _, latency_ms, messages in rows:
+        key = (chat_id, delivery_day(sent_at), category, result)
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = [0, 0, 0, 0]
+        total[0] += 1
+        total[1] += messages
+        if latency_ms is not None:
+            total[2] += latency_ms
+            total[3] += 1
+    rollups = [key + tuple(total) for key, total in totals.items()]
+    for start in range(0, len(rollups), DELIVERY_DAILY_INSERT_ROWS):
+        chunk = rollups[start:start + DELIVERY_DAILY_INSERT_ROWS]
+        statements.append((
+            f"INSERT INTO delivery_daily ({', '.join(DELIVERY_DAILY_COLUMNS)}) VALUES "
+            + ", ".join([DELIVERY_DAILY_ROW_SQL] * len(chunk)) + DELIVERY_DAILY_UPSERT_SQL,
+            tuple(value for row in chunk for value in row)))
+    return statements
+
+class DeliveryLog:
+    """
+    Batched appender for delivery_log. append() only takes a lock and adds
+    a tuple; flush() writes everything buffered in one transaction. When
+    the buffer is full the oldest rows are dropped and counted, so a
+    database that stays unwritable cannot grow the process without bound.
+    """
+
+    def __init__(self, max_buffer: int = DELIVERY_LOG_MAX_BUFFER):
+        self.rows = deque(maxlen=max_buffer)
+        self.lock = threading.Lock()
+
+    def append(self, chat_id: int, category: str, result: str, error_code: int = None,
+               latency: float = None, messages: int = 1, sent_at: int = None):
+        """Buffer one send attempt; latency is in seconds."""
+        row = (int(time.time()) if sent_at is None else sent_at, chat_id, category,
+               DELIVERY_RESULT_CODES[result], error_code,
+               None if latency is None else int(latency * 1000), messages)
+        with self.lock:
+            if len(self.rows) == self.rows.maxlen:
+                DELIVERY_LOG_DROPPED.inc()
+            self.rows.append(row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def flush(self) -> int:
+        """
+        Write all buffered rows and their rollups. On failure the rows go
+        back in front of anything appended meanwhile and are retried on
+        the next flush.
         
-        if row is None:
-            # Create default settings for new chat
-            c.execute(f"INSERT INTO hajj_eid_settings (chat_id) VALUES ({placeholder})", (chat_id,))
-            conn.commit()
-            
-            # Fetch the newly created row instead of recursion
-            c.execute(f"SELECT * FROM hajj_eid_settings WHERE chat_id = {placeholder}", (chat_id,))
-            row = c.fetchone()
-        
-        result = {
-            "chat_id": row[0],
-            "arafah_day_enabled": bool(row[1]),
-            "eid_eve_enabled": bool(row[2]),
-            "eid_day_enabled": bool(row[3]),
-            "eid_adha_enabled": bool(row[4]),
-            "hajj_enabled": bool(row[5]),
-            "media_type": row[6]
-        }
-        return result
+        Returns:
+            int: Number of rows written
+        """
+        with self.lock:
+            if not self.rows:
+                return 0
+            rows = list(self.rows)
+            self.rows.clear()
+        try:
+            db_write(delivery_log_statements(rows))
+        except Exception as e:
+            logger.error(f"Error writing {len(rows)} delivery log rows, will retry: {e}", exc_info=True)
+            with self.lock:
+                newer = list(self.rows)
+                self.rows.clear()
+                self.rows.extend(rows + newer)  # Over maxlen this keeps the newest rows
+            return 0
+        DELIVERY_LOG_WRITTEN.inc(amount=len(rows))
+        return len(rows)
+
+delivery_log = DeliveryLog()
+
+DELIVERY_LOG_BUFFERED = Gauge("delivery_log_buffered", "Delivery log rows waiting for the next flush", (),
+                              lambda: {(): len(delivery_log)})
+
+@timed_db_query
+def flush_delivery_log() -> int:
+    """Write the buffered delivery log rows; see DeliveryLog.flush."""
+    return delivery_log.flush()
+
+DeliveryStatsRow = namedtuple("DeliveryStatsRow", (
+    "category", "result", "attempts", "messages", "latency_ms_sum", "latency_samples",
+))
+CHAT_DELIVERY_STATS_QUERY = PreparedQuery("chat_delivery_stats", """
+    SELECT category, result, SUM(attempts), SUM(messages), SUM(latency_ms_sum), SUM(latency_samples)
+    FROM delivery_daily
+    WHERE chat_id = {p} AND day >= {p}
+    GROUP BY category, result
+""", DeliveryStatsRow)
+DELIVERY_LOG_OLDEST_QUERY = PreparedQuery("delivery_log_oldest", "SELECT MIN(sent_at) FROM delivery_log")
+
+@timed_db_query
+def get_chat_delivery_stats(chat_id: int, days: int = 30) -> dict:
+    """
+    Get a chat's delivery totals per category over its last `days` days
+    (today included), from the day rollups. Rows still in the append
+    buffer are not counted until the next flush.
+    
+    Returns:
+        dict: {category: {"sent": n, "failed": n, "circuit_open": n, "expired": n,
+              "messages": messages delivered, "avg_latency_ms": float or None}}
+    """
+    first_day = delivery_day(int(time.time())) - days + 1
+    stats = {}
+    latency = {}  # category -> [latency_ms_sum, latency_samples]
+    for row in CHAT_DELIVERY_STATS_QUERY.all(chat_id, first_day):
+        category = stats.get(row.category)
+        if category is None:
+            category = stats[row.category] = dict.fromkeys(DELIVERY_RESULT_CODES, 0)
+            category["messages"] = 0
+            latency[row.category] = [0, 0]
+        # PostgreSQL returns SUM over BIGINT as a Decimal
+        category[DELIVERY_RESULT_NAMES[row.result]] += int(row.attempts)
+        if row.result == DELIVERY_RESULT_CODES["sent"]:
+            category["messages"] += int(row.messages)
+        latency[row.category][0] += int(row.latency_ms_sum)
+        latency[row.category][1] += int(row.latency_samples)
+    for name, (total, samples) in latency.items():
+        stats[name]["avg_latency_ms"] = total / samples if samples else None
+    return stats
+
+@timed_db_query
+def prune_delivery_log(now: int = None) -> int:
+    """
+    Delete delivery_log rows older than DELIVERY_LOG_RETENTION_DAYS, one
+    DELIVERY_PRUNE_SLICE_SECONDS slice of the sent_at index per statement
+    so no single delete holds the write lock for long, then rollups older
+    than DELIVERY_ROLLUP_RETENTION_DAYS.
+    
+    The oldest row is looked up once, and again only after a slice that
+    deleted nothing, to skip a gap in the log. MIN(sent_at) is a full scan
+    under PostgreSQL's BRIN index, so it is never run per slice.
+    
+    Returns:
+        int: Number of log rows deleted (journaled deletes are not counted)
+    """
+    now = int(time.time()) if now is None else now
+    cutoff = now - DELIVERY_LOG_RETENTION_DAYS * 86400
+    deleted = 0
+    bound = DELIVERY_LOG_OLDEST_QUERY.scalar()
+    while bound is not None and bound < cutoff:
+        bound = min(bound + DELIVERY_PRUNE_SLICE_SECONDS, cutoff)
+        count, = db_write([("DELETE FROM delivery_log WHERE sent_at < {p}", (bound,))])
+        if count < 0:
+            break  # Journaled while PostgreSQL is down; the rest waits for the next run
+        if count == 0 and bound < cutoff:
+            bound = DELIVERY_LOG_OLDEST_QUERY.scalar()
+        deleted += count
+    db_write([("DELETE FROM delivery_daily WHERE day < {p}",
+               (delivery_day(now) - DELIVERY_ROLLUP_RETENTION_DAYS,))])
+    if deleted:
+        DELIVERY_LOG_PRUNED.inc(amount=deleted)
+        logger.info(f"Pruned {deleted} delivery log rows older than {DELIVERY_LOG_RETENTION_DAYS} days")
+    return deleted
+
+scheduler.add_job(
+    flush_delivery_log,
+    "interval",
+    seconds=DELIVERY_FLUSH_SECONDS,
+    id="delivery_log_flush",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+scheduler.add_job(
+    prune_delivery_log,
+    "interval",
+    hours=1,
+    id="delivery_log_prune",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+atexit.register(flush_delivery_log)
+
+# ────────────────────────────────────────────────
+#               Telegram Error Classification
+# ────────────────────────────────────────────────
+
+# Every send path used to carry its own chain of substring checks and
+# disabled the chat with a synchronous UPDATE in the middle of a broadcast.
+# Errors are now classified once, and chats that are gone for good are
+# queued: their jobs are dropped right away and the is_enabled updates are
+# written in batches alongside the delivery buffer.
+
+class TelegramErrorKind(Enum):
+    """Typed outcome of a failed Telegram API call."""
+    BLOCKED = "blocked"
+    KICKED = "kicked"
+    DEACTIVATED = "deactivated"
+    CHAT_NOT_FOUND = "chat_not_found"
+    FORBIDDEN = "forbidden"
+    NO_RIGHTS = "no_rights"
+    FLOOD = "flood"
+    SERVER_ERROR = "server_error"
+    NETWORK = "network"
+    OTHER = "other"
+
+# Exceptions a send can raise: API errors (JSON or plain HTTP) and transport failures
+TELEGRAM_SEND_ERRORS = (telebot.apihelper.ApiException, requests.exceptions.RequestException)
+
+TelegramErrorOutcome = namedtuple("TelegramErrorOutcome", ("kind", "deactivate", "retry_after", "description"))
+
+# Description patterns, checked in order against the lowercased description
+TELEGRAM_ERROR_PATTERNS = (
+    ("blocked", TelegramErrorKind.BLOCKED),
+    ("kicked", TelegramErrorKind.KICKED),
+    ("deactivated", TelegramErrorKind.DEACTIVATED),
+    ("chat not found", TelegramErrorKind.CHAT_NOT_FOUND),
+    ("not enough rights", TelegramErrorKind.NO_RIGHTS),
+    ("have no rights", TelegramErrorKind.NO_RIGHTS),
+    ("flood", TelegramErrorKind.FLOOD),
+    ("retry after", TelegramErrorKind.FLOOD),
+    ("forbidden", TelegramErrorKind.FORBIDDEN),
+)
+
+# Kinds after which the chat is disabled and its jobs are dropped
+DEACTIVATING_ERROR_KINDS = frozenset({
+    TelegramErrorKind.BLOCKED,
+    TelegramErrorKind.KICKED,
+    TelegramErrorKind.DEACTIVATED,
+    TelegramErrorKind.CHAT_NOT_FOUND,
+    TelegramErrorKind.FORBIDDEN,
+})
+
+# Kinds that count against the chat's circuit breaker
+TRANSIENT_ERROR_KINDS = frozenset({
+    TelegramErrorKind.NO_RIGHTS,
+    TelegramErrorKind.SERVER_ERROR,
+    TelegramErrorKind.NETWORK,
+})
+
+TELEGRAM_ERROR_REASONS = {
+    TelegramErrorKind.BLOCKED: "Bot blocked by user",
+    TelegramErrorKind.KICKED: "Bot kicked from chat",
+    TelegramErrorKind.DEACTIVATED: "User/chat deactivated",
+    TelegramErrorKind.CHAT_NOT_FOUND: "Chat not found",
+    TelegramErrorKind.FORBIDDEN: "Permission denied (bot not admin or insufficient rights)",
+}
+
+def classify_telegram_error(error: Exception) -> TelegramErrorOutcome:
+    """
+    Classify a Telegram API error by error_code first, then by description.
+    
+    Args:
+        error (Exception): One of TELEGRAM_SEND_ERRORS
+        
+    Returns:
+        TelegramErrorOutcome: kind, whether to deactivate the chat, the
+            retry_after hint of a flood error (or None) and the raw description
+    """
+    code = getattr(error, "error_code", None)
+    if code is None and isinstance(error, telebot.apihelper.ApiHTTPException):
+        code = error.result.status_code
+    description = str(getattr(error, "description", None) or error)
+    lowered = description.lower()
+    
+    kind = None
+    if isinstance(error, requests.exceptions.RequestException):
+        kind = TelegramErrorKind.NETWORK
+    elif code == 429:
+        kind = TelegramErrorKind.FLOOD
+    elif isinstance(code, int) and code >= 500:
+        kind = TelegramErrorKind.SERVER_ERROR
+    else:
+        for pattern, pattern_kind in TELEGRAM_ERROR_PATTERNS:
+            if pattern in lowered:
+                kind = pattern_kind
+                break
+        else:
+            kind = TelegramErrorKind.FORBIDDEN if code == 403 else TelegramErrorKind.OTHER
+    
+    retry_after = None
+    if kind is TelegramErrorKind.FLOOD:
+        result_json = getattr(error, "result_json", None) or {}
+        retry_after = (result_json.get("parameters") or {}).get("retry_after")
+    
+    return TelegramErrorOutcome(kind, kind in DEACTIVATING_ERROR_KINDS, retry_after, description)
+
+def handle_send_error(chat_id: int, category: str, error: Exception, latency: float = None) -> TelegramErrorOutcome:
+    """
+    Count, log and act on a failed send: chats that are gone are queued
+    for deactivation and transient failures trip the chat's circuit
+    breaker. Callers decide whether to stop, wait or continue.
+    
+    Args:
+        chat_id (int): Chat the send was addressed to
+        category (str): Metrics category of the send (e.g. "morning", "diverse")
+        error (Exception): The Telegram API error
+        latency (float): Seconds the failed call took, when measured
+        
+    Returns:
+        TelegramErrorOutcome: The classified error
+    """
+    record_send(category, "failed", error, chat_id, latency)
+    outcome = classify_telegram_error(error)
+    category_name = AZKAR_CATEGORY_NAMES.get(category, category)
+    
+    if outcome.kind is TelegramErrorKind.FLOOD:
+        logger.warning(f"✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=FloodWait - {outcome.description}")
+    elif outcome.deactivate:
+        logger.warning(f"✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON={TELEGRAM_ERROR_REASONS[outcome.kind]}")
+        queue_chat_deactivation(chat_id, outcome.kind)
+    else:
+        logger.error(f"✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON={outcome.description}")
+        if outcome.kind in TRANSIENT_ERROR_KINDS:
+            chat_breakers.record_failure(chat_id)
+    return outcome
+
+pending_deactivations = {}  # chat_id -> TelegramErrorKind that caused it
+pending_deactivations_lock = threading.Lock()
+
+def queue_chat_deactivation(chat_id: int, kind: TelegramErrorKind):
+    """Drop a chat's jobs now and queue its is_enabled = 0 for the next batch."""
+    with pending_deactivations_lock:
+        if chat_id in pending_deactivations:
+            return
+        pending_deactivations[chat_id] = kind
+    remove_chat_jobs(chat_id)
+
+def is_deactivation_pending(chat_id: int) -> bool:
+    """Return True if a chat is queued for deactivation but not yet written."""
+    with pending_deactivations_lock:
+        return chat_id in pending_deactivations
+
+@timed_db_query
+def flush_chat_deactivations() -> int:
+    """
+    Disable all queued chats in one batch. On failure they are re-queued.
+    
+    Returns:
+        int: Number of chats written
+    """
+    global pending_deactivations
+    if not pending_deactivations:
+        return 0
+    if DATABASE_URL and POSTGRES_AVAILABLE and not postgres_health.is_up():
+        return 0  # Stays queued until PostgreSQL is back
+    with pending_deactivations_lock:
+        pending, pending_deactivations = pending_deactivations, {}
+    if not pending:
+        return 0
+    
+    chat_ids = list(pending)
+    now = int(time.time())
+    statements = []
+    for start in range(0, len(chat_ids), SQL_MAX_PARAMETERS - 1):
+        chunk = tuple(chat_ids[start:start + SQL_MAX_PARAMETERS - 1])
+        in_list = ", ".join(["{p}"] * len(chunk))
+        statements.append((f"UPDATE chat_settings SET {CHAT_DISABLE_SQL} WHERE chat_id IN ({in_list})", chunk))
+        statements.append((f"UPDATE outbox SET settled_at = {{p}}, claimed_by = NULL "
+                           f"WHERE chat_id IN ({in_list}) AND settled_at IS NULL", (now,) + chunk))
+    try:
+        db_write(statements)
+        logger.info(f"Disabled {len(pending)} unreachable chats")
+        return len(pending)
+    except Exception as e:
+        logger.error(f"Error disabling {len(pending)} queued chats, will retry: {e}", exc_info=True)
+        with pending_deactivations_lock:
+            for chat_id, kind in pending.items():
+                pending_deactivations.setdefault(chat_id, kind)
+        return 0
+
+scheduler.add_job(
+    flush_chat_deactivations,
+    "interval",
+    seconds=DELIVERY_FLUSH_SECONDS,
+    id="deactivation_flush",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+atexit.register(flush_chat_deactivations)
+
+# ────────────────────────────────────────────────
+#               Per-Chat Circuit Breaker
+# ────────────────────────────────────────────────
+
+# A chat that keeps failing with transient errors (timeouts, 5xx, missing
+# rights) is skipped for a cool-down that doubles on every failed probe,
+# instead of paying for settings reads, API calls and error logging on
+# every scheduled slot. Only chats with recent failures are tracked.
+
+CIRCUIT_FAILURE_THRESHOLD = 3            # Consecutive failures that open the breaker
+CIRCUIT_BASE_COOLDOWN_SECONDS = 300
+CIRCUIT_MAX_COOLDOWN_SECONDS = 6 * 3600
+CIRCUIT_PROBE_TIMEOUT_SECONDS = 120      # A half-open probe that never reports back is retried after this
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+class ChatCircuit:
+    """Failure state of one chat."""
+    __slots__ = ("state", "failures", "trips", "open_until", "probe_started")
+
+    def __init__(self):
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probe_started = 0.0
+
+class ChatCircuitBreakers:
+    """Closed/open/half-open breakers keyed by chat_id."""
+
+    def __init__(self, threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 base_cooldown: float = CIRCUIT_BASE_COOLDOWN_SECONDS,
+                 max_cooldown: float = CIRCUIT_MAX_COOLDOWN_SECONDS,
+                 clock=time.monotonic):
+        self.threshold = threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.circuits = {}
+        self.lock = threading.Lock()
+
+    def is_blocked(self, chat_id: int) -> bool:
+        """Return True if allow() would refuse the chat, without starting a probe."""
+        if chat_id not in self.circuits:
+            return False
+        now = self.clock()
+        with self.lock:
+            circuit = self.circuits.get(chat_id)
+            if circuit is None or circuit.state == CIRCUIT_CLOSED:
+                return False
+            if circuit.state == CIRCUIT_OPEN:
+                return now < circuit.open_until
+            return now - circuit.probe_started < CIRCUIT_PROBE_TIMEOUT_SECONDS
+
+    def allow(self, chat_id: int) -> bool:
+        """Return False if sends to the chat should be skipped right now."""
+        if chat_id not in self.circuits:
+            return True
+        now = self.clock()
+        with self.lock:
+            circuit = self.circuits.get(chat_id)
+            if circuit is None or circuit.state == CIRCUIT_CLOSED:
+                return True
+            if circuit.state == CIRCUIT_OPEN:
+                if now < circuit.open_until:
+                    return False
+                circuit.state = CIRCUIT_HALF_OPEN
+                CIRCUIT_TRANSITIONS.inc(CIRCUIT_HALF_OPEN)
+            elif now - circuit.probe_started < CIRCUIT_PROBE_TIMEOUT_SECONDS:
+                return False  # A probe is already in flight
+            circuit.probe_started = now
+            return True
+
+    def record_success(self, chat_id: int):
+        """Close the chat's breaker and forget its failures."""
+        if chat_id not in self.circuits:
+            return
+        with self.lock:
+            circuit = self.circuits.pop(chat_id, None)
+        if circuit is not None and circuit.state != CIRCUIT_CLOSED:
+            CIRCUIT_TRANSITIONS.inc(CIRCUIT_CLOSED)
+
+    def record_failure(self, chat_id: int):
+        """Count a transient failure; open (or re-open) the breaker when due."""
+        now = self.clock()
+        with self.lock:
+            circuit = self.circuits.get(chat_id)
+            if circuit is None:
+                circuit = self.circuits[chat_id] = ChatCircuit()
+            circuit.failures += 1
+            if circuit.state == CIRCUIT_OPEN:
+                return
+            if circuit.state == CIRCUIT_CLOSED and circuit.failures < self.threshold:
+                return
+            cooldown = min(self.base_cooldown * 2 ** circuit.trips, self.max_cooldown)
+            circuit.trips += 1
+            circuit.state = CIRCUIT_OPEN
+            circuit.open_until = now + cooldown
+        CIRCUIT_TRANSITIONS.inc(CIRCUIT_OPEN)
+        logger.warning(f"Circuit opened for chat {chat_id} after {circuit.failures} failures, cooling down {int(cooldown)}s")
+
+    def status(self, chat_id: int):
+        """
+        Return (state, seconds until the next probe) for a chat; closed
+        breakers report 0 seconds.
+        """
+        with self.lock:
+            circuit = self.circuits.get(chat_id)
+            if circuit is None or circuit.state == CIRCUIT_CLOSED:
+                return CIRCUIT_CLOSED, 0
+            return circuit.state, max(0, int(circuit.open_until - self.clock()))
+
+    def state_counts(self) -> dict:
+        """Return {(state,): number of chats} for the tracked breakers."""
+        counts = {(CIRCUIT_OPEN,): 0, (CIRCUIT_HALF_OPEN,): 0}
+        with self.lock:
+            for circuit in self.circuits.values():
+                if circuit.state != CIRCUIT_CLOSED:
+                    counts[(circuit.state,)] += 1
+        return counts
+
+chat_breakers = ChatCircuitBreakers()
+
+CIRCUIT_TRANSITIONS = Counter("circuit_transitions", "Per-chat circuit breaker state changes", ("state",))
+CIRCUIT_CHATS = Gauge("circuit_chats", "Chats whose circuit breaker is not closed", ("state",),
+                      lambda: chat_breakers.state_counts())
+
+def circuit_allows(chat_id: int, category: str) -> bool:
+    """Gate a send on the chat's breaker, counting skipped sends."""
+    if chat_breakers.allow(chat_id):
+        return True
+    record_send(category, "circuit_open", chat_id=chat_id)
+    return False
+
+# ────────────────────────────────────────────────
+#               Ramadan Settings Functions
+# ────────────────────────────────────────────────
+
+RamadanSettingsRow = namedtuple("RamadanSettingsRow", (
+    "chat_id", "ramadan_enabled", "laylat_alqadr_enabled", "last_ten_days_enabled",
+    "iftar_dua_enabled", "media_type",
+))
+RAMADAN_SETTINGS_ROW = SettingsRowQuery("ramadan_settings", RamadanSettingsRow, RamadanSettingsRow._fields)
+
+def ramadan_settings_from_row(row: RamadanSettingsRow) -> dict:
+    """Build the Ramadan settings dict from its row."""
+    return {
+        "chat_id": row.chat_id,
+        "ramadan_enabled": bool(row.ramadan_enabled),
+        "laylat_alqadr_enabled": bool(row.laylat_alqadr_enabled),
+        "last_ten_days_enabled": bool(row.last_ten_days_enabled),
+        "iftar_dua_enabled": bool(row.iftar_dua_enabled),
+        "media_type": row.media_type
+    }
+
+@timed_db_query
+def get_ramadan_settings(chat_id: int) -> dict:
+    """Get Ramadan settings for a chat, creating default if not exists."""
+    try:
+        return ramadan_settings_from_row(RAMADAN_SETTINGS_ROW.get(chat_id))
+    except Exception as e:
+        logger.error(f"Error getting ramadan settings: {e}", exc_info=True)
+        raise
+
+def ramadan_setting_statements(chat_id: int, key: str, value) -> list:
+    """Build the write that sets one Ramadan setting, or None for an unknown key."""
+    # Whitelist validation to prevent SQL injection
+    allowed_keys = {
+        "ramadan_enabled", "laylat_alqadr_enabled",
+        "last_ten_days_enabled", "iftar_dua_enabled", "media_type"
+    }
+    if key not in allowed_keys:
+        logger.error(f"Invalid ramadan setting key: {key}")
+        return None
+    
+    # Convert value based on key type
+    if key == "media_type":
+        final_value = value
+    else:
+        final_value = int(value)
+    
+    # Create the row if missing, then update it; safe to use f-string as key is whitelisted above
+    return [
+        ("INSERT INTO ramadan_settings (chat_id) VALUES ({p}) ON CONFLICT (chat_id) DO NOTHING", (chat_id,)),
+        (f"UPDATE ramadan_settings SET {key} = {{p}} WHERE chat_id = {{p}}", (final_value, chat_id)),
+    ]
+
+@timed_db_query
+def update_ramadan_setting(chat_id: int, key: str, value):
+    """Update a specific Ramadan setting."""
+    try:
+        statements = ramadan_setting_statements(chat_id, key, value)
+        if statements is None:
+            return
+        db_write(statements)
+        logger.info(f"Updated ramadan {key} = {value} for chat {chat_id}")
+    except Exception as e:
+        logger.error(f"Error updating ramadan setting: {e}", exc_info=True)
+        raise
+
+# ────────────────────────────────────────────────
+#               Hajj & Eid Settings Functions
+# ────────────────────────────────────────────────
+
+HajjEidSettingsRow = namedtuple("HajjEidSettingsRow", (
+    "chat_id", "arafah_day_enabled", "eid_eve_enabled", "eid_day_enabled",
+    "eid_adha_enabled", "hajj_enabled", "media_type",
+))
+HAJJ_EID_SETTINGS_ROW = SettingsRowQuery("hajj_eid_settings", HajjEidSettingsRow, HajjEidSettingsRow._fields)
+
+def hajj_eid_settings_from_row(row: HajjEidSettingsRow) -> dict:
+    """Build the Hajj and Eid settings dict from its row."""
+    return {
+        "chat_id": row.chat_id,
+        "arafah_day_enabled": bool(row.arafah_day_enabled),
+        "eid_eve_enabled": bool(row.eid_eve_enabled),
+        "eid_day_enabled": bool(row.eid_day_enabled),
+        "eid_adha_enabled": bool(row.eid_adha_enabled),
+        "hajj_enabled": bool(row.hajj_enabled),
+        "media_type": row.media_type
+    }
+
+@timed_db_query
+def get_hajj_eid_settings(chat_id: int) -> dict:
+    """Get Hajj and Eid settings for a chat, creating default if not exists."""
+    try:
+        return hajj_eid_settings_from_row(HAJJ_EID_SETTINGS_ROW.get(chat_id))
     except Exception as e:
         logger.error(f"Error getting hajj_eid settings: {e}", exc_info=True)
         raise
-    finally:
-        if conn:
-            conn.close()
 
-def update_hajj_eid_setting(chat_id: int, key: str, value):
-    """Update a specific Hajj/Eid setting."""
+def hajj_eid_setting_statements(chat_id: int, key: str, value) -> list:
+    """Build the write that sets one Hajj/Eid setting, or None for an unknown key."""
     # Whitelist validation to prevent SQL injection
     allowed_keys = {
         "arafah_day_enabled", "eid_eve_enabled", "eid_day_enabled",
@@ -887,122 +3022,116 @@ def update_hajj_eid_setting(chat_id: int, key: str, value):
     }
     if key not in allowed_keys:
         logger.error(f"Invalid hajj_eid setting key: {key}")
-        return
+        return None
     
-    conn, c, is_postgres = get_db_connection()
+    # Convert value based on key type
+    if key == "media_type":
+        final_value = value
+    else:
+        final_value = int(value)
     
+    # Create the row if missing, then update it; safe to use f-string as key is whitelisted above
+    return [
+        ("INSERT INTO hajj_eid_settings (chat_id) VALUES ({p}) ON CONFLICT (chat_id) DO NOTHING", (chat_id,)),
+        (f"UPDATE hajj_eid_settings SET {key} = {{p}} WHERE chat_id = {{p}}", (final_value, chat_id)),
+    ]
+
+@timed_db_query
+def update_hajj_eid_setting(chat_id: int, key: str, value):
+    """Update a specific Hajj/Eid setting."""
     try:
-        placeholder = "%s" if is_postgres else "?"
-        
-        # Ensure settings exist
-        c.execute(f"SELECT chat_id FROM hajj_eid_settings WHERE chat_id = {placeholder}", (chat_id,))
-        if not c.fetchone():
-            c.execute(f"INSERT INTO hajj_eid_settings (chat_id) VALUES ({placeholder})", (chat_id,))
-        
-        # Convert value based on key type
-        if key == "media_type":
-            final_value = value
-        else:
-            final_value = int(value)
-        
-        # Safe to use f-string here as key is validated against whitelist above
-        c.execute(f"UPDATE hajj_eid_settings SET {key} = {placeholder} WHERE chat_id = {placeholder}", (final_value, chat_id))
-        conn.commit()
+        statements = hajj_eid_setting_statements(chat_id, key, value)
+        if statements is None:
+            return
+        db_write(statements)
         logger.info(f"Updated hajj_eid {key} = {value} for chat {chat_id}")
     except Exception as e:
         logger.error(f"Error updating hajj_eid setting: {e}", exc_info=True)
-        if conn:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
         raise
-    finally:
-        if conn:
-            conn.close()
 
 # ────────────────────────────────────────────────
 #               Fasting Reminders Settings Functions
 # ────────────────────────────────────────────────
 
+FastingRemindersRow = namedtuple("FastingRemindersRow", (
+    "chat_id", "monday_thursday_enabled", "arafah_reminder_enabled", "reminder_time",
+))
+FASTING_REMINDERS_ROW = SettingsRowQuery("fasting_reminders", FastingRemindersRow, FastingRemindersRow._fields)
+
+def fasting_reminders_settings_from_row(row: FastingRemindersRow) -> dict:
+    """Build the fasting reminders settings dict from its row."""
+    return {
+        "chat_id": row.chat_id,
+        "monday_thursday_enabled": bool(row.monday_thursday_enabled),
+        "arafah_reminder_enabled": bool(row.arafah_reminder_enabled),
+        "reminder_time": row.reminder_time
+    }
+
+@timed_db_query
 def get_fasting_reminders_settings(chat_id: int) -> dict:
     """Get fasting reminders settings for a chat, creating default if not exists."""
-    conn, c, is_postgres = get_db_connection()
-    
     try:
-        placeholder = "%s" if is_postgres else "?"
-        c.execute(f"SELECT * FROM fasting_reminders WHERE chat_id = {placeholder}", (chat_id,))
-        row = c.fetchone()
-        
-        if row is None:
-            # Create default settings for new chat
-            c.execute(f"INSERT INTO fasting_reminders (chat_id) VALUES ({placeholder})", (chat_id,))
-            conn.commit()
-            
-            # Fetch the newly created row instead of recursion
-            c.execute(f"SELECT * FROM fasting_reminders WHERE chat_id = {placeholder}", (chat_id,))
-            row = c.fetchone()
-        
-        result = {
-            "chat_id": row[0],
-            "monday_thursday_enabled": bool(row[1]),
-            "arafah_reminder_enabled": bool(row[2]),
-            "reminder_time": row[3]
-        }
-        return result
+        return fasting_reminders_settings_from_row(FASTING_REMINDERS_ROW.get(chat_id))
     except Exception as e:
         logger.error(f"Error getting fasting reminders settings: {e}", exc_info=True)
         raise
-    finally:
-        if conn:
-            conn.close()
 
-def update_fasting_reminder_setting(chat_id: int, key: str, value):
-    """Update a specific fasting reminder setting."""
+def fasting_reminder_setting_statements(chat_id: int, key: str, value) -> list:
+    """Build the write that sets one fasting reminder setting, or None for an unknown key."""
     # Whitelist validation to prevent SQL injection
     allowed_keys = {
         "monday_thursday_enabled", "arafah_reminder_enabled", "reminder_time"
     }
     if key not in allowed_keys:
         logger.error(f"Invalid fasting reminder setting key: {key}")
-        return
+        return None
     
-    conn, c, is_postgres = get_db_connection()
+    # Convert value based on key type
+    if key == "reminder_time":
+        final_value = value
+    else:
+        final_value = int(value)
     
+    # Create the row if missing, then update it; safe to use f-string as key is whitelisted above
+    return [
+        ("INSERT INTO fasting_reminders (chat_id) VALUES ({p}) ON CONFLICT (chat_id) DO NOTHING", (chat_id,)),
+        (f"UPDATE fasting_reminders SET {key} = {{p}} WHERE chat_id = {{p}}", (final_value, chat_id)),
+    ]
+
+@timed_db_query
+def update_fasting_reminder_setting(chat_id: int, key: str, value):
+    """Update a specific fasting reminder setting."""
     try:
-        placeholder = "%s" if is_postgres else "?"
-        
-        # Ensure settings exist
-        c.execute(f"SELECT chat_id FROM fasting_reminders WHERE chat_id = {placeholder}", (chat_id,))
-        if not c.fetchone():
-            c.execute(f"INSERT INTO fasting_reminders (chat_id) VALUES ({placeholder})", (chat_id,))
-        
-        # Convert value based on key type
-        if key == "reminder_time":
-            final_value = value
-        else:
-            final_value = int(value)
-        
-        # Safe to use f-string here as key is validated against whitelist above
-        c.execute(f"UPDATE fasting_reminders SET {key} = {placeholder} WHERE chat_id = {placeholder}", (final_value, chat_id))
-        conn.commit()
+        statements = fasting_reminder_setting_statements(chat_id, key, value)
+        if statements is None:
+            return
+        db_write(statements)
         logger.info(f"Updated fasting reminder {key} = {value} for chat {chat_id}")
     except Exception as e:
         logger.error(f"Error updating fasting reminder setting: {e}", exc_info=True)
-        if conn:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
         raise
-    finally:
-        if conn:
-            conn.close()
 
 # ────────────────────────────────────────────────
 #               Admin Management Functions
 # ────────────────────────────────────────────────
 
+def admin_upsert_statement(user_id: int, chat_id: int, username: str, first_name: str, last_name: str,
+                           is_primary_admin: bool) -> tuple:
+    """Build the write that inserts an admin, or updates the names while keeping an existing primary status."""
+    return ('''
+        INSERT INTO admins (user_id, chat_id, username, first_name, last_name, is_primary_admin, added_at)
+        VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p})
+        ON CONFLICT (user_id, chat_id)
+        DO UPDATE SET username = EXCLUDED.username, 
+                     first_name = EXCLUDED.first_name, 
+                     last_name = EXCLUDED.last_name,
+                     is_primary_admin = CASE 
+                         WHEN admins.is_primary_admin = 1 THEN 1 
+                         ELSE EXCLUDED.is_primary_admin 
+                     END
+    ''', (user_id, chat_id, username, first_name, last_name, int(is_primary_admin), int(time.time())))
+
+@timed_db_query
 def save_admin_info(user_id: int, chat_id: int, username: str = None, first_name: str = None, last_name: str = None, is_primary_admin: bool = False):
     """
     Save or update admin/supervisor information in the database.
@@ -1015,63 +3144,56 @@ def save_admin_info(user_id: int, chat_id: int, username: str = None, first_name
         last_name (str): User's last name (optional)
         is_primary_admin (bool): Whether this is the primary admin (first to press /start)
     """
-    conn, c, is_postgres = get_db_connection()
-    
     try:
-        placeholder = "%s" if is_postgres else "?"
-        
         # Check if this is the first admin for this chat
         if is_primary_admin:
-            # Check if there's already a primary admin
-            c.execute(f'''
-                SELECT user_id FROM admins 
-                WHERE chat_id = {placeholder} AND is_primary_admin = 1
-            ''', (chat_id,))
-            existing_primary = c.fetchone()
-            
             # If there's already a primary admin and it's not this user, don't set as primary
-            if existing_primary and existing_primary[0] != user_id:
+            existing_primary = PRIMARY_ADMIN_QUERY.scalar(chat_id)
+            if existing_primary is not None and existing_primary != user_id:
                 is_primary_admin = False
         
-        # Try to insert, on conflict update
-        if is_postgres:
-            c.execute(f'''
-                INSERT INTO admins (user_id, chat_id, username, first_name, last_name, is_primary_admin, added_at)
-                VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, EXTRACT(EPOCH FROM NOW()))
-                ON CONFLICT (user_id, chat_id)
-                DO UPDATE SET username = EXCLUDED.username, 
-                             first_name = EXCLUDED.first_name, 
-                             last_name = EXCLUDED.last_name,
-                             is_primary_admin = CASE 
-                                 WHEN admins.is_primary_admin = 1 THEN 1 
-                                 ELSE EXCLUDED.is_primary_admin 
-                             END
-            ''', (user_id, chat_id, username, first_name, last_name, int(is_primary_admin)))
-        else:
-            # SQLite - check if entry exists first
-            c.execute(f'''
-                SELECT is_primary_admin FROM admins 
-                WHERE user_id = {placeholder} AND chat_id = {placeholder}
-            ''', (user_id, chat_id))
-            existing = c.fetchone()
-            
-            if existing and existing[0] == 1:
-                # Keep existing primary admin status
-                is_primary_admin = True
-            
-            # SQLite - use INSERT OR REPLACE
-            c.execute(f'''
-                INSERT OR REPLACE INTO admins (user_id, chat_id, username, first_name, last_name, is_primary_admin, added_at)
-                VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, strftime('%s', 'now'))
-            ''', (user_id, chat_id, username, first_name, last_name, int(is_primary_admin)))
+        db_write([admin_upsert_statement(user_id, chat_id, username, first_name, last_name, is_primary_admin)])
         
-        conn.commit()
         logger.info(f"Saved admin info for user {user_id} in chat {chat_id} (primary: {is_primary_admin})")
     except Exception as e:
         logger.error(f"Error saving admin info: {e}", exc_info=True)
-    finally:
-        conn.close()
 
+AdminRow = namedtuple("AdminRow", (
+    "user_id", "chat_id", "username", "first_name", "last_name", "is_primary_admin", "added_at",
+))
+ADMIN_COLUMNS = ", ".join(AdminRow._fields)
+ADMIN_INFO_QUERY = PreparedQuery("admin_info", f"""
+    SELECT {ADMIN_COLUMNS} FROM admins WHERE user_id = {{p}} AND chat_id = {{p}}
+""", AdminRow)
+CHAT_ADMINS_QUERY = PreparedQuery("chat_admins", f"SELECT {ADMIN_COLUMNS} FROM admins WHERE chat_id = {{p}}", AdminRow)
+PRIMARY_ADMIN_QUERY = PreparedQuery("primary_admin", """
+    SELECT user_id FROM admins WHERE chat_id = {p} AND is_primary_admin = 1
+""")
+
+def admin_info_from_row(row: AdminRow) -> dict:
+    """Build the dict returned by get_admin_info."""
+    return {
+        "user_id": row.user_id,
+        "chat_id": row.chat_id,
+        "username": row.username,
+        "first_name": row.first_name,
+        "last_name": row.last_name,
+        "added_at": row.added_at
+    }
+
+def chat_admin_from_row(row: AdminRow) -> dict:
+    """Build one entry of the list returned by get_all_admins_for_chat."""
+    return {
+        "user_id": row.user_id,
+        "chat_id": row.chat_id,
+        "username": row.username,
+        "first_name": row.first_name,
+        "last_name": row.last_name,
+        "is_primary_admin": bool(row.is_primary_admin),
+        "added_at": row.added_at
+    }
+
+@timed_db_query
 def get_admin_info(user_id: int, chat_id: int) -> dict:
     """
     Get admin information for a specific user in a chat.
@@ -1083,34 +3205,14 @@ def get_admin_info(user_id: int, chat_id: int) -> dict:
     Returns:
         dict: Admin information or None if not found
     """
-    conn, c, is_postgres = get_db_connection()
-    
     try:
-        placeholder = "%s" if is_postgres else "?"
-        c.execute(f'''
-            SELECT user_id, chat_id, username, first_name, last_name, added_at
-            FROM admins
-            WHERE user_id = {placeholder} AND chat_id = {placeholder}
-        ''', (user_id, chat_id))
-        
-        row = c.fetchone()
-        
-        if row:
-            return {
-                "user_id": row[0],
-                "chat_id": row[1],
-                "username": row[2],
-                "first_name": row[3],
-                "last_name": row[4],
-                "added_at": row[5]
-            }
-        return None
+        row = ADMIN_INFO_QUERY.one(user_id, chat_id)
+        return admin_info_from_row(row) if row else None
     except Exception as e:
         logger.error(f"Error getting admin info: {e}", exc_info=True)
         return None
-    finally:
-        conn.close()
 
+@timed_db_query
 def get_all_admins_for_chat(chat_id: int) -> list:
     """
     Get all admins for a specific chat.
@@ -1121,35 +3223,11 @@ def get_all_admins_for_chat(chat_id: int) -> list:
     Returns:
         list: List of admin dictionaries
     """
-    conn, c, is_postgres = get_db_connection()
-    
     try:
-        placeholder = "%s" if is_postgres else "?"
-        c.execute(f'''
-            SELECT user_id, chat_id, username, first_name, last_name, is_primary_admin, added_at
-            FROM admins
-            WHERE chat_id = {placeholder}
-        ''', (chat_id,))
-        
-        rows = c.fetchall()
-        
-        admins = []
-        for row in rows:
-            admins.append({
-                "user_id": row[0],
-                "chat_id": row[1],
-                "username": row[2],
-                "first_name": row[3],
-                "last_name": row[4],
-                "is_primary_admin": bool(row[5]),
-                "added_at": row[6]
-            })
-        return admins
+        return [chat_admin_from_row(row) for row in CHAT_ADMINS_QUERY.all(chat_id)]
     except Exception as e:
         logger.error(f"Error getting admins for chat: {e}", exc_info=True)
         return []
-    finally:
-        conn.close()
 
 def is_user_admin_of_chat(user_id: int, chat_id: int) -> bool:
     """
@@ -1256,6 +3334,205 @@ def sync_group_admins(chat_id: int) -> int:
         logger.error(f"Error syncing admins for chat {chat_id}: {e}", exc_info=True)
         return -1
 
+# ────────────────────────────────────────────────
+#               Async Data Access
+# ────────────────────────────────────────────────
+
+# At least one of each, or every coroutine would wait for a connection forever
+try:
+    ASYNC_DB_POOL_SIZE = max(1, int(os.getenv("ASYNC_DB_POOL_SIZE", "10")))
+    ASYNC_DB_THREADS = max(1, int(os.getenv("ASYNC_DB_THREADS", "4")))
+except ValueError:
+    logger.warning("⚠️ Invalid ASYNC_DB_POOL_SIZE/ASYNC_DB_THREADS, using defaults 10/4")
+    ASYNC_DB_POOL_SIZE = 10
+    ASYNC_DB_THREADS = 4
+
+class AsyncDatabase:
+    """
+    Coroutine versions of the settings and admin functions, for code
+    running on an asyncio event loop.
+    
+    With DATABASE_URL set and asyncpg installed, queries run on this
+    object's own asyncpg pool, which prepares and caches statements per
+    connection. Otherwise reads run the same PreparedQuery objects on a
+    dedicated thread executor, each thread with its own query connection,
+    and SQLite writes are awaited on the writer thread's futures without
+    holding an executor thread.
+    """
+
+    def __init__(self, pool_size: int = ASYNC_DB_POOL_SIZE, threads: int = ASYNC_DB_THREADS):
+        self.pool_size = pool_size
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="async-db")
+        self.pool_task = None
+        self.pool_loop = None
+
+    async def _pool(self):
+        """Return the asyncpg pool for the running loop, or None to use the executor."""
+        if not (DATABASE_URL and ASYNCPG_AVAILABLE) or not postgres_health.is_up():
+            return None  # While PostgreSQL is down the executor serves the read cache and journal
+        loop = asyncio.get_running_loop()
+        if self.pool_loop is not loop:
+            # Pools are bound to the loop that created them
+            self.pool_loop = loop
+            self.pool_task = loop.create_task(self._create_pool())
+        return await asyncio.shield(self.pool_task)
+
+    async def _create_pool(self):
+        try:
+            pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=self.pool_size)
+            logger.info(f"✓ asyncpg pool ready (max {self.pool_size} connections)")
+            return pool
+        except Exception as e:
+            logger.warning(f"asyncpg pool unavailable, using the thread executor: {e}")
+            return None
+
+    async def close(self):
+        """Close the asyncpg pool opened on the running loop, if any."""
+        if self.pool_task is not None and self.pool_loop is asyncio.get_running_loop():
+            pool = await self.pool_task
+            if pool is not None:
+                await pool.close()
+        self.pool_task = None
+        self.pool_loop = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _one(self, pool, query: PreparedQuery, *params):
+        if pool is None:
+            return await self._run(query.one, *params)
+        record = await pool.fetchrow(query.numbered_sql, *params)
+        return None if record is None else query.row_type(*record)
+
+    async def _all(self, pool, query: PreparedQuery, *params) -> list:
+        if pool is None:
+            return await self._run(query.all, *params)
+        return [query.row_type(*record) for record in await pool.fetch(query.numbered_sql, *params)]
+
+    async def _scalar(self, pool, query: PreparedQuery, *params):
+        if pool is None:
+            return await self._run(query.scalar, *params)
+        return await pool.fetchval(query.numbered_sql, *params)
+
+    async def _settings_row(self, pool, settings_query: SettingsRowQuery, chat_id: int):
+        if pool is None:
+            return await self._run(settings_query.get, chat_id)
+        row = await self._one(pool, settings_query.fetch_or_create, chat_id, chat_id)
+        if row is None:
+            row = await self._one(pool, settings_query.create, chat_id)
+        return row
+
+    async def _write(self, pool, statements: list) -> list:
+        """Async db_write: run (sql, params) pairs with {p} placeholders as one transaction."""
+        if pool is not None:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    counts = []
+                    for sql, params in statements:
+                        status = await conn.execute(numbered_placeholders(sql), *params)
+                        counts.append(int(status.split()[-1]))
+                    return counts
+        if DATABASE_URL and POSTGRES_AVAILABLE:
+            return await self._run(db_write, statements)
+        return await asyncio.wrap_future(
+            sqlite_writer.submit([(sql.format(p="?"), params) for sql, params in statements]))
+
+    async def _get_settings(self, settings_query: SettingsRowQuery, from_row, chat_id: int, what: str):
+        try:
+            return from_row(await self._settings_row(await self._pool(), settings_query, chat_id))
+        except Exception as e:
+            logger.error(f"Error getting {what}: {e}", exc_info=True)
+            raise
+
+    async def _update(self, build_statements, chat_id: int, key: str, value, what: str):
+        try:
+            statements = build_statements(chat_id, key, value)
+            if statements is None:
+                return
+            await self._write(await self._pool(), statements)
+            logger.info(f"Updated {what} {key} = {value} for chat {chat_id}")
+        except Exception as e:
+            logger.error(f"Error updating {what}: {e}", exc_info=True)
+            raise
+
+    @timed_db_query
+    async def get_chat_settings(self, chat_id: int) -> ChatSettings:
+        return await self._get_settings(CHAT_SETTINGS_ROW, chat_settings_from_row, chat_id, "chat settings")
+
+    @timed_db_query
+    async def update_chat_setting(self, chat_id: int, key: str, value):
+        await self._update(chat_setting_statements, chat_id, key, value, "chat setting")
+
+    @timed_db_query
+    async def get_diverse_azkar_settings(self, chat_id: int) -> dict:
+        return await self._get_settings(DIVERSE_AZKAR_ROW, diverse_azkar_settings_from_row, chat_id,
+                                        "diverse azkar settings")
+
+    @timed_db_query
+    async def update_diverse_azkar_setting(self, chat_id: int, key: str, value):
+        await self._update(diverse_azkar_setting_statements, chat_id, key, value, "diverse azkar setting")
+
+    @timed_db_query
+    async def get_ramadan_settings(self, chat_id: int) -> dict:
+        return await self._get_settings(RAMADAN_SETTINGS_ROW, ramadan_settings_from_row, chat_id, "ramadan settings")
+
+    @timed_db_query
+    async def update_ramadan_setting(self, chat_id: int, key: str, value):
+        await self._update(ramadan_setting_statements, chat_id, key, value, "ramadan setting")
+
+    @timed_db_query
+    async def get_hajj_eid_settings(self, chat_id: int) -> dict:
+        return await self._get_settings(HAJJ_EID_SETTINGS_ROW, hajj_eid_settings_from_row, chat_id,
+                                        "hajj_eid settings")
+
+    @timed_db_query
+    async def update_hajj_eid_setting(self, chat_id: int, key: str, value):
+        await self._update(hajj_eid_setting_statements, chat_id, key, value, "hajj_eid setting")
+
+    @timed_db_query
+    async def get_fasting_reminders_settings(self, chat_id: int) -> dict:
+        return await self._get_settings(FASTING_REMINDERS_ROW, fasting_reminders_settings_from_row, chat_id,
+                                        "fasting reminders settings")
+
+    @timed_db_query
+    async def update_fasting_reminder_setting(self, chat_id: int, key: str, value):
+        await self._update(fasting_reminder_setting_statements, chat_id, key, value, "fasting reminder setting")
+
+    @timed_db_query
+    async def save_admin_info(self, user_id: int, chat_id: int, username: str = None, first_name: str = None,
+                              last_name: str = None, is_primary_admin: bool = False):
+        try:
+            pool = await self._pool()
+            if is_primary_admin:
+                # If there's already a primary admin and it's not this user, don't set as primary
+                existing_primary = await self._scalar(pool, PRIMARY_ADMIN_QUERY, chat_id)
+                if existing_primary is not None and existing_primary != user_id:
+                    is_primary_admin = False
+            await self._write(pool, [admin_upsert_statement(user_id, chat_id, username, first_name, last_name,
+                                                            is_primary_admin)])
+            logger.info(f"Saved admin info for user {user_id} in chat {chat_id} (primary: {is_primary_admin})")
+        except Exception as e:
+            logger.error(f"Error saving admin info: {e}", exc_info=True)
+
+    @timed_db_query
+    async def get_admin_info(self, user_id: int, chat_id: int) -> dict:
+        try:
+            row = await self._one(await self._pool(), ADMIN_INFO_QUERY, user_id, chat_id)
+            return admin_info_from_row(row) if row else None
+        except Exception as e:
+            logger.error(f"Error getting admin info: {e}", exc_info=True)
+            return None
+
+    @timed_db_query
+    async def get_all_admins_for_chat(self, chat_id: int) -> list:
+        try:
+            return [chat_admin_from_row(row) for row in await self._all(await self._pool(), CHAT_ADMINS_QUERY, chat_id)]
+        except Exception as e:
+            logger.error(f"Error getting admins for chat: {e}", exc_info=True)
+            return []
+
+async_db = AsyncDatabase()
+
 # ────────────────────────────────────────────────
 #               Load Azkar from JSON Files
 # ────────────────────────────────────────────────
@@ -1548,15 +3825,20 @@ def load_diverse_azkar():
         logger.error(f"Error loading diverse_azkar.json: {e}")
         return []
 
+diverse_azkar_cache = []
+
 def get_random_diverse_azkar():
     """
     Get a random diverse azkar item.
+    The JSON file is read once and kept in memory.
     
     Returns:
         str: Formatted azkar message or None if error
     """
     try:
-        azkar_list = load_diverse_azkar()
+        if not diverse_azkar_cache:
+            diverse_azkar_cache.extend(load_diverse_azkar())
+        azkar_list = diverse_azkar_cache
         if not azkar_list:
             return None
         
@@ -1644,13 +3926,16 @@ def get_random_media_by_category(category: str, media_type: str = "all"):
         logger.error(f"Error getting media by category: {e}")
         return None
 
-def send_diverse_azkar(chat_id: int):
+@with_api_lane(API_LANE_LOW)
+def send_diverse_azkar(chat_id: int, settings: dict = None):
     """
     Send a random diverse azkar to a chat with media format preferences.
     Includes comprehensive error handling and logging.
     
     Args:
         chat_id (int): Chat ID to send to
+        settings (dict): Preloaded diverse settings including "chat_enabled"
+            (see get_diverse_azkar_settings_batch); read from the DB when None
     """
     # Get current time for logging
     current_time = datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S %Z")
@@ -1660,16 +3945,22 @@ def send_diverse_azkar(chat_id: int):
         category_name = AZKAR_CATEGORY_NAMES["diverse"]
         logger.info(f"[{current_time}] Attempted to send adhkar for category [{category_name}] to chat_id=[{chat_id}]")
         
+        if not circuit_allows(chat_id, "diverse"):
+            return
+        
         # Get diverse azkar settings
-        settings = get_diverse_azkar_settings(chat_id)
+        if settings is None:
+            settings = get_diverse_azkar_settings(chat_id)
         
         if not settings["enabled"]:
             logger.info(f"[{current_time}] Skipped diverse azkar for chat {chat_id}: Feature disabled")
             return
         
         # Verify chat is still enabled globally
-        chat_settings = get_chat_settings(chat_id)
-        if not chat_settings["is_enabled"]:
+        chat_enabled = settings.get("chat_enabled")
+        if chat_enabled is None:
+            chat_enabled = get_chat_settings(chat_id)["is_enabled"]
+        if not chat_enabled:
             logger.info(f"[{current_time}] Skipped diverse azkar for chat {chat_id}: Chat disabled globally")
             return
         
@@ -1701,6 +3992,7 @@ def send_diverse_azkar(chat_id: int):
         # Try to send with media if any media type is enabled
         sent = False
         error_occurred = False
+        started = time.perf_counter()
         
         if allowed_media_types:
             # Try to send with random allowed media type
@@ -1709,43 +4001,11 @@ def send_diverse_azkar(chat_id: int):
             
             try:
                 sent = send_media_with_caption(chat_id, msg, media_type)
-            except telebot.apihelper.ApiTelegramException as e:
-                error_description = str(e)
+            except TELEGRAM_SEND_ERRORS as e:
                 error_occurred = True
-                
-                # Handle specific error types with detailed logging
-                if "blocked" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Bot blocked by user")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    return
-                    
-                elif "kicked" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Bot kicked from chat")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    return
-                    
-                elif "flood" in error_description.lower() or "retry after" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=FloodWait - {error_description}")
-                    # Don't disable, just skip this send
-                    return
-                    
-                elif "chat not found" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Chat not found")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    return
-                    
-                elif "forbidden" in error_description.lower() or "not enough rights" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Permission denied (bot not admin or insufficient rights)")
-                    update_chat_setting(chat_id, "is_enabled", 0)
+                outcome = handle_send_error(chat_id, "diverse", e, time.perf_counter() - started)
+                if outcome.deactivate or outcome.kind is TelegramErrorKind.FLOOD:
                     return
-                    
-                elif "deactivated" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=User/chat deactivated")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    return
-                    
-                else:
-                    logger.error(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON={error_description}")
         
         # Fallback to text if media failed or text is preferred
         if not sent and enable_text and not error_occurred:
@@ -1756,38 +4016,14 @@ def send_diverse_azkar(chat_id: int):
                 sent = True
                 logger.info(f"[{current_time}] ✓ Sent diverse azkar (text) to chat {chat_id}")
                 
-            except telebot.apihelper.ApiTelegramException as e:
-                error_description = str(e)
-                
-                if "blocked" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Bot blocked by user")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    
-                elif "kicked" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Bot kicked from chat")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    
-                elif "flood" in error_description.lower() or "retry after" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=FloodWait - {error_description}")
-                    
-                elif "chat not found" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Chat not found")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    
-                elif "forbidden" in error_description.lower() or "not enough rights" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Permission denied (bot not admin or insufficient rights)")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    
-                elif "deactivated" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=User/chat deactivated")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    
-                else:
-                    logger.error(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON={error_description}")
+            except TELEGRAM_SEND_ERRORS as e:
+                handle_send_error(chat_id, "diverse", e, time.perf_counter() - started)
         
         if sent:
-            # Update last sent timestamp
-            update_diverse_azkar_setting(chat_id, "last_sent_timestamp", int(time.time()))
+            record_send("diverse", "sent", chat_id=chat_id, latency=time.perf_counter() - started)
+            chat_breakers.record_success(chat_id)
+            # Update last sent timestamp (batched, see flush_delivery_buffer)
+            record_diverse_delivery(chat_id)
             logger.info(f"[{current_time}] ✓ Successfully sent [{category_name}] to chat_id=[{chat_id}]")
         else:
             if not enable_text and not allowed_media_types:
@@ -1840,6 +4076,9 @@ def send_special_azkar(chat_id: int, azkar_type: str):
     try:
         logger.info(f"[{current_time}] Attempting to send {azkar_type} special azkar to chat {chat_id}")
         
+        if not circuit_allows(chat_id, azkar_type):
+            return
+        
         messages = []
         media_type = "images"  # Default
         settings = get_chat_settings(chat_id)
@@ -1917,6 +4156,7 @@ def send_special_azkar(chat_id: int, azkar_type: str):
         
         # Send messages
         for idx, msg in enumerate(messages):
+            started = time.perf_counter()
             try:
                 # Send first message with media if enabled
                 if idx == 0 and settings.get("media_enabled", False):
@@ -1950,41 +4190,19 @@ def send_special_azkar(chat_id: int, azkar_type: str):
                     bot.send_message(chat_id, msg, parse_mode="Markdown")
                     
                 logger.info(f"[{current_time}] ✓ Sent {azkar_type} message {idx+1}/{len(messages)} to chat {chat_id}")
+                record_send(azkar_type, "sent", chat_id=chat_id, latency=time.perf_counter() - started)
+                chat_breakers.record_success(chat_id)
                 
                 # Small delay between messages
                 if idx < len(messages) - 1:
                     time.sleep(0.05)
                 
-            except telebot.apihelper.ApiTelegramException as e:
-                error_description = str(e)
-                
-                # Handle specific error types
-                if "blocked" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed {azkar_type} to chat {chat_id}: Bot blocked by user")
-                    update_chat_setting(chat_id, "is_enabled", 0)
+            except TELEGRAM_SEND_ERRORS as e:
+                outcome = handle_send_error(chat_id, azkar_type, e, time.perf_counter() - started)
+                if outcome.deactivate:
                     break
-                    
-                elif "kicked" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed {azkar_type} to chat {chat_id}: Bot kicked from chat")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    break
-                    
-                elif "flood" in error_description.lower() or "retry after" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed {azkar_type} to chat {chat_id}: FloodWait - {error_description}")
+                if outcome.kind is TelegramErrorKind.FLOOD:
                     time.sleep(1)  # Wait before continuing
-                    
-                elif "chat not found" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed {azkar_type} to chat {chat_id}: Chat not found")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    break
-                    
-                elif "forbidden" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed {azkar_type} to chat {chat_id}: Forbidden/No permission")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    break
-                    
-                else:
-                    logger.error(f"[{current_time}] ✗ Failed {azkar_type} message {idx+1}/{len(messages)} to chat {chat_id}: {error_description}")
         
         logger.info(f"[{current_time}] Completed sending {azkar_type} to chat {chat_id}")
         
@@ -2000,6 +4218,9 @@ def send_fasting_reminder(chat_id: int, reminder_type: str):
         reminder_type (str): Type of reminder - 'monday_thursday' or 'arafah'
     """
     try:
+        if not circuit_allows(chat_id, f"fasting_{reminder_type}"):
+            return
+        
         settings = get_chat_settings(chat_id)
         
         if not settings["is_enabled"]:
@@ -2057,15 +4278,14 @@ def send_fasting_reminder(chat_id: int, reminder_type: str):
                 "اللهم تقبل منا الصيام والدعاء 🌙"
             )
         
+        started = time.perf_counter()
         bot.send_message(chat_id, message, parse_mode="Markdown")
+        record_send(f"fasting_{reminder_type}", "sent", chat_id=chat_id, latency=time.perf_counter() - started)
+        chat_breakers.record_success(chat_id)
         logger.info(f"Sent {reminder_type} fasting reminder to {chat_id}")
         
-    except telebot.apihelper.ApiTelegramException as e:
-        if "blocked" in str(e).lower() or "kicked" in str(e).lower():
-            logger.warning(f"Bot blocked/kicked from {chat_id}")
-            update_chat_setting(chat_id, "is_enabled", 0)
-        else:
-            logger.error(f"Failed sending {reminder_type} reminder to {chat_id}: {e}")
+    except TELEGRAM_SEND_ERRORS as e:
+        handle_send_error(chat_id, f"fasting_{reminder_type}", e)
     except Exception as e:
         logger.error(f"Error sending {reminder_type} reminder to chat {chat_id}: {e}", exc_info=True)
 
@@ -2207,16 +4427,22 @@ SLEEP_MESSAGE = load_sleep_azkar() or (
 #               Sending Functions
 # ────────────────────────────────────────────────
 
-def send_azkar(chat_id: int, azkar_type: str):
+def send_azkar(chat_id: int, azkar_type: str, due_at: int = None, drain: bool = True):
     """
-    Send scheduled azkar to a chat with comprehensive error handling and logging.
+    Queue scheduled azkar for a chat in the outbox and help deliver it.
+    The messages survive a restart and may be sent by any worker. While
+    PostgreSQL is unavailable the send is parked and queued again once it
+    is back (see requeue_parked_azkar).
     
     Args:
         chat_id (int): Target chat ID
         azkar_type (str): Type of azkar (morning, evening, friday_kahf, friday_dua, sleep)
+        due_at (int): Unix time the azkar became due (defaults to this minute)
+        drain (bool): Whether to deliver a batch of the outbox right away
     """
     # Get current time for logging
     current_time = datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S %Z")
+    due_at = int(time.time()) // 60 * 60 if due_at is None else due_at
     
     try:
         # Get friendly category name for logging
@@ -2225,6 +4451,10 @@ def send_azkar(chat_id: int, azkar_type: str):
         # Log the attempt as required
         logger.info(f"[{current_time}] Attempted to send adhkar for category [{category_name}] to chat_id=[{chat_id}]")
         
+        if not circuit_allows(chat_id, azkar_type):
+            logger.info(f"[{current_time}] Skipped {azkar_type} for chat {chat_id}: Circuit open")
+            return
+        
         settings = get_chat_settings(chat_id)
         if not settings["is_enabled"]:
             logger.info(f"[{current_time}] Skipped {azkar_type} for chat {chat_id}: Chat disabled")
@@ -2276,293 +4506,1122 @@ def send_azkar(chat_id: int, azkar_type: str):
         media_enabled = settings.get("media_enabled", False) and send_with_media
         media_type = settings.get("media_type", "images")
 
-        logger.info(f"[{current_time}] Sending {len(messages)} {azkar_type} messages to chat {chat_id} (media: {media_enabled})")
-
-        for idx, msg in enumerate(messages):
-            try:
-                # Send first message with media if enabled
-                if media_enabled and idx == 0:
-                    send_media_with_caption(chat_id, msg, media_type)
-                else:
-                    bot.send_message(chat_id, msg, parse_mode="Markdown")
-                logger.info(f"[{current_time}] ✓ Sent {azkar_type} message {idx+1}/{len(messages)} to chat {chat_id}")
-                
-                # Small delay between messages to avoid flood limits
-                if idx < len(messages) - 1:
-                    time.sleep(0.05)
-                    
-            except telebot.apihelper.ApiTelegramException as e:
-                error_description = str(e)
-                
-                # Handle specific error types with detailed logging
-                if "blocked" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Bot blocked by user")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    break  # Stop sending remaining messages
-                    
-                elif "kicked" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Bot kicked from chat")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    break  # Stop sending remaining messages
-                    
-                elif "flood" in error_description.lower() or "retry after" in error_description.lower():
-                    # Extract retry time if available
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=FloodWait - {error_description}")
-                    # Continue with remaining messages after a longer delay
-                    time.sleep(1)
-                    
-                elif "chat not found" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Chat not found")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    break
-                    
-                elif "forbidden" in error_description.lower() or "not enough rights" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=Permission denied (bot not admin or insufficient rights)")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    break
-                    
-                elif "deactivated" in error_description.lower():
-                    logger.warning(f"[{current_time}] ✗ Failed [{category_name}] to chat_id=[{chat_id}]: REASON=User/chat deactivated")
-                    update_chat_setting(chat_id, "is_enabled", 0)
-                    break
-                    
-                else:
-                    logger.error(f"[{current_time}] ✗ Failed [{category_name}] message {idx+1}/{len(messages)} to chat_id=[{chat_id}]: REASON={error_description}")
-                    # Continue with remaining messages for unknown errors
-                    
-            except Exception as e:
-                logger.error(f"[{current_time}] ✗ Unexpected error sending [{category_name}] message {idx+1}/{len(messages)} to chat_id=[{chat_id}]: {e}", exc_info=True)
+        queued = enqueue_outbox(chat_id, azkar_type, len(messages), media_type if media_enabled else None, due_at)
+        logger.info(f"[{current_time}] Queued {queued}/{len(messages)} {azkar_type} messages for chat {chat_id} (media: {media_enabled})")
+        if drain:
+            drain_outbox(max_batches=OUTBOX_SEND_DRAIN_BATCHES)
 
-        logger.info(f"[{current_time}] ✓ Completed sending [{category_name}] to chat_id=[{chat_id}]")
+        logger.info(f"[{current_time}] ✓ Completed queueing [{category_name}] for chat_id=[{chat_id}]")
 
+    except DatabaseUnavailable as e:
+        park_azkar(chat_id, azkar_type, due_at)
+        logger.warning(f"[{current_time}] Parked {azkar_type} for chat {chat_id} until PostgreSQL is back: {e}")
     except Exception as e:
         category_name = AZKAR_CATEGORY_NAMES.get(azkar_type, azkar_type)
         logger.error(f"[{current_time}] ✗ Critical error in send_azkar ([{category_name}]) for chat_id=[{chat_id}]: {e}", exc_info=True)
 
 # ────────────────────────────────────────────────
-#               Scheduling
+#               Outbox
 # ────────────────────────────────────────────────
 
-def schedule_chat_jobs(chat_id: int):
+# Scheduled azkar are written to the outbox table as one row per message
+# (chat, category, message_index) before anything is sent. Workers claim
+# whole sequences (chat_id, category, due_at) under a lease, deliver them
+# in order and mark each row settled, so a restart mid-broadcast resumes
+# where it stopped and several processes can share the work. Settled rows
+# are kept for OUTBOX_SETTLED_RETENTION_SECONDS: their unique key is what
+# stops a job that fires twice from queueing the same minute again.
+# Postgres claims with FOR UPDATE SKIP LOCKED. Every outbox write goes
+# through db_write: on SQLite the writer thread runs it, and while
+# PostgreSQL is down enqueues and settlements are journaled like any other
+# write. Claims are not journaled; drains skip until PostgreSQL is back.
+
+OUTBOX_BATCH_SIZE = 10           # Sequences per claim; each is delivered whole
+OUTBOX_LEASE_SECONDS = 120       # A claimed row is reclaimable after this (crashed worker)
+OUTBOX_LEASE_MARGIN_SECONDS = 10 # Stop sending this long before the lease runs out
+OUTBOX_RETRY_SECONDS = 30        # Delay before retrying a transient failure
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_DRAIN_SECONDS = 30
+OUTBOX_SEND_DRAIN_BATCHES = 1    # Batches a scheduled send delivers itself; the drain job does the rest
+OUTBOX_SETTLED_RETENTION_SECONDS = 86400
+OUTBOX_INSERT_ROWS = SQL_MAX_PARAMETERS // 6
+OUTBOX_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# How long after becoming due a message is still worth sending
+DELIVERY_DEADLINES = {
+    "morning": 2 * 3600,
+    "evening": 2 * 3600,
+    "friday_kahf": 6 * 3600,
+    "friday_dua": 3 * 3600,
+    "sleep": 1 * 3600,
+}
+DEFAULT_DELIVERY_DEADLINE = 2 * 3600
+
+OUTBOX_ENQUEUED = Counter("outbox_enqueued", "Messages written to the outbox", ("category",))
+DELIVERIES_EXPIRED = Counter("deliveries_expired", "Queued deliveries dropped past their deadline", ("category",))
+OUTBOX_DELIVERY_LAG = Histogram("outbox_delivery_lag_seconds", "Delay between a message becoming due and its delivery",
+                                ("category",), buckets=SCHEDULER_LAG_BUCKETS)
+
+# Scheduled sends that could not be queued because PostgreSQL was
+# unavailable, keyed (chat_id, category, due_at). They stay in memory, like
+# the write-behind buffers, and are queued again by the first drain after
+# recovery with their original due_at, so deadlines still apply.
+parked_azkar = {}
+parked_azkar_lock = threading.Lock()
+
+def park_azkar(chat_id: int, category: str, due_at: int):
+    """Hold a scheduled send until PostgreSQL is back."""
+    with parked_azkar_lock:
+        parked_azkar[(chat_id, category, due_at)] = None
+
+def requeue_parked_azkar() -> int:
     """
-    Schedule all azkar jobs for a specific chat based on its settings.
-    Includes comprehensive validation and logging for each scheduled job.
+    Queue the parked sends again once PostgreSQL is up. A send that fails
+    again is parked again.
+    
+    Returns:
+        int: Number of sends retried
+    """
+    global parked_azkar
+    if not parked_azkar:
+        return 0
+    if DATABASE_URL and POSTGRES_AVAILABLE and not postgres_health.is_up():
+        return 0
+    with parked_azkar_lock:
+        pending, parked_azkar = parked_azkar, {}
+    for chat_id, category, due_at in pending:
+        send_azkar(chat_id, category, due_at=due_at, drain=False)
+    return len(pending)
+
+def get_azkar_messages(azkar_type: str) -> list:
+    """Return the message list of a scheduled azkar category."""
+    return {
+        "morning": MORNING_AZKAR,
+        "evening": EVENING_AZKAR,
+        "friday_kahf": [KAHF_REMINDER],
+        "friday_dua": FRIDAY_DUA,
+        "sleep": [SLEEP_MESSAGE],
+    }.get(azkar_type, [])
+
+@timed_db_query
+def enqueue_outbox(chat_id: int, category: str, count: int, media_type: str = None, due_at: int = None) -> int:
+    """
+    Write one outbox row per message of a category in a single batch.
+    Rows for the same minute are written once, so a job that fires twice
+    does not send twice, even after the first run was delivered. Each row
+    carries the deadline of its category.
     
     Args:
-        chat_id (int): The Telegram chat ID to schedule jobs for
+        chat_id (int): Target chat ID
+        category (str): Azkar type (see get_azkar_messages)
+        count (int): Number of messages
+        media_type (str): Media type for the first message, or None for text only
+        due_at (int): Unix time the messages became due (defaults to this minute)
+        
+    Returns:
+        int: Number of rows written (journaled rows are not counted)
     """
-    current_time = datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S %Z")
+    if count <= 0:
+        return 0
+    due_at = int(time.time()) // 60 * 60 if due_at is None else due_at
+    deadline_at = due_at + DELIVERY_DEADLINES.get(category, DEFAULT_DELIVERY_DEADLINE)
+    rows = [(chat_id, category, idx, media_type if idx == 0 else None, due_at, deadline_at) for idx in range(count)]
+    
+    counts = db_write([
+        ("INSERT INTO outbox (chat_id, category, message_index, media_type, due_at, deadline_at) "
+         "VALUES " + ", ".join(["({p}, {p}, {p}, {p}, {p}, {p})"] * len(chunk)) + " ON CONFLICT DO NOTHING",
+         tuple(value for row in chunk for value in row))
+        for chunk in (rows[i:i + OUTBOX_INSERT_ROWS] for i in range(0, len(rows), OUTBOX_INSERT_ROWS))
+    ])
+    written = sum(max(count, 0) for count in counts)
+    OUTBOX_ENQUEUED.inc(category, amount=written)
+    return written
+
+# A sequence is claimable through its lowest unsettled message_index, so a
+# chat's messages go out in order even across workers.
+OUTBOX_HEAD_CONDITION = '''
+    o.settled_at IS NULL AND o.claimed_until < {p} AND NOT EXISTS (
+        SELECT 1 FROM outbox prev
+        WHERE prev.chat_id = o.chat_id AND prev.category = o.category
+          AND prev.due_at = o.due_at AND prev.message_index < o.message_index
+          AND prev.settled_at IS NULL
+    )
+'''
+
+@timed_db_query
+def claim_outbox_batch(worker_id: str, limit: int = OUTBOX_BATCH_SIZE, lease_until: int = None) -> list:
+    """
+    Lease every unsettled row of up to `limit` claimable sequences to a
+    worker in one statement.
+    
+    Args:
+        worker_id (str): Lease owner
+        limit (int): Number of sequences
+        lease_until (int): Lease expiry (defaults to OUTBOX_LEASE_SECONDS from now)
     
+    Returns:
+        list: Tuples of (id, chat_id, category, message_index, media_type, due_at, attempts, deadline_at)
+            ordered by sequence and message_index
+    
+    Raises:
+        DatabaseUnavailable: PostgreSQL is down
+    """
+    now = int(time.time())
+    lease_until = now + OUTBOX_LEASE_SECONDS if lease_until is None else lease_until
+    sql = f'''
+        UPDATE outbox SET claimed_by = {{p}}, claimed_until = {{p}}, attempts = attempts + 1
+        WHERE settled_at IS NULL AND (chat_id, category, due_at) IN (
+            SELECT o.chat_id, o.category, o.due_at FROM outbox o
+            WHERE {OUTBOX_HEAD_CONDITION}
+            ORDER BY o.id LIMIT {{p}}
+            {"FOR UPDATE SKIP LOCKED" if DATABASE_URL and POSTGRES_AVAILABLE else ""}
+        )
+        RETURNING id, chat_id, category, message_index, media_type, due_at, attempts, deadline_at
+    '''
+    # A claim is only useful to this worker now, so it is never journaled
+    rows, = db_write([(sql, (worker_id, lease_until, now, limit))], journal=False)
+    return sorted(rows, key=lambda row: (row[5], row[1], row[2], row[3]))
+
+def outbox_id_statements(assignments: str, params: tuple, ids: list) -> list:
+    """Build UPDATEs applying `assignments` to outbox rows by id, chunked to SQL_MAX_PARAMETERS."""
+    step = SQL_MAX_PARAMETERS - len(params)
+    return [
+        (f"UPDATE outbox SET {assignments} WHERE id IN ({', '.join(['{p}'] * len(chunk))})", (*params, *chunk))
+        for chunk in (ids[i:i + step] for i in range(0, len(ids), step))
+    ]
+
+@timed_db_query
+def settle_outbox(done_ids: list, retry_at: dict, dropped_chats: set, expired_sequences: set = (),
+                  released_ids: list = ()):
+    """
+    Record the results of a claimed batch in one transaction: mark
+    delivered rows settled, release failed rows for a later retry, settle
+    every row of chats that can no longer be reached and the rest of each
+    sequence (chat_id, category, due_at) that missed its deadline. Rows of
+    the batch that were never attempted are released and their claim is
+    not counted as an attempt.
+    """
+    if not (done_ids or retry_at or dropped_chats or expired_sequences or released_ids):
+        return
+    now = int(time.time())
+    statements = outbox_id_statements("settled_at = {p}, claimed_by = NULL", (now,), list(done_ids))
+    statements += [
+        ("UPDATE outbox SET claimed_by = NULL, claimed_until = {p} WHERE id = {p}", (until, row_id))
+        for row_id, until in retry_at.items()
+    ]
+    statements += outbox_id_statements("claimed_by = NULL, claimed_until = 0, attempts = attempts - 1", (),
+                                       list(released_ids))
+    statements += [
+        ("UPDATE outbox SET settled_at = {p}, claimed_by = NULL WHERE chat_id = {p} AND settled_at IS NULL",
+         (now, chat_id))
+        for chat_id in dropped_chats
+    ]
+    statements += [
+        ("UPDATE outbox SET settled_at = {p}, claimed_by = NULL "
+         "WHERE chat_id = {p} AND category = {p} AND due_at = {p} AND settled_at IS NULL",
+         (now, *sequence))
+        for sequence in expired_sequences
+    ]
+    db_write(statements)
+
+@timed_db_query
+def prune_outbox(now: int = None) -> int:
+    """
+    Delete rows settled more than OUTBOX_SETTLED_RETENTION_SECONDS ago.
+    
+    Returns:
+        int: Number of rows deleted (journaled deletes are not counted)
+    """
+    now = int(time.time()) if now is None else now
+    count, = db_write([("DELETE FROM outbox WHERE settled_at < {p}",
+                        (now - OUTBOX_SETTLED_RETENTION_SECONDS,))])
+    return max(count, 0)
+
+def deliver_outbox_message(chat_id: int, category: str, message_index: int, media_type: str = None):
+    """
+    Send one outbox message.
+    
+    Returns:
+        TelegramErrorOutcome or None: None when delivered (or no longer
+            deliverable), otherwise the classified error
+    """
+    messages = get_azkar_messages(category)
+    if message_index >= len(messages):
+        logger.warning(f"Dropping outbox message {category}[{message_index}] for chat {chat_id}: content changed")
+        return None
+    msg = messages[message_index]
+    started = time.perf_counter()
     try:
-        logger.info(f"[{current_time}] Scheduling jobs for chat {chat_id}")
+        if media_type:
+            send_media_with_caption(chat_id, msg, media_type)
+        else:
+            bot.send_message(chat_id, msg, parse_mode="Markdown")
+    except TELEGRAM_SEND_ERRORS as e:
+        return handle_send_error(chat_id, category, e, time.perf_counter() - started)
+    record_send(category, "sent", chat_id=chat_id, latency=time.perf_counter() - started)
+    chat_breakers.record_success(chat_id)
+    return None
+
+def drain_outbox(max_batches: int = None, time_budget: float = None) -> int:
+    """
+    Queue parked sends, then claim and deliver outbox batches until
+    nothing is claimable or a bound is reached. A batch that runs close to
+    its lease releases the rows it did not get to. Nothing is claimed while
+    PostgreSQL is down.
+    
+    Args:
+        max_batches (int): Stop after this many batches (unbounded when None)
+        time_budget (float): Claim no new batch after this many seconds (unbounded when None)
         
-        settings = get_chat_settings(chat_id)
+    Returns:
+        int: Number of messages delivered
+    """
+    worker_id = f"{OUTBOX_WORKER_ID}:{threading.current_thread().name}"
+    started = time.monotonic()
+    requeue_parked_azkar()
+    delivered = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        if time_budget is not None and time.monotonic() - started >= time_budget:
+            break
+        if DATABASE_URL and POSTGRES_AVAILABLE and not postgres_health.is_up():
+            break  # Rows wait in PostgreSQL; the next drain after recovery picks them up
+        lease_until = int(time.time()) + OUTBOX_LEASE_SECONDS
+        try:
+            rows = claim_outbox_batch(worker_id, lease_until=lease_until)
+        except DatabaseUnavailable as e:
+            logger.warning(f"Outbox drain paused, PostgreSQL is unavailable: {e}")
+            break
+        except Exception as e:
+            logger.error(f"✗ Could not claim outbox rows: {e}", exc_info=True)
+            break
+        if not rows:
+            break
+        batches += 1
+        
+        done, retry_at, released, dropped_chats, expired_sequences = [], {}, [], set(), set()
+        blocked_sequences = set()
+        for row_id, chat_id, category, message_index, media_type, due_at, attempts, deadline_at in rows:
+            sequence = (chat_id, category, due_at)
+            if chat_id in dropped_chats or sequence in expired_sequences:
+                continue
+            now = time.time()
+            if sequence in blocked_sequences or now >= lease_until - OUTBOX_LEASE_MARGIN_SECONDS:
+                released.append(row_id)  # Waits behind a retry, or the lease is running out
+                continue
+            if deadline_at is not None and now > deadline_at:
+                # Stale content: drop the rest of the sequence without an API call
+                DELIVERIES_EXPIRED.inc(category)
+                delivery_log.append(chat_id, category, "expired")
+                expired_sequences.add(sequence)
+                continue
+            if is_deactivation_pending(chat_id):
+                dropped_chats.add(chat_id)
+                continue
+            if chat_breakers.is_blocked(chat_id):
+                record_send(category, "circuit_open", chat_id=chat_id)
+                dropped_chats.add(chat_id)
+                continue
+            
+            try:
+                outcome = deliver_outbox_message(chat_id, category, message_index, media_type)
+            except Exception as e:
+                record_send(category, "failed", chat_id=chat_id)
+                logger.error(f"✗ Unexpected error delivering outbox row {row_id} to chat {chat_id}: {e}", exc_info=True)
+                outcome = TelegramErrorOutcome(TelegramErrorKind.OTHER, False, None, str(e))
+            
+            now = time.time()
+            if outcome is None:
+                done.append(row_id)
+                delivered += 1
+                OUTBOX_DELIVERY_LAG.observe(max(0.0, now - due_at), category)
+            elif outcome.deactivate:
+                dropped_chats.add(chat_id)
+            elif outcome.kind is TelegramErrorKind.OTHER or attempts >= OUTBOX_MAX_ATTEMPTS:
+                done.append(row_id)  # Not worth retrying; move on to the next message
+            else:
+                retry_at[row_id] = int(now + (outcome.retry_after or OUTBOX_RETRY_SECONDS))
+                blocked_sequences.add(sequence)
         
-        # Validate that chat is enabled
-        if not settings["is_enabled"]:
-            logger.info(f"[{current_time}] Chat {chat_id} is disabled, clearing all scheduled jobs")
-            # Remove all jobs for this chat
-            for job in scheduler.get_jobs():
-                if str(chat_id) in job.id:
-                    job.remove()
-            return
+        try:
+            settle_outbox(done, retry_at, dropped_chats, expired_sequences, released)
+        except Exception as e:
+            # Leases expire, so unsettled rows are retried (and may be re-sent)
+            logger.error(f"✗ Could not settle {len(rows)} outbox rows: {e}", exc_info=True)
+            break
+    return delivered
+
+# Picks up rows left by a restart, expired leases and retries
+scheduler.add_job(
+    drain_outbox,
+    "interval",
+    seconds=OUTBOX_DRAIN_SECONDS,
+    kwargs={"time_budget": OUTBOX_DRAIN_SECONDS},
+    id="outbox_drain",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+scheduler.add_job(
+    prune_outbox,
+    "interval",
+    hours=1,
+    id="outbox_prune",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+
+# ────────────────────────────────────────────────
+#               Scheduling
+# ────────────────────────────────────────────────
+
+# Timed content (morning, evening, sleep, Friday and fasting reminders) is
+# planned once a day instead of living in one cron job per chat. On its
+# first tick of each day the dispatcher runs a single streaming query over
+# all enabled chats that produces the day's deliveries as parallel arrays
+# sorted by send time, and otherwise only advances a cursor over them. Settings changes patch the
+# rest of today's plan in place. Diverse azkar are not planned; they live
+# on the timing wheel below.
+
+PLAN_CATEGORIES = ("morning", "evening", "sleep", "friday_kahf", "friday_dua", "fasting_monday_thursday")
+PLAN_CODES = {category: code for code, category in enumerate(PLAN_CATEGORIES, start=1)}
+PLAN_CANCELLED = 0  # Code left in the slot of an entry removed by a settings change
+
+# Categories that only go out on some weekdays (Monday is 0). Fasting
+# reminders go out the evening before: Sunday for Monday, Wednesday for Thursday.
+PLAN_CATEGORY_WEEKDAYS = {
+    "friday_kahf": (4,),
+    "friday_dua": (4,),
+    "fasting_monday_thursday": (6, 2),
+}
+
+# Plan categories owned by each settings section. A change in one section
+# only needs that section's settings and only touches its entries.
+CHAT_PLAN_SECTIONS = {
+    "chat": ("morning", "evening", "sleep", "friday_kahf", "friday_dua"),
+    "fasting": ("fasting_monday_thursday",),
+}
 
-        # Remove previous jobs to avoid duplicates
-        jobs_removed = 0
-        for job in scheduler.get_jobs():
-            if str(chat_id) in job.id:
-                job.remove()
-                jobs_removed += 1
+PLAN_DISPATCH_SECONDS = 1
+PLAN_DISPATCH_WORKERS = 8
+PLAN_FETCH_SIZE = 1000
+DELIVERY_DISPATCH_JOB_ID = "delivery_plan_dispatch"
+
+SECONDS_PER_DAY = 24 * 3600
+
+def chat_send_offset(chat_id: int) -> int:
+    """Deterministic per-chat offset in [0, SEND_JITTER_WINDOW_SECONDS)."""
+    if SEND_JITTER_WINDOW_SECONDS <= 0:
+        return 0
+    # Fibonacci hashing spreads consecutive and similar chat IDs evenly
+    mixed = ((chat_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32
+    return mixed % SEND_JITTER_WINDOW_SECONDS
+
+def jittered_time(chat_id: int, hour: int, minute: int) -> tuple:
+    """
+    Apply the chat's offset to a configured time of day. Offsets that would
+    cross midnight are applied backwards instead, so weekday jobs stay on
+    their day.
+    
+    Returns:
+        tuple: (hour, minute, second) of the effective send time
+    """
+    base = hour * 3600 + minute * 60
+    offset = chat_send_offset(chat_id)
+    total = base + offset if base + offset < SECONDS_PER_DAY else base - offset
+    return total // 3600, total % 3600 // 60, total % 60
+
+def effective_send_time(chat_id: int, time_str: str) -> str:
+    """Return the effective HH:MM:SS send time of a configured HH:MM time."""
+    h, m, is_valid, _ = validate_time_format(time_str)
+    if not is_valid:
+        return time_str
+    return "%02d:%02d:%02d" % jittered_time(chat_id, h, m)
+
+def send_second_of_day(chat_id: int, hour: int, minute: int) -> int:
+    """Second of the day at which a chat's content for HH:MM goes out."""
+    h, m, sec = jittered_time(chat_id, hour, minute)
+    return h * 3600 + m * 60 + sec
+
+def chat_send_seconds(chat_id: int, settings: dict, fasting_settings: dict) -> dict:
+    """
+    Compute when each enabled category of a chat goes out on the days it
+    applies to (see PLAN_CATEGORY_WEEKDAYS).
+    
+    Args:
+        chat_id (int): The Telegram chat ID
+        settings (dict): chat_settings fields, or None to skip that section
+        fasting_settings (dict): fasting_reminders fields, or None to skip that section
         
-        if jobs_removed > 0:
-            logger.info(f"[{current_time}] Removed {jobs_removed} existing jobs for chat {chat_id}")
+    Returns:
+        dict: {category: second_of_day}
+    """
+    seconds = {}
+    
+    if settings is not None:
+        timed = (
+            ("morning_azkar", "morning_time", "morning"),
+            ("evening_azkar", "evening_time", "evening"),
+            ("sleep_message", "sleep_time", "sleep"),
+        )
+        for enabled_key, time_key, category in timed:
+            if not settings[enabled_key]:
+                continue
+            h, m, is_valid, error_msg = validate_time_format(settings[time_key])
+            if not is_valid:
+                logger.error(f"✗ Invalid {time_key} for chat {chat_id}: {error_msg}")
+                continue
+            seconds[category] = send_second_of_day(chat_id, h, m)
+        
+        # Friday Kahf reminder (Fri 09:00) and Friday Dua (Fri 10:00) use fixed times
+        if settings["friday_sura"]:
+            seconds["friday_kahf"] = send_second_of_day(chat_id, 9, 0)
+        if settings["friday_dua"]:
+            seconds["friday_dua"] = send_second_of_day(chat_id, 10, 0)
+    
+    if fasting_settings is not None and fasting_settings["monday_thursday_enabled"]:
+        h, m, is_valid, error_msg = validate_time_format(fasting_settings["reminder_time"])
+        if is_valid:
+            seconds["fasting_monday_thursday"] = send_second_of_day(chat_id, h, m)
+        else:
+            logger.error(f"✗ Invalid reminder_time for chat {chat_id}: {error_msg}")
+    
+    return seconds
+
+def plan_category_applies(category: str, weekday: int) -> bool:
+    """Whether a category goes out on a weekday (Monday is 0)."""
+    weekdays = PLAN_CATEGORY_WEEKDAYS.get(category)
+    return weekdays is None or weekday in weekdays
 
-        jobs_scheduled = 0
+def plan_entries_for_chat(chat_id: int, settings: dict, fasting_settings: dict, day) -> list:
+    """
+    Compute a chat's timed deliveries for one day.
+    
+    Args:
+        chat_id (int): The Telegram chat ID
+        settings (dict): chat_settings fields, or None to skip that section
+        fasting_settings (dict): fasting_reminders fields, or None to skip that section
+        day (date): Day being planned (weekday decides Friday and fasting entries)
         
-        # Morning Azkar - scheduled based on user-defined time
-        if settings["morning_azkar"]:
-            morning_time = settings["morning_time"]
-            h, m, is_valid, error_msg = validate_time_format(morning_time)
-            
-            if is_valid:
-                scheduler.add_job(
-                    send_azkar,
-                    CronTrigger(hour=h, minute=m, timezone=TIMEZONE),
-                    args=[chat_id, "morning"],
-                    id=f"morning_{chat_id}",
-                    replace_existing=True
-                )
-                jobs_scheduled += 1
-                logger.info(f"[{current_time}] ✓ Scheduled morning azkar for chat {chat_id} at {h:02d}:{m:02d} {TIMEZONE}")
-            else:
-                logger.error(f"[{current_time}] ✗ Invalid morning_time for chat {chat_id}: {error_msg}")
+    Returns:
+        list: (second_of_day, category) pairs
+    """
+    weekday = day.weekday()
+    return [(second, category)
+            for category, second in chat_send_seconds(chat_id, settings, fasting_settings).items()
+            if plan_category_applies(category, weekday)]
 
-        # Evening Azkar - scheduled based on user-defined time
-        if settings["evening_azkar"]:
-            evening_time = settings["evening_time"]
-            h, m, is_valid, error_msg = validate_time_format(evening_time)
-            
-            if is_valid:
-                scheduler.add_job(
-                    send_azkar,
-                    CronTrigger(hour=h, minute=m, timezone=TIMEZONE),
-                    args=[chat_id, "evening"],
-                    id=f"evening_{chat_id}",
-                    replace_existing=True
-                )
-                jobs_scheduled += 1
-                logger.info(f"[{current_time}] ✓ Scheduled evening azkar for chat {chat_id} at {h:02d}:{m:02d} {TIMEZONE}")
-            else:
-                logger.error(f"[{current_time}] ✗ Invalid evening_time for chat {chat_id}: {error_msg}")
+def plan_midnight(day) -> int:
+    """Unix time of midnight in TIMEZONE at the start of a day."""
+    return int(TIMEZONE.localize(datetime.combine(day, dt_time())).timestamp())
 
-        # Friday Kahf reminder - fixed time (Friday 9:00 AM)
-        if settings["friday_sura"]:
-            scheduler.add_job(
-                send_azkar,
-                CronTrigger(day_of_week="fri", hour=9, minute=0, timezone=TIMEZONE),
-                args=[chat_id, "friday_kahf"],
-                id=f"kahf_{chat_id}",
-                replace_existing=True
-            )
-            jobs_scheduled += 1
-            logger.info(f"[{current_time}] ✓ Scheduled Friday Kahf for chat {chat_id} at Fri 09:00 {TIMEZONE}")
+class DeliveryPlan:
+    """
+    One day of timed deliveries as parallel arrays sorted by send time:
+    epochs (int64), chat_ids (int64) and category codes (uint8). Entries
+    before `cursor` have been dispatched. Cancelled entries keep their slot
+    with code PLAN_CANCELLED until the next day's plan replaces them.
+    """
 
-        # Friday Dua - fixed time (Friday 10:00 AM)
-        if settings["friday_dua"]:
-            scheduler.add_job(
-                send_azkar,
-                CronTrigger(day_of_week="fri", hour=10, minute=0, timezone=TIMEZONE),
-                args=[chat_id, "friday_dua"],
-                id=f"friday_dua_{chat_id}",
-                replace_existing=True
-            )
-            jobs_scheduled += 1
-            logger.info(f"[{current_time}] ✓ Scheduled Friday Dua for chat {chat_id} at Fri 10:00 {TIMEZONE}")
+    def __init__(self, day, entries=()):
+        self.day = day
+        self.midnight = plan_midnight(day)
+        ordered = sorted(entries)  # (epoch, chat_id, code)
+        self.epochs = array("q", [entry[0] for entry in ordered])
+        self.chat_ids = array("q", [entry[1] for entry in ordered])
+        self.codes = array("B", [entry[2] for entry in ordered])
+        self.cursor = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        """Number of entries not dispatched yet (including cancelled slots)."""
+        return len(self.epochs) - self.cursor
 
-        # Sleep message - scheduled based on user-defined time
-        if settings["sleep_message"]:
+    def pop_due(self, now: float, dispatch: bool = True) -> list:
+        """
+        Advance the cursor past every entry due at `now`.
+        
+        Returns:
+            list: (epoch, chat_id, category) of the live entries passed, or
+                an empty list when dispatch is False
+        """
+        with self.lock:
+            end = bisect_right(self.epochs, now, self.cursor)
+            due = []
+            if dispatch:
+                for i in range(self.cursor, end):
+                    code = self.codes[i]
+                    if code != PLAN_CANCELLED:
+                        due.append((self.epochs[i], self.chat_ids[i], PLAN_CATEGORIES[code - 1]))
+            self.cursor = end
+            return due
+
+    def _pending_positions(self, chat_id: int):
+        """Yield positions of the chat's entries at or after the cursor (lock held)."""
+        position = self.cursor
+        while True:
             try:
-                sleep_time = settings["sleep_time"]
-                # Validate time format
-                if not sleep_time or ':' not in sleep_time:
-                    logger.error(f"[{current_time}] ✗ Invalid sleep_time format for chat {chat_id}: '{sleep_time}'")
+                position = self.chat_ids.index(chat_id, position)
+            except ValueError:
+                return
+            yield position
+            position += 1
+
+    def entries_for(self, chat_id: int) -> dict:
+        """Return {category: epoch} of the chat's pending live entries."""
+        with self.lock:
+            return {PLAN_CATEGORIES[self.codes[i] - 1]: self.epochs[i]
+                    for i in self._pending_positions(chat_id) if self.codes[i] != PLAN_CANCELLED}
+
+    def replace(self, chat_id: int, categories, desired, now: float) -> tuple:
+        """
+        Make the chat's pending entries for `categories` equal to `desired`.
+        Entries already in place are kept; times that have passed today are
+        not added.
+        
+        Args:
+            chat_id (int): The Telegram chat ID
+            categories: Categories owned by the caller
+            desired: (second_of_day, category) pairs
+            now (float): Current Unix time
+            
+        Returns:
+            tuple: (added, removed) entry counts
+        """
+        codes = {PLAN_CODES[category] for category in categories}
+        wanted = {(self.midnight + second, PLAN_CODES[category]) for second, category in desired}
+        wanted = {entry for entry in wanted if entry[0] > now}
+        added = removed = 0
+        with self.lock:
+            for i in list(self._pending_positions(chat_id)):
+                entry = (self.epochs[i], self.codes[i])
+                if entry[1] not in codes:
+                    continue
+                if entry in wanted:
+                    wanted.discard(entry)
                 else:
-                    h, m = map(int, sleep_time.split(":"))
-                    # Validate hour and minute ranges
-                    if not (0 <= h <= 23 and 0 <= m <= 59):
-                        logger.error(f"[{current_time}] ✗ Invalid sleep_time values for chat {chat_id}: {h}:{m}")
-                    else:
-                        scheduler.add_job(
-                            send_azkar,
-                            CronTrigger(hour=h, minute=m, timezone=TIMEZONE),
-                            args=[chat_id, "sleep"],
-                            id=f"sleep_{chat_id}",
-                            replace_existing=True
-                        )
-                        jobs_scheduled += 1
-                        logger.info(f"[{current_time}] ✓ Scheduled sleep message for chat {chat_id} at {h:02d}:{m:02d} {TIMEZONE}")
-            except (ValueError, AttributeError) as e:
-                logger.error(f"[{current_time}] ✗ Error scheduling sleep message for chat {chat_id}: {e}")
+                    self.codes[i] = PLAN_CANCELLED
+                    removed += 1
+            for epoch, code in sorted(wanted):
+                position = bisect_right(self.epochs, epoch, self.cursor)
+                self.epochs.insert(position, epoch)
+                self.chat_ids.insert(position, chat_id)
+                self.codes.insert(position, code)
+                added += 1
+        return added, removed
+
+delivery_plan = None
+plan_executor = ThreadPoolExecutor(max_workers=PLAN_DISPATCH_WORKERS, thread_name_prefix="delivery")
+
+PLAN_DISPATCH_LAG = Histogram("delivery_plan_lag_seconds", "Delay between a planned send time and its dispatch",
+                              ("category",), buckets=SCHEDULER_LAG_BUCKETS)
+PLAN_PENDING = Gauge("delivery_plan_pending", "Entries of today's delivery plan not dispatched yet", (),
+                     lambda: {(): len(delivery_plan) if delivery_plan is not None else 0})
+
+def iter_enabled_chat_schedules():
+    """
+    Stream the scheduling fields of every enabled chat with a single query
+    (a server-side cursor on PostgreSQL).
+    
+    Yields:
+        tuple: (chat_id, settings, fasting_settings) in the shape expected
+            by plan_entries_for_chat
+    """
+    conn, c, is_postgres = get_db_connection()
+    try:
+        if is_postgres:
+            c = conn.cursor(name="delivery_plan")  # Server-side cursor streams rows
+        c.execute(f'''
+            SELECT s.chat_id, s.flags, s.morning_time, s.evening_time, s.sleep_time,
+                   COALESCE(f.monday_thursday_enabled, 1), COALESCE(f.reminder_time, '21:00')
+            FROM chat_settings s
+            LEFT JOIN fasting_reminders f ON f.chat_id = s.chat_id
+            WHERE {chat_flags_sql("is_enabled", column="s.flags")}
+        ''')
+        while True:
+            rows = c.fetchmany(PLAN_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                settings = ChatSettings(row[0], row[1], row[2], row[3], row[4])
+                fasting_settings = {"monday_thursday_enabled": row[5], "reminder_time": row[6]}
+                yield row[0], settings, fasting_settings
+    finally:
+        conn.close()
+
+@timed_db_query
+def build_delivery_plan(day=None) -> DeliveryPlan:
+    """
+    Build the delivery plan of a day (today in TIMEZONE by default) from a
+    single streaming query over all enabled chats and make it current.
+    Entries whose time has already passed are skipped, not sent.
+    """
+    day = day or datetime.now(TIMEZONE).date()
+    midnight = plan_midnight(day)
+    entries = []
+    for chat_id, settings, fasting_settings in iter_enabled_chat_schedules():
+        for second, category in plan_entries_for_chat(chat_id, settings, fasting_settings, day):
+            entries.append((midnight + second, chat_id, PLAN_CODES[category]))
+    
+    global delivery_plan
+    plan = DeliveryPlan(day, entries)
+    plan.pop_due(time.time(), dispatch=False)
+    delivery_plan = plan
+    logger.info(f"✓ Delivery plan for {day}: {len(entries)} entries, {len(plan)} still ahead")
+    return plan
+
+def run_plan_entry(chat_id: int, category: str):
+    """Send one planned delivery."""
+    if category.startswith("fasting_"):
+        send_fasting_reminder(chat_id, category[len("fasting_"):])
+    else:
+        send_azkar(chat_id, category)
+
+def dispatch_delivery_plan():
+    """
+    Hand every planned delivery that has come due to the delivery workers.
+    Rebuilds the plan first when the day has changed; this is the only
+    rebuild, so patch_delivery_plan edits made after it are kept all day.
+    """
+    plan = delivery_plan
+    if plan is None or plan.day != datetime.now(TIMEZONE).date():
+        plan = build_delivery_plan()
+    now = time.time()
+    for epoch, chat_id, category in plan.pop_due(now):
+        PLAN_DISPATCH_LAG.observe(max(0.0, now - epoch), category)
+        plan_executor.submit(run_plan_entry, chat_id, category)
+
+def patch_delivery_plan(chat_id: int, section: str, settings: dict = None, fasting_settings: dict = None) -> tuple:
+    """
+    Bring one section of a chat's entries in today's plan in line with its
+    settings; None settings remove the section's entries.
+    
+    Returns:
+        tuple: (added, removed) entry counts
+    """
+    plan = delivery_plan
+    if plan is None:
+        return 0, 0  # Built from the database on the next dispatch
+    desired = plan_entries_for_chat(
+        chat_id,
+        settings if section == "chat" else None,
+        fasting_settings if section == "fasting" else None,
+        plan.day,
+    )
+    return plan.replace(chat_id, CHAT_PLAN_SECTIONS[section], desired, time.time())
+
+def remove_chat_jobs(chat_id: int) -> int:
+    """
+    Remove every planned delivery of a chat, including its diverse azkar
+    entry on the timing wheel.
+    
+    Returns:
+        int: Number of entries removed
+    """
+    removed = sum(patch_delivery_plan(chat_id, section)[1] for section in CHAT_PLAN_SECTIONS)
+    if cancel_diverse_azkar(chat_id):
+        removed += 1
+    return removed
+
+def reschedule_chat_jobs(chat_id: int, section: str):
+    """
+    Incrementally reschedule one settings section after a change. Only that
+    section's settings are read and only its entries in today's plan (or
+    the chat's timing wheel entry) are touched.
+    
+    Args:
+        chat_id (int): The Telegram chat ID
+        section (str): One of "chat", "diverse" or "fasting"
+    """
+    try:
+        settings = get_chat_settings(chat_id)
+        if not settings["is_enabled"]:
+            removed = remove_chat_jobs(chat_id)
+            logger.info(f"Chat {chat_id} is disabled, removed {removed} planned deliveries")
+            return
+        
+        if section == "diverse":
+            schedule_diverse_azkar(chat_id, get_diverse_azkar_settings(chat_id))
+            return
+        elif section == "chat":
+            added, removed = patch_delivery_plan(chat_id, "chat", settings=settings)
+        elif section == "fasting":
+            added, removed = patch_delivery_plan(chat_id, "fasting", fasting_settings=get_fasting_reminders_settings(chat_id))
+        else:
+            logger.error(f"Unknown job section: {section}")
+            return
+        
+        logger.info(f"✓ Rescheduled [{section}] for chat {chat_id}: {added} added, {removed} removed")
+    except Exception as e:
+        logger.error(f"✗ Error rescheduling [{section}] for chat {chat_id}: {e}", exc_info=True)
+
+def schedule_chat_jobs(chat_id: int):
+    """
+    Plan all of today's deliveries for a specific chat based on its settings
+    and put it on the diverse azkar wheel. Unchanged entries are kept as-is.
+    
+    Args:
+        chat_id (int): The Telegram chat ID to schedule jobs for
+    """
+    current_time = datetime.now(TIMEZONE).strftime("%Y-%m-%d %H:%M:%S %Z")
+    
+    try:
+        logger.info(f"[{current_time}] Scheduling jobs for chat {chat_id}")
+        
+        settings = get_chat_settings(chat_id)
+        
+        # Validate that chat is enabled
+        if not settings["is_enabled"]:
+            removed = remove_chat_jobs(chat_id)
+            logger.info(f"[{current_time}] Chat {chat_id} is disabled, cleared {removed} planned deliveries")
+            return
         
-        # Diverse Azkar (interval-based) - uses interval_minutes from DB
         diverse_settings = get_diverse_azkar_settings(chat_id)
+        fasting_settings = get_fasting_reminders_settings(chat_id)
         logger.info(f"[{current_time}] Diverse azkar settings for chat {chat_id}: enabled={diverse_settings['enabled']}, interval_minutes={diverse_settings['interval_minutes']}")
         
-        if diverse_settings["enabled"]:
-            interval_min = diverse_settings.get("interval_minutes", 60)
-            
-            # Validate interval
-            if interval_min <= 0:
-                logger.error(f"[{current_time}] ✗ Invalid interval_minutes for chat {chat_id}: {interval_min} (must be > 0)")
-            else:
-                # Remove any existing diverse azkar job first
-                for job in scheduler.get_jobs():
-                    if job.id == f"diverse_azkar_{chat_id}":
-                        job.remove()
-                        logger.info(f"[{current_time}] Removed existing diverse azkar job for chat {chat_id}")
-                
-                # Add new job with interval-based trigger
-                job = scheduler.add_job(
-                    send_diverse_azkar,
-                    'interval',
-                    minutes=interval_min,
-                    args=[chat_id],
-                    id=f"diverse_azkar_{chat_id}",
-                    replace_existing=True,
-                    next_run_time=datetime.now(TIMEZONE)  # Run once immediately, then on interval
-                )
-                jobs_scheduled += 1
-                logger.info(f"[{current_time}] ✓ Scheduled diverse azkar every {interval_min} minutes for chat {chat_id}, next run: {job.next_run_time}")
-        else:
-            logger.info(f"[{current_time}] Diverse azkar not scheduled for chat {chat_id}: disabled")
+        added, removed = patch_delivery_plan(chat_id, "chat", settings=settings)
+        fasting_added, fasting_removed = patch_delivery_plan(chat_id, "fasting", fasting_settings=fasting_settings)
+        schedule_diverse_azkar(chat_id, diverse_settings)
         
-        # Fasting Reminders
-        fasting_settings = get_fasting_reminders_settings(chat_id)
+        logger.info(
+            f"[{current_time}] ✓ Successfully scheduled chat {chat_id} "
+            f"({added + fasting_added} added, {removed + fasting_removed} removed, {TIMEZONE})"
+        )
         
-        # Monday/Thursday fasting reminders
-        if fasting_settings["monday_thursday_enabled"]:
-            try:
-                reminder_time = fasting_settings["reminder_time"]
-                # Validate time format
-                if not reminder_time or ':' not in reminder_time:
-                    logger.error(f"[{current_time}] ✗ Invalid reminder_time format for chat {chat_id}: '{reminder_time}'")
-                else:
-                    h, m = map(int, reminder_time.split(":"))
-                    # Validate hour and minute ranges
-                    if not (0 <= h <= 23 and 0 <= m <= 59):
-                        logger.error(f"[{current_time}] ✗ Invalid reminder_time values for chat {chat_id}: {h}:{m}")
-                    else:
-                        # Schedule for Sunday (day before Monday) and Wednesday (day before Thursday)
-                        scheduler.add_job(
-                            send_fasting_reminder,
-                            CronTrigger(day_of_week="sun", hour=h, minute=m, timezone=TIMEZONE),
-                            args=[chat_id, "monday_thursday"],
-                            id=f"monday_reminder_{chat_id}",
-                            replace_existing=True
-                        )
-                        scheduler.add_job(
-                            send_fasting_reminder,
-                            CronTrigger(day_of_week="wed", hour=h, minute=m, timezone=TIMEZONE),
-                            args=[chat_id, "monday_thursday"],
-                            id=f"thursday_reminder_{chat_id}",
-                            replace_existing=True
-                        )
-                        jobs_scheduled += 2
-                        logger.info(f"[{current_time}] ✓ Scheduled Monday/Thursday fasting reminders for chat {chat_id} at {h:02d}:{m:02d} {TIMEZONE}")
-            except (ValueError, AttributeError) as e:
-                logger.error(f"[{current_time}] ✗ Error scheduling fasting reminders for chat {chat_id}: {e}")
+    except Exception as e:
+        logger.error(f"[{current_time}] ✗ Critical error scheduling jobs for chat {chat_id}: {e}", exc_info=True)
+
+def schedule_all_chats():
+    """
+    Build today's delivery plan and put every enabled chat with diverse
+    azkar on the timing wheel. Called on bot startup.
+    """
+    try:
+        build_delivery_plan()
+        
+        conn, c, is_postgres = get_db_connection()
+        try:
+            c.execute(f"SELECT chat_id FROM chat_settings WHERE {chat_flags_sql('is_enabled')}")
+            chat_ids = [row[0] for row in c.fetchall()]
+        finally:
+            conn.close()
         
-        logger.info(f"[{current_time}] ✓ Successfully scheduled {jobs_scheduled} jobs for chat {chat_id}")
+        diverse = get_diverse_azkar_settings_batch(chat_ids)
+        for chat_id, diverse_settings in diverse.items():
+            try:
+                schedule_diverse_azkar(chat_id, diverse_settings)
+            except Exception as e:
+                logger.error(f"Error scheduling diverse azkar for chat {chat_id}: {e}")
         
+        logger.info(f"✓ Completed scheduling for {len(chat_ids)} chats ({len(diverse)} with diverse azkar settings)")
+    except Exception as e:
+        logger.error(f"Error in schedule_all_chats: {e}", exc_info=True)
+
+scheduler.add_job(
+    dispatch_delivery_plan,
+    "interval",
+    seconds=PLAN_DISPATCH_SECONDS,
+    id=DELIVERY_DISPATCH_JOB_ID,
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
+
+# ────────────────────────────────────────────────
+#               Diverse Azkar Timing Wheel
+# ────────────────────────────────────────────────
+
+# Interval content (diverse azkar, 1 minute to 24 hours) is driven by one
+# timer instead of one APScheduler job per chat. Chats are grouped by the
+# minute they are next due; each tick fires the whole batch with a single
+# settings query, and only the next_due epoch of each chat is persisted so
+# restarts resume where they left off.
+
+DIVERSE_WHEEL_TICK_SECONDS = 60
+DIVERSE_WHEEL_JOB_ID = "diverse_wheel_tick"
+DIVERSE_BATCH_QUERY_SIZE = 500  # One parameter per chat, under SQL_MAX_PARAMETERS
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel keyed by absolute tick numbers.
+    
+    With the default slot counts (60, 24) level 0 holds one slot per minute
+    of the current hour and level 1 one slot per hour of the current day;
+    anything further out waits in an overflow set. Entries cascade down a
+    level when the wheel reaches their slot, so scheduling and cancelling
+    are O(1) and each tick only touches the slots it passes.
+    """
+
+    def __init__(self, start_tick: int, slot_counts: tuple = (60, 24)):
+        self.slot_counts = slot_counts
+        self.spans = []  # Ticks covered by one slot at each level
+        span = 1
+        for count in slot_counts:
+            self.spans.append(span)
+            span *= count
+        self.horizon = span  # Ticks covered by one rotation of the top level
+        self.levels = [[set() for _ in range(count)] for count in slot_counts]
+        self.overflow = set()
+        self.ready = set()  # Entries already due, fired on the next advance
+        self.due = {}       # key -> due tick
+        self.where = {}     # key -> the set currently holding it
+        self.current_tick = start_tick
+
+    def __len__(self):
+        return len(self.due)
+
+    def __contains__(self, key):
+        return key in self.due
+
+    def _place(self, key, due_tick: int):
+        bucket = self.overflow
+        for level, (span, count) in enumerate(zip(self.spans, self.slot_counts)):
+            rotation = span * count
+            if due_tick // rotation == self.current_tick // rotation:
+                bucket = self.levels[level][(due_tick // span) % count]
+                break
+        bucket.add(key)
+        self.where[key] = bucket
+
+    def schedule(self, key, due_tick: int):
+        """Schedule (or move) key to fire at due_tick."""
+        self.cancel(key)
+        self.due[key] = due_tick
+        if due_tick <= self.current_tick:
+            self.ready.add(key)
+            self.where[key] = self.ready
+        else:
+            self._place(key, due_tick)
+
+    def cancel(self, key) -> bool:
+        """Remove key from the wheel. Returns True if it was scheduled."""
+        bucket = self.where.pop(key, None)
+        if bucket is None:
+            return False
+        bucket.discard(key)
+        del self.due[key]
+        return True
+
+    def _cascade(self, bucket: set):
+        entries = list(bucket)
+        bucket.clear()
+        for key in entries:
+            self._place(key, self.due[key])
+
+    def _fire(self, bucket: set, fired: list):
+        for key in bucket:
+            fired.append((key, self.due.pop(key)))
+            del self.where[key]
+        bucket.clear()
+
+    def advance(self, to_tick: int) -> list:
+        """
+        Advance the wheel to to_tick and return the (key, due_tick) pairs that
+        came due, including entries already overdue.
+        """
+        fired = []
+        self._fire(self.ready, fired)
+        while self.current_tick < to_tick:
+            tick = self.current_tick = self.current_tick + 1
+            if tick % self.horizon == 0:
+                rotation = [key for key in self.overflow if self.due[key] // self.horizon == tick // self.horizon]
+                for key in rotation:
+                    self.overflow.discard(key)
+                    self._place(key, self.due[key])
+            for level in range(len(self.levels) - 1, 0, -1):
+                span = self.spans[level]
+                if tick % span == 0:
+                    self._cascade(self.levels[level][(tick // span) % self.slot_counts[level]])
+            self._fire(self.levels[0][tick % self.slot_counts[0]], fired)
+        return fired
+
+diverse_wheel = TimingWheel(int(time.time()) // DIVERSE_WHEEL_TICK_SECONDS)
+diverse_wheel_intervals = {}  # chat_id -> interval in ticks currently on the wheel
+diverse_wheel_lock = threading.Lock()
+
+@timed_db_query
+def get_diverse_azkar_settings_batch(chat_ids: list) -> dict:
+    """
+    Load diverse azkar settings for many chats in one query per chunk,
+    including each chat's global is_enabled flag as "chat_enabled".
+    
+    Returns:
+        dict: chat_id -> settings dict (chats without rows are omitted)
+    """
+    result = {}
+    if not chat_ids:
+        return result
+    
+    conn, c, is_postgres = get_db_connection()
+    try:
+        placeholder = "%s" if is_postgres else "?"
+        for start in range(0, len(chat_ids), DIVERSE_BATCH_QUERY_SIZE):
+            chunk = chat_ids[start:start + DIVERSE_BATCH_QUERY_SIZE]
+            c.execute(f'''
+                SELECT d.chat_id, d.enabled, d.interval_minutes, d.media_type, d.last_sent_timestamp,
+                       d.enable_audio, d.enable_images, d.enable_pdf, d.enable_text, d.next_due,
+                       COALESCE(s.flags & {CHAT_FLAG_BITS["is_enabled"]}, 1)
+                FROM diverse_azkar_settings d
+                LEFT JOIN chat_settings s ON s.chat_id = d.chat_id
+                WHERE d.chat_id IN ({", ".join([placeholder] * len(chunk))})
+            ''', tuple(chunk))
+            for row in c.fetchall():
+                result[row[0]] = {
+                    "chat_id": row[0],
+                    "enabled": bool(row[1]),
+                    "interval_minutes": row[2],
+                    "media_type": row[3],
+                    "last_sent_timestamp": row[4],
+                    "enable_audio": bool(row[5]),
+                    "enable_images": bool(row[6]),
+                    "enable_pdf": bool(row[7]),
+                    "enable_text": bool(row[8]),
+                    "next_due": row[9],
+                    "chat_enabled": bool(row[10]) and not is_deactivation_pending(row[0]),
+                }
+        return result
+    finally:
+        conn.close()
+
+@timed_db_query
+def save_diverse_next_due(next_due: dict):
+    """
+    Persist next_due epochs (or None to clear) for many chats in one batch.
+    
+    Args:
+        next_due (dict): chat_id -> epoch seconds or None
+    """
+    if not next_due:
+        return
+    
+    try:
+        db_write([("UPDATE diverse_azkar_settings SET next_due = {p} WHERE chat_id = {p}", (epoch, chat_id))
+                  for chat_id, epoch in next_due.items()])
     except Exception as e:
-        logger.error(f"[{current_time}] ✗ Critical error scheduling jobs for chat {chat_id}: {e}", exc_info=True)
+        logger.error(f"Error saving diverse azkar next_due: {e}", exc_info=True)
 
-def schedule_all_chats():
+def current_wheel_tick() -> int:
+    return int(time.time()) // DIVERSE_WHEEL_TICK_SECONDS
+
+def schedule_diverse_azkar(chat_id: int, diverse_settings: dict):
+    """
+    Put a chat on the diverse azkar timing wheel according to its settings.
+    
+    - Disabled (or invalid interval): removed from the wheel.
+    - Unchanged interval: left alone, keeping its next due tick.
+    - Changed interval: next due one new interval from now, no immediate send.
+    - Newly scheduled: resumes from the persisted next_due if it is still in
+      the future, otherwise is due immediately.
+    """
+    interval = diverse_settings.get("interval_minutes", 60)
+    if diverse_settings["enabled"] and (not interval or interval <= 0):
+        logger.error(f"✗ Invalid interval_minutes for chat {chat_id}: {interval} (must be > 0)")
+    if not diverse_settings["enabled"] or not interval or interval <= 0:
+        cancel_diverse_azkar(chat_id)
+        return
+    
+    interval_ticks = interval * 60 // DIVERSE_WHEEL_TICK_SECONDS
+    now_tick = current_wheel_tick()
+    with diverse_wheel_lock:
+        previous = diverse_wheel_intervals.get(chat_id)
+        if chat_id in diverse_wheel and previous == interval_ticks:
+            return
+        if chat_id in diverse_wheel:
+            due_tick = now_tick + interval_ticks
+        else:
+            persisted = diverse_settings.get("next_due")
+            due_tick = max(persisted // DIVERSE_WHEEL_TICK_SECONDS if persisted else now_tick, now_tick)
+        diverse_wheel.schedule(chat_id, due_tick)
+        diverse_wheel_intervals[chat_id] = interval_ticks
+    
+    if due_tick * DIVERSE_WHEEL_TICK_SECONDS != diverse_settings.get("next_due"):
+        save_diverse_next_due({chat_id: due_tick * DIVERSE_WHEEL_TICK_SECONDS})
+    if due_tick <= now_tick:
+        wake_diverse_wheel()
+    logger.info(f"✓ Diverse azkar for chat {chat_id} on timing wheel every {interval}min, next due tick {due_tick}")
+
+def cancel_diverse_azkar(chat_id: int) -> bool:
+    """Remove a chat from the timing wheel and clear its persisted next_due."""
+    with diverse_wheel_lock:
+        removed = diverse_wheel.cancel(chat_id)
+        diverse_wheel_intervals.pop(chat_id, None)
+    if removed:
+        save_diverse_next_due({chat_id: None})
+    return removed
+
+def wake_diverse_wheel():
+    """Run the wheel tick as soon as possible instead of at the next minute."""
+    try:
+        scheduler.modify_job(DIVERSE_WHEEL_JOB_ID, next_run_time=datetime.now(TIMEZONE))
+    except Exception:
+        pass
+
+def run_diverse_wheel_tick():
     """
-    Schedule jobs for all enabled chats in the database.
-    This should be called on bot startup to initialize all scheduled jobs.
+    Fire every chat due up to the current tick as one batch, then put them
+    back on the wheel one interval later and persist their next_due.
     """
+    now_tick = current_wheel_tick()
+    with diverse_wheel_lock:
+        fired = diverse_wheel.advance(now_tick)
+    if not fired:
+        return
+    
+    chat_ids = [chat_id for chat_id, _ in fired]
+    # Chats behind an open circuit breaker, or overdue by a whole interval
+    # (e.g. after a stall), are pushed back without a DB read
+    skipped = {chat_id for chat_id in chat_ids if chat_breakers.is_blocked(chat_id)}
+    expired = {chat_id for chat_id, due_tick in fired
+               if chat_id not in skipped and now_tick - due_tick >= diverse_wheel_intervals.get(chat_id, 1)}
+    to_load = [chat_id for chat_id in chat_ids if chat_id not in skipped and chat_id not in expired]
     try:
-        conn, c, is_postgres = get_db_connection()
-        
-        try:
-            c.execute("SELECT chat_id FROM chat_settings WHERE is_enabled = 1")
-            chat_ids = [row[0] for row in c.fetchall()]
-            
-            logger.info(f"Scheduling jobs for {len(chat_ids)} enabled chats...")
-            
-            for chat_id in chat_ids:
-                try:
-                    schedule_chat_jobs(chat_id)
-                except Exception as e:
-                    logger.error(f"Error scheduling jobs for chat {chat_id}: {e}")
-            
-            logger.info(f"✓ Completed scheduling jobs for {len(chat_ids)} chats")
-        finally:
-            conn.close()
-            
+        batch = get_diverse_azkar_settings_batch(to_load) if to_load else {}
     except Exception as e:
-        logger.error(f"Error in schedule_all_chats: {e}", exc_info=True)
+        logger.error(f"✗ Could not load diverse azkar settings for {len(chat_ids)} chats: {e}", exc_info=True)
+        with diverse_wheel_lock:
+            for chat_id, due_tick in fired:
+                diverse_wheel.schedule(chat_id, now_tick + 1)
+        return
+    
+    next_due = {}
+    for chat_id in chat_ids:
+        if chat_id in skipped:
+            record_send("diverse", "circuit_open", chat_id=chat_id)
+        elif chat_id in expired:
+            DELIVERIES_EXPIRED.inc("diverse")
+            delivery_log.append(chat_id, "diverse", "expired")
+        else:
+            settings = batch.get(chat_id)
+            if settings is None or not settings["enabled"] or not settings["chat_enabled"]:
+                with diverse_wheel_lock:
+                    diverse_wheel_intervals.pop(chat_id, None)
+                next_due[chat_id] = None
+                continue
+            
+            send_diverse_azkar(chat_id, settings)
+        
+        with diverse_wheel_lock:
+            # The chat may have been rescheduled or cancelled while sending
+            if chat_id in diverse_wheel or chat_id not in diverse_wheel_intervals:
+                continue
+            due_tick = now_tick + diverse_wheel_intervals[chat_id]
+            diverse_wheel.schedule(chat_id, due_tick)
+        next_due[chat_id] = due_tick * DIVERSE_WHEEL_TICK_SECONDS
+    
+    save_diverse_next_due(next_due)
+    logger.info(f"✓ Diverse azkar wheel tick {now_tick}: {len(fired)} chats due, {len(diverse_wheel)} scheduled")
+
+scheduler.add_job(
+    run_diverse_wheel_tick,
+    "cron",
+    second=0,
+    id=DIVERSE_WHEEL_JOB_ID,
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True
+)
 
 # ────────────────────────────────────────────────
 #               Bot Handlers
@@ -2624,11 +5683,7 @@ def my_chat_member_handler(update: types.ChatMemberUpdated):
             update_chat_setting(chat_id, "is_enabled", 0)
             
             # Remove all scheduled jobs for this chat
-            jobs_removed = 0
-            for job in scheduler.get_jobs():
-                if str(chat_id) in job.id:
-                    job.remove()
-                    jobs_removed += 1
+            jobs_removed = remove_chat_jobs(chat_id)
             
             logger.info(f"[{current_time}] ✓ Removed {jobs_removed} scheduled jobs for chat {chat_id}")
             
@@ -2657,37 +5712,131 @@ def delete_service_messages(message: types.Message):
         logger.debug(f"Could not delete service message in {chat_id}: {e}")
 
 # ────────────────────────────────────────────────
-#               Helper Functions for Callbacks
+#               Compact Callback Data Codec
 # ────────────────────────────────────────────────
 
-def extract_chat_id_from_callback(callback_data: str) -> tuple:
+# Packed callback data layout (Telegram allows at most 64 bytes):
+#   "~" + base64url( version | action | zigzag-varint chat_id | varint args... )
+# Legacy string callbacks never start with "~", so both formats can coexist.
+CALLBACK_DATA_PREFIX = "~"
+CALLBACK_CODEC_VERSION = 1
+CALLBACK_DATA_MAX_BYTES = 64
+CALLBACK_MAX_ARGS = 8
+CALLBACK_VARINT_MAX_SHIFT = 63
+
+class CallbackAction(IntEnum):
+    """Actions that can be carried in packed callback data. Never renumber."""
+    SELECT_GROUP = 1
+    MORNING_EVENING_MENU = 2
+    FRIDAY_MENU = 3
+    DIVERSE_MENU = 4
+    RAMADAN_MENU = 5
+    TOGGLE_MORNING_AZKAR = 6
+    TOGGLE_EVENING_AZKAR = 7
+    TOGGLE_FRIDAY_SURA = 8
+    TOGGLE_FRIDAY_DUA = 9
+    TOGGLE_DIVERSE_AZKAR = 10
+    TOGGLE_RAMADAN_ENABLED = 11
+    TOGGLE_LAYLAT_ALQADR = 12
+    TOGGLE_LAST_TEN_DAYS = 13
+    TOGGLE_IFTAR_DUA = 14
+    TOGGLE_DIVERSE_AUDIO = 15
+    TOGGLE_DIVERSE_IMAGES = 16
+    TOGGLE_DIVERSE_PDF = 17
+    TOGGLE_DIVERSE_TEXT = 18
+    MORNING_TIME_PRESETS = 19
+    EVENING_TIME_PRESETS = 20
+    SET_MORNING_TIME = 21       # args: hour, minute
+    SET_EVENING_TIME = 22       # args: hour, minute
+    FRIDAY_TIME_SETTINGS = 23
+    DIVERSE_INTERVAL = 24       # args: minutes
+    DIVERSE_MEDIA_FORMAT = 25
+
+def encode_callback_data(action: CallbackAction, chat_id: int = 0, *args: int) -> str:
+    """
+    Pack an action, a chat_id and optional non-negative integer args into callback data.
+    
+    Args:
+        action (CallbackAction): The action to encode
+        chat_id (int): Target chat ID (negative for groups)
+        *args (int): Extra non-negative integer arguments
+        
+    Returns:
+        str: Callback data string of at most 64 bytes
+        
+    Raises:
+        ValueError: If an argument is negative or the result exceeds Telegram's limit
     """
-    Extract chat_id from callback data if present.
+    if len(args) > CALLBACK_MAX_ARGS:
+        raise ValueError(f"Too many callback args: {len(args)} (max {CALLBACK_MAX_ARGS})")
+    
+    buf = bytearray((CALLBACK_CODEC_VERSION, int(action)))
+    # Zigzag maps negative group IDs to small unsigned values
+    for value in ((chat_id << 1) ^ (chat_id >> 63), *args):
+        if value < 0:
+            raise ValueError(f"Callback args must be non-negative, got {value}")
+        while value > 0x7F:
+            buf.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buf.append(value)
+    
+    data = CALLBACK_DATA_PREFIX + base64.urlsafe_b64encode(bytes(buf)).rstrip(b"=").decode("ascii")
+    if len(data) > CALLBACK_DATA_MAX_BYTES:
+        raise ValueError(f"Packed callback data too long: {len(data)} bytes")
+    return data
+
+def decode_callback_data(callback_data: str) -> tuple:
+    """
+    Unpack callback data produced by encode_callback_data in a single pass.
     
     Args:
         callback_data (str): The callback data string
         
     Returns:
-        tuple: (chat_id, has_chat_id) where chat_id is int or None, has_chat_id is bool
+        tuple: (action, chat_id, args) or None if the data is not a valid packed callback
         
     Example:
-        "morning_evening_settings_-123456" -> (-123456, True)
-        "morning_evening_settings" -> (None, False)
+        encode_callback_data(CallbackAction.SELECT_GROUP, -100123) -> "~AQG1nAw"
+        decode_callback_data("~AQG1nAw") -> (CallbackAction.SELECT_GROUP, -100123, ())
     """
-    parts = callback_data.split("_")
+    if not callback_data or len(callback_data) > CALLBACK_DATA_MAX_BYTES or callback_data[0] != CALLBACK_DATA_PREFIX:
+        return None
     
-    # Check if last part looks like a chat_id (starts with - or is numeric)
-    if len(parts) > 0:
-        try:
-            potential_chat_id = parts[-1]
-            # Try to parse as integer
-            chat_id = int(potential_chat_id)
-            return (chat_id, True)
-        except ValueError:
-            # Last part is not a number, no chat_id embedded
-            return (None, False)
+    body = callback_data[1:]
+    try:
+        raw = base64.b64decode(body + "=" * (-len(body) % 4), altchars=b"-_", validate=True)
+    except (binascii.Error, ValueError):
+        return None
     
-    return (None, False)
+    if len(raw) < 3 or raw[0] != CALLBACK_CODEC_VERSION:
+        return None
+    
+    try:
+        action = CallbackAction(raw[1])
+    except ValueError:
+        return None
+    
+    values = []
+    value = 0
+    shift = 0
+    for byte in raw[2:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            if shift > CALLBACK_VARINT_MAX_SHIFT:
+                return None
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    
+    # A trailing continuation byte means the last varint was truncated
+    if shift or not values or len(values) > CALLBACK_MAX_ARGS + 1:
+        return None
+    
+    zigzag = values[0]
+    chat_id = (zigzag >> 1) ^ -(zigzag & 1)
+    return (action, chat_id, tuple(values[1:]))
 
 def create_back_button_callback(chat_id: int = None) -> str:
     """
@@ -2700,12 +5849,331 @@ def create_back_button_callback(chat_id: int = None) -> str:
         str: Callback data string
     """
     if chat_id:
-        import base64
-        chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-        return f"select_group_{chat_id_encoded}"
+        return encode_callback_data(CallbackAction.SELECT_GROUP, chat_id)
     else:
         return "open_settings"
 
+# ==================== Settings Menu Templates ====================
+#
+# Group settings screens are pure functions of a few boolean flags and a
+# couple of displayed values (times, interval). Instead of rebuilding the
+# Arabic text and InlineKeyboardMarkup on every click, each screen is
+# rendered once per (screen, packed flags, values) with placeholder tokens
+# in place of the chat-scoped callback data, and the serialized keyboard
+# JSON is cached. A re-render is then a dict lookup plus packing each
+# button's action for the chat.
+
+MENU_BACK_TOKEN = "@@back@@"
+MENU_CALLBACK_TOKEN = re.compile(r"@@cb:([\d:]+)@@")
+MENU_TEMPLATE_CACHE_MAX = 1024
+
+menu_template_cache = {}
+
+def menu_callback(action: CallbackAction, *args: int) -> str:
+    """Placeholder for packed callback data that render_settings_menu fills in with the chat_id."""
+    return "@@cb:" + ":".join(str(value) for value in (int(action), *args)) + "@@"
+
+def _pack_menu_callback(match, chat_id: int) -> str:
+    action, *args = (int(value) for value in match.group(1).split(":"))
+    return encode_callback_data(CallbackAction(action), chat_id, *args)
+
+# Interval choices offered for diverse azkar, with their confirmation names
+DIVERSE_INTERVAL_NAMES = {
+    1: "دقيقة واحدة",
+    5: "5 دقائق",
+    15: "15 دقيقة",
+    60: "ساعة واحدة",
+    120: "ساعتين",
+    240: "4 ساعات",
+    480: "8 ساعات",
+    720: "12 ساعة",
+    1440: "24 ساعة"
+}
+
+def _status_text(enabled) -> str:
+    return "✅ مفعّل" if enabled else "❌ معطّل"
+
+def _status_icon(enabled) -> str:
+    return "✅" if enabled else "❌"
+
+def pack_settings_flags(settings: dict, flag_keys: tuple) -> int:
+    """
+    Pack boolean settings into a bitmask, bit i set when flag_keys[i] is enabled.
+    
+    Args:
+        settings: Settings dictionary
+        flag_keys: Tuple of (key, default) pairs
+    
+    Returns:
+        int: Packed bitmask
+    """
+    flags = 0
+    for bit, (key, default) in enumerate(flag_keys):
+        if settings.get(key, default):
+            flags |= 1 << bit
+    return flags
+
+def _build_morning_evening_menu(flags: int, morning_time: str, evening_time: str) -> tuple:
+    morning_enabled = flags & 1
+    evening_enabled = flags & 2
+    settings_text = (
+        "🌅🌙 *إعدادات أذكار الصباح والمساء*\n\n"
+        f"*الحالة الحالية:*\n"
+        f"• أذكار الصباح: {_status_text(morning_enabled)} (الوقت: {morning_time})\n"
+        f"• أذكار المساء: {_status_text(evening_enabled)} (الوقت: {evening_time})\n\n"
+        "*أذكار الصباح:*\n"
+        "• يتم إرسالها تلقائياً في الوقت المحدد\n"
+        "• الوقت الافتراضي: 05:00\n"
+        "• قابلة للتخصيص لكل مجموعة\n\n"
+        "*أذكار المساء:*\n"
+        "• يتم إرسالها تلقائياً في الوقت المحدد\n"
+        "• الوقت الافتراضي: 18:00\n"
+        "• قابلة للتخصيص لكل مجموعة\n\n"
+        "*التحكم:*\n"
+        "استخدم الأزرار أدناه للتفعيل/التعطيل"
+    )
+    
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    markup.add(
+        types.InlineKeyboardButton(
+            f"{_status_icon(morning_enabled)} أذكار الصباح",
+            callback_data=menu_callback(CallbackAction.TOGGLE_MORNING_AZKAR)
+        ),
+        types.InlineKeyboardButton(
+            f"{_status_icon(evening_enabled)} أذكار المساء",
+            callback_data=menu_callback(CallbackAction.TOGGLE_EVENING_AZKAR)
+        )
+    )
+    markup.add(
+        types.InlineKeyboardButton("⏰ أوقات شائعة للصباح", callback_data=menu_callback(CallbackAction.MORNING_TIME_PRESETS)),
+        types.InlineKeyboardButton("🌙 أوقات شائعة للمساء", callback_data=menu_callback(CallbackAction.EVENING_TIME_PRESETS))
+    )
+    markup.add(types.InlineKeyboardButton("« العودة", callback_data=MENU_BACK_TOKEN))
+    return settings_text, markup
+
+def _build_friday_menu(flags: int) -> tuple:
+    sura_enabled = flags & 1
+    dua_enabled = flags & 2
+    settings_text = (
+        "📿🕌 *إعدادات أدعية الجمعة*\n\n"
+        f"*الحالة الحالية:*\n"
+        f"• سورة الكهف: {_status_text(sura_enabled)}\n"
+        f"• أدعية الجمعة: {_status_text(dua_enabled)}\n\n"
+        "*سورة الكهف:*\n"
+        "• تُرسل تلقائياً كل يوم جمعة\n"
+        "• الوقت: الجمعة 09:00\n"
+        "• يمكن إرسالها مع صور أو فيديو إسلامي\n\n"
+        "*أدعية الجمعة:*\n"
+        "• أدعية وأذكار خاصة بيوم الجمعة\n"
+        "• الوقت: الجمعة 10:00\n"
+        "• تشمل أدعية مستجابة في ساعة الإجابة\n\n"
+        "*التحكم:*\n"
+        "استخدم الأزرار أدناه للتفعيل/التعطيل"
+    )
+    
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    markup.add(
+        types.InlineKeyboardButton(
+            f"{_status_icon(sura_enabled)} سورة الكهف",
+            callback_data=menu_callback(CallbackAction.TOGGLE_FRIDAY_SURA)
+        ),
+        types.InlineKeyboardButton(
+            f"{_status_icon(dua_enabled)} أدعية الجمعة",
+            callback_data=menu_callback(CallbackAction.TOGGLE_FRIDAY_DUA)
+        )
+    )
+    markup.add(
+        types.InlineKeyboardButton("⏰ تخصيص أوقات الجمعة", callback_data=menu_callback(CallbackAction.FRIDAY_TIME_SETTINGS))
+    )
+    markup.add(types.InlineKeyboardButton("« العودة", callback_data=MENU_BACK_TOKEN))
+    return settings_text, markup
+
+def _build_diverse_menu(flags: int, interval: int) -> tuple:
+    enabled = flags & 1
+    
+    # Convert interval to readable format
+    if interval < 60:
+        interval_text = f"{interval} دقيقة"
+    elif interval == 60:
+        interval_text = "ساعة واحدة"
+    elif interval < 1440:
+        interval_text = f"{interval // 60} ساعات"
+    else:
+        interval_text = "يوم كامل"
+    
+    settings_text = (
+        "✨ *إعدادات الأدعية المتنوعة*\n\n"
+        f"*الحالة الحالية:*\n"
+        f"• الحالة: {_status_text(enabled)}\n"
+        f"• الفاصل الزمني: {interval_text}\n\n"
+        "*ما هي الأدعية المتنوعة؟*\n"
+        "مجموعة من الأدعية والآيات والأحاديث المتنوعة "
+        "يتم إرسالها بشكل دوري حسب الفاصل الزمني المحدد\n\n"
+        "*الفواصل الزمنية المتاحة:*\n"
+        "• دقيقة واحدة\n"
+        "• 5 دقائق\n"
+        "• 15 دقيقة\n"
+        "• ساعة واحدة\n"
+        "• ساعتين\n"
+        "• 4 ساعات\n"
+        "• 8 ساعات\n"
+        "• 12 ساعة\n"
+        "• 24 ساعة (يوم كامل)\n\n"
+        "*التحكم:*\n"
+        "استخدم الأزرار أدناه للتفعيل/التعطيل واختيار الفاصل الزمني"
+    )
+    
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        types.InlineKeyboardButton(
+            f"{_status_icon(enabled)} تفعيل/تعطيل",
+            callback_data=menu_callback(CallbackAction.TOGGLE_DIVERSE_AZKAR)
+        )
+    )
+    markup.add(
+        types.InlineKeyboardButton("1 دقيقة", callback_data=menu_callback(CallbackAction.DIVERSE_INTERVAL, 1)),
+        types.InlineKeyboardButton("5 دقائق", callback_data=menu_callback(CallbackAction.DIVERSE_INTERVAL, 5))
+    )
+    markup.add(
+        types.InlineKeyboardButton("15 دقيقة", callback_data=menu_callback(CallbackAction.DIVERSE_INTERVAL, 15)),
+        types.InlineKeyboardButton("1 ساعة", callback_data=menu_callback(CallbackAction.DIVERSE_INTERVAL, 60))
+    )
+    markup.add(
+        types.InlineKeyboardButton("2 ساعة", callback_data=menu_callback(CallbackAction.DIVERSE_INTERVAL, 120)),
+        types.InlineKeyboardButton("4 ساعات", callback_data=menu_callback(CallbackAction.DIVERSE_INTERVAL, 240))
+    )
+    markup.add(
+        types.InlineKeyboardButton("8 ساعات", callback_data=menu_callback(CallbackAction.DIVERSE_INTERVAL, 480)),
+        types.InlineKeyboardButton("12 ساعة", callback_data=menu_callback(CallbackAction.DIVERSE_INTERVAL, 720))
+    )
+    markup.add(
+        types.InlineKeyboardButton("24 ساعة", callback_data=menu_callback(CallbackAction.DIVERSE_INTERVAL, 1440))
+    )
+    markup.add(
+        types.InlineKeyboardButton("🎨 إعدادات التنسيق", callback_data=menu_callback(CallbackAction.DIVERSE_MEDIA_FORMAT))
+    )
+    markup.add(types.InlineKeyboardButton("« العودة", callback_data=MENU_BACK_TOKEN))
+    return settings_text, markup
+
+def _build_ramadan_menu(flags: int) -> tuple:
+    ramadan_enabled = flags & 1
+    laylat_alqadr_enabled = flags & 2
+    last_ten_enabled = flags & 4
+    iftar_enabled = flags & 8
+    settings_text = (
+        "🌙 *إعدادات رمضان*\n\n"
+        f"*الحالة الحالية:*\n"
+        f"• أدعية رمضان: {_status_text(ramadan_enabled)}\n"
+        f"• ليلة القدر: {_status_text(laylat_alqadr_enabled)}\n"
+        f"• العشر الأواخر: {_status_text(last_ten_enabled)}\n"
+        f"• دعاء الإفطار: {_status_text(iftar_enabled)}\n\n"
+        "*الأقسام المتاحة:*\n\n"
+        "*1. ليلة القدر:*\n"
+        "أدعية خاصة بليلة القدر المباركة\n"
+        "يتم إرسالها في الليالي الوترية من العشر الأواخر\n\n"
+        "*2. العشر الأواخر من رمضان:*\n"
+        "أذكار وأدعية خاصة بالعشر الأواخر\n"
+        "تبدأ من اليوم 21 من رمضان\n\n"
+        "*3. دعاء الإفطار:*\n"
+        "يتم إرسال دعاء الإفطار قبل أذان المغرب\n\n"
+        "*التحكم:*\n"
+        "استخدم الأزرار أدناه للتفعيل/التعطيل"
+    )
+    
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    markup.add(
+        types.InlineKeyboardButton(
+            f"{_status_icon(ramadan_enabled)} أدعية رمضان",
+            callback_data=menu_callback(CallbackAction.TOGGLE_RAMADAN_ENABLED)
+        ),
+        types.InlineKeyboardButton(
+            f"{_status_icon(laylat_alqadr_enabled)} ليلة القدر",
+            callback_data=menu_callback(CallbackAction.TOGGLE_LAYLAT_ALQADR)
+        ),
+        types.InlineKeyboardButton(
+            f"{_status_icon(last_ten_enabled)} العشر الأواخر",
+            callback_data=menu_callback(CallbackAction.TOGGLE_LAST_TEN_DAYS)
+        ),
+        types.InlineKeyboardButton(
+            f"{_status_icon(iftar_enabled)} دعاء الإفطار",
+            callback_data=menu_callback(CallbackAction.TOGGLE_IFTAR_DUA)
+        )
+    )
+    markup.add(types.InlineKeyboardButton("« العودة", callback_data=MENU_BACK_TOKEN))
+    return settings_text, markup
+
+# screen -> (flag keys with defaults, value keys with defaults, builder)
+MENU_SCREENS = {
+    "morning_evening": (
+        (("morning_azkar", 1), ("evening_azkar", 1)),
+        (("morning_time", "05:00"), ("evening_time", "18:00")),
+        _build_morning_evening_menu,
+    ),
+    "friday": (
+        (("friday_sura", 1), ("friday_dua", 1)),
+        (),
+        _build_friday_menu,
+    ),
+    "diverse": (
+        (("enabled", 0),),
+        (("interval_minutes", 60),),
+        _build_diverse_menu,
+    ),
+    "ramadan": (
+        (("ramadan_enabled", 1), ("laylat_alqadr_enabled", 1),
+         ("last_ten_days_enabled", 1), ("iftar_dua_enabled", 1)),
+        (),
+        _build_ramadan_menu,
+    ),
+}
+
+def render_settings_menu(screen: str, chat_id: int, settings: dict) -> tuple:
+    """
+    Render a group settings screen from the template cache.
+    
+    Args:
+        screen: Screen name (key of MENU_SCREENS)
+        chat_id: The group chat ID the screen belongs to
+        settings: The settings dictionary backing the screen
+    
+    Returns:
+        tuple: (text, reply_markup JSON string)
+    """
+    flag_keys, value_keys, builder = MENU_SCREENS[screen]
+    flags = pack_settings_flags(settings, flag_keys)
+    values = tuple(settings.get(key, default) for key, default in value_keys)
+    cache_key = (screen, flags, values)
+    
+    template = menu_template_cache.get(cache_key)
+    if template is None:
+        CACHE_REQUESTS.inc("menu_template", "miss")
+        text, markup = builder(flags, *values)
+        template = (text, markup.to_json())
+        if len(menu_template_cache) >= MENU_TEMPLATE_CACHE_MAX:
+            menu_template_cache.clear()
+        menu_template_cache[cache_key] = template
+    else:
+        CACHE_REQUESTS.inc("menu_template", "hit")
+    
+    text, keyboard = template
+    keyboard = MENU_CALLBACK_TOKEN.sub(lambda match: _pack_menu_callback(match, chat_id), keyboard).replace(
+        MENU_BACK_TOKEN, create_back_button_callback(chat_id)
+    )
+    return text, keyboard
+
+def edit_settings_menu(call: types.CallbackQuery, screen: str, chat_id: int, settings: dict):
+    """
+    Edit the callback's message in place to show a group settings screen.
+    """
+    text, keyboard = render_settings_menu(screen, chat_id, settings)
+    bot.edit_message_text(
+        text,
+        call.message.chat.id,
+        call.message.message_id,
+        parse_mode="Markdown",
+        reply_markup=keyboard
+    )
+
 def cmd_settings_markup():
     """
     Generate the settings inline keyboard markup.
@@ -2732,6 +6200,10 @@ def add_support_buttons(markup: types.InlineKeyboardMarkup):
     )
     return markup
 
+# ────────────────────────────────────────────────
+#               Helper Functions for Callbacks
+# ────────────────────────────────────────────────
+
 def extract_chat_id_from_callback(callback_data: str, min_underscore_count: int = 3) -> tuple:
     """
     Extract chat_id from callback data if present.
@@ -2830,9 +6302,9 @@ def cmd_start(message: types.Message):
                             # Create keyboard with main sections - encode chat_id in callback data
                             markup = types.InlineKeyboardMarkup(row_width=2)
                             markup.add(
-                                types.InlineKeyboardButton("🌅🌙 أذكار الصباح والمساء", callback_data=f"morning_evening_settings_{chat_id}"),
-                                types.InlineKeyboardButton("📿 أدعية الجمعة", callback_data=f"friday_settings_{chat_id}"),
-                                types.InlineKeyboardButton("🌙 إعدادات رمضان", callback_data=f"ramadan_settings_{chat_id}"),
+                                types.InlineKeyboardButton("🌅🌙 أذكار الصباح والمساء", callback_data=encode_callback_data(CallbackAction.MORNING_EVENING_MENU, chat_id)),
+                                types.InlineKeyboardButton("📿 أدعية الجمعة", callback_data=encode_callback_data(CallbackAction.FRIDAY_MENU, chat_id)),
+                                types.InlineKeyboardButton("🌙 إعدادات رمضان", callback_data=encode_callback_data(CallbackAction.RAMADAN_MENU, chat_id)),
                                 types.InlineKeyboardButton("🕋 إعدادات الحج", callback_data=f"hajj_eid_settings_{chat_id}"),
                                 types.InlineKeyboardButton("🌙 تذكيرات الصيام", callback_data=f"fasting_reminders_{chat_id}")
                             )
@@ -2915,13 +6387,10 @@ def cmd_start(message: types.Message):
                             chat_info = bot.get_chat(chat_id)
                             chat_title = chat_info.title or f"Group {chat_id}"
                             
-                            # Encode chat_id for callback data
-                            chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-                            
                             markup.add(
                                 types.InlineKeyboardButton(
                                     f"📱 {chat_title}",
-                                    callback_data=f"select_group_{chat_id_encoded}"
+                                    callback_data=encode_callback_data(CallbackAction.SELECT_GROUP, chat_id)
                                 )
                             )
                         except Exception as e:
@@ -3101,7 +6570,7 @@ def callback_toggle(call: types.CallbackQuery):
     settings = get_chat_settings(call.message.chat.id)
     new_value = not settings[key]
     update_chat_setting(call.message.chat.id, key, new_value)
-    schedule_chat_jobs(call.message.chat.id)
+    reschedule_chat_jobs(call.message.chat.id, "chat")
 
     # Refresh markup
     markup = types.InlineKeyboardMarkup(row_width=2)
@@ -3176,13 +6645,10 @@ def callback_open_settings(call: types.CallbackQuery):
                 chat_info = bot.get_chat(chat_id)
                 chat_title = chat_info.title or f"Group {chat_id}"
                 
-                # Encode chat_id for callback data
-                chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-                
                 markup.add(
                     types.InlineKeyboardButton(
                         f"📱 {chat_title}",
-                        callback_data=f"select_group_{chat_id_encoded}"
+                        callback_data=encode_callback_data(CallbackAction.SELECT_GROUP, chat_id)
                     )
                 )
             except Exception as e:
@@ -3201,40 +6667,406 @@ def callback_open_settings(call: types.CallbackQuery):
         logger.info(f"Group selection displayed for user {call.from_user.id} ({len(user_groups)} groups)")
         
     except Exception as e:
-        logger.error(f"Error in callback_open_settings: {e}", exc_info=True)
-        # Only answer callback if not already answered
+        logger.error(f"Error in callback_open_settings: {e}", exc_info=True)
+        # Only answer callback if not already answered
+        try:
+            bot.answer_callback_query(
+                call.id,
+                "حدث خطأ أثناء تحميل الإعدادات",
+                show_alert=True
+            )
+        except Exception:
+            # Callback already answered
+            pass
+
+# ────────────────────────────────────────────────
+#               Group Settings Actions
+# ────────────────────────────────────────────────
+
+# What each group settings button does, given an already parsed chat_id.
+# Packed callbacks are dispatched here from callback_packed; the legacy
+# string handlers further down only parse their format and call the same
+# functions, so both paths behave alike.
+
+# screen -> (settings getter, setting updater, reschedule_chat_jobs section or None).
+# The lambdas resolve the functions when called.
+SETTINGS_SCREEN_SOURCES = {
+    "morning_evening": (lambda chat_id: get_chat_settings(chat_id),
+                        lambda chat_id, key, value: update_chat_setting(chat_id, key, value), "chat"),
+    "friday": (lambda chat_id: get_chat_settings(chat_id),
+               lambda chat_id, key, value: update_chat_setting(chat_id, key, value), "chat"),
+    "diverse": (lambda chat_id: get_diverse_azkar_settings(chat_id),
+                lambda chat_id, key, value: update_diverse_azkar_setting(chat_id, key, value), "diverse"),
+    "diverse_media": (lambda chat_id: get_diverse_azkar_settings(chat_id),
+                      lambda chat_id, key, value: update_diverse_azkar_setting(chat_id, key, value), None),
+    "ramadan": (lambda chat_id: get_ramadan_settings(chat_id),
+                lambda chat_id, key, value: update_ramadan_setting(chat_id, key, value), None),
+}
+
+MENU_SCREEN_TITLES = {
+    "morning_evening": "أذكار الصباح والمساء",
+    "friday": "أدعية الجمعة",
+    "diverse": "إعدادات الأدعية المتنوعة",
+    "ramadan": "إعدادات رمضان",
+}
+
+# toggle action -> (screen, setting key, default, display name)
+MENU_TOGGLES = {
+    CallbackAction.TOGGLE_MORNING_AZKAR: ("morning_evening", "morning_azkar", 1, "أذكار الصباح"),
+    CallbackAction.TOGGLE_EVENING_AZKAR: ("morning_evening", "evening_azkar", 1, "أذكار المساء"),
+    CallbackAction.TOGGLE_FRIDAY_SURA: ("friday", "friday_sura", 1, "سورة الكهف"),
+    CallbackAction.TOGGLE_FRIDAY_DUA: ("friday", "friday_dua", 1, "أدعية الجمعة"),
+    CallbackAction.TOGGLE_DIVERSE_AZKAR: ("diverse", "enabled", 0, "أذكار متنوعة"),
+    CallbackAction.TOGGLE_RAMADAN_ENABLED: ("ramadan", "ramadan_enabled", 1, "أدعية رمضان"),
+    CallbackAction.TOGGLE_LAYLAT_ALQADR: ("ramadan", "laylat_alqadr_enabled", 1, "ليلة القدر"),
+    CallbackAction.TOGGLE_LAST_TEN_DAYS: ("ramadan", "last_ten_days_enabled", 1, "العشر الأواخر"),
+    CallbackAction.TOGGLE_IFTAR_DUA: ("ramadan", "iftar_dua_enabled", 1, "دعاء الإفطار"),
+    CallbackAction.TOGGLE_DIVERSE_AUDIO: ("diverse_media", "enable_audio", 1, "الصوت"),
+    CallbackAction.TOGGLE_DIVERSE_IMAGES: ("diverse_media", "enable_images", 1, "الصور"),
+    CallbackAction.TOGGLE_DIVERSE_PDF: ("diverse_media", "enable_pdf", 1, "ملفات PDF"),
+    CallbackAction.TOGGLE_DIVERSE_TEXT: ("diverse_media", "enable_text", 1, "النص العادي"),
+}
+
+# period -> (setting key, default, header, preset descriptions, (time, label) buttons, set action)
+AZKAR_TIME_PRESETS = {
+    "morning": (
+        "morning_time", "05:00", "⏰ *تخصيص وقت أذكار الصباح*",
+        ("• 04:30 - بعد صلاة الفجر مباشرة", "• 05:00 - الافتراضي",
+         "• 06:00 - مع شروق الشمس تقريباً", "• 07:00 - صباحاً"),
+        (("04:30", "04:30 🌄"), ("05:00", "05:00 ⭐"), ("06:00", "06:00 ☀️"), ("07:00", "07:00 🌅")),
+        CallbackAction.SET_MORNING_TIME,
+    ),
+    "evening": (
+        "evening_time", "18:00", "🌙 *تخصيص وقت أذكار المساء*",
+        ("• 15:30 - بعد صلاة العصر", "• 17:00 - قبل المغرب",
+         "• 18:00 - الافتراضي", "• 19:00 - مساءً"),
+        (("15:30", "15:30 🕌"), ("17:00", "17:00 🌆"), ("18:00", "18:00 ⭐"), ("19:00", "19:00 🌙")),
+        CallbackAction.SET_EVENING_TIME,
+    ),
+}
+
+def reject_non_admin(call: types.CallbackQuery, chat_id: int) -> bool:
+    """Answer with an alert and return True unless the user is an admin of the chat."""
+    if is_user_admin_of_chat(call.from_user.id, chat_id):
+        return False
+    bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
+    return True
+
+def legacy_chat_id_valid(call: types.CallbackQuery, chat_id) -> bool:
+    """Check the chat_id parsed from old format callback data, answering with an alert unless it is a group."""
+    if chat_id is not None and chat_id < 0:
+        return True
+    logger.warning(f"Rejected malformed callback data from user {call.from_user.id}: {call.data!r}")
+    bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
+    return False
+
+def show_settings_screen(call: types.CallbackQuery, chat_id: int, screen: str):
+    """Open a templated group settings screen (see MENU_SCREENS)."""
+    if reject_non_admin(call, chat_id):
+        return
+    bot.answer_callback_query(call.id, MENU_SCREEN_TITLES[screen])
+    get_settings = SETTINGS_SCREEN_SOURCES[screen][0]
+    edit_settings_menu(call, screen, chat_id, get_settings(chat_id))
+    logger.info(f"{screen} settings displayed for user {call.from_user.id}, chat_id={chat_id}")
+
+def toggle_menu_setting(call: types.CallbackQuery, chat_id: int, action: CallbackAction):
+    """Flip the setting behind a toggle button (see MENU_TOGGLES) and show its screen again."""
+    if reject_non_admin(call, chat_id):
+        return
+    screen, key, default, name = MENU_TOGGLES[action]
+    get_settings, update_setting, section = SETTINGS_SCREEN_SOURCES[screen]
+    new_value = not get_settings(chat_id).get(key, default)
+    update_setting(chat_id, key, new_value)
+    if section:
+        reschedule_chat_jobs(chat_id, section)
+    
+    if screen == "diverse_media":
+        edit_diverse_media_format(call, chat_id)
+    else:
+        edit_settings_menu(call, screen, chat_id, get_settings(chat_id))
+    
+    status_text = "تم التفعيل ✅" if new_value else "تم التعطيل ❌"
+    bot.answer_callback_query(call.id, f"{name}: {status_text}")
+    logger.info(f"User {call.from_user.id} toggled {key} to {new_value} for chat {chat_id}")
+
+def edit_time_presets(call: types.CallbackQuery, chat_id: int, period: str):
+    """Show the preset time buttons of morning or evening azkar (see AZKAR_TIME_PRESETS)."""
+    key, default, header, descriptions, options, set_action = AZKAR_TIME_PRESETS[period]
+    current_time = get_chat_settings(chat_id).get(key, default)
+    
+    settings_text = (
+        f"{header}\n\n"
+        f"الوقت الحالي: *{current_time}*\n\n"
+        "*اختر وقتاً من الأوقات الشائعة:*\n"
+        + "".join(f"{line}\n" for line in descriptions) +
+        "\n*أو استخدم الأمر في المجموعة:*\n"
+        f"`/settime {period} HH:MM`"
+    )
+    
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    for time_value, time_label in options:
+        # Highlight current time
+        if time_value == current_time:
+            time_label = f"✅ {time_label}"
+        hour, minute = (int(part) for part in time_value.split(":"))
+        markup.add(types.InlineKeyboardButton(
+            time_label, callback_data=encode_callback_data(set_action, chat_id, hour, minute)))
+    markup.add(types.InlineKeyboardButton(
+        "« العودة", callback_data=encode_callback_data(CallbackAction.MORNING_EVENING_MENU, chat_id)))
+    
+    bot.edit_message_text(
+        settings_text,
+        call.message.chat.id,
+        call.message.message_id,
+        parse_mode="Markdown",
+        reply_markup=markup
+    )
+
+def open_time_presets(call: types.CallbackQuery, chat_id: int, period: str):
+    """Open the preset time screen of morning or evening azkar."""
+    if reject_non_admin(call, chat_id):
+        return
+    bot.answer_callback_query(call.id, "اختر الوقت")
+    edit_time_presets(call, chat_id, period)
+
+def set_azkar_time(call: types.CallbackQuery, chat_id: int, period: str, hour: int, minute: int):
+    """Apply a preset morning or evening time and show the presets again."""
+    if reject_non_admin(call, chat_id):
+        return
+    key = AZKAR_TIME_PRESETS[period][0]
+    time_formatted = f"{hour:02d}:{minute:02d}"
+    update_chat_setting(chat_id, key, time_formatted)
+    reschedule_chat_jobs(chat_id, "chat")
+    
+    label = "الصباح" if period == "morning" else "المساء"
+    bot.answer_callback_query(call.id, f"✅ تم تعيين وقت {label}: {time_formatted}")
+    edit_time_presets(call, chat_id, period)
+
+def open_friday_time_settings(call: types.CallbackQuery, chat_id: int):
+    """Show information about customizing Friday times."""
+    if reject_non_admin(call, chat_id):
+        return
+    bot.answer_callback_query(call.id, "تخصيص أوقات الجمعة")
+    
+    settings_text = (
+        "⏰ *تخصيص أوقات الجمعة*\n\n"
+        "*الأوقات الافتراضية:*\n"
+        "• سورة الكهف: الجمعة 09:00\n"
+        "• أدعية الجمعة: الجمعة 10:00\n\n"
+        "*ملاحظة:*\n"
+        "حالياً، أوقات الجمعة ثابتة ولا يمكن تخصيصها.\n"
+        "سيتم إضافة خاصية تخصيص الأوقات في التحديثات القادمة.\n\n"
+        "*للتفعيل أو التعطيل:*\n"
+        "استخدم الأزرار في شاشة إعدادات الجمعة الرئيسية"
+    )
+    
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    markup.add(types.InlineKeyboardButton(
+        "« العودة", callback_data=encode_callback_data(CallbackAction.FRIDAY_MENU, chat_id)))
+    
+    bot.edit_message_text(
+        settings_text,
+        call.message.chat.id,
+        call.message.message_id,
+        parse_mode="Markdown",
+        reply_markup=markup
+    )
+    logger.info(f"Friday time settings displayed for user {call.from_user.id}, chat_id={chat_id}")
+
+def set_diverse_interval(call: types.CallbackQuery, chat_id: int, interval_minutes: int):
+    """Apply a diverse azkar interval, enabling diverse azkar, and show its screen again."""
+    if reject_non_admin(call, chat_id):
+        return
+    update_diverse_azkar_setting(chat_id, 'interval_minutes', interval_minutes)
+    # Enable diverse azkar if not already enabled
+    if not get_diverse_azkar_settings(chat_id).get('enabled', 0):
+        update_diverse_azkar_setting(chat_id, 'enabled', 1)
+    reschedule_chat_jobs(chat_id, "diverse")
+    
+    bot.answer_callback_query(
+        call.id,
+        f"✓ تم تحديث الفاصل الزمني: {DIVERSE_INTERVAL_NAMES.get(interval_minutes, str(interval_minutes))}",
+        show_alert=False
+    )
+    edit_settings_menu(call, "diverse", chat_id, get_diverse_azkar_settings(chat_id))
+    logger.info(f"User {call.from_user.id} selected diverse interval: {interval_minutes} minutes for chat {chat_id}")
+
+def edit_diverse_media_format(call: types.CallbackQuery, chat_id: int):
+    """Show the media format toggles of diverse azkar."""
+    diverse_settings = get_diverse_azkar_settings(chat_id)
+    audio_status = "✅ مفعّل" if diverse_settings.get('enable_audio', 1) else "❌ معطّل"
+    images_status = "✅ مفعّل" if diverse_settings.get('enable_images', 1) else "❌ معطّل"
+    pdf_status = "✅ مفعّل" if diverse_settings.get('enable_pdf', 1) else "❌ معطّل"
+    text_status = "✅ مفعّل" if diverse_settings.get('enable_text', 1) else "❌ معطّل"
+    
+    settings_text = (
+        "🎨 *إعدادات تنسيق الأدعية المتنوعة*\n\n"
+        f"*الحالة الحالية:*\n"
+        f"• الصوت: {audio_status}\n"
+        f"• الصور: {images_status}\n"
+        f"• ملفات PDF: {pdf_status}\n"
+        f"• النص العادي: {text_status}\n\n"
+        "*ما هو تنسيق الإرسال؟*\n"
+        "يمكنك اختيار نوع أو أكثر من أنواع الوسائط التالية:\n\n"
+        "*🎵 الصوت:*\n"
+        "• ملفات صوتية للأدعية والقرآن\n"
+        "• تشغيل مباشر في التليجرام\n\n"
+        "*🖼️ الصور:*\n"
+        "• صور ملهمة مع الأدعية\n"
+        "• تصميمات جميلة للآيات\n\n"
+        "*📄 ملفات PDF:*\n"
+        "• كتب ومطويات\n"
+        "• نشرات دعوية\n\n"
+        "*📝 النص العادي:*\n"
+        "• نص بسيط بدون وسائط\n"
+        "• سهل القراءة والنسخ\n\n"
+        "*التحكم:*\n"
+        "استخدم الأزرار أدناه لتفعيل أو تعطيل كل نوع"
+    )
+    
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    
+    # Add toggle buttons for each media type
+    audio_icon = "✅" if diverse_settings.get('enable_audio', 1) else "❌"
+    images_icon = "✅" if diverse_settings.get('enable_images', 1) else "❌"
+    pdf_icon = "✅" if diverse_settings.get('enable_pdf', 1) else "❌"
+    text_icon = "✅" if diverse_settings.get('enable_text', 1) else "❌"
+    
+    markup.add(
+        types.InlineKeyboardButton(
+            f"{audio_icon} الصوت",
+            callback_data=encode_callback_data(CallbackAction.TOGGLE_DIVERSE_AUDIO, chat_id)
+        ),
+        types.InlineKeyboardButton(
+            f"{images_icon} الصور",
+            callback_data=encode_callback_data(CallbackAction.TOGGLE_DIVERSE_IMAGES, chat_id)
+        ),
+        types.InlineKeyboardButton(
+            f"{pdf_icon} ملفات PDF",
+            callback_data=encode_callback_data(CallbackAction.TOGGLE_DIVERSE_PDF, chat_id)
+        ),
+        types.InlineKeyboardButton(
+            f"{text_icon} النص العادي",
+            callback_data=encode_callback_data(CallbackAction.TOGGLE_DIVERSE_TEXT, chat_id)
+        )
+    )
+    
+    # Add back button
+    markup.add(types.InlineKeyboardButton(
+        "« العودة", callback_data=encode_callback_data(CallbackAction.DIVERSE_MENU, chat_id)))
+    
+    bot.edit_message_text(
+        settings_text,
+        call.message.chat.id,
+        call.message.message_id,
+        parse_mode="Markdown",
+        reply_markup=markup
+    )
+
+def open_diverse_media_format(call: types.CallbackQuery, chat_id: int):
+    """Open the media format screen of diverse azkar."""
+    if reject_non_admin(call, chat_id):
+        return
+    bot.answer_callback_query(call.id, "إعدادات التنسيق")
+    edit_diverse_media_format(call, chat_id)
+    logger.info(f"Diverse media format settings displayed for user {call.from_user.id} in chat {chat_id}")
+
+# Allowed values of each positional arg; actions not listed take no args
+CALLBACK_ACTION_ARGS = {
+    CallbackAction.SET_MORNING_TIME: (range(24), range(60)),
+    CallbackAction.SET_EVENING_TIME: (range(24), range(60)),
+    CallbackAction.DIVERSE_INTERVAL: (DIVERSE_INTERVAL_NAMES,),
+}
+
+PACKED_CALLBACK_HANDLERS = {
+    CallbackAction.SELECT_GROUP: lambda call, chat_id: show_group_settings_panel(call, chat_id),
+    CallbackAction.MORNING_EVENING_MENU: lambda call, chat_id: show_settings_screen(call, chat_id, "morning_evening"),
+    CallbackAction.FRIDAY_MENU: lambda call, chat_id: show_settings_screen(call, chat_id, "friday"),
+    CallbackAction.DIVERSE_MENU: lambda call, chat_id: show_settings_screen(call, chat_id, "diverse"),
+    CallbackAction.RAMADAN_MENU: lambda call, chat_id: show_settings_screen(call, chat_id, "ramadan"),
+    CallbackAction.MORNING_TIME_PRESETS: lambda call, chat_id: open_time_presets(call, chat_id, "morning"),
+    CallbackAction.EVENING_TIME_PRESETS: lambda call, chat_id: open_time_presets(call, chat_id, "evening"),
+    CallbackAction.SET_MORNING_TIME:
+        lambda call, chat_id, hour, minute: set_azkar_time(call, chat_id, "morning", hour, minute),
+    CallbackAction.SET_EVENING_TIME:
+        lambda call, chat_id, hour, minute: set_azkar_time(call, chat_id, "evening", hour, minute),
+    CallbackAction.FRIDAY_TIME_SETTINGS: lambda call, chat_id: open_friday_time_settings(call, chat_id),
+    CallbackAction.DIVERSE_INTERVAL: lambda call, chat_id, minutes: set_diverse_interval(call, chat_id, minutes),
+    CallbackAction.DIVERSE_MEDIA_FORMAT: lambda call, chat_id: open_diverse_media_format(call, chat_id),
+    **{action: (lambda call, chat_id, action=action: toggle_menu_setting(call, chat_id, action))
+       for action in MENU_TOGGLES},
+}
+
+def packed_callback_valid(action: CallbackAction, chat_id: int, args: tuple) -> bool:
+    """Check a decoded packed callback against the args its action expects."""
+    # All packed actions are group-scoped, and group chat IDs are negative
+    if chat_id >= 0:
+        return False
+    allowed = CALLBACK_ACTION_ARGS.get(action, ())
+    return len(args) == len(allowed) and all(arg in values for arg, values in zip(args, allowed))
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(CALLBACK_DATA_PREFIX))
+def callback_packed(call: types.CallbackQuery):
+    """
+    Dispatch packed callback data (see encode_callback_data).
+    Malformed data is rejected here, before any database or Telegram API work.
+    """
+    packed = decode_callback_data(call.data)
+    
+    if packed is None or not packed_callback_valid(*packed):
+        logger.warning(f"Rejected malformed callback data from user {call.from_user.id}: {call.data!r}")
+        try:
+            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
+        except Exception:
+            pass
+        return
+    
+    action, chat_id, args = packed
+    try:
+        PACKED_CALLBACK_HANDLERS[action](call, chat_id, *args)
+    except Exception as e:
+        logger.error(f"Error in callback_packed ({action.name}) for chat {chat_id}: {e}", exc_info=True)
         try:
-            bot.answer_callback_query(
-                call.id,
-                "حدث خطأ أثناء تحميل الإعدادات",
-                show_alert=True
-            )
+            bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
         except Exception:
-            # Callback already answered
             pass
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("select_group_"))
 def callback_select_group(call: types.CallbackQuery):
     """
     Handle group selection from the list.
-    Opens the settings panel for the selected group.
+    Old format: select_group_<base64 chat_id> (backwards compatibility for
+    keyboards sent before packed callback data was introduced).
     """
+    # Extract and decode the chat_id with validation
+    chat_id_encoded = call.data.replace("select_group_", "")
+    
     try:
-        # Extract and decode the chat_id with validation
-        chat_id_encoded = call.data.replace("select_group_", "")
-        
+        decoded_str = base64.b64decode(chat_id_encoded).decode('utf-8')
+        chat_id = int(decoded_str)
+    except (ValueError, UnicodeDecodeError) as e:
+        logger.error(f"Invalid chat_id encoding in callback: {e}")
         try:
-            decoded_str = base64.b64decode(chat_id_encoded).decode('utf-8')
-            chat_id = int(decoded_str)
-        except (ValueError, UnicodeDecodeError) as e:
-            logger.error(f"Invalid chat_id encoding in callback: {e}")
             bot.answer_callback_query(
                 call.id,
                 "⚠️ خطأ في معرف المجموعة",
                 show_alert=True
             )
-            return
-        
+        except Exception:
+            pass
+        return
+    
+    show_group_settings_panel(call, chat_id)
+
+def show_group_settings_panel(call: types.CallbackQuery, chat_id: int):
+    """
+    Open the settings panel for the selected group.
+    
+    Args:
+        call: The callback query to answer and edit
+        chat_id (int): The group chat ID
+    """
+    try:
         # Verify user is admin of this chat
         if not is_user_admin_of_chat(call.from_user.id, chat_id):
             bot.answer_callback_query(
@@ -3264,11 +7096,11 @@ def callback_select_group(call: types.CallbackQuery):
         # Create keyboard with main sections - encode chat_id in callback data
         markup = types.InlineKeyboardMarkup(row_width=2)
         markup.add(
-            types.InlineKeyboardButton("🌅🌙 أذكار الصباح والمساء", callback_data=f"morning_evening_settings_{chat_id}"),
-            types.InlineKeyboardButton("📿 أدعية الجمعة", callback_data=f"friday_settings_{chat_id}"),
-            types.InlineKeyboardButton("✨ أذكار متنوعة", callback_data=f"diverse_azkar_settings_{chat_id}"),
+            types.InlineKeyboardButton("🌅🌙 أذكار الصباح والمساء", callback_data=encode_callback_data(CallbackAction.MORNING_EVENING_MENU, chat_id)),
+            types.InlineKeyboardButton("📿 أدعية الجمعة", callback_data=encode_callback_data(CallbackAction.FRIDAY_MENU, chat_id)),
+            types.InlineKeyboardButton("✨ أذكار متنوعة", callback_data=encode_callback_data(CallbackAction.DIVERSE_MENU, chat_id)),
             types.InlineKeyboardButton("⚙️ إعدادات عامة", callback_data=f"general_settings_{chat_id}"),
-            types.InlineKeyboardButton("🌙 إعدادات رمضان", callback_data=f"ramadan_settings_{chat_id}"),
+            types.InlineKeyboardButton("🌙 إعدادات رمضان", callback_data=encode_callback_data(CallbackAction.RAMADAN_MENU, chat_id)),
             types.InlineKeyboardButton("🕋 إعدادات الحج", callback_data=f"hajj_eid_settings_{chat_id}"),
             types.InlineKeyboardButton("🌙 تذكيرات الصيام", callback_data=f"fasting_reminders_{chat_id}")
         )
@@ -3290,7 +7122,7 @@ def callback_select_group(call: types.CallbackQuery):
         logger.info(f"Settings panel for group {chat_id} displayed to user {call.from_user.id}")
         
     except Exception as e:
-        logger.error(f"Error in callback_select_group: {e}", exc_info=True)
+        logger.error(f"Error in show_group_settings_panel: {e}", exc_info=True)
         try:
             bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
         except Exception:
@@ -3335,121 +7167,57 @@ def callback_morning_evening_settings(call: types.CallbackQuery):
     """
     Handle callback for morning and evening azkar settings.
     Shows options to enable/disable and configure timing with toggle controls.
-    Supports both old format (morning_evening_settings) and new format (morning_evening_settings_{chat_id})
+    New keyboards use packed callback data (see show_settings_screen); this
+    handler keeps the old formats morning_evening_settings and
+    morning_evening_settings_{chat_id} working.
     """
     try:
         # Extract chat_id from callback data if present
-        if "_" in call.data and call.data.count("_") >= 3:
-            # New format: morning_evening_settings_{chat_id}
-            parts = call.data.split("_")
-            try:
-                chat_id = int(parts[-1])
-                # Verify user is admin of this chat
-                if not is_user_admin_of_chat(call.from_user.id, chat_id):
-                    bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-                    return
-            except (ValueError, IndexError):
-                # Fallback to old behavior
-                chat_id = None
-                is_admin = is_user_admin_in_any_group(call.from_user.id)
-                if not is_admin:
-                    bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
-                    return
-        else:
-            # Old format: morning_evening_settings (backwards compatibility)
-            chat_id = None
-            is_admin = is_user_admin_in_any_group(call.from_user.id)
-            if not is_admin:
-                bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
-                return
+        chat_id, has_chat_id = extract_chat_id_from_callback(call.data)
+        if has_chat_id:
+            # Old format: morning_evening_settings_{chat_id}
+            if legacy_chat_id_valid(call, chat_id):
+                show_settings_screen(call, chat_id, "morning_evening")
+            return
+        
+        # Oldest format: morning_evening_settings (backwards compatibility)
+        is_admin = is_user_admin_in_any_group(call.from_user.id)
+        if not is_admin:
+            bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
+            return
         
         bot.answer_callback_query(call.id, "أذكار الصباح والمساء")
         
-        # Get settings for this specific chat (or show general info)
-        if chat_id:
-            settings = get_chat_settings(chat_id)
-            morning_status = "✅ مفعّل" if settings.get('morning_azkar', 1) else "❌ معطّل"
-            evening_status = "✅ مفعّل" if settings.get('evening_azkar', 1) else "❌ معطّل"
-            morning_time = settings.get('morning_time', '05:00')
-            evening_time = settings.get('evening_time', '18:00')
-            
-            settings_text = (
-                "🌅🌙 *إعدادات أذكار الصباح والمساء*\n\n"
-                f"*الحالة الحالية:*\n"
-                f"• أذكار الصباح: {morning_status} (الوقت: {morning_time})\n"
-                f"• أذكار المساء: {evening_status} (الوقت: {evening_time})\n\n"
-                "*أذكار الصباح:*\n"
-                "• يتم إرسالها تلقائياً في الوقت المحدد\n"
-                "• الوقت الافتراضي: 05:00\n"
-                "• قابلة للتخصيص لكل مجموعة\n\n"
-                "*أذكار المساء:*\n"
-                "• يتم إرسالها تلقائياً في الوقت المحدد\n"
-                "• الوقت الافتراضي: 18:00\n"
-                "• قابلة للتخصيص لكل مجموعة\n\n"
-                "*التحكم:*\n"
-                "استخدم الأزرار أدناه للتفعيل/التعطيل"
-            )
-        else:
-            settings_text = (
-                "🌅🌙 *إعدادات أذكار الصباح والمساء*\n\n"
-                "*أذكار الصباح:*\n"
-                "• يتم إرسالها تلقائياً في الوقت المحدد\n"
-                "• الوقت الافتراضي: 05:00\n"
-                "• قابلة للتخصيص لكل مجموعة\n\n"
-                "*أذكار المساء:*\n"
-                "• يتم إرسالها تلقائياً في الوقت المحدد\n"
-                "• الوقت الافتراضي: 18:00\n"
-                "• قابلة للتخصيص لكل مجموعة\n\n"
-                "*الميزات:*\n"
-                "• ✅/❌ تفعيل أو تعطيل لكل مجموعة\n"
-                "• دعم الوسائط (صور، فيديو، ملفات)\n"
-                "• تخصيص الأوقات باستخدام `/settime` في المجموعة\n\n"
-                "*أمثلة لتخصيص الأوقات:*\n"
-                "`/settime morning 06:30`\n"
-                "`/settime evening 19:00`\n\n"
-                "*للتعديل في مجموعة معينة:*\n"
-                "استخدم الأوامر المذكورة في المجموعة التي تريد تخصيص أوقاتها"
-            )
+        settings_text = (
+            "🌅🌙 *إعدادات أذكار الصباح والمساء*\n\n"
+            "*أذكار الصباح:*\n"
+            "• يتم إرسالها تلقائياً في الوقت المحدد\n"
+            "• الوقت الافتراضي: 05:00\n"
+            "• قابلة للتخصيص لكل مجموعة\n\n"
+            "*أذكار المساء:*\n"
+            "• يتم إرسالها تلقائياً في الوقت المحدد\n"
+            "• الوقت الافتراضي: 18:00\n"
+            "• قابلة للتخصيص لكل مجموعة\n\n"
+            "*الميزات:*\n"
+            "• ✅/❌ تفعيل أو تعطيل لكل مجموعة\n"
+            "• دعم الوسائط (صور، فيديو، ملفات)\n"
+            "• تخصيص الأوقات باستخدام `/settime` في المجموعة\n\n"
+            "*أمثلة لتخصيص الأوقات:*\n"
+            "`/settime morning 06:30`\n"
+            "`/settime evening 19:00`\n\n"
+            "*للتعديل في مجموعة معينة:*\n"
+            "استخدم الأوامر المذكورة في المجموعة التي تريد تخصيص أوقاتها"
+        )
         
         markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(
+            types.InlineKeyboardButton("⏰ أوقات شائعة للصباح", callback_data="morning_time_presets"),
+            types.InlineKeyboardButton("🌙 أوقات شائعة للمساء", callback_data="evening_time_presets")
+        )
+        # Old format: go back to general settings
+        markup.add(types.InlineKeyboardButton("« العودة", callback_data="open_settings"))
         
-        # Add toggle buttons if chat_id is specified
-        if chat_id:
-            settings = get_chat_settings(chat_id)
-            morning_icon = "✅" if settings.get('morning_azkar', 1) else "❌"
-            evening_icon = "✅" if settings.get('evening_azkar', 1) else "❌"
-            
-            markup.add(
-                types.InlineKeyboardButton(
-                    f"{morning_icon} أذكار الصباح", 
-                    callback_data=f"toggle_morning_azkar_{chat_id}"
-                ),
-                types.InlineKeyboardButton(
-                    f"{evening_icon} أذكار المساء", 
-                    callback_data=f"toggle_evening_azkar_{chat_id}"
-                )
-            )
-            
-            # Add time preset buttons
-            markup.add(
-                types.InlineKeyboardButton("⏰ أوقات شائعة للصباح", callback_data=f"morning_time_presets_{chat_id}"),
-                types.InlineKeyboardButton("🌙 أوقات شائعة للمساء", callback_data=f"evening_time_presets_{chat_id}")
-            )
-            
-            # Add back button with chat_id encoded
-            chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
-        else:
-            markup.add(
-                types.InlineKeyboardButton("⏰ أوقات شائعة للصباح", callback_data="morning_time_presets"),
-                types.InlineKeyboardButton("🌙 أوقات شائعة للمساء", callback_data="evening_time_presets")
-            )
-            # Old format: go back to general settings
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data="open_settings"))
-        
-        # Only add support buttons in main settings (not group-specific)
-        if chat_id is None:
-            add_support_buttons(markup)
+        add_support_buttons(markup)
         
         bot.edit_message_text(
             settings_text,
@@ -3539,8 +7307,7 @@ def callback_general_settings(call: types.CallbackQuery):
         )
         
         # Add back button
-        chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-        markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
+        markup.add(types.InlineKeyboardButton("« العودة", callback_data=create_back_button_callback(chat_id)))
         
         bot.edit_message_text(
             settings_text,
@@ -3657,7 +7424,7 @@ def callback_set_sleep_time(call: types.CallbackQuery):
         
         # Update the time setting
         update_chat_setting(chat_id, "sleep_time", time_formatted)
-        schedule_chat_jobs(chat_id)
+        reschedule_chat_jobs(chat_id, "chat")
         
         bot.answer_callback_query(call.id, f"✅ تم تعيين وقت النوم: {time_formatted}")
         
@@ -3710,7 +7477,7 @@ def callback_toggle_general_settings(call: types.CallbackQuery):
         
         # Reschedule jobs if it's sleep_message
         if setting_key == "sleep_message":
-            schedule_chat_jobs(chat_id)
+            reschedule_chat_jobs(chat_id, "chat")
         
         # Prepare updated message
         settings = get_chat_settings(chat_id)
@@ -3748,197 +7515,22 @@ def callback_toggle_general_settings(call: types.CallbackQuery):
             types.InlineKeyboardButton(
                 f"{sleep_icon} رسالة النوم", 
                 callback_data=f"toggle_sleep_message_{chat_id}"
-            ),
-            types.InlineKeyboardButton(
-                f"{delete_icon} حذف رسائل النظام", 
-                callback_data=f"toggle_delete_service_messages_{chat_id}"
-            )
-        )
-        
-        # Add time preset button for sleep message
-        markup.add(
-            types.InlineKeyboardButton("😴 أوقات شائعة للنوم", callback_data=f"sleep_time_presets_{chat_id}")
-        )
-        
-        # Add back button
-        chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-        markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
-        
-        # Edit message with updated status
-        bot.edit_message_text(
-            settings_text,
-            call.message.chat.id,
-            call.message.message_id,
-            parse_mode="Markdown",
-            reply_markup=markup
-        )
-        
-        # Answer callback with confirmation
-        status_text = "تم التفعيل ✅" if new_value else "تم التعطيل ❌"
-        bot.answer_callback_query(call.id, f"{setting_name}: {status_text}")
-        
-        logger.info(f"User {call.from_user.id} toggled {setting_key} to {new_value} for chat {chat_id}")
-        
-    except Exception as e:
-        logger.error(f"Error in callback_toggle_general_settings: {e}", exc_info=True)
-        try:
-            bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
-        except Exception:
-            pass
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith("morning_time_presets"))
-def callback_morning_time_presets(call: types.CallbackQuery):
-    """Show preset times for morning azkar with clickable time buttons."""
-    try:
-        # Extract chat_id from callback data if present
-        chat_id, has_chat_id = extract_chat_id_from_callback(call.data)
-        
-        if has_chat_id and chat_id:
-            # Verify user is admin of this chat
-            if not is_user_admin_of_chat(call.from_user.id, chat_id):
-                bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-                return
-        
-        # If no chat_id, verify user is admin in any group
-        if not has_chat_id:
-            is_admin = is_user_admin_in_any_group(call.from_user.id)
-            if not is_admin:
-                bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
-                return
-            # Show error if no chat_id
-            bot.answer_callback_query(call.id, "⚠️ يرجى تحديد مجموعة أولاً", show_alert=True)
-            return
-        
-        bot.answer_callback_query(call.id, "اختر الوقت")
-        
-        # Get current time setting
-        current_time = "05:00"
-        if chat_id:
-            settings = get_chat_settings(chat_id)
-            current_time = settings.get('morning_time', '05:00')
-        
-        settings_text = (
-            "⏰ *تخصيص وقت أذكار الصباح*\n\n"
-            f"الوقت الحالي: *{current_time}*\n\n"
-            "*اختر وقتاً من الأوقات الشائعة:*\n"
-            "• 04:30 - بعد صلاة الفجر مباشرة\n"
-            "• 05:00 - الافتراضي\n"
-            "• 06:00 - مع شروق الشمس تقريباً\n"
-            "• 07:00 - صباحاً\n\n"
-            "*أو استخدم الأمر في المجموعة:*\n"
-            "`/settime morning HH:MM`"
-        )
-        
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        
-        # Add clickable time buttons
-        time_options = [
-            ("04:30", "04:30 🌄"),
-            ("05:00", "05:00 ⭐"),
-            ("06:00", "06:00 ☀️"),
-            ("07:00", "07:00 🌅")
-        ]
-        
-        for time_value, time_label in time_options:
-            # Highlight current time
-            if time_value == current_time:
-                time_label = f"✅ {time_label}"
-            markup.add(
-                types.InlineKeyboardButton(
-                    time_label,
-                    callback_data=f"set_morning_time_{time_value.replace(':', '')}_{chat_id}"
-                )
-            )
-        
-        # Add back button
-        markup.add(
-            types.InlineKeyboardButton("« العودة", callback_data=f"morning_evening_settings_{chat_id}")
-        )
-        
-        bot.edit_message_text(
-            settings_text,
-            call.message.chat.id,
-            call.message.message_id,
-            parse_mode="Markdown",
-            reply_markup=markup
-        )
-        
-    except Exception as e:
-        logger.error(f"Error in callback_morning_time_presets: {e}", exc_info=True)
-        try:
-            bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
-        except Exception:
-            pass
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith("evening_time_presets"))
-def callback_evening_time_presets(call: types.CallbackQuery):
-    """Show preset times for evening azkar with clickable time buttons."""
-    try:
-        # Extract chat_id from callback data if present
-        chat_id, has_chat_id = extract_chat_id_from_callback(call.data)
-        
-        if has_chat_id and chat_id:
-            # Verify user is admin of this chat
-            if not is_user_admin_of_chat(call.from_user.id, chat_id):
-                bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-                return
-        
-        # If no chat_id, verify user is admin in any group
-        if not has_chat_id:
-            is_admin = is_user_admin_in_any_group(call.from_user.id)
-            if not is_admin:
-                bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
-                return
-            # Show error if no chat_id
-            bot.answer_callback_query(call.id, "⚠️ يرجى تحديد مجموعة أولاً", show_alert=True)
-            return
-        
-        bot.answer_callback_query(call.id, "اختر الوقت")
-        
-        # Get current time setting
-        current_time = "18:00"
-        if chat_id:
-            settings = get_chat_settings(chat_id)
-            current_time = settings.get('evening_time', '18:00')
-        
-        settings_text = (
-            "🌙 *تخصيص وقت أذكار المساء*\n\n"
-            f"الوقت الحالي: *{current_time}*\n\n"
-            "*اختر وقتاً من الأوقات الشائعة:*\n"
-            "• 15:30 - بعد صلاة العصر\n"
-            "• 17:00 - قبل المغرب\n"
-            "• 18:00 - الافتراضي\n"
-            "• 19:00 - مساءً\n\n"
-            "*أو استخدم الأمر في المجموعة:*\n"
-            "`/settime evening HH:MM`"
-        )
-        
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        
-        # Add clickable time buttons
-        time_options = [
-            ("15:30", "15:30 🕌"),
-            ("17:00", "17:00 🌆"),
-            ("18:00", "18:00 ⭐"),
-            ("19:00", "19:00 🌙")
-        ]
-        
-        for time_value, time_label in time_options:
-            # Highlight current time
-            if time_value == current_time:
-                time_label = f"✅ {time_label}"
-            markup.add(
-                types.InlineKeyboardButton(
-                    time_label,
-                    callback_data=f"set_evening_time_{time_value.replace(':', '')}_{chat_id}"
-                )
+            ),
+            types.InlineKeyboardButton(
+                f"{delete_icon} حذف رسائل النظام", 
+                callback_data=f"toggle_delete_service_messages_{chat_id}"
             )
+        )
         
-        # Add back button
+        # Add time preset button for sleep message
         markup.add(
-            types.InlineKeyboardButton("« العودة", callback_data=f"morning_evening_settings_{chat_id}")
+            types.InlineKeyboardButton("😴 أوقات شائعة للنوم", callback_data=f"sleep_time_presets_{chat_id}")
         )
         
+        # Add back button
+        markup.add(types.InlineKeyboardButton("« العودة", callback_data=create_back_button_callback(chat_id)))
+        
+        # Edit message with updated status
         bot.edit_message_text(
             settings_text,
             call.message.chat.id,
@@ -3947,84 +7539,99 @@ def callback_evening_time_presets(call: types.CallbackQuery):
             reply_markup=markup
         )
         
+        # Answer callback with confirmation
+        status_text = "تم التفعيل ✅" if new_value else "تم التعطيل ❌"
+        bot.answer_callback_query(call.id, f"{setting_name}: {status_text}")
+        
+        logger.info(f"User {call.from_user.id} toggled {setting_key} to {new_value} for chat {chat_id}")
+        
     except Exception as e:
-        logger.error(f"Error in callback_evening_time_presets: {e}", exc_info=True)
+        logger.error(f"Error in callback_toggle_general_settings: {e}", exc_info=True)
         try:
             bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
         except Exception:
             pass
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith("set_morning_time_"))
-def callback_set_morning_time(call: types.CallbackQuery):
-    """Handle setting morning azkar time from preset buttons."""
+@bot.callback_query_handler(func=lambda call: call.data.startswith("morning_time_presets"))
+def callback_morning_time_presets(call: types.CallbackQuery):
+    """
+    Show preset times for morning azkar with clickable time buttons.
+    Old format: morning_time_presets_{chat_id} (see open_time_presets).
+    """
+    legacy_time_presets(call, "morning")
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("evening_time_presets"))
+def callback_evening_time_presets(call: types.CallbackQuery):
+    """
+    Show preset times for evening azkar with clickable time buttons.
+    Old format: evening_time_presets_{chat_id} (see open_time_presets).
+    """
+    legacy_time_presets(call, "evening")
+
+def legacy_time_presets(call: types.CallbackQuery, period: str):
+    """Parse an old format time presets callback and open the presets."""
     try:
-        # Parse callback data: set_morning_time_HHMM_chat_id
-        parts = call.data.split("_")
-        if len(parts) < 5:
-            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-            return
-        
-        time_str = parts[3]  # e.g., "0430"
-        chat_id = int(parts[4] if len(parts) == 5 else parts[-1])  # Handle variable format
-        
-        # Convert time string to HH:MM format
-        time_formatted = f"{time_str[:2]}:{time_str[2:]}"
+        chat_id, has_chat_id = extract_chat_id_from_callback(call.data)
         
-        # Verify user is admin of this chat
-        if not is_user_admin_of_chat(call.from_user.id, chat_id):
-            bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
+        if not has_chat_id or chat_id >= 0:
+            # If no chat_id, verify user is admin in any group
+            if not is_user_admin_in_any_group(call.from_user.id):
+                bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
+                return
+            # Show error if no chat_id
+            bot.answer_callback_query(call.id, "⚠️ يرجى تحديد مجموعة أولاً", show_alert=True)
             return
         
-        # Update the time setting
-        update_chat_setting(chat_id, "morning_time", time_formatted)
-        schedule_chat_jobs(chat_id)
-        
-        bot.answer_callback_query(call.id, f"✅ تم تعيين وقت الصباح: {time_formatted}")
-        
-        # Refresh the time presets view
-        call.data = f"morning_time_presets_{chat_id}"
-        callback_morning_time_presets(call)
+        open_time_presets(call, chat_id, period)
         
     except Exception as e:
-        logger.error(f"Error in callback_set_morning_time: {e}", exc_info=True)
+        logger.error(f"Error in legacy_time_presets ({period}): {e}", exc_info=True)
         try:
             bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
         except Exception:
             pass
 
+@bot.callback_query_handler(func=lambda call: call.data.startswith("set_morning_time_"))
+def callback_set_morning_time(call: types.CallbackQuery):
+    """
+    Handle setting morning azkar time from preset buttons.
+    Old format: set_morning_time_HHMM_{chat_id} (see set_azkar_time).
+    """
+    legacy_set_azkar_time(call, "morning")
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith("set_evening_time_"))
 def callback_set_evening_time(call: types.CallbackQuery):
-    """Handle setting evening azkar time from preset buttons."""
+    """
+    Handle setting evening azkar time from preset buttons.
+    Old format: set_evening_time_HHMM_{chat_id} (see set_azkar_time).
+    """
+    legacy_set_azkar_time(call, "evening")
+
+def legacy_set_azkar_time(call: types.CallbackQuery, period: str):
+    """Parse and validate an old format set time callback, then apply the time."""
     try:
-        # Parse callback data: set_evening_time_HHMM_chat_id
+        # Parse callback data: set_<period>_time_HHMM_chat_id
         parts = call.data.split("_")
-        if len(parts) < 5:
-            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-            return
-        
-        time_str = parts[3]  # e.g., "1530"
-        chat_id = int(parts[4] if len(parts) == 5 else parts[-1])  # Handle variable format
-        
-        # Convert time string to HH:MM format
-        time_formatted = f"{time_str[:2]}:{time_str[2:]}"
+        hour = minute = None
+        chat_id = 0
+        if len(parts) == 5 and len(parts[3]) == 4 and parts[3].isdigit():
+            hour, minute, is_valid, _ = validate_time_format(f"{parts[3][:2]}:{parts[3][2:]}")
+            try:
+                chat_id = int(parts[4])
+            except ValueError:
+                is_valid = False
+        else:
+            is_valid = False
         
-        # Verify user is admin of this chat
-        if not is_user_admin_of_chat(call.from_user.id, chat_id):
-            bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
+        if not is_valid or chat_id >= 0:
+            logger.warning(f"Rejected malformed callback data from user {call.from_user.id}: {call.data!r}")
+            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
             return
         
-        # Update the time setting
-        update_chat_setting(chat_id, "evening_time", time_formatted)
-        schedule_chat_jobs(chat_id)
-        
-        bot.answer_callback_query(call.id, f"✅ تم تعيين وقت المساء: {time_formatted}")
-        
-        # Refresh the time presets view
-        call.data = f"evening_time_presets_{chat_id}"
-        callback_evening_time_presets(call)
+        set_azkar_time(call, chat_id, period, hour, minute)
         
     except Exception as e:
-        logger.error(f"Error in callback_set_evening_time: {e}", exc_info=True)
+        logger.error(f"Error in legacy_set_azkar_time ({period}): {e}", exc_info=True)
         try:
             bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
         except Exception:
@@ -4035,105 +7642,48 @@ def callback_friday_settings(call: types.CallbackQuery):
     """
     Handle callback for Friday prayers settings.
     Shows options for Surat Al-Kahf and Friday duas with toggle controls.
-    Supports both old format (friday_settings) and new format (friday_settings_{chat_id})
+    New keyboards use packed callback data (see show_settings_screen); this
+    handler keeps the old formats friday_settings and friday_settings_{chat_id}
+    working.
     """
     try:
         # Extract chat_id from callback data if present
-        chat_id = None
-        if "_" in call.data and call.data.count("_") >= 2:
-            # New format: friday_settings_{chat_id}
-            parts = call.data.split("_")
-            try:
-                chat_id = int(parts[-1])
-                # Verify user is admin of this chat
-                if not is_user_admin_of_chat(call.from_user.id, chat_id):
-                    bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-                    return
-            except (ValueError, IndexError):
-                # Fallback to old behavior
-                chat_id = None
-        
-        # If no chat_id, verify user is admin in any group
-        if chat_id is None:
-            is_admin = is_user_admin_in_any_group(call.from_user.id)
-            if not is_admin:
-                bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
-                return
+        chat_id, has_chat_id = extract_chat_id_from_callback(call.data, 2)
+        if has_chat_id:
+            # Old format: friday_settings_{chat_id}
+            if legacy_chat_id_valid(call, chat_id):
+                show_settings_screen(call, chat_id, "friday")
+            return
         
-        # Get settings for this specific chat (or show general info)
-        if chat_id:
-            settings = get_chat_settings(chat_id)
-            friday_sura_status = "✅ مفعّل" if settings.get('friday_sura', 1) else "❌ معطّل"
-            friday_dua_status = "✅ مفعّل" if settings.get('friday_dua', 1) else "❌ معطّل"
-            
-            settings_text = (
-                "📿🕌 *إعدادات أدعية الجمعة*\n\n"
-                f"*الحالة الحالية:*\n"
-                f"• سورة الكهف: {friday_sura_status}\n"
-                f"• أدعية الجمعة: {friday_dua_status}\n\n"
-                "*سورة الكهف:*\n"
-                "• تُرسل تلقائياً كل يوم جمعة\n"
-                "• الوقت: الجمعة 09:00\n"
-                "• يمكن إرسالها مع صور أو فيديو إسلامي\n\n"
-                "*أدعية الجمعة:*\n"
-                "• أدعية وأذكار خاصة بيوم الجمعة\n"
-                "• الوقت: الجمعة 10:00\n"
-                "• تشمل أدعية مستجابة في ساعة الإجابة\n\n"
-                "*التحكم:*\n"
-                "استخدم الأزرار أدناه للتفعيل/التعطيل"
-            )
-        else:
-            settings_text = (
-                "📿🕌 *إعدادات أدعية الجمعة*\n\n"
-                "*سورة الكهف:*\n"
-                "• تُرسل تلقائياً كل يوم جمعة\n"
-                "• الوقت: الجمعة 09:00\n"
-                "• يمكن إرسالها مع صور أو فيديو إسلامي\n\n"
-                "*أدعية الجمعة:*\n"
-                "• أدعية وأذكار خاصة بيوم الجمعة\n"
-                "• الوقت: الجمعة 10:00\n"
-                "• تشمل أدعية مستجابة في ساعة الإجابة\n\n"
-                "*الميزات:*\n"
-                "• ✅/❌ تفعيل أو تعطيل كل ميزة على حدة\n"
-                "• دعم إرسال الوسائط المتعددة\n"
-                "• إعدادات مستقلة لكل مجموعة\n\n"
-                "*للتعديل في مجموعة معينة:*\n"
-                "استخدم `/start` في المجموعة واختر الميزات المطلوبة"
-            )
+        # Oldest format: friday_settings, verify user is admin in any group
+        is_admin = is_user_admin_in_any_group(call.from_user.id)
+        if not is_admin:
+            bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
+            return
         
         bot.answer_callback_query(call.id, "أدعية الجمعة")
         
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        
-        # Add toggle buttons if chat_id is specified
-        if chat_id:
-            settings = get_chat_settings(chat_id)
-            friday_sura_icon = "✅" if settings.get('friday_sura', 1) else "❌"
-            friday_dua_icon = "✅" if settings.get('friday_dua', 1) else "❌"
-            
-            markup.add(
-                types.InlineKeyboardButton(
-                    f"{friday_sura_icon} سورة الكهف", 
-                    callback_data=f"toggle_friday_sura_{chat_id}"
-                ),
-                types.InlineKeyboardButton(
-                    f"{friday_dua_icon} أدعية الجمعة", 
-                    callback_data=f"toggle_friday_dua_{chat_id}"
-                )
-            )
-            # Add button for customizing Friday times
-            markup.add(
-                types.InlineKeyboardButton("⏰ تخصيص أوقات الجمعة", callback_data=f"friday_time_settings_{chat_id}")
-            )
-            # Add back button with chat_id encoded
-            chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
-        else:
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data="open_settings"))
+        settings_text = (
+            "📿🕌 *إعدادات أدعية الجمعة*\n\n"
+            "*سورة الكهف:*\n"
+            "• تُرسل تلقائياً كل يوم جمعة\n"
+            "• الوقت: الجمعة 09:00\n"
+            "• يمكن إرسالها مع صور أو فيديو إسلامي\n\n"
+            "*أدعية الجمعة:*\n"
+            "• أدعية وأذكار خاصة بيوم الجمعة\n"
+            "• الوقت: الجمعة 10:00\n"
+            "• تشمل أدعية مستجابة في ساعة الإجابة\n\n"
+            "*الميزات:*\n"
+            "• ✅/❌ تفعيل أو تعطيل كل ميزة على حدة\n"
+            "• دعم إرسال الوسائط المتعددة\n"
+            "• إعدادات مستقلة لكل مجموعة\n\n"
+            "*للتعديل في مجموعة معينة:*\n"
+            "استخدم `/start` في المجموعة واختر الميزات المطلوبة"
+        )
         
-        # Only add support buttons in main settings (not group-specific)
-        if chat_id is None:
-            add_support_buttons(markup)
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(types.InlineKeyboardButton("« العودة", callback_data="open_settings"))
+        add_support_buttons(markup)
         
         bot.edit_message_text(
             settings_text,
@@ -4143,7 +7693,7 @@ def callback_friday_settings(call: types.CallbackQuery):
             reply_markup=markup
         )
         
-        logger.info(f"Friday settings displayed for user {call.from_user.id}, chat_id={chat_id}")
+        logger.info(f"Friday settings displayed for user {call.from_user.id}")
         
     except Exception as e:
         logger.error(f"Error in callback_friday_settings: {e}", exc_info=True)
@@ -4156,50 +7706,12 @@ def callback_friday_settings(call: types.CallbackQuery):
 def callback_friday_time_settings(call: types.CallbackQuery):
     """
     Show information about customizing Friday times.
-    Format: friday_time_settings_{chat_id}
+    Old format: friday_time_settings_{chat_id} (see open_friday_time_settings).
     """
     try:
-        # Extract chat_id from callback data
-        parts = call.data.split("_")
-        if len(parts) < 4:
-            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-            return
-        
-        chat_id = int(parts[-1])
-        
-        # Verify user is admin of this chat
-        if not is_user_admin_of_chat(call.from_user.id, chat_id):
-            bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-            return
-        
-        bot.answer_callback_query(call.id, "تخصيص أوقات الجمعة")
-        
-        settings_text = (
-            "⏰ *تخصيص أوقات الجمعة*\n\n"
-            "*الأوقات الافتراضية:*\n"
-            "• سورة الكهف: الجمعة 09:00\n"
-            "• أدعية الجمعة: الجمعة 10:00\n\n"
-            "*ملاحظة:*\n"
-            "حالياً، أوقات الجمعة ثابتة ولا يمكن تخصيصها.\n"
-            "سيتم إضافة خاصية تخصيص الأوقات في التحديثات القادمة.\n\n"
-            "*للتفعيل أو التعطيل:*\n"
-            "استخدم الأزرار في شاشة إعدادات الجمعة الرئيسية"
-        )
-        
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        markup.add(
-            types.InlineKeyboardButton("« العودة", callback_data=f"friday_settings_{chat_id}")
-        )
-        
-        bot.edit_message_text(
-            settings_text,
-            call.message.chat.id,
-            call.message.message_id,
-            parse_mode="Markdown",
-            reply_markup=markup
-        )
-        
-        logger.info(f"Friday time settings displayed for user {call.from_user.id}, chat_id={chat_id}")
+        chat_id, has_chat_id = extract_chat_id_from_callback(call.data)
+        if legacy_chat_id_valid(call, chat_id if has_chat_id else None):
+            open_friday_time_settings(call, chat_id)
         
     except Exception as e:
         logger.error(f"Error in callback_friday_time_settings: {e}", exc_info=True)
@@ -4272,134 +7784,77 @@ def callback_media_type(call: types.CallbackQuery):
     """
     Handle media type selection callbacks.
     """
-    try:
-        media_type = call.data.replace("media_type_", "")
-        
-        media_names = {
-            "images": "صور",
-            "videos": "فيديو",
-            "documents": "ملفات",
-            "all": "عشوائي"
-        }
-        
-        bot.answer_callback_query(
-            call.id,
-            f"✓ تم اختيار: {media_names.get(media_type, 'عشوائي')}",
-            show_alert=False
-        )
-        
-        logger.info(f"User {call.from_user.id} selected media type: {media_type}")
-        
-        # Note: This is a demonstration. In a full implementation,
-        # you would save this preference to a user settings table
-        
-    except Exception as e:
-        logger.error(f"Error in callback_media_type: {e}", exc_info=True)
-        try:
-            bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
-        except Exception:
-            pass
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith("toggle_friday_"))
-def callback_toggle_friday(call: types.CallbackQuery):
-    """
-    Handle toggle callbacks for Friday settings (Sura Al-Kahf and Friday duas).
-    Format: toggle_friday_sura_{chat_id} or toggle_friday_dua_{chat_id}
-    """
-    try:
-        # Parse callback data to extract setting name and chat_id
-        parts = call.data.split("_")
-        if len(parts) < 4:
-            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-            return
-        
-        # Extract setting type and chat_id
-        # Format: toggle_friday_sura_{chat_id} or toggle_friday_dua_{chat_id}
-        setting_type = parts[2]  # 'sura' or 'dua'
-        chat_id = int(parts[3])
-        
-        # Verify user is admin of this chat
-        if not is_user_admin_of_chat(call.from_user.id, chat_id):
-            bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-            return
-        
-        # Get current settings
-        settings = get_chat_settings(chat_id)
-        
-        # Determine the setting key
-        if setting_type == "sura":
-            setting_key = "friday_sura"
-            setting_name = "سورة الكهف"
-        elif setting_type == "dua":
-            setting_key = "friday_dua"
-            setting_name = "أدعية الجمعة"
-        else:
-            bot.answer_callback_query(call.id, "⚠️ إعداد غير معروف", show_alert=True)
-            return
-        
-        # Toggle the setting
-        new_value = not settings.get(setting_key, 1)
-        update_chat_setting(chat_id, setting_key, new_value)
-        
-        # Reschedule jobs
-        schedule_chat_jobs(chat_id)
-        
-        # Prepare updated message
-        settings = get_chat_settings(chat_id)
-        friday_sura_status = "✅ مفعّل" if settings.get('friday_sura', 1) else "❌ معطّل"
-        friday_dua_status = "✅ مفعّل" if settings.get('friday_dua', 1) else "❌ معطّل"
-        
-        settings_text = (
-            "📿🕌 *إعدادات أدعية الجمعة*\n\n"
-            f"*الحالة الحالية:*\n"
-            f"• سورة الكهف: {friday_sura_status}\n"
-            f"• أدعية الجمعة: {friday_dua_status}\n\n"
-            "*سورة الكهف:*\n"
-            "• تُرسل تلقائياً كل يوم جمعة\n"
-            "• الوقت: الجمعة 09:00\n"
-            "• يمكن إرسالها مع صور أو فيديو إسلامي\n\n"
-            "*أدعية الجمعة:*\n"
-            "• أدعية وأذكار خاصة بيوم الجمعة\n"
-            "• الوقت: الجمعة 10:00\n"
-            "• تشمل أدعية مستجابة في ساعة الإجابة\n\n"
-            "*التحكم:*\n"
-            "استخدم الأزرار أدناه للتفعيل/التعطيل"
-        )
-        
-        # Update markup with new status
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        friday_sura_icon = "✅" if settings.get('friday_sura', 1) else "❌"
-        friday_dua_icon = "✅" if settings.get('friday_dua', 1) else "❌"
-        
-        markup.add(
-            types.InlineKeyboardButton(
-                f"{friday_sura_icon} سورة الكهف", 
-                callback_data=f"toggle_friday_sura_{chat_id}"
-            ),
-            types.InlineKeyboardButton(
-                f"{friday_dua_icon} أدعية الجمعة", 
-                callback_data=f"toggle_friday_dua_{chat_id}"
-            )
-        )
+    try:
+        media_type = call.data.replace("media_type_", "")
         
-        # Add back button
-        chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-        markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
+        media_names = {
+            "images": "صور",
+            "videos": "فيديو",
+            "documents": "ملفات",
+            "all": "عشوائي"
+        }
         
-        # Edit message with updated status
-        bot.edit_message_text(
-            settings_text,
-            call.message.chat.id,
-            call.message.message_id,
-            parse_mode="Markdown",
-            reply_markup=markup
+        bot.answer_callback_query(
+            call.id,
+            f"✓ تم اختيار: {media_names.get(media_type, 'عشوائي')}",
+            show_alert=False
         )
         
-        # Answer callback with confirmation
-        status_text = "تم التفعيل ✅" if new_value else "تم التعطيل ❌"
-        bot.answer_callback_query(call.id, f"{setting_name}: {status_text}")
+        logger.info(f"User {call.from_user.id} selected media type: {media_type}")
         
-        logger.info(f"User {call.from_user.id} toggled {setting_key} to {new_value} for chat {chat_id}")
+        # Note: This is a demonstration. In a full implementation,
+        # you would save this preference to a user settings table
+        
+    except Exception as e:
+        logger.error(f"Error in callback_media_type: {e}", exc_info=True)
+        try:
+            bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
+        except Exception:
+            pass
+
+# Old format toggle prefix -> action; the chat_id follows the prefix
+LEGACY_TOGGLE_PREFIXES = {
+    "toggle_friday_sura_": CallbackAction.TOGGLE_FRIDAY_SURA,
+    "toggle_friday_dua_": CallbackAction.TOGGLE_FRIDAY_DUA,
+    "toggle_morning_azkar_": CallbackAction.TOGGLE_MORNING_AZKAR,
+    "toggle_evening_azkar_": CallbackAction.TOGGLE_EVENING_AZKAR,
+    "toggle_diverse_azkar_": CallbackAction.TOGGLE_DIVERSE_AZKAR,
+    "toggle_diverse_audio_": CallbackAction.TOGGLE_DIVERSE_AUDIO,
+    "toggle_diverse_images_": CallbackAction.TOGGLE_DIVERSE_IMAGES,
+    "toggle_diverse_pdf_": CallbackAction.TOGGLE_DIVERSE_PDF,
+    "toggle_diverse_text_": CallbackAction.TOGGLE_DIVERSE_TEXT,
+}
+
+def legacy_toggle(call: types.CallbackQuery) -> bool:
+    """
+    Parse an old format toggle_<setting>_{chat_id} callback and flip the setting.
+    
+    Returns:
+        bool: False if the data is not a known old format toggle
+    """
+    for prefix, action in LEGACY_TOGGLE_PREFIXES.items():
+        if call.data.startswith(prefix):
+            break
+    else:
+        return False
+    
+    try:
+        chat_id = int(call.data[len(prefix):])
+    except ValueError:
+        chat_id = None
+    if legacy_chat_id_valid(call, chat_id):
+        toggle_menu_setting(call, chat_id, action)
+    return True
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("toggle_friday_"))
+def callback_toggle_friday(call: types.CallbackQuery):
+    """
+    Handle toggle callbacks for Friday settings (Sura Al-Kahf and Friday duas).
+    Old format: toggle_friday_sura_{chat_id} or toggle_friday_dua_{chat_id}
+    """
+    try:
+        if not legacy_toggle(call):
+            bot.answer_callback_query(call.id, "⚠️ إعداد غير معروف", show_alert=True)
         
     except Exception as e:
         logger.error(f"Error in callback_toggle_friday: {e}", exc_info=True)
@@ -4412,110 +7867,10 @@ def callback_toggle_friday(call: types.CallbackQuery):
 def callback_toggle_morning_evening(call: types.CallbackQuery):
     """
     Handle toggle callbacks for morning and evening azkar.
-    Format: toggle_morning_azkar_{chat_id} or toggle_evening_azkar_{chat_id}
+    Old format: toggle_morning_azkar_{chat_id} or toggle_evening_azkar_{chat_id}
     """
     try:
-        # Parse callback data to extract setting name and chat_id
-        parts = call.data.split("_")
-        if len(parts) < 4:
-            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-            return
-        
-        # Extract setting type and chat_id
-        # Format: toggle_morning_azkar_{chat_id} or toggle_evening_azkar_{chat_id}
-        setting_type = parts[1]  # 'morning' or 'evening'
-        chat_id = int(parts[-1])
-        
-        # Verify user is admin of this chat
-        if not is_user_admin_of_chat(call.from_user.id, chat_id):
-            bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-            return
-        
-        # Get current settings
-        settings = get_chat_settings(chat_id)
-        
-        # Determine the setting key
-        if setting_type == "morning":
-            setting_key = "morning_azkar"
-            setting_name = "أذكار الصباح"
-        elif setting_type == "evening":
-            setting_key = "evening_azkar"
-            setting_name = "أذكار المساء"
-        else:
-            bot.answer_callback_query(call.id, "⚠️ إعداد غير معروف", show_alert=True)
-            return
-        
-        # Toggle the setting
-        new_value = not settings.get(setting_key, 1)
-        update_chat_setting(chat_id, setting_key, new_value)
-        
-        # Reschedule jobs
-        schedule_chat_jobs(chat_id)
-        
-        # Prepare updated message
-        settings = get_chat_settings(chat_id)
-        morning_status = "✅ مفعّل" if settings.get('morning_azkar', 1) else "❌ معطّل"
-        evening_status = "✅ مفعّل" if settings.get('evening_azkar', 1) else "❌ معطّل"
-        morning_time = settings.get('morning_time', '05:00')
-        evening_time = settings.get('evening_time', '18:00')
-        
-        settings_text = (
-            "🌅🌙 *إعدادات أذكار الصباح والمساء*\n\n"
-            f"*الحالة الحالية:*\n"
-            f"• أذكار الصباح: {morning_status} (الوقت: {morning_time})\n"
-            f"• أذكار المساء: {evening_status} (الوقت: {evening_time})\n\n"
-            "*أذكار الصباح:*\n"
-            "• يتم إرسالها تلقائياً في الوقت المحدد\n"
-            "• الوقت الافتراضي: 05:00\n"
-            "• قابلة للتخصيص لكل مجموعة\n\n"
-            "*أذكار المساء:*\n"
-            "• يتم إرسالها تلقائياً في الوقت المحدد\n"
-            "• الوقت الافتراضي: 18:00\n"
-            "• قابلة للتخصيص لكل مجموعة\n\n"
-            "*التحكم:*\n"
-            "استخدم الأزرار أدناه للتفعيل/التعطيل"
-        )
-        
-        # Update markup with new status
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        morning_icon = "✅" if settings.get('morning_azkar', 1) else "❌"
-        evening_icon = "✅" if settings.get('evening_azkar', 1) else "❌"
-        
-        markup.add(
-            types.InlineKeyboardButton(
-                f"{morning_icon} أذكار الصباح", 
-                callback_data=f"toggle_morning_azkar_{chat_id}"
-            ),
-            types.InlineKeyboardButton(
-                f"{evening_icon} أذكار المساء", 
-                callback_data=f"toggle_evening_azkar_{chat_id}"
-            )
-        )
-        
-        # Add time preset buttons
-        markup.add(
-            types.InlineKeyboardButton("⏰ أوقات شائعة للصباح", callback_data=f"morning_time_presets_{chat_id}"),
-            types.InlineKeyboardButton("🌙 أوقات شائعة للمساء", callback_data=f"evening_time_presets_{chat_id}")
-        )
-        
-        # Add back button
-        chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-        markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
-        
-        # Edit message with updated status
-        bot.edit_message_text(
-            settings_text,
-            call.message.chat.id,
-            call.message.message_id,
-            parse_mode="Markdown",
-            reply_markup=markup
-        )
-        
-        # Answer callback with confirmation
-        status_text = "تم التفعيل ✅" if new_value else "تم التعطيل ❌"
-        bot.answer_callback_query(call.id, f"{setting_name}: {status_text}")
-        
-        logger.info(f"User {call.from_user.id} toggled {setting_key} to {new_value} for chat {chat_id}")
+        legacy_toggle(call)
         
     except Exception as e:
         logger.error(f"Error in callback_toggle_morning_evening: {e}", exc_info=True)
@@ -4583,144 +7938,61 @@ def callback_schedule_settings(call: types.CallbackQuery):
 def callback_diverse_azkar_settings(call: types.CallbackQuery):
     """
     Handle callback for diverse azkar settings panel.
-    Supports both old format (diverse_azkar_settings) and new format (diverse_azkar_settings_{chat_id})
+    New keyboards use packed callback data (see show_settings_screen); this
+    handler keeps the old formats diverse_azkar_settings and
+    diverse_azkar_settings_{chat_id} working.
     """
     try:
         # Extract chat_id from callback data if present
         chat_id, has_chat_id = extract_chat_id_from_callback(call.data)
+        if has_chat_id:
+            # Old format: diverse_azkar_settings_{chat_id}
+            if legacy_chat_id_valid(call, chat_id):
+                show_settings_screen(call, chat_id, "diverse")
+            return
         
-        if has_chat_id and chat_id:
-            # Verify user is admin of this chat
-            if not is_user_admin_of_chat(call.from_user.id, chat_id):
-                bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-                return
-        
-        # If no chat_id, verify user is admin in any group
-        if not has_chat_id:
-            is_admin = is_user_admin_in_any_group(call.from_user.id)
-            if not is_admin:
-                bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
-                return
+        # Oldest format: diverse_azkar_settings, verify user is admin in any group
+        is_admin = is_user_admin_in_any_group(call.from_user.id)
+        if not is_admin:
+            bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
+            return
         
         bot.answer_callback_query(call.id, "إعدادات الأدعية المتنوعة")
         
-        # Get settings for this specific chat (or show general info)
-        if chat_id:
-            diverse_settings = get_diverse_azkar_settings(chat_id)
-            enabled_status = "✅ مفعّل" if diverse_settings.get('enabled', 0) else "❌ معطّل"
-            interval = diverse_settings.get('interval_minutes', 60)
-            
-            # Convert interval to readable format
-            if interval < 60:
-                interval_text = f"{interval} دقيقة"
-            elif interval == 60:
-                interval_text = "ساعة واحدة"
-            elif interval < 1440:
-                interval_text = f"{interval // 60} ساعات"
-            else:
-                interval_text = "يوم كامل"
-            
-            settings_text = (
-                "✨ *إعدادات الأدعية المتنوعة*\n\n"
-                f"*الحالة الحالية:*\n"
-                f"• الحالة: {enabled_status}\n"
-                f"• الفاصل الزمني: {interval_text}\n\n"
-                "*ما هي الأدعية المتنوعة؟*\n"
-                "مجموعة من الأدعية والآيات والأحاديث المتنوعة "
-                "يتم إرسالها بشكل دوري حسب الفاصل الزمني المحدد\n\n"
-                "*الفواصل الزمنية المتاحة:*\n"
-                "• دقيقة واحدة\n"
-                "• 5 دقائق\n"
-                "• 15 دقيقة\n"
-                "• ساعة واحدة\n"
-                "• ساعتين\n"
-                "• 4 ساعات\n"
-                "• 8 ساعات\n"
-                "• 12 ساعة\n"
-                "• 24 ساعة (يوم كامل)\n\n"
-                "*التحكم:*\n"
-                "استخدم الأزرار أدناه للتفعيل/التعطيل واختيار الفاصل الزمني"
-            )
-        else:
-            settings_text = (
-                "✨ *إعدادات الأدعية المتنوعة*\n\n"
-                "*ما هي الأدعية المتنوعة؟*\n"
-                "مجموعة من الأدعية والآيات والأحاديث المتنوعة "
-                "يتم إرسالها بشكل دوري حسب الفاصل الزمني المحدد\n\n"
-                "*الفواصل الزمنية المتاحة:*\n"
-                "• دقيقة واحدة\n"
-                "• 5 دقائق\n"
-                "• 15 دقيقة\n"
-                "• ساعة واحدة\n"
-                "• ساعتين\n"
-                "• 4 ساعات\n"
-                "• 8 ساعات\n"
-                "• 12 ساعة\n"
-                "• 24 ساعة (يوم كامل)\n\n"
-                "*للتفعيل في مجموعة:*\n"
-                "استخدم `/start` في المجموعة واختر الفاصل الزمني المناسب"
-            )
+        settings_text = (
+            "✨ *إعدادات الأدعية المتنوعة*\n\n"
+            "*ما هي الأدعية المتنوعة؟*\n"
+            "مجموعة من الأدعية والآيات والأحاديث المتنوعة "
+            "يتم إرسالها بشكل دوري حسب الفاصل الزمني المحدد\n\n"
+            "*الفواصل الزمنية المتاحة:*\n"
+            "• دقيقة واحدة\n"
+            "• 5 دقائق\n"
+            "• 15 دقيقة\n"
+            "• ساعة واحدة\n"
+            "• ساعتين\n"
+            "• 4 ساعات\n"
+            "• 8 ساعات\n"
+            "• 12 ساعة\n"
+            "• 24 ساعة (يوم كامل)\n\n"
+            "*للتفعيل في مجموعة:*\n"
+            "استخدم `/start` في المجموعة واختر الفاصل الزمني المناسب"
+        )
         
         markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(
+            types.InlineKeyboardButton("1 دقيقة", callback_data="diverse_interval_1"),
+            types.InlineKeyboardButton("5 دقائق", callback_data="diverse_interval_5"),
+            types.InlineKeyboardButton("15 دقيقة", callback_data="diverse_interval_15"),
+            types.InlineKeyboardButton("1 ساعة", callback_data="diverse_interval_60"),
+            types.InlineKeyboardButton("2 ساعة", callback_data="diverse_interval_120"),
+            types.InlineKeyboardButton("4 ساعات", callback_data="diverse_interval_240"),
+            types.InlineKeyboardButton("8 ساعات", callback_data="diverse_interval_480"),
+            types.InlineKeyboardButton("12 ساعة", callback_data="diverse_interval_720"),
+            types.InlineKeyboardButton("24 ساعة", callback_data="diverse_interval_1440")
+        )
+        markup.add(types.InlineKeyboardButton("« العودة", callback_data="open_settings"))
         
-        # Add toggle button and interval buttons if chat_id is specified
-        if chat_id:
-            diverse_settings = get_diverse_azkar_settings(chat_id)
-            enabled_icon = "✅" if diverse_settings.get('enabled', 0) else "❌"
-            
-            markup.add(
-                types.InlineKeyboardButton(
-                    f"{enabled_icon} تفعيل/تعطيل", 
-                    callback_data=f"toggle_diverse_azkar_{chat_id}"
-                )
-            )
-            
-            # Add interval selection buttons
-            markup.add(
-                types.InlineKeyboardButton("1 دقيقة", callback_data=f"diverse_interval_{chat_id}_1"),
-                types.InlineKeyboardButton("5 دقائق", callback_data=f"diverse_interval_{chat_id}_5")
-            )
-            markup.add(
-                types.InlineKeyboardButton("15 دقيقة", callback_data=f"diverse_interval_{chat_id}_15"),
-                types.InlineKeyboardButton("1 ساعة", callback_data=f"diverse_interval_{chat_id}_60")
-            )
-            markup.add(
-                types.InlineKeyboardButton("2 ساعة", callback_data=f"diverse_interval_{chat_id}_120"),
-                types.InlineKeyboardButton("4 ساعات", callback_data=f"diverse_interval_{chat_id}_240")
-            )
-            markup.add(
-                types.InlineKeyboardButton("8 ساعات", callback_data=f"diverse_interval_{chat_id}_480"),
-                types.InlineKeyboardButton("12 ساعة", callback_data=f"diverse_interval_{chat_id}_720")
-            )
-            markup.add(
-                types.InlineKeyboardButton("24 ساعة", callback_data=f"diverse_interval_{chat_id}_1440")
-            )
-            
-            # Add media format settings button
-            markup.add(
-                types.InlineKeyboardButton("🎨 إعدادات التنسيق", callback_data=f"diverse_media_format_{chat_id}")
-            )
-            
-            # Add back button with chat_id encoded
-            chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
-        else:
-            markup.add(
-                types.InlineKeyboardButton("1 دقيقة", callback_data="diverse_interval_1"),
-                types.InlineKeyboardButton("5 دقائق", callback_data="diverse_interval_5"),
-                types.InlineKeyboardButton("15 دقيقة", callback_data="diverse_interval_15"),
-                types.InlineKeyboardButton("1 ساعة", callback_data="diverse_interval_60"),
-                types.InlineKeyboardButton("2 ساعة", callback_data="diverse_interval_120"),
-                types.InlineKeyboardButton("4 ساعات", callback_data="diverse_interval_240"),
-                types.InlineKeyboardButton("8 ساعات", callback_data="diverse_interval_480"),
-                types.InlineKeyboardButton("12 ساعة", callback_data="diverse_interval_720"),
-                types.InlineKeyboardButton("24 ساعة", callback_data="diverse_interval_1440")
-            )
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data="open_settings"))
-        
-        # Only add support buttons in main settings (not group-specific)
-        if chat_id is None:
-            add_support_buttons(markup)
+        add_support_buttons(markup)
         
         bot.edit_message_text(
             settings_text,
@@ -4743,126 +8015,53 @@ def callback_diverse_azkar_settings(call: types.CallbackQuery):
 def callback_diverse_interval(call: types.CallbackQuery):
     """
     Handle diverse azkar interval selection.
-    Supports both old format (diverse_interval_{minutes}) and new format (diverse_interval_{chat_id}_{minutes})
+    New keyboards use packed callback data (see set_diverse_interval); this
+    handler keeps the old formats diverse_interval_{minutes} and
+    diverse_interval_{chat_id}_{minutes} working.
     """
     try:
-        # Parse callback data
+        # Parse and validate callback data before touching any settings
         parts = call.data.replace("diverse_interval_", "").split("_")
-        
-        chat_id = None
-        interval_minutes = None
-        
-        if len(parts) == 2:
-            # New format: diverse_interval_{chat_id}_{minutes}
-            try:
-                chat_id = int(parts[0])
-                interval_minutes = int(parts[1])
-                
-                # Verify user is admin of this chat
-                if not is_user_admin_of_chat(call.from_user.id, chat_id):
-                    bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-                    return
-            except (ValueError, IndexError):
-                bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-                return
-        elif len(parts) == 1:
-            # Old format: diverse_interval_{minutes}
-            try:
-                interval_minutes = int(parts[0])
-            except ValueError:
-                bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-                return
-        else:
-            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-            return
-        
-        interval_names = {
-            1: "دقيقة واحدة",
-            5: "5 دقائق",
-            15: "15 دقيقة",
-            60: "ساعة واحدة",
-            120: "ساعتين",
-            240: "4 ساعات",
-            480: "8 ساعات",
-            720: "12 ساعة",
-            1440: "24 ساعة"
-        }
-        
-        # If chat_id is provided, update the settings
-        if chat_id:
-            update_diverse_azkar_setting(chat_id, 'interval_minutes', interval_minutes)
-            # Enable diverse azkar if not already enabled
-            diverse_settings = get_diverse_azkar_settings(chat_id)
-            if not diverse_settings.get('enabled', 0):
-                update_diverse_azkar_setting(chat_id, 'enabled', 1)
-            
-            # Reschedule jobs
-            schedule_chat_jobs(chat_id)
-            
-            bot.answer_callback_query(
-                call.id,
-                f"✓ تم تحديث الفاصل الزمني: {interval_names.get(interval_minutes, str(interval_minutes))}",
-                show_alert=False
-            )
-            
-            # Refresh the settings view
-            call.data = f"diverse_azkar_settings_{chat_id}"
-            callback_diverse_azkar_settings(call)
-        else:
-            bot.answer_callback_query(
-                call.id,
-                f"✓ تم اختيار الفاصل الزمني: {interval_names.get(interval_minutes, str(interval_minutes))}",
-                show_alert=False
-            )
-        
-        logger.info(f"User {call.from_user.id} selected diverse interval: {interval_minutes} minutes for chat {chat_id}")
-        
-    except Exception as e:
-        logger.error(f"Error in callback_diverse_interval: {e}", exc_info=True)
         try:
-            bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
-        except Exception:
-            pass
-
-@bot.callback_query_handler(func=lambda call: call.data.startswith("toggle_diverse_azkar_"))
-def callback_toggle_diverse_azkar(call: types.CallbackQuery):
-    """
-    Handle toggle callbacks for diverse azkar.
-    Format: toggle_diverse_azkar_{chat_id}
-    """
-    try:
-        # Parse callback data to extract chat_id
-        parts = call.data.split("_")
-        if len(parts) < 4:
+            values = [int(part) for part in parts]
+        except ValueError:
+            values = []
+        
+        if len(values) not in (1, 2) or values[-1] not in DIVERSE_INTERVAL_NAMES:
+            logger.warning(f"Rejected malformed callback data from user {call.from_user.id}: {call.data!r}")
             bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
             return
         
-        chat_id = int(parts[-1])
-        
-        # Verify user is admin of this chat
-        if not is_user_admin_of_chat(call.from_user.id, chat_id):
-            bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
+        interval_minutes = values[-1]
+        if len(values) == 2:
+            # Old format: diverse_interval_{chat_id}_{minutes}
+            if legacy_chat_id_valid(call, values[0]):
+                set_diverse_interval(call, values[0], interval_minutes)
             return
         
-        # Get current settings
-        diverse_settings = get_diverse_azkar_settings(chat_id)
-        
-        # Toggle the enabled setting
-        new_value = not diverse_settings.get('enabled', 0)
-        update_diverse_azkar_setting(chat_id, 'enabled', new_value)
-        
-        # Reschedule jobs
-        schedule_chat_jobs(chat_id)
-        
-        # Answer callback with confirmation
-        status_text = "تم التفعيل ✅" if new_value else "تم التعطيل ❌"
-        bot.answer_callback_query(call.id, f"أذكار متنوعة: {status_text}")
-        
-        # Refresh the settings view
-        call.data = f"diverse_azkar_settings_{chat_id}"
-        callback_diverse_azkar_settings(call)
+        # Oldest format: diverse_interval_{minutes}
+        bot.answer_callback_query(
+            call.id,
+            f"✓ تم اختيار الفاصل الزمني: {DIVERSE_INTERVAL_NAMES[interval_minutes]}",
+            show_alert=False
+        )
+        logger.info(f"User {call.from_user.id} selected diverse interval: {interval_minutes} minutes")
         
-        logger.info(f"User {call.from_user.id} toggled diverse azkar to {new_value} for chat {chat_id}")
+    except Exception as e:
+        logger.error(f"Error in callback_diverse_interval: {e}", exc_info=True)
+        try:
+            bot.answer_callback_query(call.id, "حدث خطأ", show_alert=True)
+        except Exception:
+            pass
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("toggle_diverse_azkar_"))
+def callback_toggle_diverse_azkar(call: types.CallbackQuery):
+    """
+    Handle toggle callbacks for diverse azkar.
+    Old format: toggle_diverse_azkar_{chat_id}
+    """
+    try:
+        legacy_toggle(call)
         
     except Exception as e:
         logger.error(f"Error in callback_toggle_diverse_azkar: {e}", exc_info=True)
@@ -4875,97 +8074,12 @@ def callback_toggle_diverse_azkar(call: types.CallbackQuery):
 def callback_diverse_media_format(call: types.CallbackQuery):
     """
     Handle callback for diverse azkar media format settings.
-    Format: diverse_media_format_{chat_id}
+    Old format: diverse_media_format_{chat_id} (see open_diverse_media_format).
     """
     try:
-        # Parse callback data to extract chat_id
-        parts = call.data.split("_")
-        if len(parts) < 4:
-            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-            return
-        
-        chat_id = int(parts[-1])
-        
-        # Verify user is admin of this chat
-        if not is_user_admin_of_chat(call.from_user.id, chat_id):
-            bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-            return
-        
-        bot.answer_callback_query(call.id, "إعدادات التنسيق")
-        
-        # Get current settings
-        diverse_settings = get_diverse_azkar_settings(chat_id)
-        audio_status = "✅ مفعّل" if diverse_settings.get('enable_audio', 1) else "❌ معطّل"
-        images_status = "✅ مفعّل" if diverse_settings.get('enable_images', 1) else "❌ معطّل"
-        pdf_status = "✅ مفعّل" if diverse_settings.get('enable_pdf', 1) else "❌ معطّل"
-        text_status = "✅ مفعّل" if diverse_settings.get('enable_text', 1) else "❌ معطّل"
-        
-        settings_text = (
-            "🎨 *إعدادات تنسيق الأدعية المتنوعة*\n\n"
-            f"*الحالة الحالية:*\n"
-            f"• الصوت: {audio_status}\n"
-            f"• الصور: {images_status}\n"
-            f"• ملفات PDF: {pdf_status}\n"
-            f"• النص العادي: {text_status}\n\n"
-            "*ما هو تنسيق الإرسال؟*\n"
-            "يمكنك اختيار نوع أو أكثر من أنواع الوسائط التالية:\n\n"
-            "*🎵 الصوت:*\n"
-            "• ملفات صوتية للأدعية والقرآن\n"
-            "• تشغيل مباشر في التليجرام\n\n"
-            "*🖼️ الصور:*\n"
-            "• صور ملهمة مع الأدعية\n"
-            "• تصميمات جميلة للآيات\n\n"
-            "*📄 ملفات PDF:*\n"
-            "• كتب ومطويات\n"
-            "• نشرات دعوية\n\n"
-            "*📝 النص العادي:*\n"
-            "• نص بسيط بدون وسائط\n"
-            "• سهل القراءة والنسخ\n\n"
-            "*التحكم:*\n"
-            "استخدم الأزرار أدناه لتفعيل أو تعطيل كل نوع"
-        )
-        
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        
-        # Add toggle buttons for each media type
-        audio_icon = "✅" if diverse_settings.get('enable_audio', 1) else "❌"
-        images_icon = "✅" if diverse_settings.get('enable_images', 1) else "❌"
-        pdf_icon = "✅" if diverse_settings.get('enable_pdf', 1) else "❌"
-        text_icon = "✅" if diverse_settings.get('enable_text', 1) else "❌"
-        
-        markup.add(
-            types.InlineKeyboardButton(
-                f"{audio_icon} الصوت", 
-                callback_data=f"toggle_diverse_audio_{chat_id}"
-            ),
-            types.InlineKeyboardButton(
-                f"{images_icon} الصور", 
-                callback_data=f"toggle_diverse_images_{chat_id}"
-            ),
-            types.InlineKeyboardButton(
-                f"{pdf_icon} ملفات PDF", 
-                callback_data=f"toggle_diverse_pdf_{chat_id}"
-            ),
-            types.InlineKeyboardButton(
-                f"{text_icon} النص العادي", 
-                callback_data=f"toggle_diverse_text_{chat_id}"
-            )
-        )
-        
-        # Add back button
-        markup.add(
-            types.InlineKeyboardButton("« العودة", callback_data=f"diverse_azkar_settings_{chat_id}")
-        )
-        
-        bot.edit_message_text(
-            settings_text,
-            call.message.chat.id,
-            call.message.message_id,
-            parse_mode="Markdown",
-            reply_markup=markup
-        )
-        
-        logger.info(f"Diverse media format settings displayed for user {call.from_user.id} in chat {chat_id}")
+        chat_id, has_chat_id = extract_chat_id_from_callback(call.data)
+        if legacy_chat_id_valid(call, chat_id if has_chat_id else None):
+            open_diverse_media_format(call, chat_id)
         
     except Exception as e:
         logger.error(f"Error in callback_diverse_media_format: {e}", exc_info=True)
@@ -4981,51 +8095,10 @@ def callback_diverse_media_format(call: types.CallbackQuery):
 def callback_toggle_diverse_media(call: types.CallbackQuery):
     """
     Handle toggle callbacks for diverse azkar media types.
-    Format: toggle_diverse_{type}_{chat_id}
+    Old format: toggle_diverse_{type}_{chat_id}
     """
     try:
-        # Parse callback data
-        parts = call.data.split("_")
-        if len(parts) < 4:
-            bot.answer_callback_query(call.id, "⚠️ خطأ في البيانات", show_alert=True)
-            return
-        
-        media_type = parts[2]  # 'audio', 'images', 'pdf', or 'text'
-        chat_id = int(parts[-1])
-        
-        # Verify user is admin of this chat
-        if not is_user_admin_of_chat(call.from_user.id, chat_id):
-            bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-            return
-        
-        # Map media types to setting keys and names
-        setting_map = {
-            "audio": ("enable_audio", "الصوت"),
-            "images": ("enable_images", "الصور"),
-            "pdf": ("enable_pdf", "ملفات PDF"),
-            "text": ("enable_text", "النص العادي")
-        }
-        
-        if media_type not in setting_map:
-            bot.answer_callback_query(call.id, "⚠️ نوع غير معروف", show_alert=True)
-            return
-        
-        setting_key, setting_name = setting_map[media_type]
-        
-        # Get current settings and toggle
-        diverse_settings = get_diverse_azkar_settings(chat_id)
-        new_value = not diverse_settings.get(setting_key, 1)
-        update_diverse_azkar_setting(chat_id, setting_key, new_value)
-        
-        # Answer callback with confirmation
-        status_text = "تم التفعيل ✅" if new_value else "تم التعطيل ❌"
-        bot.answer_callback_query(call.id, f"{setting_name}: {status_text}")
-        
-        # Refresh the media format settings view
-        call.data = f"diverse_media_format_{chat_id}"
-        callback_diverse_media_format(call)
-        
-        logger.info(f"User {call.from_user.id} toggled {setting_key} to {new_value} for chat {chat_id}")
+        legacy_toggle(call)
         
     except Exception as e:
         logger.error(f"Error in callback_toggle_diverse_media: {e}", exc_info=True)
@@ -5038,113 +8111,45 @@ def callback_toggle_diverse_media(call: types.CallbackQuery):
 def callback_ramadan_settings(call: types.CallbackQuery):
     """
     Handle callback for Ramadan settings panel.
-    Supports both old format (ramadan_settings) and new format (ramadan_settings_{chat_id})
+    New keyboards use packed callback data (see show_settings_screen); this
+    handler keeps the old formats ramadan_settings and ramadan_settings_{chat_id}
+    working.
     """
     try:
         # Extract chat_id from callback data if present
-        chat_id = None
-        if "_" in call.data and call.data.count("_") >= 2:
-            # New format: ramadan_settings_{chat_id}
-            parts = call.data.split("_")
-            try:
-                chat_id = int(parts[-1])
-                # Verify user is admin of this chat
-                if not is_user_admin_of_chat(call.from_user.id, chat_id):
-                    bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
-                    return
-            except (ValueError, IndexError):
-                # Fallback to old behavior
-                chat_id = None
+        chat_id, has_chat_id = extract_chat_id_from_callback(call.data, 2)
+        if has_chat_id:
+            # Old format: ramadan_settings_{chat_id}
+            if legacy_chat_id_valid(call, chat_id):
+                show_settings_screen(call, chat_id, "ramadan")
+            return
         
-        # If no chat_id, verify user is admin in any group
-        if chat_id is None:
-            is_admin = is_user_admin_in_any_group(call.from_user.id)
-            if not is_admin:
-                bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
-                return
+        # Oldest format: ramadan_settings, verify user is admin in any group
+        is_admin = is_user_admin_in_any_group(call.from_user.id)
+        if not is_admin:
+            bot.answer_callback_query(call.id, "⚠️ يجب أن تكون مشرفًا", show_alert=True)
+            return
         
         bot.answer_callback_query(call.id, "إعدادات رمضان")
         
-        # Get settings for this specific chat (or show general info)
-        if chat_id:
-            ramadan_settings = get_ramadan_settings(chat_id)
-            ramadan_status = "✅ مفعّل" if ramadan_settings.get('ramadan_enabled', 1) else "❌ معطّل"
-            laylat_alqadr_status = "✅ مفعّل" if ramadan_settings.get('laylat_alqadr_enabled', 1) else "❌ معطّل"
-            last_ten_status = "✅ مفعّل" if ramadan_settings.get('last_ten_days_enabled', 1) else "❌ معطّل"
-            iftar_status = "✅ مفعّل" if ramadan_settings.get('iftar_dua_enabled', 1) else "❌ معطّل"
-            
-            settings_text = (
-                "🌙 *إعدادات رمضان*\n\n"
-                f"*الحالة الحالية:*\n"
-                f"• أدعية رمضان: {ramadan_status}\n"
-                f"• ليلة القدر: {laylat_alqadr_status}\n"
-                f"• العشر الأواخر: {last_ten_status}\n"
-                f"• دعاء الإفطار: {iftar_status}\n\n"
-                "*الأقسام المتاحة:*\n\n"
-                "*1. ليلة القدر:*\n"
-                "أدعية خاصة بليلة القدر المباركة\n"
-                "يتم إرسالها في الليالي الوترية من العشر الأواخر\n\n"
-                "*2. العشر الأواخر من رمضان:*\n"
-                "أذكار وأدعية خاصة بالعشر الأواخر\n"
-                "تبدأ من اليوم 21 من رمضان\n\n"
-                "*3. دعاء الإفطار:*\n"
-                "يتم إرسال دعاء الإفطار قبل أذان المغرب\n\n"
-                "*التحكم:*\n"
-                "استخدم الأزرار أدناه للتفعيل/التعطيل"
-            )
-        else:
-            settings_text = (
-                "🌙 *إعدادات رمضان*\n\n"
-                "*الأقسام المتاحة:*\n\n"
-                "*1. ليلة القدر:*\n"
-                "أدعية خاصة بليلة القدر المباركة\n"
-                "يتم إرسالها في الليالي الوترية من العشر الأواخر\n\n"
-                "*2. العشر الأواخر من رمضان:*\n"
-                "أذكار وأدعية خاصة بالعشر الأواخر\n"
-                "تبدأ من اليوم 21 من رمضان\n\n"
-                "*3. دعاء الإفطار:*\n"
-                "يتم إرسال دعاء الإفطار قبل أذان المغرب\n\n"
-                "*للتفعيل:*\n"
-                "استخدم `/start` في المجموعة وفعّل الميزات المطلوبة"
-            )
+        settings_text = (
+            "🌙 *إعدادات رمضان*\n\n"
+            "*الأقسام المتاحة:*\n\n"
+            "*1. ليلة القدر:*\n"
+            "أدعية خاصة بليلة القدر المباركة\n"
+            "يتم إرسالها في الليالي الوترية من العشر الأواخر\n\n"
+            "*2. العشر الأواخر من رمضان:*\n"
+            "أذكار وأدعية خاصة بالعشر الأواخر\n"
+            "تبدأ من اليوم 21 من رمضان\n\n"
+            "*3. دعاء الإفطار:*\n"
+            "يتم إرسال دعاء الإفطار قبل أذان المغرب\n\n"
+            "*للتفعيل:*\n"
+            "استخدم `/start` في المجموعة وفعّل الميزات المطلوبة"
+        )
         
         markup = types.InlineKeyboardMarkup(row_width=1)
-        
-        # Add toggle buttons if chat_id is specified
-        if chat_id:
-            ramadan_settings = get_ramadan_settings(chat_id)
-            ramadan_icon = "✅" if ramadan_settings.get('ramadan_enabled', 1) else "❌"
-            laylat_alqadr_icon = "✅" if ramadan_settings.get('laylat_alqadr_enabled', 1) else "❌"
-            last_ten_icon = "✅" if ramadan_settings.get('last_ten_days_enabled', 1) else "❌"
-            iftar_icon = "✅" if ramadan_settings.get('iftar_dua_enabled', 1) else "❌"
-            
-            markup.add(
-                types.InlineKeyboardButton(
-                    f"{ramadan_icon} أدعية رمضان", 
-                    callback_data=f"toggle_ramadan_enabled_{chat_id}"
-                ),
-                types.InlineKeyboardButton(
-                    f"{laylat_alqadr_icon} ليلة القدر", 
-                    callback_data=f"toggle_ramadan_laylat_alqadr_{chat_id}"
-                ),
-                types.InlineKeyboardButton(
-                    f"{last_ten_icon} العشر الأواخر", 
-                    callback_data=f"toggle_ramadan_last_ten_{chat_id}"
-                ),
-                types.InlineKeyboardButton(
-                    f"{iftar_icon} دعاء الإفطار", 
-                    callback_data=f"toggle_ramadan_iftar_{chat_id}"
-                )
-            )
-            # Add back button with chat_id encoded
-            chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
-        else:
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data="open_settings"))
-        
-        # Only add support buttons in main settings (not group-specific)
-        if chat_id is None:
-            add_support_buttons(markup)
+        markup.add(types.InlineKeyboardButton("« العودة", callback_data="open_settings"))
+        add_support_buttons(markup)
         
         bot.edit_message_text(
             settings_text,
@@ -5154,7 +8159,7 @@ def callback_ramadan_settings(call: types.CallbackQuery):
             reply_markup=markup
         )
         
-        logger.info(f"Ramadan settings displayed for user {call.from_user.id}, chat_id={chat_id}")
+        logger.info(f"Ramadan settings displayed for user {call.from_user.id}")
         
     except Exception as e:
         logger.error(f"Error in callback_ramadan_settings: {e}", exc_info=True)
@@ -5285,8 +8290,7 @@ def callback_hajj_eid_settings(call: types.CallbackQuery):
                 )
             )
             # Add back button with chat_id encoded
-            chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
+            markup.add(types.InlineKeyboardButton("« العودة", callback_data=create_back_button_callback(chat_id)))
         else:
             markup.add(types.InlineKeyboardButton("« العودة", callback_data="open_settings"))
         
@@ -5423,8 +8427,7 @@ def callback_fasting_reminders_settings(call: types.CallbackQuery):
             )
             
             # Add back button with chat_id encoded
-            chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-            markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
+            markup.add(types.InlineKeyboardButton("« العودة", callback_data=create_back_button_callback(chat_id)))
         else:
             markup.add(
                 types.InlineKeyboardButton("⏰ أوقات شائعة للتذكير", callback_data="fasting_time_presets"),
@@ -5574,7 +8577,7 @@ def callback_set_diverse_interval(call: types.CallbackQuery):
         
         update_diverse_azkar_setting(chat_id, "interval_minutes", interval_minutes)
         update_diverse_azkar_setting(chat_id, "enabled", 1)  # Auto-enable when selecting interval
-        schedule_chat_jobs(chat_id)
+        reschedule_chat_jobs(chat_id, "diverse")
         
         bot.answer_callback_query(call.id, f"✓ تم تعيين الفاصل الزمني: {interval_minutes} دقيقة")
         
@@ -5601,7 +8604,7 @@ def callback_toggle_diverse_enabled(call: types.CallbackQuery):
         new_value = not diverse_settings["enabled"]
         
         update_diverse_azkar_setting(chat_id, "enabled", new_value)
-        schedule_chat_jobs(chat_id)
+        reschedule_chat_jobs(chat_id, "diverse")
         
         status_text = "تم التفعيل" if new_value else "تم التعطيل"
         bot.answer_callback_query(call.id, f"✓ {status_text}")
@@ -5645,7 +8648,9 @@ def callback_group_ramadan_settings(call: types.CallbackQuery):
         
         for key, label in ramadan_btns:
             status = "✅" if ramadan_settings[key] else "❌"
-            markup.add(types.InlineKeyboardButton(f"{label} {status}", callback_data=f"toggle_ramadan_{key}"))
+            markup.add(types.InlineKeyboardButton(
+                f"{label} {status}",
+                callback_data=encode_callback_data(RAMADAN_TOGGLE_KEYS[key], chat_id)))
         
         bot.edit_message_text(
             settings_text,
@@ -5664,139 +8669,44 @@ def callback_group_ramadan_settings(call: types.CallbackQuery):
         except Exception:
             pass
 
+# Ramadan toggle key (old short form or column name) -> action
+RAMADAN_TOGGLE_KEYS = {
+    "enabled": CallbackAction.TOGGLE_RAMADAN_ENABLED,
+    "laylat_alqadr": CallbackAction.TOGGLE_LAYLAT_ALQADR,
+    "last_ten": CallbackAction.TOGGLE_LAST_TEN_DAYS,
+    "iftar": CallbackAction.TOGGLE_IFTAR_DUA,
+    **{MENU_TOGGLES[action][1]: action for action in (
+        CallbackAction.TOGGLE_RAMADAN_ENABLED, CallbackAction.TOGGLE_LAYLAT_ALQADR,
+        CallbackAction.TOGGLE_LAST_TEN_DAYS, CallbackAction.TOGGLE_IFTAR_DUA)},
+}
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith("toggle_ramadan_"))
 def callback_toggle_ramadan(call: types.CallbackQuery):
     """
     Toggle Ramadan setting for a group.
-    Supports both in-group format (toggle_ramadan_{key}) and private chat format (toggle_ramadan_{key}_{chat_id})
+    Old formats: in-group toggle_ramadan_{key} and private chat
+    toggle_ramadan_{key}_{chat_id} (see toggle_menu_setting).
     """
     try:
         # Parse callback data to extract key and possibly chat_id
         parts = call.data.replace("toggle_ramadan_", "").split("_")
-        
-        # Validate parts is not empty
-        if not parts or not parts[0]:
-            logger.error(f"Invalid callback data format: {call.data}")
-            bot.answer_callback_query(call.id, "❌ خطأ في البيانات")
-            return
-        
-        # Check if chat_id is in the callback data (private chat with group context)
-        chat_id = None
-        setting_key = None
-        
-        if len(parts) >= 2:
-            # Try to parse last part as chat_id
-            try:
-                chat_id = int(parts[-1])
-                # The key is everything except the last part (chat_id)
-                setting_key = "_".join(parts[:-1])
-            except ValueError:
-                # Last part is not a number, so it's part of the key
-                chat_id = call.message.chat.id
-                setting_key = "_".join(parts)
-        else:
-            # Single part - use as key, chat_id from message
+        try:
+            # Private chat with group context: the last part is the chat_id
+            chat_id = int(parts[-1])
+            setting_key = "_".join(parts[:-1])
+        except ValueError:
+            # In-group format: the whole rest is the key
             chat_id = call.message.chat.id
-            setting_key = parts[0]
-        
-        # Map common keys to database column names
-        key_mapping = {
-            "enabled": "ramadan_enabled",
-            "laylat_alqadr": "laylat_alqadr_enabled",
-            "last_ten": "last_ten_days_enabled",
-            "iftar": "iftar_dua_enabled"
-        }
-        db_key = key_mapping.get(setting_key, setting_key)
+            setting_key = "_".join(parts)
         
-        # Verify user is admin
-        if not is_user_admin_of_chat(call.from_user.id, chat_id):
-            bot.answer_callback_query(call.id, "⚠️ لست مشرفًا في هذه المجموعة", show_alert=True)
+        action = RAMADAN_TOGGLE_KEYS.get(setting_key)
+        if action is None:
+            logger.warning(f"Rejected malformed callback data from user {call.from_user.id}: {call.data!r}")
+            bot.answer_callback_query(call.id, "⚠️ إعداد غير معروف", show_alert=True)
             return
         
-        # Get current settings and toggle
-        ramadan_settings = get_ramadan_settings(chat_id)
-        new_value = not ramadan_settings.get(db_key, 1)
-        
-        update_ramadan_setting(chat_id, db_key, new_value)
-        
-        # Prepare updated message with current status
-        ramadan_settings = get_ramadan_settings(chat_id)
-        ramadan_status = "✅ مفعّل" if ramadan_settings.get('ramadan_enabled', 1) else "❌ معطّل"
-        laylat_alqadr_status = "✅ مفعّل" if ramadan_settings.get('laylat_alqadr_enabled', 1) else "❌ معطّل"
-        last_ten_status = "✅ مفعّل" if ramadan_settings.get('last_ten_days_enabled', 1) else "❌ معطّل"
-        iftar_status = "✅ مفعّل" if ramadan_settings.get('iftar_dua_enabled', 1) else "❌ معطّل"
-        
-        settings_text = (
-            "🌙 *إعدادات رمضان*\n\n"
-            f"*الحالة الحالية:*\n"
-            f"• أدعية رمضان: {ramadan_status}\n"
-            f"• ليلة القدر: {laylat_alqadr_status}\n"
-            f"• العشر الأواخر: {last_ten_status}\n"
-            f"• دعاء الإفطار: {iftar_status}\n\n"
-            "*الأقسام المتاحة:*\n\n"
-            "*1. ليلة القدر:*\n"
-            "أدعية خاصة بليلة القدر المباركة\n"
-            "يتم إرسالها في الليالي الوترية من العشر الأواخر\n\n"
-            "*2. العشر الأواخر من رمضان:*\n"
-            "أذكار وأدعية خاصة بالعشر الأواخر\n"
-            "تبدأ من اليوم 21 من رمضان\n\n"
-            "*3. دعاء الإفطار:*\n"
-            "يتم إرسال دعاء الإفطار قبل أذان المغرب\n\n"
-            "*التحكم:*\n"
-            "استخدم الأزرار أدناه للتفعيل/التعطيل"
-        )
-        
-        # Update markup with new status
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        ramadan_icon = "✅" if ramadan_settings.get('ramadan_enabled', 1) else "❌"
-        laylat_alqadr_icon = "✅" if ramadan_settings.get('laylat_alqadr_enabled', 1) else "❌"
-        last_ten_icon = "✅" if ramadan_settings.get('last_ten_days_enabled', 1) else "❌"
-        iftar_icon = "✅" if ramadan_settings.get('iftar_dua_enabled', 1) else "❌"
-        
-        markup.add(
-            types.InlineKeyboardButton(
-                f"{ramadan_icon} أدعية رمضان", 
-                callback_data=f"toggle_ramadan_enabled_{chat_id}"
-            ),
-            types.InlineKeyboardButton(
-                f"{laylat_alqadr_icon} ليلة القدر", 
-                callback_data=f"toggle_ramadan_laylat_alqadr_{chat_id}"
-            ),
-            types.InlineKeyboardButton(
-                f"{last_ten_icon} العشر الأواخر", 
-                callback_data=f"toggle_ramadan_last_ten_{chat_id}"
-            ),
-            types.InlineKeyboardButton(
-                f"{iftar_icon} دعاء الإفطار", 
-                callback_data=f"toggle_ramadan_iftar_{chat_id}"
-            )
-        )
-        
-        # Add back button
-        chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-        markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
-        
-        # Edit message with updated status
-        bot.edit_message_text(
-            settings_text,
-            call.message.chat.id,
-            call.message.message_id,
-            parse_mode="Markdown",
-            reply_markup=markup
-        )
-        
-        # Answer callback with confirmation
-        status_text = "تم التفعيل ✅" if new_value else "تم التعطيل ❌"
-        setting_names = {
-            "enabled": "أدعية رمضان",
-            "laylat_alqadr": "ليلة القدر",
-            "last_ten": "العشر الأواخر",
-            "iftar": "دعاء الإفطار"
-        }
-        setting_name = setting_names.get(setting_key, setting_key)
-        bot.answer_callback_query(call.id, f"{setting_name}: {status_text}")
-        
-        logger.info(f"User {call.from_user.id} toggled {db_key} to {new_value} for chat {chat_id}")
+        if legacy_chat_id_valid(call, chat_id):
+            toggle_menu_setting(call, chat_id, action)
         
     except Exception as e:
         logger.error(f"Error in callback_toggle_ramadan: {e}", exc_info=True)
@@ -5980,8 +8890,7 @@ def callback_toggle_hajj_eid(call: types.CallbackQuery):
         )
         
         # Add back button
-        chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-        markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
+        markup.add(types.InlineKeyboardButton("« العودة", callback_data=create_back_button_callback(chat_id)))
         
         # Edit message with updated status
         bot.edit_message_text(
@@ -6115,7 +9024,7 @@ def callback_toggle_fasting(call: types.CallbackQuery):
         new_value = not fasting_settings.get(db_key, 1)
         
         update_fasting_reminder_setting(chat_id, db_key, new_value)
-        schedule_chat_jobs(chat_id)
+        reschedule_chat_jobs(chat_id, "fasting")
         
         # Prepare updated message with current status
         fasting_settings = get_fasting_reminders_settings(chat_id)
@@ -6168,8 +9077,7 @@ def callback_toggle_fasting(call: types.CallbackQuery):
         )
         
         # Add back button
-        chat_id_encoded = base64.b64encode(str(chat_id).encode()).decode()
-        markup.add(types.InlineKeyboardButton("« العودة", callback_data=f"select_group_{chat_id_encoded}"))
+        markup.add(types.InlineKeyboardButton("« العودة", callback_data=create_back_button_callback(chat_id)))
         
         # Edit message with updated status
         bot.edit_message_text(
@@ -6194,6 +9102,8 @@ def callback_toggle_fasting(call: types.CallbackQuery):
         except Exception:
             pass
 
+STATUS_DELIVERY_DAYS = 7  # Days of delivery_daily summarized by /status
+
 @bot.message_handler(commands=["status"])
 def cmd_status(message: types.Message):
     if message.chat.type == "private":
@@ -6204,11 +9114,30 @@ def cmd_status(message: types.Message):
         bot.send_message(message.chat.id, "هذا الأمر متاح للمشرفين فقط")
         return
 
-    settings = get_chat_settings(message.chat.id)
+    chat_id = message.chat.id
+    settings = get_chat_settings(chat_id)
+
+    circuit_state, retry_in = chat_breakers.status(chat_id)
+    if circuit_state == CIRCUIT_OPEN:
+        delivery_line = f"الإرسال: 🟠 متوقف مؤقتاً بسبب أخطاء متكررة (إعادة المحاولة بعد {max(1, retry_in // 60)} دقيقة)\n"
+    elif circuit_state == CIRCUIT_HALF_OPEN:
+        delivery_line = "الإرسال: 🟡 قيد التجربة بعد أخطاء متكررة\n"
+    else:
+        delivery_line = ""
+
+    delivery = get_chat_delivery_stats(chat_id, days=STATUS_DELIVERY_DAYS).values()
+    sent = sum(stats["sent"] for stats in delivery)
+    failed = sum(stats["failed"] for stats in delivery)
+    skipped = sum(stats["circuit_open"] + stats["expired"] for stats in delivery)
 
     text = (
         "📊 *حالة البوت*\n\n"
-        f"البوت: {'🟢 مفعّل' if settings['is_enabled'] else '🔴 معطّل'}\n\n"
+        f"البوت: {'🟢 مفعّل' if settings['is_enabled'] else '🔴 معطّل'}\n"
+        f"{delivery_line}\n"
+        f"*الإرسال خلال آخر {STATUS_DELIVERY_DAYS} أيام:*\n"
+        f"✅ تم الإرسال: {sent}\n"
+        f"❌ فشل: {failed}\n"
+        f"⏭️ لم يُرسل: {skipped}\n\n"
         "*الميزات المفعلة:*\n"
         f"🌅 أذكار الصباح: {'✅' if settings['morning_azkar'] else '❌'}\n"
         f"🌙 أذكار المساء: {'✅' if settings['evening_azkar'] else '❌'}\n"
@@ -6216,12 +9145,12 @@ def cmd_status(message: types.Message):
         f"🕌 أدعية الجمعة: {'✅' if settings['friday_dua'] else '❌'}\n"
         f"😴 رسالة النوم: {'✅' if settings['sleep_message'] else '❌'}\n"
         f"🗑️ حذف رسائل الخدمة: {'✅' if settings['delete_service_messages'] else '❌'}\n\n"
-        "*الأوقات:*\n"
-        f"🌅 الصباح: {settings['morning_time']}\n"
-        f"🌙 المساء: {settings['evening_time']}\n"
-        f"😴 النوم: {settings['sleep_time']}\n"
-        f"📿 سورة الكهف: الجمعة 09:00\n"
-        f"🕌 دعاء الجمعة: الجمعة 10:00"
+        "*الأوقات (وقت الإرسال الفعلي):*\n"
+        f"🌅 الصباح: {settings['morning_time']} ({effective_send_time(chat_id, settings['morning_time'])})\n"
+        f"🌙 المساء: {settings['evening_time']} ({effective_send_time(chat_id, settings['evening_time'])})\n"
+        f"😴 النوم: {settings['sleep_time']} ({effective_send_time(chat_id, settings['sleep_time'])})\n"
+        f"📿 سورة الكهف: الجمعة 09:00 ({effective_send_time(chat_id, '09:00')})\n"
+        f"🕌 دعاء الجمعة: الجمعة 10:00 ({effective_send_time(chat_id, '10:00')})"
     )
 
     bot.send_message(message.chat.id, text, parse_mode="Markdown")
@@ -6251,9 +9180,7 @@ def cmd_disable(message: types.Message):
         return
 
     update_chat_setting(message.chat.id, "is_enabled", 0)
-    for job in scheduler.get_jobs():
-        if str(message.chat.id) in job.id:
-            job.remove()
+    remove_chat_jobs(message.chat.id)
     bot.send_message(message.chat.id, "✅ تم تعطيل البوت")
     logger.info(f"Bot disabled in {message.chat.id}")
 
@@ -6326,7 +9253,7 @@ def cmd_settime(message: types.Message):
         # Update setting
         setting_key = valid_types[azkar_type]
         update_chat_setting(message.chat.id, setting_key, time_str)
-        schedule_chat_jobs(message.chat.id)
+        reschedule_chat_jobs(message.chat.id, "chat")
 
         type_names = {
             "morning": "أذكار الصباح",
@@ -6394,7 +9321,7 @@ def cmd_setfastingtime(message: types.Message):
 
         # Update setting
         update_fasting_reminder_setting(message.chat.id, "reminder_time", time_str)
-        schedule_chat_jobs(message.chat.id)
+        reschedule_chat_jobs(message.chat.id, "fasting")
 
         bot.send_message(
             message.chat.id,
@@ -6505,6 +9432,14 @@ def health():
             "port": PORT
         }, 500
 
+@app.route("/metrics")
+def metrics():
+    """
+    Prometheus scrape endpoint.
+    Served from in-process counters only; never calls the Telegram API.
+    """
+    return render_metrics(), 200, {"Content-Type": METRICS_CONTENT_TYPE}
+
 @app.route(WEBHOOK_PATH, methods=["POST"])
 def telegram_webhook():
     """
@@ -6521,6 +9456,8 @@ def telegram_webhook():
             logger.info(f"Received JSON: {json_string[:200]}...")
             
             update = types.Update.de_json(json_string)
+            if update:
+                WEBHOOK_UPDATES.inc(update_type_of(update))
             
             if update and update.message:
                 msg_text = getattr(update.message, 'text', None)
@@ -6531,7 +9468,7 @@ def telegram_webhook():
             elif update:
                 logger.info(f"Processing update type: {update.update_id}")
             
-            bot.process_new_updates([update])
+            process_update_timed(update)
             logger.info("Update processed successfully")
             return '', 200
             
@@ -6772,6 +9709,9 @@ try:
     # Log startup configuration
     log_startup_summary()
     
+    # All handlers are registered by now; record their latency for /metrics
+    instrument_bot_handlers()
+    
     # Setup webhook with retry logic
     webhook_setup_success = setup_webhook()
     
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the vectorized due-chat computation.
+Compares ScheduleColumns with planning chats one by one through
+schedule_chat_jobs, at 10k, 100k and 1M synthetic chats.
+
+Needs NumPy, which the bot itself does not require:
+    pip install numpy
+
+Usage:
+    BOT_TOKEN=123456:TEST python benchmark_due_chats.py [sizes...]
+"""
+
+import os
+import random
+import sys
+import time
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+from schedule_columns import NUMPY_AVAILABLE, ScheduleColumns
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+PER_CHAT_SAMPLE = 2_000  # schedule_chat_jobs is timed on a sample and extrapolated
+BENCH_DAY = date(2099, 1, 2)  # A Friday, so every category is planned
+
+
+def synthetic_schedules(count, seed=42):
+    """Yield (chat_id, settings, fasting_settings) for synthetic chats"""
+    rng = random.Random(seed)
+    for i in range(count):
+        chat_id = -1_000_000_000_000 - i
+        settings = {
+            "is_enabled": True,
+            "morning_azkar": rng.random() < 0.9,
+            "evening_azkar": rng.random() < 0.9,
+            "sleep_message": rng.random() < 0.6,
+            "friday_sura": rng.random() < 0.8,
+            "friday_dua": rng.random() < 0.8,
+            "morning_time": "%02d:%02d" % (rng.randint(4, 7), rng.choice((0, 15, 30, 45))),
+            "evening_time": "%02d:%02d" % (rng.randint(16, 19), rng.choice((0, 15, 30, 45))),
+            "sleep_time": "%02d:%02d" % (rng.randint(21, 23), rng.choice((0, 30))),
+        }
+        fasting_settings = {"monday_thursday_enabled": rng.random() < 0.5, "reminder_time": "21:00"}
+        yield chat_id, settings, fasting_settings
+
+
+def bench_columns(count):
+    """Return (build seconds, seconds per due_chats call, due entries over the day)"""
+    start = time.perf_counter()
+    columns = ScheduleColumns.from_schedules(synthetic_schedules(count))
+    built = time.perf_counter() - start
+
+    start = time.perf_counter()
+    total = 0
+    for minute in range(24 * 60):
+        total += sum(ids.size for ids in columns.due_chats(minute, BENCH_DAY.weekday()).values())
+    per_call = (time.perf_counter() - start) / (24 * 60)
+    return built, per_call, total
+
+
+def bench_per_chat(count):
+    """Return the extrapolated seconds for schedule_chat_jobs over `count` chats"""
+    sample = list(synthetic_schedules(min(count, PER_CHAT_SAMPLE)))
+    by_id = {chat_id: (settings, fasting) for chat_id, settings, fasting in sample}
+    with patch.object(App, "delivery_plan", App.DeliveryPlan(BENCH_DAY)), \
+         patch.object(App, "get_chat_settings", side_effect=lambda chat_id: by_id[chat_id][0]), \
+         patch.object(App, "get_fasting_reminders_settings", side_effect=lambda chat_id: by_id[chat_id][1]), \
+         patch.object(App, "get_diverse_azkar_settings",
+                      return_value={"enabled": False, "interval_minutes": 60}), \
+         patch.object(App, "schedule_diverse_azkar"):
+        start = time.perf_counter()
+        for chat_id, _, _ in sample:
+            App.schedule_chat_jobs(chat_id)
+        elapsed = time.perf_counter() - start
+    return elapsed * count / len(sample)
+
+
+def main():
+    if not NUMPY_AVAILABLE:
+        print("NumPy is not installed; install it to run this benchmark")
+        return 1
+    App.logger.setLevel("WARNING")
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+
+    print(f"{'chats':>10} {'columns build':>14} {'due_chats/min':>14} {'schedule_chat_jobs':>19}")
+    for count in sizes:
+        built, per_call, _ = bench_columns(count)
+        per_chat = bench_per_chat(count)
+        print(f"{count:>10,} {built:>13.2f}s {per_call * 1000:>12.3f}ms {per_chat:>18.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the prepared query layer.
+Compares the per-call latency of the hot settings and admin lookups run
+the previous way (open a connection, format the SQL, execute, close)
+with the same lookups through PreparedQuery. Runs on a temporary SQLite
+database, and on PostgreSQL as well when DATABASE_URL is set.
+
+Usage:
+    BOT_TOKEN=123456:TEST python benchmark_query_layer.py [calls]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+CHATS = 5_000
+DEFAULT_CALLS = 20_000
+
+
+def per_call_lookup(table, columns, chat_id):
+    """The previous getter body: a fresh connection and formatted SQL per call"""
+    conn, c, is_postgres = App.get_db_connection()
+    try:
+        placeholder = "%s" if is_postgres else "?"
+        c.execute(f"SELECT {columns} FROM {table} WHERE chat_id = {placeholder}", (chat_id,))
+        return c.fetchone()
+    finally:
+        conn.close()
+
+
+def per_call_admin(user_id, chat_id):
+    conn, c, is_postgres = App.get_db_connection()
+    try:
+        placeholder = "%s" if is_postgres else "?"
+        c.execute(f'''
+            SELECT user_id, chat_id, username, first_name, last_name, is_primary_admin, added_at
+            FROM admins
+            WHERE user_id = {placeholder} AND chat_id = {placeholder}
+        ''', (user_id, chat_id))
+        return c.fetchone()
+    finally:
+        conn.close()
+
+
+def timed(calls, fn, chat_ids):
+    """Return mean microseconds per call of fn(chat_id)"""
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(chat_ids[i % len(chat_ids)])
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def bench(calls, chat_ids):
+    columns = ", ".join(App.ChatSettings.__slots__)
+    cases = (
+        ("chat settings",
+         lambda chat_id: per_call_lookup("chat_settings", columns, chat_id),
+         lambda chat_id: App.CHAT_SETTINGS_ROW.get(chat_id)),
+        ("fasting settings",
+         lambda chat_id: per_call_lookup("fasting_reminders", "*", chat_id),
+         lambda chat_id: App.FASTING_REMINDERS_ROW.get(chat_id)),
+        ("admin info",
+         lambda chat_id: per_call_admin(-chat_id % 100, chat_id),
+         lambda chat_id: App.ADMIN_INFO_QUERY.one(-chat_id % 100, chat_id)),
+    )
+    for name, before, after in cases:
+        App.close_query_connection()
+        after(chat_ids[0])  # Open the connection and prepare outside the timing
+        old, new = timed(calls, before, chat_ids), timed(calls, after, chat_ids)
+        print(f"{name:>18} {old:>10.1f}us {new:>10.1f}us {old / new:>8.1f}x")
+
+
+def seed(c, placeholder):
+    chat_ids = [-1_000_000_000_000 - i for i in range(CHATS)]
+    rows = [(chat_id,) for chat_id in chat_ids]
+    for table in ("chat_settings", "fasting_reminders"):
+        c.executemany(f"INSERT INTO {table} (chat_id) VALUES ({placeholder}) ON CONFLICT (chat_id) DO NOTHING", rows)
+    c.executemany(f"INSERT INTO admins (user_id, chat_id) VALUES ({placeholder}, {placeholder}) "
+                  f"ON CONFLICT (user_id, chat_id) DO NOTHING", [(-chat_id % 100, chat_id) for chat_id in chat_ids])
+    return chat_ids
+
+
+def main():
+    App.logger.setLevel("WARNING")
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CALLS
+    print(f"{calls:,} calls over {CHATS:,} chats")
+    print(f"{'query':>18} {'per call':>12} {'prepared':>12} {'speedup':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp, \
+         patch.object(App, "DB_FILE", os.path.join(tmp, "bench.db")), \
+         patch.object(App, "DATABASE_URL", None):
+        App.migrate_sqlite_schema()
+        conn = sqlite3.connect(App.DB_FILE)
+        chat_ids = seed(conn.cursor(), "?")
+        conn.commit()
+        conn.close()
+        random.Random(7).shuffle(chat_ids)
+        print("SQLite")
+        bench(calls, chat_ids)
+        App.close_query_connection()
+
+    if App.DATABASE_URL and App.POSTGRES_AVAILABLE:
+        conn, c, is_postgres = App.get_db_connection()
+        if is_postgres:
+            chat_ids = seed(c, "%s")
+            conn.commit()
+            conn.close()
+            print("PostgreSQL")
+            bench(calls // 10, chat_ids)
+            App.close_query_connection()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
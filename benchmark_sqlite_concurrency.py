@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark for concurrent SQLite reads and writes.
+Compares the old connection setup (rollback journal, a commit per write
+from every thread) with connect_sqlite under WAL and the batching
+SQLiteWriter, with reader and writer threads running side by side.
+
+Usage:
+    BOT_TOKEN=123456:TEST python benchmark_sqlite_concurrency.py [seconds]
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+CHATS = 10_000
+READERS = 8
+WRITERS = 8
+DEFAULT_SECONDS = 5.0
+TOGGLE_SQL = "UPDATE chat_settings SET flags = (flags | 2) - (flags & 2) WHERE chat_id = ?"
+
+
+def prepare(db_file, wal):
+    """Create a migrated database with CHATS rows in the requested journal mode"""
+    with patch.object(App, "DB_FILE", db_file):
+        App.migrate_sqlite_schema()
+    conn = sqlite3.connect(db_file)
+    if not wal:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    conn.executemany("INSERT INTO chat_settings (chat_id) VALUES (?)", [(-i,) for i in range(1, CHATS + 1)])
+    conn.commit()
+    conn.close()
+
+
+def run(connect, write, seconds, readers):
+    """Run reader and writer threads for `seconds`; return (reads, writes, errors)"""
+    stop = threading.Event()
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def reader(seed):
+        rng = random.Random(seed)
+        conn = connect()
+        done = errors = 0
+        while not stop.is_set():
+            try:
+                conn.execute("SELECT flags, morning_time FROM chat_settings WHERE chat_id = ?",
+                             (-rng.randint(1, CHATS),)).fetchone()
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        conn.close()
+        with lock:
+            counts["reads"] += done
+            counts["errors"] += errors
+
+    def writer(seed):
+        rng = random.Random(seed)
+        done = errors = 0
+        while not stop.is_set():
+            try:
+                write(rng.randint(1, CHATS))
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        with lock:
+            counts["writes"] += done
+            counts["errors"] += errors
+
+    threads = ([threading.Thread(target=reader, args=(i,)) for i in range(readers)] +
+               [threading.Thread(target=writer, args=(100 + i,)) for i in range(WRITERS)])
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return counts["reads"], counts["writes"], counts["errors"]
+
+
+def bench_baseline(tmp, seconds, readers):
+    """The previous setup: default connections, each writer commits its own transaction"""
+    db_file = os.path.join(tmp, f"baseline-{readers}.db")
+    prepare(db_file, wal=False)
+    local = threading.local()
+
+    def connect():
+        return sqlite3.connect(db_file)
+
+    def write(chat_id):
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = connect()
+        conn.execute(TOGGLE_SQL, (-chat_id,))
+        conn.commit()
+
+    return run(connect, write, seconds, readers)
+
+
+def bench_tuned(tmp, seconds, readers):
+    """WAL, synchronous=NORMAL and busy timeout, with writes funnelled through SQLiteWriter"""
+    db_file = os.path.join(tmp, f"tuned-{readers}.db")
+    prepare(db_file, wal=True)
+    with patch.object(App, "DB_FILE", db_file):
+        writer = App.SQLiteWriter()
+        try:
+            return run(App.connect_sqlite,
+                       lambda chat_id: writer.execute([(TOGGLE_SQL, (-chat_id,))]), seconds, readers)
+        finally:
+            writer.close()
+
+
+def main():
+    App.logger.setLevel("WARNING")
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SECONDS
+
+    print(f"{WRITERS} writers, {CHATS:,} chats, {seconds:g}s per run")
+    print(f"{'setup':>10} {'readers':>8} {'reads/s':>12} {'writes/s':>10} {'lock errors':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for readers in (READERS, 0):
+            for name, bench in (("baseline", bench_baseline), ("tuned", bench_tuned)):
+                reads, writes, errors = bench(tmp, seconds, readers)
+                print(f"{name:>10} {readers:>8} {reads / seconds:>12,.0f} {writes / seconds:>10,.0f} {errors:>12,}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Bulk migration, reconciliation and backup of the bot's settings between
+SQLite (bot_settings.db) and PostgreSQL (DATABASE_URL).
+
+The bot falls back to SQLite whenever a PostgreSQL connect fails, so an
+outage leaves part of the state in each store. This tool streams the
+settings tables between the two in fixed-size chunks, so memory stays
+bounded however many chats there are:
+
+    migrate     copy every row of one store into the other; the source wins
+    reconcile   merge both stores: a row missing on one side is copied to it,
+                and a row that differs keeps the copy with the later
+                updated_at (schema version 4), or the --prefer side's copy
+                when the stamps tie
+    backup      write a consistent SQLite snapshot of either store
+
+Rows deleted from one store while the stores were split come back on
+reconcile; without tombstones a deletion cannot be told from an insert.
+
+App is not imported: importing it re-registers the webhook and starts the
+scheduler. Both stores must already carry the bot's schema, which the bot
+applies at startup.
+
+Usage:
+    python db_sync.py migrate --from sqlite [--dry-run]
+    python db_sync.py reconcile [--prefer postgres] [--dry-run]
+    python db_sync.py backup snapshot.db [--from postgres]
+"""
+
+import argparse
+import io
+import os
+import sqlite3
+import sys
+from collections import namedtuple
+
+try:
+    import psycopg2
+    POSTGRES_AVAILABLE = True
+except ImportError:
+    POSTGRES_AVAILABLE = False
+
+DEFAULT_SQLITE_FILE = "bot_settings.db"
+DEFAULT_CHUNK_SIZE = 1000
+SQLITE_BUSY_TIMEOUT = 30  # seconds to wait for the bot's writer thread
+
+# Parents before children, so chat_settings rows exist before the rows
+# referencing them are copied into PostgreSQL.
+SyncTable = namedtuple("SyncTable", ["name", "key", "references_chat"])
+
+SYNC_TABLES = (
+    SyncTable("chat_settings", ("chat_id",), False),
+    SyncTable("diverse_azkar_settings", ("chat_id",), True),
+    SyncTable("ramadan_settings", ("chat_id",), True),
+    SyncTable("hajj_eid_settings", ("chat_id",), True),
+    SyncTable("fasting_reminders", ("chat_id",), True),
+    SyncTable("admins", ("user_id", "chat_id"), False),
+)
+
+SKIPPED_COLUMNS = {"id"}  # admins.id is numbered independently by each backend
+STAMP_COLUMN = "updated_at"
+
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+class SyncError(Exception):
+    """A store cannot take part in a sync; the message says why"""
+
+
+def normalize_database_url(url):
+    """Apply the same postgres:// and psql:// corrections as App"""
+    if url and url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    if url and url.startswith("psql://"):
+        return url.replace("psql://", "postgresql://", 1)
+    return url
+
+
+def upsert_sql(table, columns, placeholder):
+    """INSERT of `columns` that overwrites the existing row with the same key"""
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns if column not in table.key)
+    return (f"INSERT INTO {table.name} ({', '.join(columns)}) {placeholder} "
+            f"ON CONFLICT ({', '.join(table.key)}) DO UPDATE SET {updates}")
+
+
+def copy_text(rows):
+    """Encode rows in COPY's text format"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value).translate(COPY_ESCAPES) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+class SQLiteStore:
+    """A SQLite file, read through one snapshot and written through a second connection"""
+
+    def __init__(self, path, name="sqlite"):
+        if not os.path.exists(path):
+            raise SyncError(f"SQLite database {path} does not exist")
+        self.name = name
+        self.path = path
+        self.writer = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT)
+        # WAL lets the snapshot stay open while this tool and the bot write
+        self.writer.execute("PRAGMA journal_mode=WAL")
+        self.reader = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+        self.reader.execute("BEGIN")  # Every table is read from the same snapshot
+
+    def columns(self, table):
+        return [row[1] for row in self.writer.execute(f"PRAGMA table_info({table.name})")]
+
+    def rows(self, table, columns, chunk_size):
+        """Yield the table's rows in key order, fetching chunk_size at a time"""
+        cursor = self.reader.execute(
+            f"SELECT {', '.join(columns)} FROM {table.name} ORDER BY {', '.join(table.key)}")
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                return
+            yield from chunk
+
+    def upsert(self, table, columns, rows):
+        """Write one chunk in its own transaction; returns the number of rows written"""
+        placeholders = ", ".join("?" for _ in columns)
+        with self.writer:
+            self.writer.executemany(upsert_sql(table, columns, f"VALUES ({placeholders})"), rows)
+        return len(rows)
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+
+class PostgresStore:
+    """A PostgreSQL database, read through a server-side cursor and written with COPY"""
+
+    def __init__(self, url, name="postgres"):
+        if not url:
+            raise SyncError("DATABASE_URL is not set")
+        if not POSTGRES_AVAILABLE:
+            raise SyncError("psycopg2 is not installed")
+        self.name = name
+        try:
+            self.reader = psycopg2.connect(url)
+            self.writer = psycopg2.connect(url)
+        except psycopg2.Error as e:
+            raise SyncError(f"Cannot connect to PostgreSQL: {e}") from e
+        # Every table is read from the same snapshot
+        self.reader.set_session(isolation_level="REPEATABLE READ", readonly=True)
+
+    def columns(self, table):
+        with self.writer.cursor() as c:
+            c.execute('''
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = %s
+                ORDER BY ordinal_position
+            ''', (table.name,))
+            columns = [row[0] for row in c.fetchall()]
+        self.writer.rollback()
+        return columns
+
+    def rows(self, table, columns, chunk_size):
+        """Yield the table's rows in key order through a named cursor fetching chunk_size at a time"""
+        with self.reader.cursor(name=f"db_sync_{table.name}") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table.name} ORDER BY {', '.join(table.key)}")
+            yield from cursor
+
+    def upsert(self, table, columns, rows):
+        """
+        COPY one chunk into a session-local staging table and merge it in one
+        INSERT ... SELECT. Rows whose chat has no chat_settings row would
+        violate the foreign key and are left out.
+
+        Returns:
+            int: Number of rows written
+        """
+        stage = f"db_sync_{table.name}"
+        column_list = ", ".join(columns)
+        where = " WHERE chat_id IN (SELECT chat_id FROM chat_settings)" if table.references_chat else ""
+        with self.writer.cursor() as c:
+            c.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} AS SELECT {column_list} FROM {table.name} WITH NO DATA")
+            c.execute(f"TRUNCATE {stage}")
+            c.copy_expert(f"COPY {stage} ({column_list}) FROM STDIN", copy_text(rows))
+            c.execute(upsert_sql(table, columns, f"SELECT {column_list} FROM {stage}{where}"))
+            written = c.rowcount
+        self.writer.commit()
+        return written
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+
+def sync_columns(left, right, table):
+    """Key columns followed by the other columns both stores have"""
+    left_columns, right_columns = left.columns(table), right.columns(table)
+    for store, columns in ((left, left_columns), (right, right_columns)):
+        if not columns:
+            raise SyncError(f"{table.name} does not exist in {store.name}; "
+                            f"start the bot against it once to create the schema")
+    return list(table.key) + [column for column in left_columns
+                              if column in right_columns and column not in table.key
+                              and column not in SKIPPED_COLUMNS]
+
+
+def paired_rows(left, right, key_length):
+    """
+    Walk two key-ordered row streams together, yielding (left_row, right_row)
+    pairs with None for the side a key is missing from.
+    """
+    left, right = iter(left), iter(right)
+    left_row, right_row = next(left, None), next(right, None)
+    while left_row is not None or right_row is not None:
+        if right_row is None or (left_row is not None and left_row[:key_length] < right_row[:key_length]):
+            yield left_row, None
+            left_row = next(left, None)
+        elif left_row is None or right_row[:key_length] < left_row[:key_length]:
+            yield None, right_row
+            right_row = next(right, None)
+        else:
+            yield left_row, right_row
+            left_row, right_row = next(left, None), next(right, None)
+
+
+def sync_table(source, target, table, two_way=False, prefer=None,
+               chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """
+    Copy the rows of one table that differ between two stores.
+
+    One-way (migrate), every source row missing from or different in the
+    target overwrites it, and rows only in the target are kept. Two-way
+    (reconcile), rows are also copied from target to source, and a row
+    present in both keeps the copy with the later updated_at; ties, and
+    stores without the column, keep the `prefer` store's copy.
+
+    Args:
+        source, target: SQLiteStore or PostgresStore
+        table (SyncTable): Table to sync
+        two_way (bool): Reconcile instead of overwriting the target
+        prefer: Store whose copy wins a tie; defaults to source
+        chunk_size (int): Rows per read and per write
+        dry_run (bool): Count what would be copied without writing
+
+    Returns:
+        dict: Rows left unchanged ("identical"), copied into each store
+            (by store name) and dropped for lack of a chat_settings row
+            ("orphaned")
+    """
+    prefer = prefer or source
+    columns = sync_columns(source, target, table)
+    stamp = columns.index(STAMP_COLUMN) if STAMP_COLUMN in columns else None
+    report = {"identical": 0, source.name: 0, target.name: 0, "orphaned": 0}
+    pending = {source.name: [], target.name: []}
+
+    def flush(store):
+        rows = pending[store.name]
+        if rows and not dry_run:
+            report["orphaned"] += len(rows) - store.upsert(table, columns, rows)
+        pending[store.name] = []
+
+    def data(row):
+        return row if stamp is None else row[:stamp] + row[stamp + 1:]
+
+    pairs = paired_rows(source.rows(table, columns, chunk_size),
+                        target.rows(table, columns, chunk_size), len(table.key))
+    for source_row, target_row in pairs:
+        if target_row is None:
+            store, row = target, source_row
+        elif source_row is None:
+            if not two_way:
+                continue
+            store, row = source, target_row
+        elif data(source_row) == data(target_row):
+            report["identical"] += 1
+            continue
+        elif not two_way:
+            store, row = target, source_row
+        else:
+            source_wins = (source_row[stamp] > target_row[stamp] if stamp is not None
+                           and source_row[stamp] != target_row[stamp] else prefer is source)
+            store, row = (target, source_row) if source_wins else (source, target_row)
+        report[store.name] += 1
+        pending[store.name].append(row)
+        if len(pending[store.name]) >= chunk_size:
+            flush(store)
+    flush(source)
+    flush(target)
+    return report
+
+
+def sync_stores(source, target, two_way=False, prefer=None, chunk_size=DEFAULT_CHUNK_SIZE, dry_run=False):
+    """Run sync_table over every synced table; returns {table name: report}"""
+    return {table.name: sync_table(source, target, table, two_way, prefer, chunk_size, dry_run)
+            for table in SYNC_TABLES}
+
+
+def clone_sqlite_schema(template_path, dest_path):
+    """
+    Create dest_path with the tables, indexes, triggers and schema_version
+    rows of the SQLite database at template_path, so the bot sees it as
+    fully migrated.
+    """
+    if not os.path.exists(template_path):
+        raise SyncError(f"{template_path} is needed as the schema template and does not exist")
+    template = sqlite3.connect(template_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        statements = template.execute('''
+            SELECT sql FROM sqlite_master
+            WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+            ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END
+        ''').fetchall()
+        versions = template.execute("SELECT version, description, applied_at FROM schema_version").fetchall()
+        with dest:
+            for (sql,) in statements:
+                dest.execute(sql)
+            dest.executemany("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                             versions)
+    finally:
+        template.close()
+        dest.close()
+
+
+def backup(dest_path, source_name, sqlite_path, database_url, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write a consistent SQLite snapshot of one store to dest_path. A SQLite
+    source is copied whole with the online backup API; a PostgreSQL source
+    has its settings tables streamed into a copy of the local SQLite schema.
+    """
+    if os.path.exists(dest_path):
+        raise SyncError(f"{dest_path} already exists")
+    if source_name == "sqlite":
+        if not os.path.exists(sqlite_path):
+            raise SyncError(f"SQLite database {sqlite_path} does not exist")
+        source = sqlite3.connect(sqlite_path)
+        dest = sqlite3.connect(dest_path)
+        try:
+            source.backup(dest)
+        finally:
+            source.close()
+            dest.close()
+        return None
+
+    source = PostgresStore(database_url)
+    try:
+        clone_sqlite_schema(sqlite_path, dest_path)
+        dest = SQLiteStore(dest_path, name="backup")
+        try:
+            return sync_stores(source, dest, chunk_size=chunk_size)
+        finally:
+            dest.close()
+    finally:
+        source.close()
+
+
+def print_report(reports, names):
+    print(f"{'table':>24} {'identical':>10} " + " ".join(f"{'-> ' + name:>12}" for name in names)
+          + f" {'orphaned':>9}")
+    for table, report in reports.items():
+        print(f"{table:>24} {report['identical']:>10,} " + " ".join(f"{report[name]:>12,}" for name in names)
+              + f" {report['orphaned']:>9,}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Copy, reconcile and back up the bot's settings "
+                                                 "between SQLite and PostgreSQL.")
+    parser.add_argument("--sqlite", default=DEFAULT_SQLITE_FILE, help="SQLite database file")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"),
+                        help="PostgreSQL URL (default: $DATABASE_URL)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per read and write")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser("migrate", help="overwrite one store with the other")
+    migrate.add_argument("--from", dest="source", choices=("sqlite", "postgres"), required=True)
+    migrate.add_argument("--dry-run", action="store_true", help="report without writing")
+
+    reconcile = commands.add_parser("reconcile", help="merge both stores, newest row wins")
+    reconcile.add_argument("--prefer", choices=("sqlite", "postgres"), default="postgres",
+                           help="store whose copy wins when the updated_at stamps tie")
+    reconcile.add_argument("--dry-run", action="store_true", help="report without writing")
+
+    snapshot = commands.add_parser("backup", help="write a SQLite snapshot of one store")
+    snapshot.add_argument("dest", help="new SQLite file to write")
+    snapshot.add_argument("--from", dest="source", choices=("sqlite", "postgres"), default="postgres")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    database_url = normalize_database_url(args.database_url)
+    stores = []
+    try:
+        if args.command == "backup":
+            reports = backup(args.dest, args.source, args.sqlite, database_url, args.chunk_size)
+            if reports:
+                print_report(reports, ("postgres", "backup"))
+            print(f"Wrote {args.dest}")
+            return 0
+
+        stores.append(SQLiteStore(args.sqlite))
+        stores.append(PostgresStore(database_url))
+        sqlite_store, postgres_store = stores
+        if args.command == "migrate":
+            source, target = stores if args.source == "sqlite" else stores[::-1]
+            reports = sync_stores(source, target, chunk_size=args.chunk_size, dry_run=args.dry_run)
+        else:
+            source, target = sqlite_store, postgres_store
+            prefer = sqlite_store if args.prefer == "sqlite" else postgres_store
+            reports = sync_stores(source, target, two_way=True, prefer=prefer,
+                                  chunk_size=args.chunk_size, dry_run=args.dry_run)
+        print_report(reports, (source.name, target.name))
+        if args.dry_run:
+            print("Dry run: nothing was written")
+        return 0
+    except SyncError as e:
+        print(f"db_sync: {e}", file=sys.stderr)
+        return 1
+    finally:
+        for store in stores:
+            store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Vectorized schedule columns: a columnar view of every enabled chat's
+schedule for answering "who is due at this minute" with one vectorized
+comparison per category instead of a Python loop or a query per chat.
+
+The bot does not use this module. dispatch_delivery_plan walks the sorted
+DeliveryPlan, which keeps each chat's send second and is patched in place
+on settings changes, while these columns hold whole minutes and are rebuilt
+from the database. They back benchmark_due_chats.py and need NumPy, which
+is not a requirement of the bot:
+    pip install numpy
+"""
+
+from array import array
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+import App
+from App import PLAN_CATEGORIES, PLAN_CODES, chat_send_seconds, plan_category_applies, timed_db_query
+
+
+class ScheduleColumns:
+    """
+    Chat schedules as NumPy columns: chat_ids (int64), one minute-of-day
+    column (uint16) per plan category holding the chat's effective send
+    minute, and flags (uint8) with bit (code - 1) set for each enabled
+    category.
+    """
+
+    def __init__(self, chat_ids, minutes: dict, flags):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("NumPy is required for ScheduleColumns")
+        self.chat_ids = chat_ids
+        self.minutes = minutes
+        self.flags = flags
+
+    def __len__(self):
+        return len(self.chat_ids)
+
+    @classmethod
+    def from_schedules(cls, schedules) -> "ScheduleColumns":
+        """
+        Build the columns from (chat_id, settings, fasting_settings) tuples,
+        as yielded by App.iter_enabled_chat_schedules.
+        """
+        chat_ids = array("q")
+        minutes = {category: array("H") for category in PLAN_CATEGORIES}
+        flags = array("B")
+        for chat_id, settings, fasting_settings in schedules:
+            seconds = chat_send_seconds(chat_id, settings, fasting_settings)
+            mask = 0
+            for category in PLAN_CATEGORIES:
+                second = seconds.get(category)
+                if second is None:
+                    minutes[category].append(0)
+                else:
+                    minutes[category].append(second // 60)
+                    mask |= 1 << (PLAN_CODES[category] - 1)
+            chat_ids.append(chat_id)
+            flags.append(mask)
+        return cls(
+            np.frombuffer(chat_ids, dtype=np.int64),
+            {category: np.frombuffer(column, dtype=np.uint16) for category, column in minutes.items()},
+            np.frombuffer(flags, dtype=np.uint8),
+        )
+
+    def due_chats(self, minute_of_day: int, weekday: int) -> dict:
+        """
+        Find the chats due at a minute of the day.
+
+        Args:
+            minute_of_day (int): Minute in App.TIMEZONE, 0-1439
+            weekday (int): Day of the week, Monday is 0
+
+        Returns:
+            dict: {category: int64 array of chat IDs}, categories with no
+                due chats omitted
+        """
+        due = {}
+        for category in PLAN_CATEGORIES:
+            if not plan_category_applies(category, weekday):
+                continue
+            bit = 1 << (PLAN_CODES[category] - 1)
+            mask = (self.minutes[category] == minute_of_day) & ((self.flags & bit) != 0)
+            chat_ids = self.chat_ids[mask]
+            if chat_ids.size:
+                due[category] = chat_ids
+        return due
+
+
+@timed_db_query
+def load_schedule_columns():
+    """
+    Load the schedules of all enabled chats into ScheduleColumns.
+
+    Returns:
+        ScheduleColumns: The columns, or None when NumPy is not installed
+    """
+    if not NUMPY_AVAILABLE:
+        return None
+    return ScheduleColumns.from_schedules(App.iter_enabled_chat_schedules())
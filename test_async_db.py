@@ -0,0 +1,252 @@
+"""
+Tests for the async data access layer. The same suite runs against SQLite
+and, when TEST_DATABASE_URL is set and asyncpg is installed, PostgreSQL.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+class AsyncDatabaseContract:
+    """Behaviour every backend must share; mixed into a backend test case"""
+
+    CHAT_ID = -1009800000047
+
+    GETTERS = (
+        ("get_chat_settings", "chat_settings"),
+        ("get_diverse_azkar_settings", "diverse_azkar_settings"),
+        ("get_ramadan_settings", "ramadan_settings"),
+        ("get_hajj_eid_settings", "hajj_eid_settings"),
+        ("get_fasting_reminders_settings", "fasting_reminders"),
+    )
+
+    async def test_getters_match_sync_functions(self):
+        """Test that each async getter returns what its blocking twin returns"""
+        for name, _ in self.GETTERS:
+            with self.subTest(getter=name):
+                result = await getattr(self.db, name)(self.CHAT_ID)
+                expected = await asyncio.to_thread(getattr(App, name), self.CHAT_ID)
+                self.assertEqual(dict(result), dict(expected))
+
+    async def test_first_touch_creates_defaults(self):
+        """Test that a new chat gets its default settings"""
+        settings = await self.db.get_chat_settings(self.CHAT_ID)
+        self.assertTrue(settings["is_enabled"])
+        self.assertEqual(settings["morning_time"], "05:00")
+        fasting = await self.db.get_fasting_reminders_settings(self.CHAT_ID)
+        self.assertEqual(fasting["reminder_time"], "21:00")
+
+    async def test_updates_round_trip(self):
+        """Test that every update function is visible to the matching getter"""
+        await self.db.get_chat_settings(self.CHAT_ID)
+        await self.db.update_chat_setting(self.CHAT_ID, "sleep_message", False)
+        await self.db.update_chat_setting(self.CHAT_ID, "evening_time", "17:30")
+        await self.db.update_diverse_azkar_setting(self.CHAT_ID, "interval_minutes", 30)
+        await self.db.update_ramadan_setting(self.CHAT_ID, "iftar_dua_enabled", 0)
+        await self.db.update_hajj_eid_setting(self.CHAT_ID, "media_type", "audio")
+        await self.db.update_fasting_reminder_setting(self.CHAT_ID, "reminder_time", "20:15")
+
+        settings = await self.db.get_chat_settings(self.CHAT_ID)
+        self.assertFalse(settings["sleep_message"])
+        self.assertEqual(settings["evening_time"], "17:30")
+        self.assertEqual((await self.db.get_diverse_azkar_settings(self.CHAT_ID))["interval_minutes"], 30)
+        self.assertFalse((await self.db.get_ramadan_settings(self.CHAT_ID))["iftar_dua_enabled"])
+        self.assertEqual((await self.db.get_hajj_eid_settings(self.CHAT_ID))["media_type"], "audio")
+        self.assertEqual((await self.db.get_fasting_reminders_settings(self.CHAT_ID))["reminder_time"], "20:15")
+
+    async def test_invalid_key_ignored(self):
+        """Test that an unknown key is rejected without touching the database"""
+        with patch.object(self.db, "_write") as write:
+            self.assertIsNone(await self.db.update_ramadan_setting(self.CHAT_ID, "drop_table", 1))
+        write.assert_not_called()
+
+    async def test_admins(self):
+        """Test saving admins and keeping the first primary admin"""
+        await self.db.save_admin_info(1, self.CHAT_ID, "first", "A", None, is_primary_admin=True)
+        await self.db.save_admin_info(2, self.CHAT_ID, "second", "B", None, is_primary_admin=True)
+        await self.db.save_admin_info(1, self.CHAT_ID, "renamed", "A", None)
+
+        self.assertEqual((await self.db.get_admin_info(1, self.CHAT_ID))["username"], "renamed")
+        self.assertIsNone(await self.db.get_admin_info(3, self.CHAT_ID))
+        admins = await self.db.get_all_admins_for_chat(self.CHAT_ID)
+        self.assertEqual({a["user_id"]: a["is_primary_admin"] for a in admins}, {1: True, 2: False})
+
+    async def test_concurrent_first_touches(self):
+        """Test that concurrent first touches of one chat all succeed"""
+        results = await asyncio.gather(*(self.db.get_ramadan_settings(self.CHAT_ID) for _ in range(20)))
+        self.assertEqual(len({tuple(sorted(r.items())) for r in results}), 1)
+
+
+class TestSQLiteAsyncDatabase(AsyncDatabaseContract, unittest.IsolatedAsyncioTestCase):
+    """The shared suite on SQLite, through the thread executor"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patches = [patch.object(App, "DB_FILE", os.path.join(self.tmp.name, "async.db")),
+                        patch.object(App, "DATABASE_URL", None)]
+        for p in self.patches:
+            p.start()
+        App.migrate_sqlite_schema()
+        self.db = App.AsyncDatabase(threads=2)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    def tearDown(self):
+        self.db.executor.shutdown(wait=True)
+        App.close_query_connection()
+        for p in reversed(self.patches):
+            p.stop()
+        self.tmp.cleanup()
+
+    async def test_reads_leave_the_event_loop(self):
+        """Test that blocking reads run on the executor threads"""
+        threads = []
+        original = App.SettingsRowQuery.get
+
+        def record(settings_query, chat_id):
+            threads.append(threading.current_thread().name)
+            return original(settings_query, chat_id)
+
+        with patch.object(App.SettingsRowQuery, "get", autospec=True, side_effect=record):
+            await self.db.get_chat_settings(self.CHAT_ID)
+        self.assertTrue(threads[0].startswith("async-db"))
+
+    async def test_sync_save_admin_info_matches(self):
+        """Test that the sync save_admin_info keeps the first primary admin through the same query"""
+        with patch.object(App.PRIMARY_ADMIN_QUERY, "scalar", wraps=App.PRIMARY_ADMIN_QUERY.scalar) as scalar:
+            App.save_admin_info(1, self.CHAT_ID, "first", "A", None, is_primary_admin=True)
+            App.save_admin_info(2, self.CHAT_ID, "second", "B", None, is_primary_admin=True)
+        self.assertEqual(scalar.call_count, 2)
+        admins = await self.db.get_all_admins_for_chat(self.CHAT_ID)
+        self.assertEqual({a["user_id"]: a["is_primary_admin"] for a in admins}, {1: True, 2: False})
+
+    async def test_writes_go_through_writer_thread(self):
+        """Test that SQLite writes are awaited on the writer's future"""
+        with patch.object(App.sqlite_writer, "submit", wraps=App.sqlite_writer.submit) as submit:
+            await self.db.update_chat_setting(self.CHAT_ID, "morning_time", "04:45")
+        submit.assert_called_once()
+
+
+@unittest.skipUnless(TEST_DATABASE_URL and App.ASYNCPG_AVAILABLE and App.POSTGRES_AVAILABLE,
+                     "TEST_DATABASE_URL and asyncpg are required")
+class TestPostgresAsyncDatabase(AsyncDatabaseContract, unittest.IsolatedAsyncioTestCase):
+    """The shared suite on PostgreSQL, through the asyncpg pool"""
+
+    TABLES = ("chat_settings", "diverse_azkar_settings", "ramadan_settings",
+              "hajj_eid_settings", "fasting_reminders", "admins")
+
+    def setUp(self):
+        self.url_patch = patch.object(App, "DATABASE_URL", TEST_DATABASE_URL)
+        self.url_patch.start()
+        App.migrate_postgres_schema()
+        self.clean()
+        self.db = App.AsyncDatabase(pool_size=4, threads=2)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+
+    def tearDown(self):
+        self.db.executor.shutdown(wait=True)
+        self.clean()
+        App.close_query_connection()
+        self.url_patch.stop()
+
+    def clean(self):
+        conn = App.psycopg2.connect(TEST_DATABASE_URL)
+        try:
+            with conn.cursor() as c:
+                for table in self.TABLES:
+                    c.execute(f"DELETE FROM {table} WHERE chat_id = %s", (self.CHAT_ID,))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class FakePool:
+    """Records the asyncpg calls made by AsyncDatabase"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.calls = []
+        self.conn = MagicMock()
+        self.conn.execute.side_effect = self._execute
+        self.conn.transaction.return_value = self._context(None)
+
+    async def _execute(self, sql, *params):
+        self.calls.append(("execute", sql, params))
+        return "UPDATE 1"
+
+    def _context(self, value):
+        class Context:
+            async def __aenter__(self):
+                return value
+
+            async def __aexit__(self, *exc):
+                return False
+        return Context()
+
+    async def fetchrow(self, sql, *params):
+        self.calls.append(("fetchrow", sql, params))
+        return self.rows.pop(0)
+
+    def acquire(self):
+        return self._context(self.conn)
+
+
+class TestAsyncpgPath(unittest.IsolatedAsyncioTestCase):
+    """Test the statements sent to an asyncpg pool"""
+
+    async def asyncSetUp(self):
+        self.db = App.AsyncDatabase(threads=1)
+
+    async def asyncTearDown(self):
+        self.db.executor.shutdown(wait=True)
+
+    def use_pool(self, pool):
+        async def get_pool():
+            return pool
+        return patch.object(self.db, "_pool", side_effect=get_pool)
+
+    async def test_get_uses_one_prepared_cte(self):
+        """Test that a settings read is one fetchrow of the numbered CTE"""
+        pool = FakePool([(-1, 1, 0, "21:00")])
+        with self.use_pool(pool):
+            result = await self.db.get_fasting_reminders_settings(-1)
+        self.assertFalse(result["arafah_reminder_enabled"])
+        (kind, sql, params), = pool.calls
+        self.assertEqual(sql, App.FASTING_REMINDERS_ROW.fetch_or_create.numbered_sql)
+        self.assertIn("$2", sql)
+        self.assertEqual(params, (-1, -1))
+
+    async def test_lost_race_falls_back_to_upsert(self):
+        """Test that an empty CTE result is followed by the returning upsert"""
+        pool = FakePool([None, (-1, 1, 1, "21:00")])
+        with self.use_pool(pool):
+            await self.db.get_fasting_reminders_settings(-1)
+        self.assertEqual(pool.calls[1][1], App.FASTING_REMINDERS_ROW.create.numbered_sql)
+
+    async def test_write_runs_in_transaction(self):
+        """Test that an update's statements run with $n placeholders in one transaction"""
+        pool = FakePool([])
+        with self.use_pool(pool):
+            await self.db.update_ramadan_setting(-1, "ramadan_enabled", False)
+        pool.conn.transaction.assert_called_once()
+        self.assertEqual([params for _, _, params in pool.calls], [(-1,), (0, -1)])
+        self.assertTrue(all("{p}" not in sql and "$1" in sql for _, sql, _ in pool.calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+"""
+Tests for the compact packed callback_data codec.
+"""
+
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+from App import CallbackAction, encode_callback_data, decode_callback_data
+
+
+class TestCallbackCodecRoundTrip(unittest.TestCase):
+    """Test encoding and decoding of packed callback data"""
+
+    def test_round_trip_group_chat_id(self):
+        """Test that a supergroup chat_id survives a round trip"""
+        data = encode_callback_data(CallbackAction.SELECT_GROUP, -1001234567890)
+        self.assertEqual(decode_callback_data(data), (CallbackAction.SELECT_GROUP, -1001234567890, ()))
+
+    def test_round_trip_with_args(self):
+        """Test that extra integer args survive a round trip"""
+        data = encode_callback_data(CallbackAction.SELECT_GROUP, -42, 0, 127, 128, 1439)
+        self.assertEqual(decode_callback_data(data), (CallbackAction.SELECT_GROUP, -42, (0, 127, 128, 1439)))
+
+    def test_positive_and_zero_chat_ids(self):
+        """Test zigzag encoding for non-negative chat IDs"""
+        for chat_id in (0, 1, 5_000_000_000):
+            data = encode_callback_data(CallbackAction.SELECT_GROUP, chat_id)
+            self.assertEqual(decode_callback_data(data)[1], chat_id)
+
+    def test_encoded_data_is_compact(self):
+        """Test that packed data is much shorter than the legacy base64 format"""
+        data = encode_callback_data(CallbackAction.SELECT_GROUP, -1001234567890)
+        self.assertTrue(data.startswith(App.CALLBACK_DATA_PREFIX))
+        self.assertLessEqual(len(data.encode("utf-8")), 12)
+
+    def test_max_args_fit_telegram_limit(self):
+        """Test that the maximum number of minute-of-day args stays within 64 bytes"""
+        args = [1439] * App.CALLBACK_MAX_ARGS
+        data = encode_callback_data(CallbackAction.SELECT_GROUP, -1001234567890, *args)
+        self.assertLessEqual(len(data.encode("utf-8")), App.CALLBACK_DATA_MAX_BYTES)
+
+    def test_encode_rejects_oversized_payload(self):
+        """Test that payloads over Telegram's 64-byte limit are rejected"""
+        with self.assertRaises(ValueError):
+            encode_callback_data(CallbackAction.SELECT_GROUP, -1001234567890, *([2 ** 62] * App.CALLBACK_MAX_ARGS))
+
+    def test_encode_rejects_negative_args(self):
+        """Test that negative args are rejected"""
+        with self.assertRaises(ValueError):
+            encode_callback_data(CallbackAction.SELECT_GROUP, -1, -5)
+
+    def test_encode_rejects_too_many_args(self):
+        """Test that more than CALLBACK_MAX_ARGS args are rejected"""
+        with self.assertRaises(ValueError):
+            encode_callback_data(CallbackAction.SELECT_GROUP, -1, *range(App.CALLBACK_MAX_ARGS + 1))
+
+
+class TestCallbackCodecRejection(unittest.TestCase):
+    """Test that malformed callback data is rejected"""
+
+    def test_rejects_legacy_strings(self):
+        """Test that legacy callback strings are not mistaken for packed data"""
+        for data in ("open_settings", "select_group_LTEwMDEyMw==", "toggle_morning_azkar_-100123", ""):
+            self.assertIsNone(decode_callback_data(data))
+
+    def test_rejects_invalid_base64(self):
+        """Test that non-base64url characters are rejected"""
+        self.assertIsNone(decode_callback_data("~AQ+/"))
+        self.assertIsNone(decode_callback_data("~AQG1nAw!"))
+        self.assertIsNone(decode_callback_data("~ن"))
+
+    def test_rejects_unknown_version(self):
+        """Test that data from another codec version is rejected"""
+        data = encode_callback_data(CallbackAction.SELECT_GROUP, -100123)
+        raw = bytearray(App.base64.urlsafe_b64decode(data[1:] + "=" * (-len(data[1:]) % 4)))
+        raw[0] = App.CALLBACK_CODEC_VERSION + 1
+        tampered = "~" + App.base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode()
+        self.assertIsNone(decode_callback_data(tampered))
+
+    def test_rejects_unknown_action(self):
+        """Test that an unknown action number is rejected"""
+        tampered = "~" + App.base64.urlsafe_b64encode(bytes((1, 250, 1))).rstrip(b"=").decode()
+        self.assertIsNone(decode_callback_data(tampered))
+
+    def test_rejects_truncated_varint(self):
+        """Test that a dangling continuation byte is rejected"""
+        tampered = "~" + App.base64.urlsafe_b64encode(bytes((1, 1, 0x81))).rstrip(b"=").decode()
+        self.assertIsNone(decode_callback_data(tampered))
+
+    def test_rejects_oversized_varint(self):
+        """Test that a varint longer than 64 bits is rejected"""
+        tampered = "~" + App.base64.urlsafe_b64encode(bytes((1, 1) + (0xFF,) * 10 + (0x01,))).rstrip(b"=").decode()
+        self.assertIsNone(decode_callback_data(tampered))
+
+    def test_rejects_oversized_data(self):
+        """Test that data longer than Telegram's 64-byte limit is rejected"""
+        self.assertIsNone(decode_callback_data("~" + "A" * 64))
+
+
+class TestPackedCallbackDispatch(unittest.TestCase):
+    """Test the packed callback dispatcher"""
+
+    def _make_call(self, data):
+        call = MagicMock()
+        call.data = data
+        call.id = "cb1"
+        call.from_user.id = 111
+        return call
+
+    def test_malformed_data_rejected_before_db_access(self):
+        """Test that malformed data never reaches admin checks or the database"""
+        call = self._make_call("~not!valid")
+        with patch.object(App, "is_user_admin_of_chat") as admin_check, \
+             patch.object(App, "get_db_connection") as db, \
+             patch.object(App.bot, "answer_callback_query") as answer:
+            App.callback_packed(call)
+        admin_check.assert_not_called()
+        db.assert_not_called()
+        answer.assert_called_once()
+
+    def test_private_chat_id_rejected(self):
+        """Test that group actions with a non-group chat_id are rejected"""
+        call = self._make_call(encode_callback_data(CallbackAction.SELECT_GROUP, 12345))
+        with patch.object(App, "show_group_settings_panel") as panel, \
+             patch.object(App.bot, "answer_callback_query"):
+            App.callback_packed(call)
+        panel.assert_not_called()
+
+    def test_select_group_dispatched(self):
+        """Test that SELECT_GROUP opens the group settings panel"""
+        call = self._make_call(encode_callback_data(CallbackAction.SELECT_GROUP, -100123))
+        with patch.object(App, "show_group_settings_panel") as panel:
+            App.callback_packed(call)
+        panel.assert_called_once_with(call, -100123)
+
+    def test_every_action_has_a_handler(self):
+        """Test that each CallbackAction is dispatched somewhere"""
+        self.assertEqual(set(App.PACKED_CALLBACK_HANDLERS), set(CallbackAction))
+
+    def test_out_of_range_time_rejected_before_admin_check(self):
+        """Test that a preset time with hour 24 never reaches the admin check or the settings"""
+        call = self._make_call(encode_callback_data(CallbackAction.SET_MORNING_TIME, -100123, 24, 0))
+        with patch.object(App, "is_user_admin_of_chat") as admin_check, \
+             patch.object(App, "update_chat_setting") as update, \
+             patch.object(App.bot, "answer_callback_query") as answer:
+            App.callback_packed(call)
+        admin_check.assert_not_called()
+        update.assert_not_called()
+        answer.assert_called_once()
+
+    def test_unknown_interval_rejected(self):
+        """Test that a diverse interval outside the offered choices is rejected"""
+        call = self._make_call(encode_callback_data(CallbackAction.DIVERSE_INTERVAL, -100123, 7))
+        with patch.object(App, "set_diverse_interval") as set_interval, \
+             patch.object(App.bot, "answer_callback_query"):
+            App.callback_packed(call)
+        set_interval.assert_not_called()
+
+    def test_wrong_arg_count_rejected(self):
+        """Test that missing or extra args are rejected"""
+        for data in (encode_callback_data(CallbackAction.SET_EVENING_TIME, -100123, 18),
+                     encode_callback_data(CallbackAction.FRIDAY_MENU, -100123, 1)):
+            with patch.object(App, "is_user_admin_of_chat") as admin_check, \
+                 patch.object(App.bot, "answer_callback_query"):
+                App.callback_packed(self._make_call(data))
+            admin_check.assert_not_called()
+
+    def test_time_preset_dispatched(self):
+        """Test that SET_EVENING_TIME stores the time and reschedules the chat"""
+        call = self._make_call(encode_callback_data(CallbackAction.SET_EVENING_TIME, -100123, 19, 30))
+        with patch.object(App, "is_user_admin_of_chat", return_value=True), \
+             patch.object(App, "update_chat_setting") as update, \
+             patch.object(App, "reschedule_chat_jobs") as reschedule, \
+             patch.object(App, "get_chat_settings", return_value={"evening_time": "19:30"}), \
+             patch.object(App.bot, "answer_callback_query"), \
+             patch.object(App.bot, "edit_message_text"):
+            App.callback_packed(call)
+        update.assert_called_once_with(-100123, "evening_time", "19:30")
+        reschedule.assert_called_once_with(-100123, "chat")
+
+    def test_toggle_dispatched(self):
+        """Test that a toggle action flips its setting"""
+        call = self._make_call(encode_callback_data(CallbackAction.TOGGLE_DIVERSE_PDF, -100123))
+        with patch.object(App, "is_user_admin_of_chat", return_value=True), \
+             patch.object(App, "get_diverse_azkar_settings", return_value={"enable_pdf": 1}), \
+             patch.object(App, "update_diverse_azkar_setting") as update, \
+             patch.object(App.bot, "answer_callback_query"), \
+             patch.object(App.bot, "edit_message_text"):
+            App.callback_packed(call)
+        update.assert_called_once_with(-100123, "enable_pdf", False)
+
+    def test_legacy_toggle_delegates(self):
+        """Test that old format toggle data takes the same path as packed data"""
+        with patch.object(App, "toggle_menu_setting") as toggle:
+            App.callback_toggle_ramadan(self._make_call("toggle_ramadan_laylat_alqadr_-100123"))
+        toggle.assert_called_once()
+        self.assertEqual(toggle.call_args.args[1:], (-100123, CallbackAction.TOGGLE_LAYLAT_ALQADR))
+
+    def test_back_button_uses_packed_data(self):
+        """Test that back buttons to the group panel use packed data"""
+        data = App.create_back_button_callback(-100123)
+        self.assertEqual(decode_callback_data(data), (CallbackAction.SELECT_GROUP, -100123, ()))
+        self.assertEqual(App.create_back_button_callback(None), "open_settings")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""
+Tests for the per-chat circuit breaker in front of the send paths.
+"""
+
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import telebot
+import App
+from App import ChatCircuitBreakers, CIRCUIT_CLOSED, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestChatCircuitBreakers(unittest.TestCase):
+    """Test breaker state transitions"""
+
+    CHAT_ID = -1009500000001
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breakers = ChatCircuitBreakers(threshold=3, base_cooldown=60, max_cooldown=300, clock=self.clock)
+
+    def trip(self):
+        for _ in range(3):
+            self.breakers.record_failure(self.CHAT_ID)
+
+    def test_opens_after_threshold(self):
+        """Test that the breaker opens only after consecutive failures"""
+        self.breakers.record_failure(self.CHAT_ID)
+        self.breakers.record_failure(self.CHAT_ID)
+        self.assertTrue(self.breakers.allow(self.CHAT_ID))
+        self.breakers.record_failure(self.CHAT_ID)
+        self.assertFalse(self.breakers.allow(self.CHAT_ID))
+        self.assertEqual(self.breakers.status(self.CHAT_ID), (CIRCUIT_OPEN, 60))
+
+    def test_half_open_allows_single_probe(self):
+        """Test that after the cool-down exactly one probe is let through"""
+        self.trip()
+        self.clock.now += 61
+        self.assertFalse(self.breakers.is_blocked(self.CHAT_ID))
+        self.assertTrue(self.breakers.allow(self.CHAT_ID))
+        self.assertEqual(self.breakers.status(self.CHAT_ID)[0], CIRCUIT_HALF_OPEN)
+        self.assertFalse(self.breakers.allow(self.CHAT_ID))
+        self.assertTrue(self.breakers.is_blocked(self.CHAT_ID))
+
+    def test_successful_probe_closes(self):
+        """Test that a success closes the breaker and forgets the chat"""
+        self.trip()
+        self.clock.now += 61
+        self.breakers.allow(self.CHAT_ID)
+        self.breakers.record_success(self.CHAT_ID)
+        self.assertEqual(self.breakers.status(self.CHAT_ID), (CIRCUIT_CLOSED, 0))
+        self.assertNotIn(self.CHAT_ID, self.breakers.circuits)
+
+    def test_failed_probe_doubles_cooldown(self):
+        """Test exponential cool-down capped at the maximum"""
+        self.trip()
+        cooldowns = []
+        for _ in range(4):
+            self.clock.now = self.breakers.circuits[self.CHAT_ID].open_until + 1
+            self.assertTrue(self.breakers.allow(self.CHAT_ID))
+            self.breakers.record_failure(self.CHAT_ID)
+            cooldowns.append(self.breakers.status(self.CHAT_ID)[1])
+        self.assertEqual(cooldowns, [120, 240, 300, 300])
+
+    def test_stale_probe_is_retried(self):
+        """Test that a probe that never reports back does not wedge the breaker"""
+        self.trip()
+        self.clock.now += 61
+        self.breakers.allow(self.CHAT_ID)
+        self.clock.now += App.CIRCUIT_PROBE_TIMEOUT_SECONDS + 1
+        self.assertTrue(self.breakers.allow(self.CHAT_ID))
+
+    def test_state_counts(self):
+        """Test the per-state gauge samples"""
+        self.trip()
+        self.breakers.record_failure(self.CHAT_ID + 1)
+        self.assertEqual(self.breakers.state_counts(), {(CIRCUIT_OPEN,): 1, (CIRCUIT_HALF_OPEN,): 0})
+
+
+class TestCircuitBreakerSendPaths(unittest.TestCase):
+    """Test the breaker in front of the send paths"""
+
+    CHAT_ID = -1009500000002
+
+    def setUp(self):
+        self.breakers = ChatCircuitBreakers(threshold=1, base_cooldown=600)
+        self.patcher = patch.object(App, "chat_breakers", self.breakers)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_open_breaker_skips_db_and_api(self):
+        """Test that an open breaker skips the send without DB or API work"""
+        self.breakers.record_failure(self.CHAT_ID)
+        with patch.object(App, "get_chat_settings") as get_settings, \
+             patch.object(App, "get_fasting_reminders_settings") as get_fasting, \
+             patch.object(App, "get_diverse_azkar_settings") as get_diverse, \
+             patch.object(App.bot, "send_message") as send:
+            App.send_azkar(self.CHAT_ID, "morning")
+            App.send_diverse_azkar(self.CHAT_ID)
+            App.send_special_azkar(self.CHAT_ID, "ramadan")
+            App.send_fasting_reminder(self.CHAT_ID, "arafah")
+        for mock in (get_settings, get_fasting, get_diverse, send):
+            mock.assert_not_called()
+
+    def test_transient_error_trips_breaker(self):
+        """Test that timeouts and missing rights trip the breaker without deactivating"""
+        chat = {"is_enabled": True, "morning_azkar": True, "media_enabled": False}
+        with patch.object(App, "get_chat_settings", return_value=chat), \
+             patch.object(App, "queue_chat_deactivation") as queue, \
+             patch.object(App.bot, "send_message", side_effect=App.requests.exceptions.ReadTimeout("timed out")):
+            App.send_azkar(self.CHAT_ID, "morning")
+        queue.assert_not_called()
+        self.assertEqual(self.breakers.status(self.CHAT_ID)[0], CIRCUIT_OPEN)
+        App.settle_outbox([], {}, {self.CHAT_ID})
+
+    def test_success_closes_breaker(self):
+        """Test that a successful send closes a half-open breaker"""
+        self.breakers = ChatCircuitBreakers(threshold=1, base_cooldown=0)
+        self.breakers.record_failure(self.CHAT_ID)
+        fasting = {"monday_thursday_enabled": True, "arafah_reminder_enabled": True}
+        with patch.object(App, "chat_breakers", self.breakers), \
+             patch.object(App, "get_chat_settings", return_value={"is_enabled": True}), \
+             patch.object(App, "get_fasting_reminders_settings", return_value=fasting), \
+             patch.object(App.bot, "send_message"):
+            App.send_fasting_reminder(self.CHAT_ID, "arafah")
+        self.assertEqual(self.breakers.status(self.CHAT_ID), (CIRCUIT_CLOSED, 0))
+
+    def test_wheel_tick_skips_open_chats_without_db(self):
+        """Test that the diverse wheel pushes back open chats without reading settings"""
+        self.breakers.record_failure(self.CHAT_ID)
+        with patch.object(App.diverse_wheel, "advance", return_value=[(self.CHAT_ID, 0)]), \
+             patch.dict(App.diverse_wheel_intervals, {self.CHAT_ID: 5}), \
+             patch.object(App, "get_diverse_azkar_settings_batch") as batch, \
+             patch.object(App, "send_diverse_azkar") as send, \
+             patch.object(App, "save_diverse_next_due") as save:
+            App.run_diverse_wheel_tick()
+        try:
+            batch.assert_not_called()
+            send.assert_not_called()
+            self.assertIn(self.CHAT_ID, App.diverse_wheel)
+            self.assertIsNotNone(save.call_args.args[0][self.CHAT_ID])
+        finally:
+            App.cancel_diverse_azkar(self.CHAT_ID)
+
+    def test_metrics_and_status_show_breaker(self):
+        """Test that breaker state is exported and shown in /status"""
+        self.breakers.record_failure(self.CHAT_ID)
+        self.assertIn('azkar_circuit_chats{state="open"} 1', App.render_metrics())
+
+        message = MagicMock()
+        message.chat.type = "supergroup"
+        message.chat.id = self.CHAT_ID
+        member = MagicMock(status="administrator")
+        settings = App.get_chat_settings(self.CHAT_ID)
+        with patch.object(App.bot, "get_chat_member", return_value=member), \
+             patch.object(App, "get_chat_settings", return_value=settings), \
+             patch.object(App.bot, "send_message") as send:
+            App.cmd_status(message)
+        self.assertIn("متوقف مؤقتاً", send.call_args.args[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,315 @@
+"""
+Tests for the SQLite/PostgreSQL migration and reconciliation tool.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+import db_sync
+from db_sync import SYNC_TABLES, SQLiteStore, sync_stores, sync_table
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+CHAT_SETTINGS = SYNC_TABLES[0]
+ADMINS = SYNC_TABLES[-1]
+
+
+class SQLiteFixture(unittest.TestCase):
+    """Two migrated SQLite files standing in for the two stores"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.paths = {}
+        for name in ("left", "right"):
+            self.paths[name] = os.path.join(self.tmp.name, f"{name}.db")
+            with patch.object(App, "DB_FILE", self.paths[name]):
+                App.migrate_sqlite_schema()
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        self.tmp.cleanup()
+
+    def execute(self, name, sql, params=()):
+        conn = sqlite3.connect(self.paths[name])
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def insert_chats(self, name, table, chat_ids):
+        conn = sqlite3.connect(self.paths[name])
+        try:
+            with conn:
+                conn.executemany(f"INSERT INTO {table} (chat_id) VALUES (?)", [(chat_id,) for chat_id in chat_ids])
+        finally:
+            conn.close()
+
+    def open(self):
+        """Open both stores; their snapshots start at the first read"""
+        self.stores = [SQLiteStore(self.paths["left"], "left"), SQLiteStore(self.paths["right"], "right")]
+        return self.stores
+
+    def settings(self, name):
+        return self.execute(name, "SELECT chat_id, morning_time, flags FROM chat_settings ORDER BY chat_id")
+
+
+class TestUpdatedAtStamps(SQLiteFixture):
+    """Test the schema v4 triggers maintaining updated_at"""
+
+    def stamp(self):
+        return self.execute("left", "SELECT updated_at FROM chat_settings WHERE chat_id = -1")[0][0]
+
+    def test_inserts_and_updates_are_stamped(self):
+        """Test that writes set updated_at to the current time in milliseconds"""
+        before = int(time.time() * 1000) - 1000
+        self.execute("left", "INSERT INTO chat_settings (chat_id) VALUES (-1)")
+        inserted = self.stamp()
+        self.assertGreater(inserted, before)
+        time.sleep(0.01)
+        self.execute("left", "UPDATE chat_settings SET morning_time = '04:00' WHERE chat_id = -1")
+        self.assertGreater(self.stamp(), inserted)
+
+    def test_explicit_stamp_is_kept(self):
+        """Test that a write setting updated_at itself keeps its value"""
+        self.execute("left", "INSERT INTO chat_settings (chat_id, updated_at) VALUES (-1, 5)")
+        self.assertEqual(self.stamp(), 5)
+        self.execute("left", "UPDATE chat_settings SET morning_time = '04:00', updated_at = 9 WHERE chat_id = -1")
+        self.assertEqual(self.stamp(), 9)
+
+
+class TestMigrate(SQLiteFixture):
+    """Test one-way copies"""
+
+    def test_copies_every_table(self):
+        """Test that a full migrate leaves the target with every source row"""
+        chat_ids = range(-1, -2501, -1)
+        for table in SYNC_TABLES[:-1]:
+            self.insert_chats("left", table.name, chat_ids)
+        self.execute("left", "INSERT INTO admins (user_id, chat_id, username) VALUES (7, -1, 'admin')")
+
+        reports = sync_stores(*self.open(), chunk_size=100)
+        for table in SYNC_TABLES[:-1]:
+            self.assertEqual(reports[table.name]["right"], 2500)
+            source = self.execute("left", f"SELECT * FROM {table.name} ORDER BY chat_id")
+            self.assertEqual(self.execute("right", f"SELECT * FROM {table.name} ORDER BY chat_id"), source)
+        self.assertEqual(self.execute("right", "SELECT user_id, chat_id, username FROM admins"), [(7, -1, "admin")])
+
+    def test_source_wins_and_target_only_rows_kept(self):
+        """Test that migrate overwrites differing rows and leaves extra target rows alone"""
+        self.execute("left", "INSERT INTO chat_settings (chat_id, morning_time, updated_at) VALUES (-1, '04:00', 1)")
+        self.execute("right", "INSERT INTO chat_settings (chat_id, morning_time, updated_at) VALUES (-1, '06:00', 2)")
+        self.execute("right", "INSERT INTO chat_settings (chat_id) VALUES (-2)")
+
+        report = sync_table(*self.open(), CHAT_SETTINGS)
+        self.assertEqual((report["right"], report["left"]), (1, 0))
+        self.assertEqual(self.settings("right"), [(-2, "05:00", 127), (-1, "04:00", 127)])
+        self.assertEqual(self.settings("left"), [(-1, "04:00", 127)])
+
+    def test_identical_rows_not_rewritten(self):
+        """Test that rows equal apart from updated_at are counted and left alone"""
+        for name, stamp in (("left", 1), ("right", 2)):
+            self.execute(name, "INSERT INTO chat_settings (chat_id, updated_at) VALUES (-1, ?)", (stamp,))
+        report = sync_table(*self.open(), CHAT_SETTINGS)
+        self.assertEqual((report["identical"], report["right"]), (1, 0))
+        self.assertEqual(self.execute("right", "SELECT updated_at FROM chat_settings")[0][0], 2)
+
+    def test_dry_run_writes_nothing(self):
+        """Test that a dry run reports the copies without making them"""
+        self.execute("left", "INSERT INTO chat_settings (chat_id) VALUES (-1)")
+        report = sync_table(*self.open(), CHAT_SETTINGS, dry_run=True)
+        self.assertEqual(report["right"], 1)
+        self.assertEqual(self.settings("right"), [])
+
+    def test_admin_ids_not_copied(self):
+        """Test that admins are matched on (user_id, chat_id) and keep their own ids"""
+        self.execute("right", "INSERT INTO admins (user_id, chat_id) VALUES (1, -9)")
+        self.execute("left", "INSERT INTO admins (user_id, chat_id, username) VALUES (2, -1, 'a')")
+        sync_table(*self.open(), ADMINS)
+        self.assertEqual(self.execute("right", "SELECT id, user_id FROM admins ORDER BY id"), [(1, 1), (2, 2)])
+
+    def test_missing_table_reported(self):
+        """Test that a store without the bot's schema raises SyncError"""
+        self.execute("right", "DROP TABLE fasting_reminders")
+        with self.assertRaises(db_sync.SyncError):
+            sync_table(*self.open(), SYNC_TABLES[4])
+
+
+class TestReconcile(SQLiteFixture):
+    """Test two-way merges of diverged stores"""
+
+    def test_rows_from_either_side_are_merged(self):
+        """Test that rows present on one side only end up on both"""
+        self.execute("left", "INSERT INTO chat_settings (chat_id) VALUES (-1)")
+        self.execute("right", "INSERT INTO chat_settings (chat_id) VALUES (-2)")
+        report = sync_table(*self.open(), CHAT_SETTINGS, two_way=True)
+        self.assertEqual((report["left"], report["right"]), (1, 1))
+        self.assertEqual(self.settings("left"), self.settings("right"))
+        self.assertEqual(len(self.settings("left")), 2)
+
+    def test_newest_row_wins(self):
+        """Test that a row changed on both sides keeps the later change everywhere"""
+        self.execute("left", "INSERT INTO chat_settings (chat_id, morning_time, updated_at) VALUES (-1, '04:00', 200)")
+        self.execute("right", "INSERT INTO chat_settings (chat_id, morning_time, updated_at) VALUES (-1, '06:00', 100)")
+        self.execute("left", "INSERT INTO chat_settings (chat_id, morning_time, updated_at) VALUES (-2, '04:30', 100)")
+        self.execute("right", "INSERT INTO chat_settings (chat_id, morning_time, updated_at) VALUES (-2, '06:30', 200)")
+
+        sync_table(*self.open(), CHAT_SETTINGS, two_way=True)
+        expected = [(-2, 200, "06:30"), (-1, 200, "04:00")]
+        for name in ("left", "right"):
+            self.assertEqual(self.execute(name, "SELECT chat_id, updated_at, morning_time FROM chat_settings "
+                                                "ORDER BY chat_id"), expected)
+
+    def test_tie_goes_to_preferred_store(self):
+        """Test that equal stamps keep the preferred store's copy"""
+        self.execute("left", "INSERT INTO chat_settings (chat_id, morning_time, updated_at) VALUES (-1, '04:00', 100)")
+        self.execute("right", "INSERT INTO chat_settings (chat_id, morning_time, updated_at) VALUES (-1, '06:00', 100)")
+        left, right = self.open()
+        sync_table(left, right, CHAT_SETTINGS, two_way=True, prefer=right)
+        self.assertEqual(self.settings("left"), [(-1, "06:00", 127)])
+
+    def test_small_chunks(self):
+        """Test that interleaved keys merge correctly when flushed in many chunks"""
+        self.insert_chats("left", "ramadan_settings", range(-1, -301, -2))
+        self.insert_chats("right", "ramadan_settings", range(-2, -301, -2))
+        report = sync_table(*self.open(), SYNC_TABLES[2], two_way=True, chunk_size=7)
+        self.assertEqual((report["left"], report["right"]), (150, 150))
+        for name in ("left", "right"):
+            self.assertEqual(self.execute(name, "SELECT COUNT(*) FROM ramadan_settings")[0][0], 300)
+
+
+class TestPairedRows(unittest.TestCase):
+    """Test the merge walk over two key-ordered streams"""
+
+    def test_pairs(self):
+        """Test that matching keys are paired and the rest padded with None"""
+        left = [(1, "a"), (3, "c"), (4, "d")]
+        right = [(2, "b"), (3, "C"), (5, "e")]
+        self.assertEqual(list(db_sync.paired_rows(left, right, 1)), [
+            ((1, "a"), None), (None, (2, "b")), ((3, "c"), (3, "C")), ((4, "d"), None), (None, (5, "e")),
+        ])
+
+
+class TestPostgresStatements(unittest.TestCase):
+    """Test the statements PostgresStore sends, against a fake connection"""
+
+    def test_copy_text_escaping(self):
+        """Test that NULLs, tabs, newlines and backslashes survive COPY's text format"""
+        encoded = db_sync.copy_text([(1, None, "a\tb\\c\nd")]).getvalue()
+        self.assertEqual(encoded, "1\t\\N\ta\\tb\\\\c\\nd\n")
+
+    def test_upsert_copies_then_merges(self):
+        """Test that a chunk is COPYed into a staging table and merged without orphans"""
+        store = db_sync.PostgresStore.__new__(db_sync.PostgresStore)
+        store.writer = MagicMock()
+        cursor = store.writer.cursor.return_value.__enter__.return_value
+        cursor.rowcount = 1
+        written = store.upsert(SYNC_TABLES[1], ["chat_id", "enabled"], [(-1, 1), (-2, 0)])
+
+        self.assertEqual(written, 1)
+        statements = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertIn("CREATE TEMP TABLE IF NOT EXISTS db_sync_diverse_azkar_settings", statements[0])
+        self.assertEqual(statements[1], "TRUNCATE db_sync_diverse_azkar_settings")
+        copy_sql, data = cursor.copy_expert.call_args[0]
+        self.assertEqual(copy_sql, "COPY db_sync_diverse_azkar_settings (chat_id, enabled) FROM STDIN")
+        self.assertEqual(data.getvalue(), "-1\t1\n-2\t0\n")
+        self.assertIn("WHERE chat_id IN (SELECT chat_id FROM chat_settings)", statements[2])
+        self.assertIn("ON CONFLICT (chat_id) DO UPDATE SET enabled = EXCLUDED.enabled", statements[2])
+        store.writer.commit.assert_called_once()
+
+
+class TestCommandLine(SQLiteFixture):
+    """Test the db_sync command line"""
+
+    def test_sqlite_backup(self):
+        """Test that backing up SQLite writes a complete copy"""
+        self.execute("left", "INSERT INTO chat_settings (chat_id) VALUES (-1)")
+        dest = os.path.join(self.tmp.name, "backup.db")
+        self.assertEqual(db_sync.main(["--sqlite", self.paths["left"], "backup", dest, "--from", "sqlite"]), 0)
+        conn = sqlite3.connect(dest)
+        try:
+            self.assertEqual(conn.execute("SELECT chat_id FROM chat_settings").fetchall(), [(-1,)])
+        finally:
+            conn.close()
+
+    def test_backup_refuses_existing_file(self):
+        """Test that a backup never overwrites an existing file"""
+        self.assertEqual(db_sync.main(["--sqlite", self.paths["left"], "backup", self.paths["right"],
+                                       "--from", "sqlite"]), 1)
+
+    def test_missing_database_url(self):
+        """Test that PostgreSQL commands fail cleanly without a URL"""
+        self.assertEqual(db_sync.main(["--sqlite", self.paths["left"], "--database-url", "", "reconcile"]), 1)
+
+    def test_schema_clone(self):
+        """Test that a PostgreSQL backup file starts out fully migrated"""
+        dest = os.path.join(self.tmp.name, "clone.db")
+        db_sync.clone_sqlite_schema(self.paths["left"], dest)
+        with patch.object(App, "DB_FILE", dest):
+            self.assertEqual(App.migrate_sqlite_schema(), App.SQLITE_MIGRATIONS[-1].version)
+        conn = sqlite3.connect(dest)
+        try:
+            triggers = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'").fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(triggers, 2 * len(App.STAMPED_TABLES))
+
+
+@unittest.skipUnless(TEST_DATABASE_URL and App.POSTGRES_AVAILABLE, "TEST_DATABASE_URL is required")
+class TestPostgresRoundTrip(SQLiteFixture):
+    """Test a reconcile against a live PostgreSQL database"""
+
+    CHAT_ID = -1009800000048
+
+    def setUp(self):
+        super().setUp()
+        with patch.object(App, "DATABASE_URL", TEST_DATABASE_URL):
+            App.migrate_postgres_schema()
+        self.clean()
+
+    def tearDown(self):
+        super().tearDown()
+        self.clean()
+
+    def clean(self):
+        conn = App.psycopg2.connect(TEST_DATABASE_URL)
+        try:
+            with conn.cursor() as c:
+                for table in reversed(SYNC_TABLES):
+                    c.execute(f"DELETE FROM {table.name} WHERE chat_id = %s", (self.CHAT_ID,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def test_reconcile(self):
+        """Test that SQLite-only rows reach PostgreSQL and come back unchanged"""
+        self.execute("left", "INSERT INTO chat_settings (chat_id, morning_time) VALUES (?, '04:10')", (self.CHAT_ID,))
+        self.execute("left", "INSERT INTO fasting_reminders (chat_id) VALUES (?)", (self.CHAT_ID,))
+        sqlite_store = SQLiteStore(self.paths["left"])
+        postgres_store = db_sync.PostgresStore(TEST_DATABASE_URL)
+        self.stores = [sqlite_store, postgres_store]
+        reports = sync_stores(sqlite_store, postgres_store, two_way=True)
+        self.assertGreaterEqual(reports["fasting_reminders"]["postgres"], 1)
+        self.assertEqual(reports["fasting_reminders"]["orphaned"], 0)
+
+        conn = App.psycopg2.connect(TEST_DATABASE_URL)
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT morning_time FROM chat_settings WHERE chat_id = %s", (self.CHAT_ID,))
+                self.assertEqual(c.fetchone()[0], "04:10")
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Tests for deadline-aware delivery of queued scheduled content.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+
+class TestOutboxDeadlines(unittest.TestCase):
+    """Test that stale outbox rows are dropped instead of sent"""
+
+    CHAT_ID = -1009800000001
+
+    def setUp(self):
+        App.scheduler.pause_job("outbox_drain")
+        self.execute("DELETE FROM outbox")
+
+    def tearDown(self):
+        self.execute("DELETE FROM outbox")
+        App.scheduler.resume_job("outbox_drain")
+
+    def execute(self, sql, params=()):
+        conn, c, _ = App.get_db_connection()
+        try:
+            c.execute(sql, params)
+            rows = c.fetchall()
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+    def test_rows_carry_category_deadline(self):
+        """Test that each row's deadline depends on its category"""
+        due = int(time.time()) // 60 * 60
+        App.enqueue_outbox(self.CHAT_ID, "morning", 1, due_at=due)
+        App.enqueue_outbox(self.CHAT_ID, "sleep", 1, due_at=due)
+        deadlines = dict(self.execute("SELECT category, deadline_at - due_at FROM outbox"))
+        self.assertEqual(deadlines, {"morning": App.DELIVERY_DEADLINES["morning"],
+                                     "sleep": App.DELIVERY_DEADLINES["sleep"]})
+
+    def test_expired_sequence_dropped_without_api_call(self):
+        """Test that an expired sequence is deleted whole and counted"""
+        stale_due = int(time.time()) - App.DELIVERY_DEADLINES["morning"] - 60
+        App.enqueue_outbox(self.CHAT_ID, "morning", 5, due_at=stale_due)
+        expired = App.DELIVERIES_EXPIRED.value("morning")
+        with patch.object(App.bot, "send_message") as send:
+            self.assertEqual(App.drain_outbox(), 0)
+        send.assert_not_called()
+        self.assertEqual(App.DELIVERIES_EXPIRED.value("morning"), expired + 1)
+        self.assertEqual(self.execute("SELECT COUNT(*) FROM outbox WHERE settled_at IS NULL")[0][0], 0)
+
+    def test_fresh_rows_still_delivered(self):
+        """Test that rows within their deadline are sent as usual"""
+        App.enqueue_outbox(self.CHAT_ID, "sleep", 1, due_at=int(time.time()) - 60)
+        with patch.object(App.bot, "send_message") as send:
+            self.assertEqual(App.drain_outbox(), 1)
+        send.assert_called_once()
+
+
+class TestOutboxDeadlineMigration(unittest.TestCase):
+    """Test the deadline_at migration on an existing outbox table"""
+
+    def test_migration_adds_deadline_column(self):
+        """Test that the migrations add deadline_at to an outbox created without it"""
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = os.path.join(tmp, "old.db")
+            conn = sqlite3.connect(db_file)
+            conn.execute("CREATE TABLE diverse_azkar_settings (chat_id INTEGER PRIMARY KEY)")
+            conn.execute("CREATE TABLE outbox (id INTEGER PRIMARY KEY, chat_id INTEGER, category TEXT, "
+                         "message_index INTEGER, media_type TEXT, due_at INTEGER)")
+            conn.commit()
+            conn.close()
+            with patch.object(App, "DB_FILE", db_file):
+                App.migrate_sqlite_schema()
+            conn = sqlite3.connect(db_file)
+            columns = [col[1] for col in conn.execute("PRAGMA table_info(outbox)")]
+            conn.close()
+        self.assertIn("deadline_at", columns)
+
+
+class TestDiverseDeadline(unittest.TestCase):
+    """Test that overdue diverse slots are skipped"""
+
+    CHAT_ID = -1009800000002
+
+    def test_overdue_chat_skipped_and_rescheduled(self):
+        """Test that a chat overdue by a whole interval is skipped without a DB read"""
+        now_tick = App.current_wheel_tick()
+        expired = App.DELIVERIES_EXPIRED.value("diverse")
+        with patch.object(App.diverse_wheel, "advance", return_value=[(self.CHAT_ID, now_tick - 10)]), \
+             patch.dict(App.diverse_wheel_intervals, {self.CHAT_ID: 5}), \
+             patch.object(App, "get_diverse_azkar_settings_batch") as batch, \
+             patch.object(App, "send_diverse_azkar") as send, \
+             patch.object(App, "save_diverse_next_due"):
+            App.run_diverse_wheel_tick()
+        try:
+            batch.assert_not_called()
+            send.assert_not_called()
+            self.assertEqual(App.DELIVERIES_EXPIRED.value("diverse"), expired + 1)
+            self.assertIn(self.CHAT_ID, App.diverse_wheel)
+        finally:
+            App.cancel_diverse_azkar(self.CHAT_ID)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+"""
+Tests for the delivery log: batched appends, day rollups, per-chat stats
+and retention pruning.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import telebot
+import App
+
+DAY = 86400
+
+
+def api_error(code, description):
+    return telebot.apihelper.ApiTelegramException(
+        "sendMessage", None, {"error_code": code, "description": description})
+
+
+def riyadh(*args):
+    return int(App.TIMEZONE.localize(datetime(*args)).timestamp())
+
+
+class DeliveryLogTestCase(unittest.TestCase):
+    CHAT_A = -1009500000001
+    CHAT_B = -1009500000002
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp.name, "delivery.db")
+        self.log = App.DeliveryLog(max_buffer=100)
+        self.patches = [
+            patch.object(App, "DB_FILE", self.db_file),
+            patch.object(App, "DATABASE_URL", None),
+            patch.object(App, "delivery_log", self.log),
+        ]
+        for p in self.patches:
+            p.start()
+        App.migrate_sqlite_schema()
+
+    def tearDown(self):
+        App.close_query_connection()
+        App.sqlite_writer.close()
+        for p in reversed(self.patches):
+            p.stop()
+        self.tmp.cleanup()
+
+    def query(self, sql, params=()):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+
+class TestAppend(DeliveryLogTestCase):
+    """Test what reaches the append buffer"""
+
+    def test_record_send_with_chat_is_logged(self):
+        """Test that a send addressed to a chat is buffered with its latency in milliseconds"""
+        App.record_send("morning", "sent", chat_id=self.CHAT_A, latency=0.125)
+        (row,) = self.log.rows
+        self.assertEqual(row[1:], (self.CHAT_A, "morning", App.DELIVERY_RESULT_CODES["sent"], None, 125, 1))
+
+    def test_record_send_without_chat_is_not_logged(self):
+        """Test that metric-only calls leave the log alone"""
+        App.record_send("morning", "sent")
+        self.assertEqual(len(self.log), 0)
+
+    def test_failed_send_keeps_error_code(self):
+        """Test that a failed send is logged with the Telegram error code"""
+        App.handle_send_error(self.CHAT_A, "evening", api_error(400, "Bad Request: message is too long"), 0.05)
+        (row,) = self.log.rows
+        self.assertEqual(row[3:6], (App.DELIVERY_RESULT_CODES["failed"], 400, 50))
+
+    def test_full_buffer_drops_oldest(self):
+        """Test that a full buffer keeps the newest rows and counts the drops"""
+        dropped = App.DELIVERY_LOG_DROPPED.value()
+        for i in range(105):
+            self.log.append(self.CHAT_A, "diverse", "sent", sent_at=i)
+        self.assertEqual(len(self.log), 100)
+        self.assertEqual(self.log.rows[0][0], 5)
+        self.assertEqual(App.DELIVERY_LOG_DROPPED.value() - dropped, 5)
+
+
+class TestFlush(DeliveryLogTestCase):
+    """Test writing the buffer to delivery_log and delivery_daily"""
+
+    def test_multi_row_inserts(self):
+        """Test that rows are written in multi-row INSERTs sized to the parameter limit"""
+        rows = [(1_700_000_000 + i * DAY, self.CHAT_A, "diverse", 0, None, 10, 1) for i in range(1_200)]
+        statements = App.delivery_log_statements(rows)
+        inserts = [sql for sql, _ in statements if "INTO delivery_log" in sql]
+        self.assertEqual(len(inserts), -(-1_200 // App.DELIVERY_LOG_INSERT_ROWS))
+        for sql, params in statements:
+            self.assertEqual(sql.count("{p}"), len(params))
+            self.assertLessEqual(len(params), App.SQL_MAX_PARAMETERS)
+
+    def test_flush_writes_log_and_rollups(self):
+        """Test that one flush writes every row and its day totals"""
+        now = riyadh(2026, 3, 10, 12, 0)
+        self.log.append(self.CHAT_A, "morning", "sent", latency=0.1, sent_at=now)
+        self.log.append(self.CHAT_A, "morning", "sent", latency=0.3, sent_at=now + 1)
+        self.log.append(self.CHAT_A, "morning", "failed", error_code=400, sent_at=now + 2)
+        self.log.append(self.CHAT_B, "diverse", "circuit_open", sent_at=now + 3)
+        self.assertEqual(App.flush_delivery_log(), 4)
+        self.assertEqual(len(self.log), 0)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM delivery_log"), [(4,)])
+        self.assertEqual(self.query(
+            "SELECT chat_id, category, result, attempts, messages, latency_ms_sum, latency_samples "
+            "FROM delivery_daily ORDER BY chat_id DESC, result"), [
+                (self.CHAT_A, "morning", 0, 2, 2, 400, 2),
+                (self.CHAT_A, "morning", 1, 1, 1, 0, 0),
+                (self.CHAT_B, "diverse", 2, 1, 1, 0, 0),
+            ])
+
+    def test_flushes_accumulate(self):
+        """Test that later flushes add to the same rollup row"""
+        now = riyadh(2026, 3, 10, 12, 0)
+        for i in range(3):
+            self.log.append(self.CHAT_A, "morning", "sent", latency=0.01, sent_at=now + i)
+            App.flush_delivery_log()
+        self.assertEqual(self.query("SELECT attempts, latency_ms_sum FROM delivery_daily"), [(3, 30)])
+
+    def test_days_follow_timezone(self):
+        """Test that rollup days split at local midnight, not UTC midnight"""
+        self.log.append(self.CHAT_A, "night", "sent", sent_at=riyadh(2026, 3, 10, 23, 59))
+        self.log.append(self.CHAT_A, "night", "sent", sent_at=riyadh(2026, 3, 11, 0, 1))
+        App.flush_delivery_log()
+        days = [day for (day,) in self.query("SELECT day FROM delivery_daily ORDER BY day")]
+        self.assertEqual(len(days), 2)
+        self.assertEqual(datetime.utcfromtimestamp(days[1] * DAY).date(), datetime(2026, 3, 11).date())
+
+    def test_failed_flush_keeps_rows(self):
+        """Test that rows survive a failed write, ahead of rows appended meanwhile"""
+        self.log.append(self.CHAT_A, "morning", "sent", sent_at=1)
+        with patch.object(App, "db_write", side_effect=sqlite3.OperationalError("database is locked")):
+            self.assertEqual(App.flush_delivery_log(), 0)
+        self.log.append(self.CHAT_A, "morning", "sent", sent_at=2)
+        self.assertEqual([row[0] for row in self.log.rows], [1, 2])
+        self.assertEqual(App.flush_delivery_log(), 2)
+
+
+class TestStatsAndRetention(DeliveryLogTestCase):
+    """Test per-chat stats and pruning"""
+
+    def test_stats_from_rollups(self):
+        """Test that stats are summed from delivery_daily without reading delivery_log"""
+        now = int(App.time.time())
+        for days_ago in (0, 1, 40):
+            self.log.append(self.CHAT_A, "morning", "sent", latency=0.2, sent_at=now - days_ago * DAY)
+        self.log.append(self.CHAT_A, "morning", "failed", error_code=400, latency=0.4, sent_at=now)
+        self.log.append(self.CHAT_A, "friday_kahf", "expired", sent_at=now)
+        self.log.append(self.CHAT_B, "morning", "sent", sent_at=now)
+        App.flush_delivery_log()
+        self.query("DELETE FROM delivery_log")
+
+        stats = App.get_chat_delivery_stats(self.CHAT_A)
+        self.assertEqual(set(stats), {"morning", "friday_kahf"})
+        self.assertEqual(stats["morning"]["sent"], 2)
+        self.assertEqual(stats["morning"]["failed"], 1)
+        self.assertEqual(stats["morning"]["messages"], 2)
+        self.assertAlmostEqual(stats["morning"]["avg_latency_ms"], 800 / 3)
+        self.assertEqual(stats["friday_kahf"]["expired"], 1)
+        self.assertIsNone(stats["friday_kahf"]["avg_latency_ms"])
+        self.assertEqual(App.get_chat_delivery_stats(self.CHAT_A, days=1)["morning"]["sent"], 1)
+        self.assertEqual(App.get_chat_delivery_stats(-1), {})
+
+    def test_prune(self):
+        """Test that raw rows past retention and rollups past their own retention are deleted"""
+        now = riyadh(2026, 3, 10, 12, 0)
+        for days_ago in (0, App.DELIVERY_LOG_RETENTION_DAYS - 1, App.DELIVERY_LOG_RETENTION_DAYS + 1,
+                         App.DELIVERY_ROLLUP_RETENTION_DAYS + 1):
+            self.log.append(self.CHAT_A, "morning", "sent", sent_at=now - days_ago * DAY)
+        App.flush_delivery_log()
+
+        self.assertEqual(App.prune_delivery_log(now), 2)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM delivery_log"), [(2,)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM delivery_daily"), [(3,)])
+        self.assertEqual(App.prune_delivery_log(now), 0)
+
+    def test_prune_deletes_in_slices(self):
+        """Test that each DELETE covers one slice of the sent_at index and MIN only runs to skip a gap"""
+        now = riyadh(2026, 3, 10, 12, 0)
+        cutoff = now - App.DELIVERY_LOG_RETENTION_DAYS * DAY
+        for slices_before in (300, 3, 2):
+            self.log.append(self.CHAT_A, "morning", "sent",
+                            sent_at=cutoff - slices_before * App.DELIVERY_PRUNE_SLICE_SECONDS)
+        App.flush_delivery_log()
+        oldest = App.DELIVERY_LOG_OLDEST_QUERY
+        with patch.object(App, "db_write", wraps=App.db_write) as db_write, \
+             patch.object(oldest, "scalar", wraps=oldest.scalar) as scalar:
+            self.assertEqual(App.prune_delivery_log(now), 3)
+        log_deletes = [call.args[0] for call in db_write.call_args_list if "delivery_log" in call.args[0][0][0]]
+        # 300 slices back, the empty slice after it, then the last three up to the cutoff
+        self.assertEqual(len(log_deletes), 5)
+        self.assertEqual(scalar.call_count, 2)
+
+    def test_status_shows_delivery_totals(self):
+        """Test that /status summarizes the chat's recent rollups"""
+        now = int(App.time.time())
+        self.log.append(self.CHAT_A, "morning", "sent", sent_at=now)
+        self.log.append(self.CHAT_A, "evening", "sent", sent_at=now)
+        self.log.append(self.CHAT_A, "evening", "failed", error_code=400, sent_at=now)
+        self.log.append(self.CHAT_A, "evening", "expired", sent_at=now)
+        App.flush_delivery_log()
+        message = MagicMock()
+        message.chat.type = "supergroup"
+        message.chat.id = self.CHAT_A
+        with patch.object(App.bot, "get_chat_member", return_value=MagicMock(status="administrator")), \
+             patch.object(App.bot, "send_message") as send:
+            App.cmd_status(message)
+        text = send.call_args.args[1]
+        self.assertIn("تم الإرسال: 2", text)
+        self.assertIn("فشل: 1", text)
+        self.assertIn("لم يُرسل: 1", text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+Tests for the precomputed daily delivery plan.
+"""
+
+import os
+import sys
+import time
+import unittest
+from datetime import date, datetime
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+from App import DeliveryPlan, PLAN_CODES
+
+
+FRIDAY = date(2026, 10, 23)
+
+
+def plan_with(entries, day=FRIDAY):
+    """Build a plan from (second_of_day, chat_id, category) triples"""
+    midnight = App.plan_midnight(day)
+    return DeliveryPlan(day, [(midnight + second, chat_id, PLAN_CODES[category])
+                              for second, chat_id, category in entries])
+
+
+class TestDeliveryPlan(unittest.TestCase):
+    """Test the array-backed plan and its cursor"""
+
+    def test_midnight_is_local(self):
+        """Test that the plan starts at midnight in TIMEZONE"""
+        plan = DeliveryPlan(FRIDAY)
+        local = datetime.fromtimestamp(plan.midnight, App.TIMEZONE)
+        self.assertEqual((local.date(), local.hour, local.minute), (FRIDAY, 0, 0))
+
+    def test_pop_due_walks_in_time_order(self):
+        """Test that due entries come out once, sorted by send time"""
+        plan = plan_with([(3600, -3, "evening"), (60, -1, "morning"), (600, -2, "sleep")])
+        due = plan.pop_due(plan.midnight + 600)
+        self.assertEqual([(chat_id, category) for _, chat_id, category in due], [(-1, "morning"), (-2, "sleep")])
+        self.assertEqual(plan.pop_due(plan.midnight + 600), [])
+        self.assertEqual(len(plan), 1)
+
+    def test_pop_due_without_dispatch_skips(self):
+        """Test that skipping past entries returns nothing and advances the cursor"""
+        plan = plan_with([(60, -1, "morning"), (3600, -1, "evening")])
+        self.assertEqual(plan.pop_due(plan.midnight + 120, dispatch=False), [])
+        self.assertEqual(set(plan.entries_for(-1)), {"evening"})
+
+    def test_replace_patches_in_place(self):
+        """Test that replace adds, keeps and cancels only the given categories"""
+        plan = plan_with([(60, -1, "morning"), (120, -2, "morning"), (3600, -1, "sleep")])
+        added, removed = plan.replace(-1, ("morning", "sleep"), [(60, "morning"), (7200, "evening")], plan.midnight)
+        self.assertEqual((added, removed), (1, 1))
+        self.assertEqual(plan.entries_for(-1), {"morning": plan.midnight + 60, "evening": plan.midnight + 7200})
+        self.assertEqual(set(plan.entries_for(-2)), {"morning"})
+        due = plan.pop_due(plan.midnight + 10_000)
+        self.assertEqual([category for _, chat_id, category in due if chat_id == -1], ["morning", "evening"])
+
+    def test_replace_ignores_past_times(self):
+        """Test that entries whose time already passed today are not added"""
+        plan = plan_with([])
+        added, _ = plan.replace(-1, ("morning",), [(60, "morning")], plan.midnight + 600)
+        self.assertEqual(added, 0)
+        self.assertEqual(len(plan), 0)
+
+    def test_replace_other_section_left_alone(self):
+        """Test that patching the chat section keeps fasting entries"""
+        plan = plan_with([(60, -1, "fasting_monday_thursday")])
+        plan.replace(-1, App.CHAT_PLAN_SECTIONS["chat"], [], plan.midnight)
+        self.assertEqual(set(plan.entries_for(-1)), {"fasting_monday_thursday"})
+
+
+class TestBuildAndDispatch(unittest.TestCase):
+    """Test building the plan from the database and dispatching it"""
+
+    CHAT_ID = -1009700000001
+
+    def setUp(self):
+        App.scheduler.pause_job(App.DELIVERY_DISPATCH_JOB_ID)
+        App.get_chat_settings(self.CHAT_ID)
+
+    def tearDown(self):
+        App.scheduler.resume_job(App.DELIVERY_DISPATCH_JOB_ID)
+
+    def test_build_reads_enabled_chats(self):
+        """Test that the build plans enabled chats and skips disabled ones"""
+        future_day = date(2099, 1, 2)  # A Friday
+        with patch.object(App, "delivery_plan", None):
+            plan = App.build_delivery_plan(future_day)
+            self.assertIs(App.delivery_plan, plan)
+            entries = plan.entries_for(self.CHAT_ID)
+            self.assertTrue({"morning", "evening", "friday_kahf", "friday_dua"} <= set(entries))
+            App.update_chat_setting(self.CHAT_ID, "is_enabled", 0)
+            try:
+                self.assertEqual(App.build_delivery_plan(future_day).entries_for(self.CHAT_ID), {})
+            finally:
+                App.update_chat_setting(self.CHAT_ID, "is_enabled", 1)
+
+    def test_dispatch_rebuilds_stale_plan(self):
+        """Test that a plan from another day is rebuilt before dispatching"""
+        stale = DeliveryPlan(date(2000, 1, 1))
+        with patch.object(App, "delivery_plan", stale), \
+             patch.object(App, "build_delivery_plan", return_value=DeliveryPlan(FRIDAY)) as build:
+            App.dispatch_delivery_plan()
+        build.assert_called_once_with()
+
+    def test_plan_is_only_rebuilt_by_dispatch(self):
+        """Test that no scheduled job rebuilds the plan behind dispatch's back"""
+        self.assertNotIn(App.build_delivery_plan, [job.func for job in App.scheduler.get_jobs()])
+
+    def test_dispatch_submits_due_entries(self):
+        """Test that due entries are handed to the delivery workers"""
+        today = datetime.now(App.TIMEZONE).date()
+        plan = DeliveryPlan(today)
+        now = time.time()
+        plan.replace(self.CHAT_ID, ("morning",), [(int(now) - plan.midnight + 1, "morning")], now)
+        with patch.object(App, "delivery_plan", plan), \
+             patch.object(App.plan_executor, "submit") as submit, \
+             patch.object(App.time, "time", return_value=now + 5):
+            App.dispatch_delivery_plan()
+        submit.assert_called_once_with(App.run_plan_entry, self.CHAT_ID, "morning")
+
+    def test_run_plan_entry_routes_fasting(self):
+        """Test that fasting entries go to the fasting reminder sender"""
+        with patch.object(App, "send_fasting_reminder") as fasting, patch.object(App, "send_azkar") as azkar:
+            App.run_plan_entry(self.CHAT_ID, "fasting_monday_thursday")
+            App.run_plan_entry(self.CHAT_ID, "sleep")
+        fasting.assert_called_once_with(self.CHAT_ID, "monday_thursday")
+        azkar.assert_called_once_with(self.CHAT_ID, "sleep")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+Tests for diff-based incremental rescheduling of per-chat deliveries.
+"""
+
+import os
+import sys
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+
+def make_chat_settings(chat_id, **overrides):
+    settings = {
+        "chat_id": chat_id,
+        "is_enabled": True,
+        "morning_azkar": True,
+        "evening_azkar": True,
+        "friday_sura": True,
+        "friday_dua": True,
+        "sleep_message": True,
+        "delete_service_messages": True,
+        "morning_time": "05:00",
+        "evening_time": "18:00",
+        "sleep_time": "22:00",
+        "media_enabled": False,
+        "media_type": "images",
+        "send_media_with_morning": False,
+        "send_media_with_evening": False,
+        "send_media_with_friday": False,
+    }
+    settings.update(overrides)
+    return settings
+
+
+class TestIncrementalRescheduling(unittest.TestCase):
+    """Test that setting changes only touch the affected plan entries"""
+
+    CHAT_ID = -1009000000001
+    # A Sunday: carries the fasting reminder but no Friday entries
+    DAY = date(2026, 10, 25)
+
+    def setUp(self):
+        self.chat = make_chat_settings(self.CHAT_ID)
+        self.diverse = {"chat_id": self.CHAT_ID, "enabled": True, "interval_minutes": 60}
+        self.fasting = {"chat_id": self.CHAT_ID, "monday_thursday_enabled": True, "reminder_time": "21:00"}
+        self.patches = [
+            patch.object(App, "get_chat_settings", side_effect=lambda chat_id: dict(self.chat)),
+            patch.object(App, "get_diverse_azkar_settings", side_effect=lambda chat_id: dict(self.diverse)),
+            patch.object(App, "get_fasting_reminders_settings", side_effect=lambda chat_id: dict(self.fasting)),
+            # Jobs fire on the live scheduler; keep them away from Telegram
+            patch.object(App, "send_azkar"),
+            patch.object(App, "send_diverse_azkar"),
+            patch.object(App, "send_fasting_reminder"),
+            patch.object(App, "save_diverse_next_due"),
+            patch.object(App, "wake_diverse_wheel"),
+            # A fresh plan for a future day so every entry is still ahead
+            patch.object(App, "delivery_plan", App.DeliveryPlan(self.DAY)),
+        ]
+        self.mocks = [p.start() for p in self.patches]
+
+    def tearDown(self):
+        App.remove_chat_jobs(self.CHAT_ID)
+        for p in self.patches:
+            p.stop()
+
+    def entries(self, chat_id=None):
+        return App.delivery_plan.entries_for(chat_id or self.CHAT_ID)
+
+    def diverse_due(self):
+        return App.diverse_wheel.due.get(self.CHAT_ID)
+
+    def push_diverse_due(self):
+        """Move the chat's diverse entry far into the future and return its due tick"""
+        due_tick = App.current_wheel_tick() + 1000
+        App.diverse_wheel.schedule(self.CHAT_ID, due_tick)
+        return due_tick
+
+    def test_full_schedule_plans_all_entries(self):
+        """Test that a full schedule plans every entry of the day and the wheel entry"""
+        App.schedule_chat_jobs(self.CHAT_ID)
+        self.assertEqual(set(self.entries()), {"morning", "evening", "sleep", "fasting_monday_thursday"})
+        self.assertIn(self.CHAT_ID, App.diverse_wheel)
+        self.assertIsNone(App.scheduler.get_job(f"morning_{self.CHAT_ID}"))
+
+    def test_friday_plans_kahf_and_dua(self):
+        """Test that Friday plans include the Kahf and dua reminders"""
+        with patch.object(App, "delivery_plan", App.DeliveryPlan(date(2026, 10, 23))):
+            App.schedule_chat_jobs(self.CHAT_ID)
+            self.assertEqual(set(self.entries()), {"morning", "evening", "sleep", "friday_kahf", "friday_dua"})
+
+    def test_unrelated_toggle_keeps_diverse_next_run(self):
+        """Test that toggling morning azkar does not reset the diverse azkar entry"""
+        App.schedule_chat_jobs(self.CHAT_ID)
+        before = self.push_diverse_due()
+
+        self.chat["morning_azkar"] = False
+        App.reschedule_chat_jobs(self.CHAT_ID, "chat")
+
+        self.assertNotIn("morning", self.entries())
+        self.assertIn("evening", self.entries())
+        self.assertEqual(self.diverse_due(), before)
+
+    def test_full_reschedule_is_idempotent(self):
+        """Test that re-running schedule_chat_jobs leaves the plan unchanged"""
+        App.schedule_chat_jobs(self.CHAT_ID)
+        before = self.push_diverse_due()
+        plan = App.delivery_plan
+        snapshot = (list(plan.epochs), list(plan.chat_ids), list(plan.codes))
+        App.schedule_chat_jobs(self.CHAT_ID)
+        self.assertEqual((list(plan.epochs), list(plan.chat_ids), list(plan.codes)), snapshot)
+        self.assertEqual(self.diverse_due(), before)
+
+    def test_time_change_updates_only_that_entry(self):
+        """Test that changing the morning time only moves the morning entry"""
+        App.schedule_chat_jobs(self.CHAT_ID)
+        before = self.entries()
+        self.chat["morning_time"] = "06:30"
+        App.reschedule_chat_jobs(self.CHAT_ID, "chat")
+        after = self.entries()
+        hour, minute, second = App.jittered_time(self.CHAT_ID, 6, 30)
+        self.assertEqual(after["morning"], App.delivery_plan.midnight + hour * 3600 + minute * 60 + second)
+        self.assertEqual({k: v for k, v in after.items() if k != "morning"},
+                         {k: v for k, v in before.items() if k != "morning"})
+
+    def test_section_reads_only_its_settings(self):
+        """Test that a diverse change does not read fasting settings"""
+        App.reschedule_chat_jobs(self.CHAT_ID, "diverse")
+        get_chat, get_diverse, get_fasting = self.mocks[:3]
+        get_diverse.assert_called_once()
+        get_fasting.assert_not_called()
+        self.assertIn(self.CHAT_ID, App.diverse_wheel)
+        self.assertEqual(self.entries(), {})
+
+    def test_interval_change_does_not_send_immediately(self):
+        """Test that changing the interval pushes the next run one interval out"""
+        App.reschedule_chat_jobs(self.CHAT_ID, "diverse")
+        self.diverse["interval_minutes"] = 30
+        App.reschedule_chat_jobs(self.CHAT_ID, "diverse")
+        delta_ticks = self.diverse_due() - App.current_wheel_tick()
+        self.assertGreater(delta_ticks * App.DIVERSE_WHEEL_TICK_SECONDS, 25 * 60)
+
+    def test_disable_removes_only_that_chat(self):
+        """Test that disabling a chat removes its entries and leaves other chats alone"""
+        other_chat = self.CHAT_ID * 10 - 1  # contains CHAT_ID as a substring
+        App.schedule_chat_jobs(self.CHAT_ID)
+        App.schedule_chat_jobs(other_chat)
+        try:
+            self.chat["is_enabled"] = False
+            App.reschedule_chat_jobs(self.CHAT_ID, "chat")
+            self.assertEqual(self.entries(), {})
+            self.assertNotIn(self.CHAT_ID, App.diverse_wheel)
+            self.assertIn("morning", self.entries(other_chat))
+            self.assertIn(other_chat, App.diverse_wheel)
+        finally:
+            App.remove_chat_jobs(other_chat)
+
+
+if __name__ == '__main__':
+    unittest.main()
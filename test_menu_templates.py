@@ -0,0 +1,121 @@
+"""
+Tests for the cached settings menu templates.
+"""
+
+import json
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+from App import render_settings_menu, pack_settings_flags
+
+
+def callback_data_of(keyboard_json):
+    keyboard = json.loads(keyboard_json)["inline_keyboard"]
+    return [button["callback_data"] for row in keyboard for button in row]
+
+
+class TestMenuTemplateCache(unittest.TestCase):
+    """Test the (screen, flags, values) template cache"""
+
+    def setUp(self):
+        App.menu_template_cache.clear()
+        self.hits = App.CACHE_REQUESTS.value("menu_template", "hit")
+        self.misses = App.CACHE_REQUESTS.value("menu_template", "miss")
+
+    def cache_stats(self):
+        return (App.CACHE_REQUESTS.value("menu_template", "hit") - self.hits,
+                App.CACHE_REQUESTS.value("menu_template", "miss") - self.misses)
+
+    def test_pack_settings_flags(self):
+        """Test that flags are packed in key order with defaults"""
+        keys = (("a", 1), ("b", 1), ("c", 0))
+        self.assertEqual(pack_settings_flags({"a": True, "b": False}, keys), 0b001)
+        self.assertEqual(pack_settings_flags({}, keys), 0b011)
+        self.assertEqual(pack_settings_flags({"a": 0, "b": 0, "c": 1}, keys), 0b100)
+
+    def test_same_state_is_cache_hit_across_chats(self):
+        """Test that two chats with identical settings share one template"""
+        settings = {"friday_sura": 1, "friday_dua": 0}
+        render_settings_menu("friday", -1001, settings)
+        render_settings_menu("friday", -1002, settings)
+        self.assertEqual(self.cache_stats(), (1, 1))
+        self.assertEqual(len(App.menu_template_cache), 1)
+
+    def test_chat_id_substituted(self):
+        """Test that every chat-scoped callback carries the real chat_id"""
+        text, keyboard = render_settings_menu("diverse", -100555, {"enabled": 1, "interval_minutes": 15})
+        data = callback_data_of(keyboard)
+        self.assertNotIn("@@", keyboard)
+        decoded = [App.decode_callback_data(d) for d in data]
+        self.assertIn((App.CallbackAction.TOGGLE_DIVERSE_AZKAR, -100555, ()), decoded)
+        self.assertIn((App.CallbackAction.DIVERSE_INTERVAL, -100555, (1440,)), decoded)
+        self.assertEqual(decoded[-1], (App.CallbackAction.SELECT_GROUP, -100555, ()))
+        self.assertIn("15 دقيقة", text)
+
+    def test_state_changes_select_different_templates(self):
+        """Test that toggling a flag or changing a time renders a new template"""
+        settings = {"morning_azkar": 1, "evening_azkar": 1, "morning_time": "05:00", "evening_time": "18:00"}
+        first_text, first_keyboard = render_settings_menu("morning_evening", -1, settings)
+
+        settings["morning_azkar"] = 0
+        text, keyboard = render_settings_menu("morning_evening", -1, settings)
+        self.assertNotEqual(keyboard, first_keyboard)
+        self.assertTrue(json.loads(keyboard)["inline_keyboard"][0][0]["text"].startswith("❌"))
+
+        settings["morning_time"] = "06:30"
+        text, _ = render_settings_menu("morning_evening", -1, settings)
+        self.assertIn("06:30", text)
+        self.assertEqual(self.cache_stats()[1], 3)
+
+    def test_cache_is_bounded(self):
+        """Test that the cache never grows past MENU_TEMPLATE_CACHE_MAX"""
+        with patch.object(App, "MENU_TEMPLATE_CACHE_MAX", 4):
+            for minute in range(10):
+                render_settings_menu("morning_evening", -1, {"morning_time": f"05:{minute:02d}"})
+                self.assertLessEqual(len(App.menu_template_cache), 4)
+
+
+class TestMenuHandlers(unittest.TestCase):
+    """Test that settings handlers render through the template layer"""
+
+    def _make_call(self, data):
+        call = MagicMock()
+        call.data = data
+        call.id = "cb1"
+        call.from_user.id = 111
+        call.message.chat.id = 111
+        call.message.message_id = 7
+        return call
+
+    def test_friday_screen_and_toggle_render_same_keyboard(self):
+        """Test that the screen and its toggle handler show the same keyboard"""
+        settings = {"friday_sura": 1, "friday_dua": 1}
+
+        def update(chat_id, key, value):
+            settings[key] = value
+
+        with patch.object(App, "is_user_admin_of_chat", return_value=True), \
+             patch.object(App, "get_chat_settings", side_effect=lambda chat_id: dict(settings)), \
+             patch.object(App, "update_chat_setting", side_effect=update), \
+             patch.object(App, "reschedule_chat_jobs"), \
+             patch.object(App.bot, "answer_callback_query"), \
+             patch.object(App.bot, "edit_message_text") as edit:
+            App.callback_toggle_friday(self._make_call("toggle_friday_dua_-100777"))
+            settings["friday_dua"] = 0
+            App.callback_friday_settings(self._make_call("friday_settings_-100777"))
+
+        toggled, screen = (c.kwargs["reply_markup"] for c in edit.call_args_list)
+        self.assertIsInstance(screen, str)
+        self.assertEqual(toggled, screen)
+        self.assertIn(App.encode_callback_data(App.CallbackAction.FRIDAY_TIME_SETTINGS, -100777),
+                      callback_data_of(screen))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+Tests for the Prometheus /metrics endpoint and instrumentation.
+"""
+
+import os
+import sys
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import telebot
+import App
+
+
+def api_error(code, description):
+    return telebot.apihelper.ApiTelegramException(
+        "sendMessage", None, {"error_code": code, "description": description})
+
+
+class TestMetricTypes(unittest.TestCase):
+    """Test counter and histogram exposition"""
+
+    def setUp(self):
+        self.registry = list(App.metrics_registry)
+
+    def tearDown(self):
+        App.metrics_registry[:] = self.registry
+
+    def test_counter_exposition(self):
+        """Test that counters render HELP, TYPE and labelled samples"""
+        counter = App.Counter("test_things", "Things", ("kind",))
+        counter.inc("a")
+        counter.inc("a", amount=2)
+        counter.inc('quote"d')
+        lines = counter.collect()
+        self.assertIn("# TYPE azkar_test_things_total counter", lines)
+        self.assertIn('azkar_test_things_total{kind="a"} 3', lines)
+        self.assertIn('azkar_test_things_total{kind="quote\\"d"} 1', lines)
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Test that histogram buckets are cumulative and end with +Inf"""
+        histogram = App.Histogram("test_seconds", "Latency", ("op",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, "x")
+        lines = histogram.collect()
+        self.assertIn('azkar_test_seconds_bucket{op="x",le="0.1"} 1', lines)
+        self.assertIn('azkar_test_seconds_bucket{op="x",le="1.0"} 3', lines)
+        self.assertIn('azkar_test_seconds_bucket{op="x",le="+Inf"} 4', lines)
+        self.assertIn('azkar_test_seconds_count{op="x"} 4', lines)
+        self.assertEqual(histogram.count("x"), 4)
+
+
+class TestInstrumentation(unittest.TestCase):
+    """Test that the bot records the documented series"""
+
+    def test_metrics_endpoint(self):
+        """Test that /metrics serves text exposition without Telegram calls"""
+        with patch.object(App.bot, "get_webhook_info") as webhook_info:
+            response = App.app.test_client().get("/metrics")
+        webhook_info.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        body = response.get_data(as_text=True)
+        for name in ("azkar_webhook_updates_total", "azkar_handler_duration_seconds",
+                     "azkar_messages_sent_total", "azkar_telegram_errors_total",
+                     "azkar_db_query_duration_seconds", "azkar_scheduler_job_lag_seconds",
+                     "azkar_cache_requests_total"):
+            self.assertIn(f"# TYPE {name}", body)
+
+    def test_db_functions_are_timed(self):
+        """Test that settings getters record DB latency"""
+        before = App.DB_QUERY_SECONDS.count("get_chat_settings")
+        App.get_chat_settings(-100424242)
+        self.assertEqual(App.DB_QUERY_SECONDS.count("get_chat_settings"), before + 1)
+
+    def test_send_results_and_error_classes(self):
+        """Test that sends are counted by category and result, errors by class"""
+        sent = App.MESSAGES_SENT.value("sleep", "sent")
+        failed = App.MESSAGES_SENT.value("sleep", "failed")
+        forbidden = App.TELEGRAM_ERRORS.value("forbidden")
+        settings = {"is_enabled": True, "sleep_message": True}
+        with patch.object(App, "get_chat_settings", return_value=settings), \
+             patch.object(App, "update_chat_setting"), \
+             patch.object(App.bot, "send_message") as send:
+            App.send_azkar(-100111, "sleep")
+            send.side_effect = api_error(403, "Forbidden: bot was kicked from the group chat")
+            App.send_azkar(-100112, "sleep")
+        self.assertEqual(App.MESSAGES_SENT.value("sleep", "sent"), sent + 1)
+        self.assertEqual(App.MESSAGES_SENT.value("sleep", "failed"), failed + 1)
+        self.assertEqual(App.TELEGRAM_ERRORS.value("forbidden"), forbidden + 1)
+
+    def test_error_code_classes(self):
+        """Test the coarse Telegram error classes"""
+        self.assertEqual(App.classify_telegram_error_code(api_error(429, "Too Many Requests")), "rate_limited")
+        self.assertEqual(App.classify_telegram_error_code(api_error(400, "Bad Request")), "bad_request")
+        self.assertEqual(App.classify_telegram_error_code(api_error(502, "Bad Gateway")), "server_error")
+        self.assertEqual(App.classify_telegram_error_code(ValueError()), "other")
+
+    def test_webhook_counts_update_type(self):
+        """Test that webhook updates are counted by payload type"""
+        before = App.WEBHOOK_UPDATES.value("callback_query")
+        with patch.object(App.types.Update, "de_json") as de_json, \
+             patch.object(App.bot, "process_new_updates"):
+            de_json.return_value = SimpleNamespace(message=None, callback_query=object(), update_id=1)
+            App.app.test_client().post(App.WEBHOOK_PATH, data="{}", content_type="application/json")
+        self.assertEqual(App.WEBHOOK_UPDATES.value("callback_query"), before + 1)
+
+    def test_handlers_instrumented_once(self):
+        """Test that handler wrapping records latency and is idempotent"""
+        App.instrument_bot_handlers()
+        App.instrument_bot_handlers()
+        handler = next(h for h in App.bot.message_handlers if h["function"].__name__ == "cmd_status")
+        self.assertTrue(handler["function"]._timed)
+        before = App.HANDLER_SECONDS.count("cmd_status")
+        message = MagicMock()
+        message.chat.type = "private"
+        with patch.object(App.bot, "send_message"):
+            handler["function"](message)
+        self.assertEqual(App.HANDLER_SECONDS.count("cmd_status"), before + 1)
+
+    def test_scheduler_lag_by_job_kind(self):
+        """Test that scheduler lag is labelled by job kind without the chat_id"""
+        self.assertEqual(App.job_kind("morning_-100123"), "morning")
+        self.assertEqual(App.job_kind("diverse_azkar_-100123"), "diverse_azkar")
+        self.assertEqual(App.job_kind("webhook_verification"), "webhook_verification")
+        before = App.SCHEDULER_JOB_LAG.count("morning")
+        event = SimpleNamespace(code=App.EVENT_JOB_SUBMITTED, job_id="morning_-100123",
+                                scheduled_run_times=[datetime.now(App.TIMEZONE) - timedelta(seconds=3)])
+        App.on_scheduler_event(event)
+        self.assertEqual(App.SCHEDULER_JOB_LAG.count("morning"), before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
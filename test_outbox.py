@@ -0,0 +1,202 @@
+"""
+Tests for the durable outbox of scheduled messages.
+"""
+
+import os
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import telebot
+import App
+
+
+def api_error(code, description):
+    return telebot.apihelper.ApiTelegramException(
+        "sendMessage", None, {"error_code": code, "description": description})
+
+
+class OutboxTestCase(unittest.TestCase):
+    CHAT_A = -1009600000001
+    CHAT_B = -1009600000002
+
+    def setUp(self):
+        self.due = int(time.time()) // 60 * 60
+        App.scheduler.pause_job("outbox_drain")
+        self.execute("DELETE FROM outbox")
+
+    def tearDown(self):
+        self.execute("DELETE FROM outbox")
+        App.scheduler.resume_job("outbox_drain")
+
+    def execute(self, sql, params=()):
+        conn, c, _ = App.get_db_connection()
+        try:
+            c.execute(sql, params)
+            rows = c.fetchall()
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+    def pending(self):
+        return self.execute(
+            "SELECT chat_id, category, message_index FROM outbox WHERE settled_at IS NULL ORDER BY id")
+
+
+class TestOutboxQueue(OutboxTestCase):
+    """Test enqueueing and claiming outbox rows"""
+
+    def test_enqueue_is_idempotent_per_slot(self):
+        """Test that re-enqueueing the same slot does not duplicate rows"""
+        self.assertEqual(App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due), 3)
+        self.assertEqual(App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due), 0)
+        self.assertEqual(len(self.pending()), 3)
+
+    def test_claim_takes_whole_sequences(self):
+        """Test that a claim leases every message of a sequence, in order"""
+        App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due)
+        App.enqueue_outbox(self.CHAT_B, "morning", 2, due_at=self.due)
+        rows = App.claim_outbox_batch("worker-1")
+        self.assertEqual(sorted((row[1], row[3]) for row in rows),
+                         sorted([(self.CHAT_A, 0), (self.CHAT_A, 1), (self.CHAT_A, 2), (self.CHAT_B, 0), (self.CHAT_B, 1)]))
+        self.assertEqual([row[3] for row in rows if row[1] == self.CHAT_A], [0, 1, 2])
+        # Leased sequences are invisible to other workers
+        self.assertEqual(App.claim_outbox_batch("worker-2"), [])
+
+    def test_claim_limit_counts_sequences(self):
+        """Test that the claim limit bounds sequences, not messages"""
+        App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due)
+        App.enqueue_outbox(self.CHAT_B, "morning", 2, due_at=self.due)
+        rows = App.claim_outbox_batch("worker-1", limit=1)
+        self.assertEqual([(row[1], row[3]) for row in rows], [(self.CHAT_A, 0), (self.CHAT_A, 1), (self.CHAT_A, 2)])
+
+    def test_expired_lease_is_reclaimed(self):
+        """Test that rows of a crashed worker are picked up after the lease"""
+        App.enqueue_outbox(self.CHAT_A, "sleep", 1, due_at=self.due)
+        first = App.claim_outbox_batch("crashed-worker")
+        self.execute("UPDATE outbox SET claimed_until = ?", (int(time.time()) - 1,))
+        second = App.claim_outbox_batch("worker-2")
+        self.assertEqual(second[0][0], first[0][0])
+        self.assertEqual(second[0][6], 2)  # attempts
+
+
+class TestOutboxDelivery(OutboxTestCase):
+    """Test draining the outbox"""
+
+    def test_drain_delivers_in_order(self):
+        """Test that a chat's messages are delivered in order and settled"""
+        App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due)
+        App.enqueue_outbox(self.CHAT_B, "sleep", 1, due_at=self.due)
+        with patch.object(App.bot, "send_message") as send:
+            self.assertEqual(App.drain_outbox(), 4)
+        texts_a = [call.args[1] for call in send.call_args_list if call.args[0] == self.CHAT_A]
+        self.assertEqual(texts_a, App.MORNING_AZKAR[:3])
+        self.assertEqual(self.pending(), [])
+
+    def test_delivery_resumes_after_restart(self):
+        """Test that messages left by a crash mid-broadcast are still delivered"""
+        App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due)
+        first, *_ = App.claim_outbox_batch("crashed-worker")
+        App.settle_outbox([first[0]], {}, set())
+        self.execute("UPDATE outbox SET claimed_until = ?", (int(time.time()) - 1,))
+        self.assertEqual(len(self.pending()), 2)
+        with patch.object(App.bot, "send_message") as send:
+            App.drain_outbox()
+        self.assertEqual([call.args[1] for call in send.call_args_list], App.MORNING_AZKAR[1:3])
+
+    def test_unreachable_chat_rows_are_dropped(self):
+        """Test that a kicked chat's remaining messages are settled unsent"""
+        App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due)
+        with patch.object(App.bot, "send_message", side_effect=api_error(403, "Forbidden: bot was kicked")) as send, \
+             patch.object(App, "queue_chat_deactivation"):
+            App.drain_outbox()
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(self.pending(), [])
+
+    def test_transient_failure_is_retried_later(self):
+        """Test that a flood error releases the row until its retry time"""
+        App.enqueue_outbox(self.CHAT_A, "sleep", 1, due_at=self.due)
+        error = telebot.apihelper.ApiTelegramException("sendMessage", None, {
+            "error_code": 429, "description": "Too Many Requests: retry after 40", "parameters": {"retry_after": 40}})
+        with patch.object(App.bot, "send_message", side_effect=error):
+            self.assertEqual(App.drain_outbox(), 0)
+        claimed_by, claimed_until = self.execute("SELECT claimed_by, claimed_until FROM outbox")[0]
+        self.assertIsNone(claimed_by)
+        self.assertGreater(claimed_until, time.time() + 30)
+
+    def test_send_azkar_enqueues_and_delivers(self):
+        """Test that the scheduled job writes the outbox and drains it"""
+        settings = {"is_enabled": True, "sleep_message": True}
+        enqueued = App.OUTBOX_ENQUEUED.value("sleep")
+        with patch.object(App, "get_chat_settings", return_value=settings), \
+             patch.object(App.bot, "send_message") as send:
+            App.send_azkar(self.CHAT_A, "sleep")
+        send.assert_called_once()
+        self.assertEqual(App.OUTBOX_ENQUEUED.value("sleep"), enqueued + 1)
+        self.assertEqual(self.pending(), [])
+
+    def test_refired_job_after_delivery_does_not_resend(self):
+        """Test that delivered rows keep their slot, so the same minute is not queued twice"""
+        App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due)
+        with patch.object(App.bot, "send_message"):
+            App.drain_outbox()
+        self.assertEqual(App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due), 0)
+        with patch.object(App.bot, "send_message") as send:
+            self.assertEqual(App.drain_outbox(), 0)
+        send.assert_not_called()
+
+    def test_retry_holds_back_rest_of_sequence(self):
+        """Test that a retried message releases the later ones without counting an attempt"""
+        App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due)
+        error = telebot.apihelper.ApiTelegramException("sendMessage", None, {
+            "error_code": 429, "description": "Too Many Requests: retry after 40", "parameters": {"retry_after": 40}})
+        with patch.object(App.bot, "send_message", side_effect=error) as send:
+            App.drain_outbox()
+        send.assert_called_once()
+        rows = self.execute("SELECT message_index, claimed_by, attempts FROM outbox ORDER BY message_index")
+        self.assertEqual(rows, [(0, None, 1), (1, None, 0), (2, None, 0)])
+        self.assertEqual(App.claim_outbox_batch("worker-2"), [])
+
+    def test_expiring_lease_releases_unsent_rows(self):
+        """Test that a batch stops sending before its lease runs out"""
+        App.enqueue_outbox(self.CHAT_A, "morning", 3, due_at=self.due)
+        with patch.object(App, "OUTBOX_LEASE_MARGIN_SECONDS", App.OUTBOX_LEASE_SECONDS + 1), \
+             patch.object(App.bot, "send_message") as send:
+            self.assertEqual(App.drain_outbox(max_batches=1), 0)
+        send.assert_not_called()
+        self.assertEqual(len(App.claim_outbox_batch("worker-2")), 3)
+
+    def test_send_azkar_drain_is_bounded(self):
+        """Test that a scheduled send delivers at most its bounded share of the outbox"""
+        for offset in range(App.OUTBOX_BATCH_SIZE + 1):
+            App.enqueue_outbox(self.CHAT_B, "sleep", 1, due_at=self.due - 60 * (offset + 1))
+        settings = {"is_enabled": True, "sleep_message": True}
+        with patch.object(App, "get_chat_settings", return_value=settings), \
+             patch.object(App.bot, "send_message") as send:
+            App.send_azkar(self.CHAT_A, "sleep")
+        self.assertEqual(send.call_count, App.OUTBOX_BATCH_SIZE * App.OUTBOX_SEND_DRAIN_BATCHES)
+        self.assertEqual(len(self.pending()), 2)
+
+    def test_prune_deletes_old_settled_rows(self):
+        """Test that settled rows are kept for the retention window, then deleted"""
+        App.enqueue_outbox(self.CHAT_A, "sleep", 1, due_at=self.due)
+        App.enqueue_outbox(self.CHAT_B, "sleep", 1, due_at=self.due)
+        with patch.object(App.bot, "send_message"):
+            App.drain_outbox()
+        self.execute("UPDATE outbox SET settled_at = ? WHERE chat_id = ?",
+                     (int(time.time()) - App.OUTBOX_SETTLED_RETENTION_SECONDS - 1, self.CHAT_A))
+        self.assertEqual(App.prune_outbox(), 1)
+        self.assertEqual(self.execute("SELECT chat_id FROM outbox"), [(self.CHAT_B,)])
+
+    def test_drain_job_registered(self):
+        """Test that a periodic job picks up leftover rows"""
+        self.assertIsNotNone(App.scheduler.get_job("outbox_drain"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,429 @@
+"""
+Tests for the PostgreSQL health state machine, the read cache and the
+write journal used while PostgreSQL is down.
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+DOWN = App.psycopg2.OperationalError("could not connect to server") if App.POSTGRES_AVAILABLE else None
+
+
+class FakePostgres:
+    """A PostgreSQL server that is either reachable or not, recording committed writes"""
+
+    def __init__(self):
+        self.reachable = True
+        self.connects = 0
+        self.committed = []
+        self.reject = set()
+        self.error = None  # Raised by every execute, e.g. a deadlock
+        self.delay = 0
+
+    def connect(self):
+        self.connects += 1
+        if not self.reachable:
+            raise DOWN
+        conn = MagicMock(closed=False)
+        pending = []
+
+        def execute(sql, params=None):
+            if not self.reachable:
+                raise DOWN
+            if sql in self.reject:
+                raise App.psycopg2.IntegrityError("rejected")
+            if self.error is not None:
+                raise self.error
+            time.sleep(self.delay)
+            pending.append((sql, tuple(params or ())))
+
+        def commit():
+            self.committed.extend(pending)
+            pending.clear()
+
+        conn.cursor.return_value.execute.side_effect = execute
+        conn.cursor.return_value.rowcount = 1
+        conn.cursor.return_value.description = None
+        conn.commit.side_effect = commit
+        conn.rollback.side_effect = pending.clear
+        return conn
+
+
+@unittest.skipUnless(App.POSTGRES_AVAILABLE, "psycopg2 is not installed")
+class HealthFixture(unittest.TestCase):
+    """PostgreSQL configured against FakePostgres, with a fresh health state machine"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp.name, "health.db")
+        self.server = FakePostgres()
+        # The probe thread waits an hour between attempts; tests call probe() directly
+        self.health = App.PostgresHealth(App.WriteJournal(), base_interval=3600)
+        self.cache = App.ReadCache(max_entries=3)
+        self.patches = [
+            patch.object(App, "DB_FILE", self.db_file),
+            patch.object(App, "DATABASE_URL", "postgresql://bot@db.invalid/bot"),
+            patch.object(App, "connect_postgres", side_effect=self.server.connect),
+            patch.object(App, "postgres_health", self.health),
+            patch.object(App, "read_cache", self.cache),
+        ]
+        for p in self.patches:
+            p.start()
+        App.migrate_sqlite_schema()
+
+    def tearDown(self):
+        self.health.stopping.set()
+        App.close_query_connection()
+        App.sqlite_writer.close()
+        for p in reversed(self.patches):
+            p.stop()
+        self.tmp.cleanup()
+
+    def go_down(self):
+        self.server.reachable = False
+        with self.assertRaises(App.DatabaseUnavailable):
+            App.get_db_connection()
+
+    def journal(self):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return [json.loads(row[0]) for row in conn.execute("SELECT statements FROM pg_write_journal ORDER BY id")]
+        finally:
+            conn.close()
+
+
+class TestStateMachine(HealthFixture):
+    """Test the up/down/recovering transitions"""
+
+    def test_failed_connect_marks_down_and_fails_fast(self):
+        """Test that after one failed connect no further connects are attempted"""
+        self.go_down()
+        self.assertEqual(self.health.state, App.DB_DOWN)
+        for _ in range(5):
+            with self.assertRaises(App.DatabaseUnavailable):
+                App.get_db_connection()
+        self.assertEqual(self.server.connects, 1)
+
+    def test_no_sqlite_fallback(self):
+        """Test that a PostgreSQL outage never hands out a SQLite connection"""
+        self.go_down()
+        with self.assertRaises(App.DatabaseUnavailable):
+            App.get_db_connection()
+
+    def test_probe_thread_started(self):
+        """Test that marking PostgreSQL down starts one background probe"""
+        self.go_down()
+        self.assertTrue(self.health.probe_thread.is_alive())
+        thread = self.health.probe_thread
+        self.health.mark_down(DOWN)
+        self.assertIs(self.health.probe_thread, thread)
+
+    def test_failed_probe_stays_down(self):
+        """Test that a probe against an unreachable server changes nothing"""
+        self.go_down()
+        self.assertFalse(self.health.probe())
+        self.assertEqual(self.health.state, App.DB_DOWN)
+
+    def test_probe_recovers(self):
+        """Test that a successful probe marks PostgreSQL up and connections work again"""
+        self.go_down()
+        self.server.reachable = True
+        self.assertTrue(self.health.probe())
+        self.assertEqual(self.health.state, App.DB_UP)
+        conn, c, is_postgres = App.get_db_connection()
+        self.assertTrue(is_postgres)
+
+    def test_sqlite_only_unaffected(self):
+        """Test that without DATABASE_URL SQLite is used as before"""
+        with patch.object(App, "DATABASE_URL", None):
+            conn, c, is_postgres = App.get_db_connection()
+            conn.close()
+        self.assertFalse(is_postgres)
+        self.assertEqual(self.server.connects, 0)
+
+
+class TestStatementErrors(HealthFixture):
+    """Test that a failed statement on a working connection is not an outage"""
+
+    ERRORS = (
+        App.psycopg2.errors.DeadlockDetected("deadlock detected"),
+        App.psycopg2.errors.SerializationFailure("could not serialize access"),
+        App.psycopg2.errors.QueryCanceled("canceling statement due to statement timeout"),
+    ) if App.POSTGRES_AVAILABLE else ()
+
+    def test_write_raises_and_stays_up(self):
+        """Test that a deadlock or timeout in a write is raised without marking down or journaling"""
+        for error in self.ERRORS:
+            with self.subTest(error=type(error).__name__):
+                self.server.error = error
+                with self.assertRaises(type(error)):
+                    App.db_write([("UPDATE t SET a = {p}", (1,))])
+                self.assertEqual(self.health.state, App.DB_UP)
+                self.assertEqual(self.journal(), [])
+
+    def test_read_raises_and_stays_up(self):
+        """Test that a statement timeout in a prepared query is raised, not served from the cache"""
+        qc = MagicMock(is_postgres=True, prepared={"user_admin_count"})
+        qc.conn.closed = 0
+        qc.cursor.execute.side_effect = self.ERRORS[2]
+        with patch.object(App, "query_connection", return_value=qc):
+            with self.assertRaises(App.psycopg2.errors.QueryCanceled):
+                App.USER_ADMIN_COUNT_QUERY.scalar(7)
+        self.assertEqual(self.health.state, App.DB_UP)
+
+    def test_closed_connection_is_lost(self):
+        """Test that any error on a closed connection counts as a lost connection"""
+        self.assertTrue(App.connection_lost(self.ERRORS[0], MagicMock(closed=2)))
+        self.assertTrue(App.connection_lost(App.psycopg2.InterfaceError("connection already closed")))
+        self.assertFalse(App.connection_lost(self.ERRORS[0], MagicMock(closed=0)))
+
+
+class TestReadCache(HealthFixture):
+    """Test reads answered while PostgreSQL is down"""
+
+    def fake_query_connection(self, row):
+        qc = MagicMock(is_postgres=True, prepared=set())
+        qc.cursor.fetchone.return_value = row
+        return patch.object(App, "query_connection", return_value=qc)
+
+    def test_last_read_served_while_down(self):
+        """Test that a row read from PostgreSQL is returned during an outage"""
+        with self.fake_query_connection((-1, 1, 0, "21:00")):
+            App.get_fasting_reminders_settings(-1)
+        self.go_down()
+        with patch.object(App, "query_connection", side_effect=AssertionError("no connection while down")):
+            settings = App.get_fasting_reminders_settings(-1)
+        self.assertEqual(settings["reminder_time"], "21:00")
+        self.assertFalse(settings["arafah_reminder_enabled"])
+
+    def test_miss_fails_fast(self):
+        """Test that an uncached read raises instead of returning defaults"""
+        self.go_down()
+        with self.assertRaises(App.DatabaseUnavailable):
+            App.get_fasting_reminders_settings(-2)
+
+    def test_connection_lost_mid_query(self):
+        """Test that losing the connection on both attempts marks down and serves the cache"""
+        with self.fake_query_connection((3,)):
+            App.USER_ADMIN_COUNT_QUERY.scalar(7)
+        qc = MagicMock(is_postgres=True, prepared={"user_admin_count"})
+        qc.cursor.execute.side_effect = DOWN
+        with patch.object(App, "query_connection", return_value=qc):
+            self.assertEqual(App.USER_ADMIN_COUNT_QUERY.scalar(7), 3)
+        self.assertEqual(self.health.state, App.DB_DOWN)
+
+    def test_bounded(self):
+        """Test that the least recently used entries are evicted"""
+        for key in range(5):
+            self.cache.put(("q", (key,)), key)
+        self.assertEqual(len(self.cache), 3)
+        with self.assertRaises(App.DatabaseUnavailable):
+            self.cache.get(("q", (0,)))
+        self.assertEqual(self.cache.get(("q", (4,))), 4)
+
+
+class TestWriteJournal(HealthFixture):
+    """Test writes made while PostgreSQL is down"""
+
+    def test_writes_journaled_not_sent_to_sqlite(self):
+        """Test that an outage write lands in the journal and not in the SQLite tables"""
+        self.go_down()
+        App.update_ramadan_setting(-1, "ramadan_enabled", False)
+        self.assertEqual(len(self.journal()), 1)
+        conn = sqlite3.connect(self.db_file)
+        try:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM ramadan_settings").fetchone()[0], 0)
+        finally:
+            conn.close()
+
+    def test_failed_write_is_journaled(self):
+        """Test that a write whose connect fails is journaled rather than lost"""
+        self.server.reachable = False
+        self.assertEqual(App.db_write([("UPDATE t SET a = {p}", (1,))]), [-1])
+        self.assertEqual(self.journal(), [[["UPDATE t SET a = {p}", [1]]]])
+        self.assertEqual(self.health.state, App.DB_DOWN)
+
+    def test_replayed_in_order_on_recovery(self):
+        """Test that journaled writes reach PostgreSQL in order before it is marked up"""
+        self.go_down()
+        App.db_write([("UPDATE t SET a = {p}", (1,))])
+        App.db_write([("UPDATE t SET a = {p}", (2,)), ("UPDATE u SET b = {p}", (3,))])
+        self.server.reachable = True
+        self.assertTrue(self.health.probe())
+        self.assertEqual(self.server.committed, [("UPDATE t SET a = %s", (1,)), ("UPDATE t SET a = %s", (2,)),
+                                                 ("UPDATE u SET b = %s", (3,))])
+        self.assertEqual(self.journal(), [])
+        self.assertEqual(App.db_write([("UPDATE t SET a = {p}", (4,))]), [1])
+
+    def test_rejected_write_dropped(self):
+        """Test that a journaled write PostgreSQL rejects does not block the others"""
+        self.go_down()
+        self.server.reject.add("INSERT INTO t VALUES (%s)")
+        App.db_write([("INSERT INTO t VALUES ({p})", (1,))])
+        App.db_write([("UPDATE t SET a = {p}", (2,))])
+        self.server.reachable = True
+        self.assertTrue(self.health.probe())
+        self.assertEqual(self.server.committed, [("UPDATE t SET a = %s", (2,))])
+        self.assertEqual(self.journal(), [])
+
+    def test_outage_during_replay(self):
+        """Test that a replay cut short keeps the unapplied writes and stays down"""
+        self.go_down()
+        App.db_write([("UPDATE t SET a = {p}", (1,))])
+        self.server.reachable = True
+        with patch.object(self.health.journal, "replay", side_effect=DOWN):
+            self.assertFalse(self.health.probe())
+        self.assertEqual(self.health.state, App.DB_DOWN)
+        self.assertEqual(len(self.journal()), 1)
+
+    def test_concurrent_replayers_apply_each_write_once(self):
+        """Test that two processes recovering together replay the shared journal once, in order"""
+        other = App.PostgresHealth(App.WriteJournal(owner="other-worker"), base_interval=3600)
+        self.health.journal.owner = "this-worker"
+        self.go_down()
+        other.mark_down(DOWN)
+        for i in range(250):
+            self.health.journal.append([("UPDATE t SET a = {p}", (i,))])
+        self.server.reachable = True
+        self.server.delay = 0.0005
+        results = []
+        threads = [threading.Thread(target=lambda h=h: results.append(h.probe())) for h in (self.health, other)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(30)
+        finally:
+            other.stopping.set()
+        self.assertEqual(results, [True, True])
+        self.assertEqual(self.server.committed, [("UPDATE t SET a = %s", (i,)) for i in range(250)])
+        self.assertEqual(self.journal(), [])
+
+    def test_claimed_entries_wait_for_their_owner(self):
+        """Test that entries claimed by another live process are neither replayed nor left behind"""
+        self.go_down()
+        App.db_write([("UPDATE t SET a = {p}", (1,))])
+        App.sqlite_writer.execute([("UPDATE pg_write_journal SET claimed_by = ?, claimed_until = ?",
+                                    ("other-worker", int(time.time()) + 60))])
+        self.server.reachable = True
+        self.assertEqual(self.health.journal.replay(self.server.connect()), 0)
+        self.assertEqual(self.server.committed, [])
+        self.health.stopping.set()  # Stop the probe waiting for the claim
+        self.assertFalse(self.health.probe())
+        self.assertEqual(self.health.state, App.DB_DOWN)
+
+    def test_write_behind_kept_while_down(self):
+        """Test that buffered deliveries wait in memory during an outage"""
+        self.go_down()
+        with patch.object(App, "delivery_buffer", {-1: [100, 2]}):
+            self.assertEqual(App.flush_delivery_buffer(), 0)
+            self.assertEqual(App.delivery_buffer, {-1: [100, 2]})
+
+
+class TestOutboxWhileDown(HealthFixture):
+    """Test that the outbox pauses during an outage instead of failing"""
+
+    def test_enqueue_journaled(self):
+        """Test that queued messages are journaled and reach PostgreSQL on recovery"""
+        self.go_down()
+        self.assertEqual(App.enqueue_outbox(-1, "morning", 2, due_at=600), 0)
+        (statements,) = self.journal()
+        self.assertIn("INSERT INTO outbox", statements[0][0])
+        self.server.reachable = True
+        self.assertTrue(self.health.probe())
+        (sql, params), = self.server.committed
+        self.assertTrue(sql.startswith("INSERT INTO outbox"))
+        self.assertEqual(params[:6], (-1, "morning", 0, None, 600, 600 + App.DELIVERY_DEADLINES["morning"]))
+
+    def test_claim_is_not_journaled(self):
+        """Test that a claim during an outage raises instead of landing in the journal"""
+        self.server.reachable = False
+        with self.assertRaises(App.DatabaseUnavailable):
+            App.claim_outbox_batch("worker")
+        self.assertEqual(self.journal(), [])
+
+    def dispatch_due_morning(self):
+        """Put a morning entry for chat -1 in today's plan and dispatch it inline"""
+        now = time.time()
+        plan = App.DeliveryPlan(datetime.now(App.TIMEZONE).date())
+        plan.replace(-1, ("morning",), [(int(now) - plan.midnight, "morning")], now - 1)
+        with patch.object(App, "delivery_plan", plan), \
+             patch.object(App.plan_executor, "submit", side_effect=lambda fn, *args: fn(*args)):
+            App.dispatch_delivery_plan()
+        self.assertEqual(list(plan.pop_due(now + 60)), [])
+
+    def outbox_inserts(self):
+        return [params for sql, params in self.server.committed if sql.startswith("INSERT INTO outbox")]
+
+    def test_dispatched_send_journaled_while_down(self):
+        """Test that a due entry dispatched during an outage is in the outbox after recovery"""
+        settings = {"is_enabled": 1, "morning_azkar": 1}
+        self.go_down()
+        with patch.object(App, "get_chat_settings", return_value=settings):
+            self.dispatch_due_morning()
+        self.assertEqual(self.outbox_inserts(), [])
+        self.server.reachable = True
+        self.assertTrue(self.health.probe())
+        (params,) = self.outbox_inserts()
+        due_at = params[4]
+        self.assertEqual(params[:6], (-1, "morning", 0, None, due_at, due_at + App.DELIVERY_DEADLINES["morning"]))
+        self.assertEqual(len(params), 6 * len(App.MORNING_AZKAR))
+
+    def test_send_parked_until_recovery(self):
+        """Test that a send whose settings cannot be read is queued by the first drain after recovery"""
+        settings = {"is_enabled": 1, "morning_azkar": 1}
+
+        def get_chat_settings(chat_id):
+            if not self.health.is_up():
+                raise App.DatabaseUnavailable("not cached")
+            return settings
+
+        self.go_down()
+        with patch.object(App, "get_chat_settings", side_effect=get_chat_settings), \
+             patch.object(App, "parked_azkar", {}), \
+             patch.object(App, "claim_outbox_batch", return_value=[]):
+            self.dispatch_due_morning()
+            ((chat_id, category, due_at),) = App.parked_azkar
+            self.assertEqual((chat_id, category), (-1, "morning"))
+            App.drain_outbox()
+            self.assertEqual(len(App.parked_azkar), 1)
+            self.server.reachable = True
+            self.assertTrue(self.health.probe())
+            App.drain_outbox()
+            self.assertEqual(App.parked_azkar, {})
+        (params,) = self.outbox_inserts()
+        self.assertEqual(params[4], due_at)
+
+    def test_drain_skips_while_down(self):
+        """Test that a drain claims nothing and logs no error while PostgreSQL is down"""
+        self.go_down()
+        with patch.object(App, "claim_outbox_batch") as claim, patch.object(App.logger, "error") as error:
+            self.assertEqual(App.drain_outbox(), 0)
+        claim.assert_not_called()
+        error.assert_not_called()
+
+    def test_drain_stops_when_connection_fails(self):
+        """Test that a drain whose claim finds PostgreSQL gone stops without an error"""
+        self.server.reachable = False
+        with patch.object(App.logger, "error") as error:
+            self.assertEqual(App.drain_outbox(), 0)
+        # Only the health transition itself is logged as an error
+        self.assertEqual([c.args[0].split(",")[0] for c in error.call_args_list], ["PostgreSQL marked down"])
+        self.assertEqual(self.health.state, App.DB_DOWN)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+"""
+Tests for outbound API priority lanes and the shared rate limiter.
+"""
+
+import os
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+from App import PriorityRateLimiter, API_LANE_INTERACTIVE, API_LANE_SCHEDULED, API_LANE_LOW
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestPriorityRateLimiter(unittest.TestCase):
+    """Test lane reserves in the token bucket"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = PriorityRateLimiter(
+            rate=10, burst=10,
+            reserves={API_LANE_INTERACTIVE: 0, API_LANE_SCHEDULED: 3, API_LANE_LOW: 6},
+            clock=self.clock, sleep=self.clock.sleep)
+
+    def drain(self, lane):
+        taken = 0
+        while self.limiter.try_acquire(lane) == 0:
+            taken += 1
+        return taken
+
+    def test_lower_lanes_leave_reserve(self):
+        """Test that each lane stops at its reserve"""
+        self.assertEqual(self.drain(API_LANE_LOW), 4)
+        self.assertEqual(self.drain(API_LANE_SCHEDULED), 3)
+        self.assertEqual(self.drain(API_LANE_INTERACTIVE), 3)
+
+    def test_interactive_not_delayed_by_broadcast(self):
+        """Test that interactive calls get a token immediately during a broadcast"""
+        self.drain(API_LANE_SCHEDULED)
+        self.assertGreater(self.limiter.try_acquire(API_LANE_SCHEDULED), 0)
+        self.assertEqual(self.limiter.acquire(API_LANE_INTERACTIVE), 0.0)
+
+    def test_acquire_waits_for_refill(self):
+        """Test that a blocked lane waits for the bucket to refill past its reserve"""
+        self.drain(API_LANE_SCHEDULED)
+        waited = self.limiter.acquire(API_LANE_SCHEDULED)
+        self.assertAlmostEqual(waited, 0.1, places=6)
+
+
+class TestBudgetValidation(unittest.TestCase):
+    """Test that a configured budget always lets every lane through"""
+
+    def test_reserve_clamped_to_burst(self):
+        """Test that a reserve too large for the burst is capped so the low lane still gets tokens"""
+        for rate, reserve, expected in ((10, 5, 4.5), (11, 5, 5), (1, 5, 0), (30, -1, 0)):
+            with self.subTest(rate=rate, reserve=reserve):
+                self.assertEqual(App.api_budget(rate, reserve)[2], expected)
+                limiter = App.build_api_limiter(rate, reserve)
+                self.assertEqual(limiter.try_acquire(API_LANE_LOW), 0.0)
+
+    def test_non_positive_rate_uses_default(self):
+        """Test that a zero or negative rate falls back to the default instead of dividing by zero"""
+        for rate in (0, -3):
+            with self.subTest(rate=rate):
+                limiter = App.build_api_limiter(rate, 5)
+                self.assertEqual(limiter.rate, 30.0)
+
+    def test_rate_below_one_still_holds_a_token(self):
+        """Test that a fractional rate keeps a burst of one token"""
+        limiter = App.build_api_limiter(0.5, 5)
+        self.assertEqual(limiter.burst, 1.0)
+        self.assertEqual(limiter.try_acquire(API_LANE_LOW), 0.0)
+        self.assertAlmostEqual(limiter.try_acquire(API_LANE_LOW), 2.0, places=2)
+
+    def test_limiter_rejects_unusable_config(self):
+        """Test that the limiter refuses a rate of zero or a lane that could never get a token"""
+        reserves = {API_LANE_INTERACTIVE: 0, API_LANE_SCHEDULED: 5, API_LANE_LOW: 10}
+        with self.assertRaises(ValueError):
+            PriorityRateLimiter(rate=0, burst=30, reserves=reserves)
+        with self.assertRaises(ValueError):
+            PriorityRateLimiter(rate=10, burst=10, reserves=reserves)
+        PriorityRateLimiter(rate=11, burst=11, reserves=reserves)
+
+
+class TestLaneSelection(unittest.TestCase):
+    """Test how outbound calls are assigned to lanes"""
+
+    def test_default_lanes(self):
+        """Test that update processing is interactive and background work is scheduled"""
+        self.assertEqual(App.current_api_lane(), API_LANE_SCHEDULED)
+        App.update_timing.segments = {"db": 0.0, "api": 0.0}
+        try:
+            self.assertEqual(App.current_api_lane(), API_LANE_INTERACTIVE)
+        finally:
+            App.update_timing.segments = None
+
+    def test_diverse_azkar_runs_in_low_lane(self):
+        """Test that diverse azkar API calls use the low-priority lane"""
+        lanes = []
+        settings = {"enabled": True, "interval_minutes": 5, "chat_enabled": True,
+                    "enable_audio": False, "enable_images": False, "enable_pdf": False, "enable_text": True}
+        with patch.object(App.bot, "send_message", side_effect=lambda *a, **k: lanes.append(App.current_api_lane())), \
+             patch.object(App, "record_diverse_delivery"):
+            App.send_diverse_azkar(-1009700000001, settings)
+        self.assertEqual(lanes, [API_LANE_LOW])
+        self.assertEqual(App.current_api_lane(), API_LANE_SCHEDULED)
+
+    def test_request_sender_acquires_lane_slot(self):
+        """Test that every Bot API request goes through the limiter"""
+        session = MagicMock()
+        calls = App.API_CALLS.value("interactive")
+        with patch.object(App.api_sessions, "session", session, create=True), \
+             patch.object(App.api_limiter, "acquire", return_value=0.0) as acquire:
+            App.update_timing.segments = {"db": 0.0, "api": 0.0}
+            try:
+                App.timed_api_request("post", "https://api.telegram.org/botX/answerCallbackQuery")
+            finally:
+                App.update_timing.segments = None
+        acquire.assert_called_once_with(API_LANE_INTERACTIVE)
+        session.request.assert_called_once()
+        self.assertEqual(App.API_CALLS.value("interactive"), calls + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
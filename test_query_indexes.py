@@ -0,0 +1,79 @@
+"""
+Tests that the hot admin and scheduling queries are served by indexes.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+
+class TestQueryPlans(unittest.TestCase):
+    """Test EXPLAIN QUERY PLAN output on a freshly migrated SQLite database"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        db_file = os.path.join(cls.tmp.name, "plans.db")
+        with patch.object(App, "DB_FILE", db_file):
+            App.migrate_sqlite_schema()
+        cls.conn = sqlite3.connect(db_file)
+        # Mostly disabled chats, as left behind by groups that removed the bot
+        cls.conn.executemany("INSERT INTO chat_settings (chat_id, flags) VALUES (?, ?)",
+                             [(-100 - i, App.CHAT_FLAGS_DEFAULT if i % 10 == 0 else 0) for i in range(500)])
+        cls.conn.executemany("INSERT INTO admins (user_id, chat_id) VALUES (?, ?)",
+                             [(i % 50, -100 - i) for i in range(500)])
+        cls.conn.execute("ANALYZE")
+        cls.conn.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        cls.tmp.cleanup()
+
+    def plan(self, query, params=()):
+        return " | ".join(row[3] for row in self.conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+
+    def test_enabled_chats_use_partial_index(self):
+        """Test that the enabled-chats query reads the partial index"""
+        plan = self.plan(f"SELECT chat_id FROM chat_settings WHERE {App.chat_flags_sql('is_enabled')}")
+        self.assertIn("idx_chat_settings_enabled", plan)
+
+    def test_delivery_plan_query_uses_partial_index(self):
+        """Test that the streaming plan query starts from the partial index"""
+        plan = self.plan(f'''
+            SELECT s.chat_id, s.flags, s.morning_time, f.reminder_time
+            FROM chat_settings s LEFT JOIN fasting_reminders f ON f.chat_id = s.chat_id
+            WHERE {App.chat_flags_sql("is_enabled", column="s.flags")}
+        ''')
+        self.assertIn("idx_chat_settings_enabled", plan)
+
+    def test_negative_chat_ids_use_primary_key(self):
+        """Test that chat_id < 0 is a primary key range search"""
+        self.assertIn("SEARCH chat_settings USING INTEGER PRIMARY KEY", self.plan(
+            "SELECT chat_id FROM chat_settings WHERE chat_id < 0"))
+
+    def test_admin_user_queries_are_covered(self):
+        """Test that per-user admin queries are answered from a covering index"""
+        for query in ("SELECT DISTINCT chat_id FROM admins WHERE user_id = ?",
+                      "SELECT COUNT(*) FROM admins WHERE user_id = ?"):
+            plan = self.plan(query, (7,))
+            self.assertIn("COVERING INDEX", plan, query)
+            self.assertNotIn("SCAN", plan, query)
+
+    def test_admin_chat_queries_use_index(self):
+        """Test that per-chat admin lookups no longer scan the table"""
+        plan = self.plan("SELECT user_id FROM admins WHERE chat_id = ? AND is_primary_admin = 1", (-101,))
+        self.assertIn("idx_admins_chat", plan)
+        self.assertNotIn("SCAN", plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Tests for the prepared query layer.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+from App import PreparedQuery
+
+
+class TestPreparedQueryText(unittest.TestCase):
+    """Test the per-dialect SQL generated from one definition"""
+
+    def test_placeholders(self):
+        """Test that {p} becomes ? for SQLite and $n for PREPARE"""
+        query = PreparedQuery("pair", "SELECT a FROM t WHERE b = {p} AND c = {p}")
+        self.assertEqual(query.sqlite_sql, "SELECT a FROM t WHERE b = ? AND c = ?")
+        self.assertEqual(query.prepare_sql, "PREPARE pair AS SELECT a FROM t WHERE b = $1 AND c = $2")
+        self.assertEqual(query.execute_sql, "EXECUTE pair (%s, %s)")
+
+    def test_no_parameters(self):
+        """Test that a query without parameters is executed without an argument list"""
+        query = PreparedQuery("everything", "SELECT a FROM t")
+        self.assertEqual(query.execute_sql, "EXECUTE everything")
+
+
+class TestSQLiteQueries(unittest.TestCase):
+    """Test prepared queries on a temporary SQLite database"""
+
+    CHAT_ID = -1009800000046
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp.name, "queries.db")
+        self.db_patch = patch.object(App, "DB_FILE", self.db_file)
+        self.db_patch.start()
+        App.migrate_sqlite_schema()
+        conn = sqlite3.connect(self.db_file)
+        conn.executemany("INSERT INTO admins (user_id, chat_id, username, is_primary_admin) VALUES (?, ?, ?, ?)",
+                         [(1, self.CHAT_ID, "first", 1), (2, self.CHAT_ID, "second", 0)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        App.close_query_connection()
+        self.db_patch.stop()
+        self.tmp.cleanup()
+
+    def test_typed_rows(self):
+        """Test that rows come back as the query's row type"""
+        row = App.ADMIN_INFO_QUERY.one(1, self.CHAT_ID)
+        self.assertIsInstance(row, App.AdminRow)
+        self.assertEqual((row.username, row.is_primary_admin), ("first", 1))
+        self.assertEqual(sorted(r.user_id for r in App.CHAT_ADMINS_QUERY.all(self.CHAT_ID)), [1, 2])
+        self.assertEqual(App.USER_ADMIN_COUNT_QUERY.scalar(2), 1)
+        self.assertIsNone(App.ADMIN_INFO_QUERY.one(3, self.CHAT_ID))
+
+    def test_getters_use_queries(self):
+        """Test that the admin getters return the same dicts as before"""
+        self.assertEqual(App.get_admin_info(2, self.CHAT_ID)["username"], "second")
+        admins = App.get_all_admins_for_chat(self.CHAT_ID)
+        self.assertEqual({a["user_id"]: a["is_primary_admin"] for a in admins}, {1: True, 2: False})
+        self.assertTrue(App.is_user_admin_in_any_group(1))
+
+    def test_connection_reused_per_thread(self):
+        """Test that a thread keeps one connection and other threads get their own"""
+        first = App.query_connection()
+        App.ADMIN_INFO_QUERY.one(1, self.CHAT_ID)
+        self.assertIs(App.query_connection(), first)
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(App.query_connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], first)
+
+    def test_reopened_when_database_changes(self):
+        """Test that a cached connection is replaced when DB_FILE changes"""
+        first = App.query_connection()
+        with patch.object(App, "DB_FILE", os.path.join(self.tmp.name, "other.db")):
+            self.assertIsNot(App.query_connection(), first)
+
+    def test_failed_query_drops_connection(self):
+        """Test that a failing statement does not leave its connection behind"""
+        first = App.query_connection()
+        with self.assertRaises(sqlite3.OperationalError):
+            PreparedQuery("broken", "SELECT missing FROM admins").one()
+        self.assertIsNot(App.query_connection(), first)
+
+
+class TestPostgresQueries(unittest.TestCase):
+    """Test PREPARE/EXECUTE handling against a fake PostgreSQL connection"""
+
+    def fake_connection(self):
+        return MagicMock(is_postgres=True, prepared=set())
+
+    def test_prepared_once_per_connection(self):
+        """Test that a query is PREPAREd on first use and then only EXECUTEd"""
+        qc = self.fake_connection()
+        qc.cursor.fetchone.return_value = (3,)
+        with patch.object(App, "query_connection", return_value=qc):
+            App.USER_ADMIN_COUNT_QUERY.scalar(1)
+            App.USER_ADMIN_COUNT_QUERY.scalar(2)
+        statements = [call[0][0] for call in qc.cursor.execute.call_args_list]
+        self.assertEqual(statements, [App.USER_ADMIN_COUNT_QUERY.prepare_sql,
+                                      "EXECUTE user_admin_count (%s)", "EXECUTE user_admin_count (%s)"])
+
+    @unittest.skipUnless(App.POSTGRES_AVAILABLE, "psycopg2 is not installed")
+    def test_reconnects_after_lost_connection(self):
+        """Test that a dropped server connection is retried on a new one"""
+        stale, fresh = self.fake_connection(), self.fake_connection()
+        stale.prepared.add("user_admin_count")
+        stale.cursor.execute.side_effect = App.psycopg2.OperationalError("server closed the connection")
+        fresh.cursor.fetchone.return_value = (1,)
+        with patch.object(App, "query_connection", side_effect=[stale, fresh]), \
+             patch.object(App, "close_query_connection") as close:
+            self.assertEqual(App.USER_ADMIN_COUNT_QUERY.scalar(5), 1)
+        close.assert_called_once()
+        self.assertIn("user_admin_count", fresh.prepared)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Tests for the vectorized schedule columns.
+"""
+
+import os
+import sys
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+import schedule_columns
+from schedule_columns import ScheduleColumns
+
+
+def make_schedule(chat_id, **overrides):
+    settings = {
+        "morning_azkar": True, "evening_azkar": True, "sleep_message": False,
+        "friday_sura": True, "friday_dua": False,
+        "morning_time": "05:00", "evening_time": "18:00", "sleep_time": "22:00",
+    }
+    settings.update(overrides)
+    return chat_id, settings, {"monday_thursday_enabled": True, "reminder_time": "21:00"}
+
+
+def send_minute(chat_id, hour, minute):
+    return App.send_second_of_day(chat_id, hour, minute) // 60
+
+
+class TestSendSeconds(unittest.TestCase):
+    """Test the weekday-independent send times shared by the plan and the columns"""
+
+    def test_disabled_and_invalid_times_skipped(self):
+        """Test that disabled categories and invalid times have no send time"""
+        chat_id, settings, fasting = make_schedule(-1, evening_time="25:99")
+        seconds = App.chat_send_seconds(chat_id, settings, fasting)
+        self.assertEqual(set(seconds), {"morning", "friday_kahf", "fasting_monday_thursday"})
+
+    def test_weekday_gating(self):
+        """Test that Friday and fasting categories only apply on their days"""
+        self.assertTrue(App.plan_category_applies("morning", 0))
+        self.assertTrue(App.plan_category_applies("friday_kahf", 4))
+        self.assertFalse(App.plan_category_applies("friday_dua", 3))
+        self.assertTrue(App.plan_category_applies("fasting_monday_thursday", 6))
+        self.assertFalse(App.plan_category_applies("fasting_monday_thursday", 0))
+
+    def test_load_without_numpy(self):
+        """Test that loading the columns is a no-op without NumPy"""
+        with patch.object(schedule_columns, "NUMPY_AVAILABLE", False), \
+             patch.object(App, "iter_enabled_chat_schedules") as rows:
+            self.assertIsNone(schedule_columns.load_schedule_columns())
+        rows.assert_not_called()
+
+
+@unittest.skipUnless(schedule_columns.NUMPY_AVAILABLE, "NumPy is not installed")
+class TestScheduleColumns(unittest.TestCase):
+    """Test the due-chat lookup over NumPy columns"""
+
+    def setUp(self):
+        self.columns = ScheduleColumns.from_schedules([
+            make_schedule(-101),
+            make_schedule(-102, morning_azkar=False),
+            make_schedule(-103, morning_time="06:00"),
+        ])
+
+    def test_column_types(self):
+        """Test that the columns use compact dtypes"""
+        self.assertEqual(len(self.columns), 3)
+        self.assertEqual(self.columns.chat_ids.dtype, schedule_columns.np.int64)
+        self.assertEqual(self.columns.minutes["morning"].dtype, schedule_columns.np.uint16)
+        self.assertEqual(self.columns.flags.dtype, schedule_columns.np.uint8)
+
+    def test_due_chats_matches_minute_and_flag(self):
+        """Test that only enabled chats at that minute are due"""
+        due = self.columns.due_chats(send_minute(-101, 5, 0), 0)
+        self.assertEqual(due["morning"].tolist(), [-101])
+        self.assertNotIn(-102, due.get("morning", schedule_columns.np.array([])).tolist())
+
+    def test_due_chats_respects_weekday(self):
+        """Test that Friday categories are only due on Fridays"""
+        minute = send_minute(-101, 9, 0)
+        self.assertIn(-101, self.columns.due_chats(minute, 4)["friday_kahf"].tolist())
+        self.assertNotIn("friday_kahf", self.columns.due_chats(minute, 3))
+
+    def test_agrees_with_plan(self):
+        """Test that the columns yield the same deliveries as the per-chat plan"""
+        day = date(2026, 10, 25)
+        schedules = [make_schedule(-200 - i, morning_time="%02d:%02d" % (4 + i % 3, i % 60)) for i in range(50)]
+        columns = ScheduleColumns.from_schedules(schedules)
+        expected = sorted((second // 60, chat_id, category)
+                          for chat_id, settings, fasting in schedules
+                          for second, category in App.plan_entries_for_chat(chat_id, settings, fasting, day))
+        found = sorted((minute, chat_id, category)
+                       for minute in range(24 * 60)
+                       for category, chat_ids in columns.due_chats(minute, day.weekday()).items()
+                       for chat_id in chat_ids.tolist())
+        self.assertEqual(found, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Tests for the versioned schema migration runner.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+from App import SchemaMigration
+
+
+class CountingConnection:
+    """sqlite3 connection wrapper counting the statements run through its cursors"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = []
+
+    def cursor(self):
+        wrapper = self
+        cursor = self.conn.cursor()
+
+        class Cursor:
+            def execute(self, sql, params=()):
+                wrapper.statements.append(sql)
+                return cursor.execute(sql, params)
+
+            def fetchone(self):
+                return cursor.fetchone()
+
+            def fetchall(self):
+                return cursor.fetchall()
+
+        return Cursor()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ("conn", "statements"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.conn, name, value)
+
+
+class TestMigrationRunner(unittest.TestCase):
+    """Test applying numbered migrations to SQLite"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp.name, "schema.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def migrate(self):
+        with patch.object(App, "DB_FILE", self.db_file):
+            return App.migrate_sqlite_schema()
+
+    def test_fresh_database_reaches_latest_version(self):
+        """Test that an empty database gets every table and all versions recorded"""
+        self.assertEqual(self.migrate(), App.SQLITE_MIGRATIONS[-1].version)
+        conn = sqlite3.connect(self.db_file)
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        versions = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+        conn.close()
+        self.assertTrue({"chat_settings", "diverse_azkar_settings", "fasting_reminders", "outbox"} <= tables)
+        self.assertEqual(versions, [m.version for m in App.SQLITE_MIGRATIONS])
+
+    def test_backends_share_version_numbers(self):
+        """Test that each version number describes the same change on SQLite and PostgreSQL"""
+        self.assertEqual([(m.version, m.description) for m in App.SQLITE_MIGRATIONS],
+                         [(m.version, m.description) for m in App.POSTGRES_MIGRATIONS])
+
+    def test_current_database_costs_one_select(self):
+        """Test that an up-to-date database only reads schema_version"""
+        self.migrate()
+        conn = CountingConnection(sqlite3.connect(self.db_file))
+        try:
+            App.run_schema_migrations(conn, App.SQLITE_MIGRATIONS, is_postgres=False)
+        finally:
+            conn.close()
+        self.assertEqual(conn.statements, ["SELECT MAX(version) FROM schema_version"])
+
+    def test_only_pending_migrations_run(self):
+        """Test that a new migration runs once on top of the applied ones"""
+        self.migrate()
+        extra = SchemaMigration(App.SQLITE_MIGRATIONS[-1].version + 1, "Test table",
+                                ("CREATE TABLE test_extra (id INTEGER)",))
+        migrations = App.SQLITE_MIGRATIONS + (extra,)
+        conn = sqlite3.connect(self.db_file)
+        try:
+            self.assertEqual(App.run_schema_migrations(conn, migrations, is_postgres=False), extra.version)
+            self.assertEqual(App.run_schema_migrations(conn, migrations, is_postgres=False), extra.version)
+        finally:
+            conn.close()
+
+    def test_failed_migration_rolls_back(self):
+        """Test that a failing step leaves neither its DDL nor its version behind"""
+        self.migrate()
+        version = App.SQLITE_MIGRATIONS[-1].version + 1
+        broken = SchemaMigration(version, "Broken", ("CREATE TABLE half_done (id INTEGER)", "NOT SQL"))
+        conn = sqlite3.connect(self.db_file)
+        try:
+            with self.assertRaises(sqlite3.Error):
+                App.run_schema_migrations(conn, App.SQLITE_MIGRATIONS + (broken,), is_postgres=False)
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            latest = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+        finally:
+            conn.close()
+        self.assertNotIn("half_done", tables)
+        self.assertEqual(latest, version - 1)
+
+    def test_pre_versioning_database_upgraded(self):
+        """Test that a database from before versioning gets its missing columns"""
+        conn = sqlite3.connect(self.db_file)
+        conn.execute("CREATE TABLE diverse_azkar_settings (chat_id INTEGER PRIMARY KEY, enabled INTEGER)")
+        conn.commit()
+        conn.close()
+        self.migrate()
+        conn = sqlite3.connect(self.db_file)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(diverse_azkar_settings)")}
+        conn.close()
+        self.assertTrue({"enable_audio", "next_due", "sent_count"} <= columns)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Tests for deterministic per-chat spreading of scheduled send times.
+"""
+
+import os
+import sys
+import unittest
+from collections import Counter
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+
+class TestSendOffset(unittest.TestCase):
+    """Test the per-chat offset"""
+
+    def test_offset_is_deterministic_and_in_window(self):
+        """Test that a chat always gets the same offset inside the window"""
+        for chat_id in (-1001234567890, -1001234567891, -42, 42):
+            offset = App.chat_send_offset(chat_id)
+            self.assertEqual(offset, App.chat_send_offset(chat_id))
+            self.assertTrue(0 <= offset < App.SEND_JITTER_WINDOW_SECONDS)
+
+    def test_offsets_spread_evenly(self):
+        """Test that consecutive chat IDs are spread across the whole window"""
+        window = App.SEND_JITTER_WINDOW_SECONDS
+        buckets = Counter(App.chat_send_offset(-1001000000000 - i) * 5 // window for i in range(10000))
+        self.assertEqual(set(buckets), set(range(5)))
+        for count in buckets.values():
+            self.assertTrue(1500 < count < 2500, buckets)
+
+    def test_zero_window_disables_spreading(self):
+        """Test that a zero window keeps the configured time"""
+        with patch.object(App, "SEND_JITTER_WINDOW_SECONDS", 0):
+            self.assertEqual(App.jittered_time(-100123, 5, 0), (5, 0, 0))
+
+    def test_offset_never_crosses_midnight(self):
+        """Test that late times are shifted backwards to stay on the same day"""
+        with patch.object(App, "chat_send_offset", return_value=240):
+            self.assertEqual(App.jittered_time(-100123, 23, 58), (23, 54, 0))
+            self.assertEqual(App.jittered_time(-100123, 5, 0), (5, 4, 0))
+
+
+class TestJitteredSchedule(unittest.TestCase):
+    """Test that jobs and the schedule view use the effective time"""
+
+    CHAT_ID = -1009900000001
+
+    def test_plan_entries_use_effective_time(self):
+        """Test that planned entries carry the chat's hour, minute and second"""
+        settings = {"morning_azkar": True, "evening_azkar": False, "sleep_message": False,
+                    "friday_sura": True, "friday_dua": False, "morning_time": "05:00"}
+        friday = date(2026, 10, 23)
+        entries = dict((category, second) for second, category in
+                       App.plan_entries_for_chat(self.CHAT_ID, settings, None, friday))
+        h, m, sec = App.jittered_time(self.CHAT_ID, 5, 0)
+        self.assertEqual(entries["morning"], h * 3600 + m * 60 + sec)
+        self.assertIn("friday_kahf", entries)
+        monday = date(2026, 10, 19)
+        self.assertNotIn("friday_kahf", dict((c, s) for s, c in
+                                             App.plan_entries_for_chat(self.CHAT_ID, settings, None, monday)))
+
+    def test_status_shows_effective_time(self):
+        """Test that /status lists the effective send time"""
+        message = MagicMock()
+        message.chat.type = "supergroup"
+        message.chat.id = self.CHAT_ID
+        settings = App.get_chat_settings(self.CHAT_ID)
+        with patch.object(App.bot, "get_chat_member", return_value=MagicMock(status="creator")), \
+             patch.object(App, "get_chat_settings", return_value=settings), \
+             patch.object(App.bot, "send_message") as send:
+            App.cmd_status(message)
+        self.assertIn(App.effective_send_time(self.CHAT_ID, settings["morning_time"]), send.call_args.args[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Tests for the bit-packed chat_settings flags.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+from App import ChatSettings, CHAT_FLAG_BITS, CHAT_FLAGS_DEFAULT
+
+
+class TestChatSettingsObject(unittest.TestCase):
+    """Test the lazily decoded settings object"""
+
+    def test_defaults_decode(self):
+        """Test that the default flags decode to the column defaults"""
+        settings = ChatSettings(-1, CHAT_FLAGS_DEFAULT)
+        for key, default in App.CHAT_SETTING_FLAGS:
+            self.assertIs(settings[key], bool(default), key)
+        self.assertEqual(settings["morning_time"], "05:00")
+        self.assertEqual(settings.get("missing", "x"), "x")
+
+    def test_behaves_like_the_old_dict(self):
+        """Test that the object exposes the same keys as the old settings dict"""
+        settings = ChatSettings(-1, CHAT_FLAGS_DEFAULT)
+        self.assertEqual(len(dict(settings)), 16)
+        self.assertEqual(set(settings), set(App.ChatSettings.KEYS))
+        self.assertEqual(dict(settings)["chat_id"], -1)
+
+    def test_setitem_updates_bits(self):
+        """Test that writing a flag key flips only its bit"""
+        settings = ChatSettings(-1, CHAT_FLAGS_DEFAULT)
+        settings["is_enabled"] = False
+        self.assertEqual(settings.flags, CHAT_FLAGS_DEFAULT & ~CHAT_FLAG_BITS["is_enabled"])
+        settings["media_enabled"] = True
+        self.assertTrue(settings["media_enabled"])
+        self.assertTrue(settings["morning_azkar"])
+        with self.assertRaises(KeyError):
+            settings["unknown"] = 1
+
+    def test_object_is_compact(self):
+        """Test that a settings object is several times smaller than the dict it replaces"""
+        settings = ChatSettings(-1, CHAT_FLAGS_DEFAULT)
+        self.assertFalse(hasattr(settings, "__dict__"))
+        self.assertLess(sys.getsizeof(settings) * 4, sys.getsizeof(dict(settings)))
+
+    def test_flags_sql(self):
+        """Test the bitwise SQL filter helper"""
+        mask = CHAT_FLAG_BITS["is_enabled"] | CHAT_FLAG_BITS["morning_azkar"]
+        self.assertEqual(App.chat_flags_sql("is_enabled", "morning_azkar", column="s.flags"),
+                         f"(s.flags & {mask}) = {mask}")
+
+
+class TestFlagsStorage(unittest.TestCase):
+    """Test that flags are stored, kept in step and filterable in SQL"""
+
+    CHAT_ID = -1009800000001
+
+    def setUp(self):
+        App.get_chat_settings(self.CHAT_ID)
+
+    def tearDown(self):
+        App.update_chat_setting(self.CHAT_ID, "is_enabled", 1)
+        App.update_chat_setting(self.CHAT_ID, "sleep_message", 1)
+
+    def row(self):
+        conn, c, _ = App.get_db_connection()
+        try:
+            c.execute("SELECT flags, sleep_message FROM chat_settings WHERE chat_id = ?", (self.CHAT_ID,))
+            return c.fetchone()
+        finally:
+            conn.close()
+
+    def test_update_keeps_column_and_flags_in_step(self):
+        """Test that a flag update writes both the bit and the legacy column"""
+        App.update_chat_setting(self.CHAT_ID, "sleep_message", False)
+        flags, sleep_message = self.row()
+        self.assertEqual(sleep_message, 0)
+        self.assertEqual(flags & CHAT_FLAG_BITS["sleep_message"], 0)
+        self.assertFalse(App.get_chat_settings(self.CHAT_ID)["sleep_message"])
+
+    def test_bitwise_filter_selects_enabled(self):
+        """Test that the enabled filter follows the is_enabled bit"""
+        conn, c, _ = App.get_db_connection()
+        try:
+            query = f"SELECT chat_id FROM chat_settings WHERE {App.chat_flags_sql('is_enabled')}"
+            c.execute(query)
+            self.assertIn(self.CHAT_ID, [row[0] for row in c.fetchall()])
+            App.update_chat_setting(self.CHAT_ID, "is_enabled", 0)
+            c.execute(query)
+            self.assertNotIn(self.CHAT_ID, [row[0] for row in c.fetchall()])
+        finally:
+            conn.close()
+
+    def test_deactivation_clears_bit(self):
+        """Test that batched deactivation clears the is_enabled bit"""
+        with patch.object(App, "remove_chat_jobs"):
+            App.queue_chat_deactivation(self.CHAT_ID, App.TelegramErrorKind.BLOCKED)
+        App.flush_chat_deactivations()
+        flags, _ = self.row()
+        self.assertEqual(flags & CHAT_FLAG_BITS["is_enabled"], 0)
+
+
+class TestFlagsMigration(unittest.TestCase):
+    """Test the backfill of flags from the per-flag columns"""
+
+    def test_migration_backfills_flags(self):
+        """Test that an old-schema database gets flags computed from its columns"""
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = os.path.join(tmp, "old.db")
+            conn = sqlite3.connect(db_file)
+            conn.execute("""
+                CREATE TABLE chat_settings (
+                    chat_id INTEGER PRIMARY KEY, is_enabled INTEGER DEFAULT 1,
+                    morning_azkar INTEGER DEFAULT 1, evening_azkar INTEGER DEFAULT 1,
+                    friday_sura INTEGER DEFAULT 1, friday_dua INTEGER DEFAULT 1,
+                    sleep_message INTEGER DEFAULT 1, delete_service_messages INTEGER DEFAULT 1,
+                    morning_time TEXT, evening_time TEXT, sleep_time TEXT,
+                    media_enabled INTEGER DEFAULT 0, media_type TEXT,
+                    send_media_with_morning INTEGER DEFAULT 0, send_media_with_evening INTEGER DEFAULT 0,
+                    send_media_with_friday INTEGER DEFAULT 0
+                )
+            """)
+            conn.execute("INSERT INTO chat_settings (chat_id, evening_azkar, media_enabled) VALUES (-5, 0, 1)")
+            conn.commit()
+            conn.close()
+            with patch.object(App, "DB_FILE", db_file):
+                App.migrate_sqlite_schema()
+            conn = sqlite3.connect(db_file)
+            flags = conn.execute("SELECT flags FROM chat_settings WHERE chat_id = -5").fetchone()[0]
+            conn.close()
+        expected = (CHAT_FLAGS_DEFAULT & ~CHAT_FLAG_BITS["evening_azkar"]) | CHAT_FLAG_BITS["media_enabled"]
+        self.assertEqual(flags, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""
+Tests for the upsert-based get-or-create of settings rows.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+GETTERS = (
+    ("chat_settings", App.get_chat_settings),
+    ("diverse_azkar_settings", App.get_diverse_azkar_settings),
+    ("ramadan_settings", App.get_ramadan_settings),
+    ("hajj_eid_settings", App.get_hajj_eid_settings),
+    ("fasting_reminders", App.get_fasting_reminders_settings),
+)
+
+
+class TestSQLiteGetOrCreate(unittest.TestCase):
+    """Test the settings getters against a temporary SQLite database"""
+
+    CHAT_ID = -1009800000045
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp.name, "upsert.db")
+        self.db_patch = patch.object(App, "DB_FILE", self.db_file)
+        self.db_patch.start()
+        App.migrate_sqlite_schema()
+
+    def tearDown(self):
+        App.close_query_connection()
+        App.sqlite_writer.close()
+        self.db_patch.stop()
+        self.tmp.cleanup()
+
+    def traced_statements(self):
+        """Return the list the query connection's statements are appended to"""
+        statements = []
+        App.query_connection().conn.set_trace_callback(statements.append)
+        return statements
+
+    def rows(self, table):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE chat_id = ?", (self.CHAT_ID,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_first_touch_creates_defaults(self):
+        """Test that each getter creates its row with the column defaults"""
+        for table, getter in GETTERS:
+            with self.subTest(table=table):
+                settings = getter(self.CHAT_ID)
+                self.assertEqual(settings["chat_id"], self.CHAT_ID)
+                self.assertEqual(self.rows(table), 1)
+        self.assertEqual(App.get_chat_settings(self.CHAT_ID)["morning_time"], "05:00")
+        self.assertEqual(App.get_fasting_reminders_settings(self.CHAT_ID)["reminder_time"], "21:00")
+
+    def test_existing_row_is_one_select(self):
+        """Test that reading an existing row runs a single SELECT and no write"""
+        App.get_ramadan_settings(self.CHAT_ID)
+        statements = self.traced_statements()
+        App.get_ramadan_settings(self.CHAT_ID)
+        queries = [sql for sql in statements if sql.lstrip().upper().startswith(("SELECT", "INSERT", "BEGIN"))]
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].lstrip().startswith("SELECT"))
+
+    def test_first_touch_inserts_through_writer(self):
+        """Test that a miss is inserted by the writer thread, not the query connection"""
+        statements = self.traced_statements()
+        with patch.object(App.sqlite_writer, "execute", wraps=App.sqlite_writer.execute) as execute:
+            settings = App.get_hajj_eid_settings(self.CHAT_ID)
+        self.assertEqual(settings["chat_id"], self.CHAT_ID)
+        (writes,), _ = execute.call_args
+        self.assertEqual(len(writes), 1)
+        self.assertIn("INSERT INTO hajj_eid_settings", writes[0][0])
+        self.assertFalse([sql for sql in statements if "INSERT" in sql])
+        self.assertEqual(sum(sql.lstrip().startswith("SELECT") for sql in statements), 2)
+
+    def test_concurrent_first_touches(self):
+        """Test that many workers touching a new chat at once all get the row"""
+        start = threading.Barrier(10)
+        results, errors = [], []
+
+        def touch():
+            start.wait()
+            try:
+                results.append(App.get_fasting_reminders_settings(self.CHAT_ID))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=touch) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 10)
+        self.assertEqual(self.rows("fasting_reminders"), 1)
+
+
+class TestPostgresGetOrCreate(unittest.TestCase):
+    """Test the PostgreSQL statements issued by the settings row queries"""
+
+    def setUp(self):
+        self.qc = MagicMock(is_postgres=True, prepared=set())
+        self.connection_patch = patch.object(App, "query_connection", return_value=self.qc)
+        self.connection_patch.start()
+
+    def tearDown(self):
+        self.connection_patch.stop()
+
+    def executed(self):
+        return [call[0] for call in self.qc.cursor.execute.call_args_list]
+
+    def test_single_statement(self):
+        """Test that PostgreSQL reads or creates the row in one prepared CTE"""
+        self.qc.cursor.fetchone.return_value = (-1, 0, 1, 1, 1, "images")
+        row = App.RAMADAN_SETTINGS_ROW.get(-1)
+        self.assertEqual(row.chat_id, -1)
+        (prepare,), (execute, params) = self.executed()
+        self.assertIn("PREPARE fetch_or_create_ramadan_settings AS", prepare)
+        self.assertIn("WITH created AS", prepare)
+        self.assertIn("ON CONFLICT (chat_id) DO NOTHING", prepare)
+        self.assertEqual(execute, "EXECUTE fetch_or_create_ramadan_settings (%s, %s)")
+        self.assertEqual(params, (-1, -1))
+
+    def test_lost_race_falls_back_to_upsert(self):
+        """Test that an empty CTE result is retried with a returning upsert"""
+        self.qc.cursor.fetchone.side_effect = [None, (-1, 1, 0, "21:00")]
+        row = App.FASTING_REMINDERS_ROW.get(-1)
+        self.assertEqual(row.reminder_time, "21:00")
+        prepare = self.executed()[2][0]
+        self.assertIn("DO UPDATE SET chat_id = EXCLUDED.chat_id", prepare)
+        self.assertIn("RETURNING", prepare)
+        self.assertEqual(self.executed()[3], ("EXECUTE create_fasting_reminders (%s)", (-1,)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Tests for the SQLite connection tuning and the batching writer thread.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+
+class SQLiteTestCase(unittest.TestCase):
+    """Run each test against a freshly migrated temporary database"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.tmp.name, "writer.db")
+        self.db_patch = patch.object(App, "DB_FILE", self.db_file)
+        self.db_patch.start()
+        App.migrate_sqlite_schema()
+        self.writer = App.SQLiteWriter()
+
+    def tearDown(self):
+        self.db_patch.stop()
+        self.writer.close()
+        self.tmp.cleanup()
+
+    def query(self, sql, params=()):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+
+class TestConnectionTuning(SQLiteTestCase):
+    """Test the pragmas applied to SQLite connections"""
+
+    def test_database_uses_wal(self):
+        """Test that the migrated database is in WAL mode"""
+        self.assertEqual(self.query("PRAGMA journal_mode"), [("wal",)])
+
+    def test_connection_pragmas(self):
+        """Test that tuned connections relax fsync and wait on locks"""
+        conn = App.connect_sqlite()
+        try:
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], App.SQLITE_BUSY_TIMEOUT_MS)
+        finally:
+            conn.close()
+
+
+class TestSQLiteWriter(SQLiteTestCase):
+    """Test the single writer thread"""
+
+    INSERT = "INSERT INTO chat_settings (chat_id) VALUES (?)"
+
+    def test_write_returns_rowcounts(self):
+        """Test that a committed write reports each statement's rowcount"""
+        counts = self.writer.execute([(self.INSERT, (-1,)),
+                                      ("UPDATE chat_settings SET flags = 0 WHERE chat_id < 0", ())])
+        self.assertEqual(counts, [1, 1])
+        self.assertEqual(self.query("SELECT flags FROM chat_settings WHERE chat_id = -1"), [(0,)])
+
+    def test_returning_statement_yields_rows(self):
+        """Test that a statement with RETURNING resolves to its rows instead of a rowcount"""
+        results = self.writer.execute([(self.INSERT, (-1,)),
+                                       ("UPDATE chat_settings SET flags = 0 WHERE chat_id < 0 RETURNING chat_id", ())])
+        self.assertEqual(results, [1, [(-1,)]])
+
+    def test_concurrent_writes_are_batched(self):
+        """Test that writes queued from many threads share transactions"""
+        before = App.SQLITE_WRITE_BATCH_SIZE.count()
+        start = threading.Barrier(20)
+
+        def write(i):
+            start.wait()
+            for j in range(10):
+                self.writer.submit([(self.INSERT, (-1000 * (i + 1) - j,))])
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.writer.execute([(self.INSERT, (-1,))])
+
+        self.assertEqual(self.query("SELECT COUNT(*) FROM chat_settings"), [(201,)])
+        self.assertLess(App.SQLITE_WRITE_BATCH_SIZE.count() - before, 201)
+
+    def test_failed_write_is_isolated(self):
+        """Test that a failing write is reported while the rest of its batch commits"""
+        with patch.object(self.writer, "_run"):  # Hold the queue so all three land in one batch
+            first = self.writer.submit([(self.INSERT, (-1,))])
+            broken = self.writer.submit([(self.INSERT, (-2,)), (self.INSERT, (-1,))])
+            last = self.writer.submit([(self.INSERT, (-3,))])
+        batch = [self.writer.queue.get_nowait() for _ in range(3)]
+        self.writer._write_batch(batch)
+
+        self.assertEqual(first.result(), [1])
+        self.assertEqual(last.result(), [1])
+        with self.assertRaises(sqlite3.IntegrityError):
+            broken.result()
+        self.assertEqual(self.query("SELECT chat_id FROM chat_settings ORDER BY chat_id"), [(-3,), (-1,)])
+
+
+class TestDbWrite(SQLiteTestCase):
+    """Test setting updates routed through db_write"""
+
+    CHAT_ID = -1009800000044
+
+    def setUp(self):
+        super().setUp()
+        self.writer_patch = patch.object(App, "sqlite_writer", self.writer)
+        self.writer_patch.start()
+
+    def tearDown(self):
+        self.writer_patch.stop()
+        super().tearDown()
+
+    def test_setting_update_goes_through_writer(self):
+        """Test that update_chat_setting is committed by the writer thread"""
+        App.get_chat_settings(self.CHAT_ID)
+        with patch.object(self.writer, "execute", wraps=self.writer.execute) as execute:
+            App.update_chat_setting(self.CHAT_ID, "morning_time", "06:30")
+        execute.assert_called_once()
+        self.assertEqual(App.get_chat_settings(self.CHAT_ID)["morning_time"], "06:30")
+
+    def test_side_table_update_creates_row(self):
+        """Test that side-table updates insert the chat row when missing"""
+        App.update_fasting_reminder_setting(self.CHAT_ID, "reminder_time", "20:00")
+        self.assertEqual(self.query("SELECT reminder_time FROM fasting_reminders WHERE chat_id = ?",
+                                    (self.CHAT_ID,)), [("20:00",)])
+
+    def test_admin_upsert_keeps_primary(self):
+        """Test that re-saving an admin keeps their primary status and updates names"""
+        App.save_admin_info(1, self.CHAT_ID, "old", "A", None, is_primary_admin=True)
+        App.save_admin_info(1, self.CHAT_ID, "new", "A", None, is_primary_admin=False)
+        self.assertEqual(self.query("SELECT username, is_primary_admin FROM admins WHERE chat_id = ?",
+                                    (self.CHAT_ID,)), [("new", 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
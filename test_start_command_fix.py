@@ -157,8 +157,8 @@ class TestSecurityImprovements(unittest.TestCase):
             content = f.read()
         
         # Check for logic that prevents reassigning primary admin
-        self.assertIn('existing_primary = c.fetchone()', content)
-        self.assertIn("if existing_primary and existing_primary[0] != user_id:", content)
+        self.assertIn('existing_primary = PRIMARY_ADMIN_QUERY.scalar(chat_id)', content)
+        self.assertIn("if existing_primary is not None and existing_primary != user_id:", content)
 
 
 if __name__ == '__main__':
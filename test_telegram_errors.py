@@ -0,0 +1,171 @@
+"""
+Tests for Telegram error classification and batched chat deactivation.
+"""
+
+import os
+import sqlite3
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import telebot
+import App
+from App import TelegramErrorKind, classify_telegram_error
+
+
+def api_error(code, description, parameters=None):
+    result_json = {"error_code": code, "description": description}
+    if parameters:
+        result_json["parameters"] = parameters
+    return telebot.apihelper.ApiTelegramException("sendMessage", None, result_json)
+
+
+class TestClassifyTelegramError(unittest.TestCase):
+    """Test mapping of error_code and description to a typed outcome"""
+
+    def test_chat_gone_errors_deactivate(self):
+        """Test that blocked, kicked, deactivated and missing chats deactivate"""
+        cases = [
+            (403, "Forbidden: bot was blocked by the user", TelegramErrorKind.BLOCKED),
+            (403, "Forbidden: bot was kicked from the supergroup chat", TelegramErrorKind.KICKED),
+            (403, "Forbidden: user is deactivated", TelegramErrorKind.DEACTIVATED),
+            (400, "Bad Request: chat not found", TelegramErrorKind.CHAT_NOT_FOUND),
+            (403, "Forbidden: something new", TelegramErrorKind.FORBIDDEN),
+        ]
+        for code, description, kind in cases:
+            outcome = classify_telegram_error(api_error(code, description))
+            self.assertIs(outcome.kind, kind, description)
+            self.assertTrue(outcome.deactivate, description)
+
+    def test_flood_carries_retry_after(self):
+        """Test that 429 errors are floods with their retry_after hint"""
+        outcome = classify_telegram_error(
+            api_error(429, "Too Many Requests: retry after 7", {"retry_after": 7}))
+        self.assertIs(outcome.kind, TelegramErrorKind.FLOOD)
+        self.assertEqual(outcome.retry_after, 7)
+        self.assertFalse(outcome.deactivate)
+
+    def test_transient_and_unknown_errors_keep_chat(self):
+        """Test that server, rights, network and unknown errors do not deactivate"""
+        server = classify_telegram_error(api_error(502, "Bad Gateway"))
+        rights = classify_telegram_error(api_error(400, "Bad Request: not enough rights to send text messages to the chat"))
+        network = classify_telegram_error(App.requests.exceptions.ReadTimeout("read timed out"))
+        other = classify_telegram_error(api_error(400, "Bad Request: message is too long"))
+        self.assertIs(server.kind, TelegramErrorKind.SERVER_ERROR)
+        self.assertIs(rights.kind, TelegramErrorKind.NO_RIGHTS)
+        self.assertIs(network.kind, TelegramErrorKind.NETWORK)
+        self.assertIs(other.kind, TelegramErrorKind.OTHER)
+        self.assertFalse(any(o.deactivate for o in (server, rights, network, other)))
+
+    def test_plain_exception_uses_description(self):
+        """Test that errors without error_code fall back to description patterns"""
+        outcome = classify_telegram_error(Exception("Forbidden: bot was blocked by the user"))
+        self.assertIs(outcome.kind, TelegramErrorKind.BLOCKED)
+
+
+class TestBatchedDeactivation(unittest.TestCase):
+    """Test the deactivation queue and its batched flush"""
+
+    CHAT_IDS = (-1009400000001, -1009400000002)
+
+    def setUp(self):
+        App.scheduler.pause_job("deactivation_flush")
+        App.flush_chat_deactivations()
+        for chat_id in self.CHAT_IDS:
+            App.get_chat_settings(chat_id)
+            App.update_chat_setting(chat_id, "is_enabled", 1)
+
+    def tearDown(self):
+        App.flush_chat_deactivations()
+        App.scheduler.resume_job("deactivation_flush")
+
+    def is_enabled_in_db(self, chat_id):
+        conn, c, _ = App.get_db_connection()
+        try:
+            c.execute("SELECT is_enabled FROM chat_settings WHERE chat_id = ?", (chat_id,))
+            return bool(c.fetchone()[0])
+        finally:
+            conn.close()
+
+    def test_queue_drops_jobs_and_defers_update(self):
+        """Test that queuing drops jobs at once but writes nothing yet"""
+        with patch.object(App, "remove_chat_jobs") as remove_jobs, \
+             patch.object(App, "update_chat_setting") as update:
+            App.queue_chat_deactivation(self.CHAT_IDS[0], TelegramErrorKind.KICKED)
+            App.queue_chat_deactivation(self.CHAT_IDS[0], TelegramErrorKind.KICKED)
+        remove_jobs.assert_called_once_with(self.CHAT_IDS[0])
+        update.assert_not_called()
+        self.assertTrue(self.is_enabled_in_db(self.CHAT_IDS[0]))
+        self.assertFalse(App.get_chat_settings(self.CHAT_IDS[0])["is_enabled"])
+
+    def test_flush_disables_all_in_one_batch(self):
+        """Test that a flush disables every queued chat in one write"""
+        with patch.object(App, "remove_chat_jobs"):
+            for chat_id in self.CHAT_IDS:
+                App.queue_chat_deactivation(chat_id, TelegramErrorKind.BLOCKED)
+        with patch.object(App, "db_write", wraps=App.db_write) as db_write:
+            self.assertEqual(App.flush_chat_deactivations(), 2)
+        db_write.assert_called_once()
+        for chat_id in self.CHAT_IDS:
+            self.assertFalse(self.is_enabled_in_db(chat_id))
+            self.assertFalse(App.is_deactivation_pending(chat_id))
+
+    def test_failed_flush_requeues(self):
+        """Test that queued chats survive a failed flush"""
+        with patch.object(App, "remove_chat_jobs"):
+            App.queue_chat_deactivation(self.CHAT_IDS[0], TelegramErrorKind.BLOCKED)
+        with patch.object(App, "db_write", side_effect=sqlite3.OperationalError("database is locked")):
+            self.assertEqual(App.flush_chat_deactivations(), 0)
+        self.assertTrue(App.is_deactivation_pending(self.CHAT_IDS[0]))
+
+
+class TestSendPathsUseClassifier(unittest.TestCase):
+    """Test that the send paths queue deactivations instead of updating"""
+
+    CHAT_ID = -1009400000003
+
+    def setUp(self):
+        self.chat = {"is_enabled": True, "morning_azkar": True, "media_enabled": False}
+        self.patches = [
+            patch.object(App, "get_chat_settings", return_value=self.chat),
+            patch.object(App, "update_chat_setting"),
+            patch.object(App, "queue_chat_deactivation"),
+        ]
+        self.mocks = [p.start() for p in self.patches]
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_send_azkar_stops_and_queues_on_kick(self):
+        """Test that a kicked chat stops the message loop and is queued"""
+        error = api_error(403, "Forbidden: bot was kicked from the group chat")
+        with patch.object(App.bot, "send_message", side_effect=error) as send:
+            App.send_azkar(self.CHAT_ID, "morning")
+        self.assertEqual(send.call_count, 1)
+        _, update, queue = self.mocks
+        update.assert_not_called()
+        queue.assert_called_once_with(self.CHAT_ID, TelegramErrorKind.KICKED)
+
+    def test_fasting_reminder_queues_on_chat_not_found(self):
+        """Test that the fasting reminder uses the shared classifier"""
+        fasting = {"monday_thursday_enabled": True, "arafah_reminder_enabled": True}
+        with patch.object(App, "get_fasting_reminders_settings", return_value=fasting), \
+             patch.object(App.bot, "send_message", side_effect=api_error(400, "Bad Request: chat not found")):
+            App.send_fasting_reminder(self.CHAT_ID, "arafah")
+        self.mocks[2].assert_called_once_with(self.CHAT_ID, TelegramErrorKind.CHAT_NOT_FOUND)
+
+    def test_flood_does_not_deactivate(self):
+        """Test that a flood error neither deactivates nor stops the diverse path early"""
+        settings = {"enabled": True, "interval_minutes": 5, "chat_enabled": True,
+                    "enable_audio": False, "enable_images": False, "enable_pdf": False, "enable_text": True}
+        with patch.object(App.bot, "send_message", side_effect=api_error(429, "Too Many Requests: retry after 3")):
+            App.send_diverse_azkar(self.CHAT_ID, settings)
+        self.mocks[2].assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
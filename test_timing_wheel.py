@@ -0,0 +1,193 @@
+"""
+Tests for the diverse azkar timing wheel.
+"""
+
+import os
+import random
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+from App import TimingWheel
+
+
+class TestTimingWheel(unittest.TestCase):
+    """Test the hierarchical timing wheel data structure"""
+
+    def test_fires_exactly_at_due_tick_across_levels(self):
+        """Test that entries on every level and in overflow fire on their tick"""
+        start = 1_000_000 * 60 + 17
+        wheel = TimingWheel(start)
+        offsets = [1, 5, 42, 43, 60, 61, 119, 500, 1439, 1440, 1441, 3000]
+        for offset in offsets:
+            wheel.schedule(offset, start + offset)
+        fired_at = {}
+        for tick in range(start + 1, start + 3001):
+            for key, due in wheel.advance(tick):
+                self.assertEqual(due, tick)
+                fired_at[key] = tick
+        self.assertEqual(fired_at, {offset: start + offset for offset in offsets})
+        self.assertEqual(len(wheel), 0)
+
+    def test_matches_sorted_reference(self):
+        """Test that random schedules fire in the same ticks as a naive reference"""
+        rng = random.Random(7)
+        start = 123_457
+        wheel = TimingWheel(start)
+        expected = {}
+        for key in range(2000):
+            due = start + rng.randint(-5, 4000)
+            wheel.schedule(key, due)
+            expected[key] = max(due, start)
+        fired = {}
+        tick = start
+        while tick < start + 4001:
+            tick += rng.randint(1, 90)  # Uneven advances, as after a slow batch
+            for key, _ in wheel.advance(tick):
+                self.assertNotIn(key, fired)
+                fired[key] = tick
+        for key, due in expected.items():
+            self.assertGreaterEqual(fired[key], due)
+            self.assertLess(fired[key] - due, 91)
+
+    def test_overdue_fire_on_next_advance(self):
+        """Test that entries scheduled in the past fire on the next advance"""
+        wheel = TimingWheel(100)
+        wheel.schedule("late", 90)
+        self.assertEqual(wheel.advance(100), [("late", 90)])
+
+    def test_cancel_and_reschedule(self):
+        """Test that cancelled or moved entries do not fire at the old tick"""
+        wheel = TimingWheel(0)
+        wheel.schedule("a", 10)
+        wheel.schedule("b", 10)
+        self.assertTrue(wheel.cancel("a"))
+        self.assertFalse(wheel.cancel("a"))
+        wheel.schedule("b", 200)
+        self.assertEqual(wheel.advance(199), [])
+        self.assertEqual(wheel.advance(200), [("b", 200)])
+
+    def test_batch_of_thousands_in_one_tick(self):
+        """Test that thousands of chats due on the same tick fire as one batch"""
+        wheel = TimingWheel(0)
+        for chat_id in range(5000):
+            wheel.schedule(-chat_id - 1, 1)
+        self.assertEqual(len(wheel.advance(1)), 5000)
+
+
+class TestDiverseWheelScheduling(unittest.TestCase):
+    """Test scheduling diverse azkar on the shared wheel"""
+
+    CHAT_ID = -1009100000001
+
+    def setUp(self):
+        self.patches = [
+            patch.object(App, "save_diverse_next_due"),
+            patch.object(App, "wake_diverse_wheel"),
+        ]
+        self.save, self.wake = [p.start() for p in self.patches]
+
+    def tearDown(self):
+        App.cancel_diverse_azkar(self.CHAT_ID)
+        for p in self.patches:
+            p.stop()
+
+    def settings(self, **overrides):
+        settings = {"chat_id": self.CHAT_ID, "enabled": True, "interval_minutes": 5, "next_due": None}
+        settings.update(overrides)
+        return settings
+
+    def test_one_timer_for_all_chats(self):
+        """Test that diverse azkar use one scheduler job, not one per chat"""
+        App.schedule_diverse_azkar(self.CHAT_ID, self.settings())
+        self.assertIsNone(App.scheduler.get_job(f"diverse_azkar_{self.CHAT_ID}"))
+        self.assertIsNotNone(App.scheduler.get_job(App.DIVERSE_WHEEL_JOB_ID))
+
+    def test_newly_enabled_is_due_now(self):
+        """Test that a newly enabled chat is due immediately and wakes the wheel"""
+        App.schedule_diverse_azkar(self.CHAT_ID, self.settings())
+        self.assertLessEqual(App.diverse_wheel.due[self.CHAT_ID], App.current_wheel_tick())
+        self.wake.assert_called_once()
+
+    def test_resumes_from_persisted_next_due(self):
+        """Test that a persisted future next_due is honoured after restart"""
+        next_due = (App.current_wheel_tick() + 3) * App.DIVERSE_WHEEL_TICK_SECONDS
+        App.schedule_diverse_azkar(self.CHAT_ID, self.settings(next_due=next_due))
+        self.assertEqual(App.diverse_wheel.due[self.CHAT_ID] * App.DIVERSE_WHEEL_TICK_SECONDS, next_due)
+        self.save.assert_not_called()
+        self.wake.assert_not_called()
+
+    def test_disable_cancels_and_clears_next_due(self):
+        """Test that disabling removes the chat and clears its persisted next_due"""
+        App.schedule_diverse_azkar(self.CHAT_ID, self.settings())
+        App.schedule_diverse_azkar(self.CHAT_ID, self.settings(enabled=False))
+        self.assertNotIn(self.CHAT_ID, App.diverse_wheel)
+        self.save.assert_called_with({self.CHAT_ID: None})
+
+    def test_tick_fires_batch_and_reschedules(self):
+        """Test that a tick sends to due chats with one settings query and persists next_due"""
+        other = self.CHAT_ID - 1
+        for chat_id in (self.CHAT_ID, other):
+            App.schedule_diverse_azkar(chat_id, self.settings(chat_id=chat_id))
+        batch = {
+            self.CHAT_ID: dict(self.settings(), chat_enabled=True),
+            other: dict(self.settings(chat_id=other), chat_enabled=False),
+        }
+        now_tick = App.current_wheel_tick()
+        try:
+            with patch.object(App, "get_diverse_azkar_settings_batch", return_value=batch) as load, \
+                 patch.object(App, "send_diverse_azkar") as send:
+                App.run_diverse_wheel_tick()
+            load.assert_called_once()
+            send.assert_called_once_with(self.CHAT_ID, batch[self.CHAT_ID])
+            self.assertEqual(App.diverse_wheel.due[self.CHAT_ID], now_tick + 5)
+            self.assertNotIn(other, App.diverse_wheel)
+            persisted = self.save.call_args.args[0]
+            self.assertEqual(persisted[self.CHAT_ID], (now_tick + 5) * App.DIVERSE_WHEEL_TICK_SECONDS)
+            self.assertIsNone(persisted[other])
+        finally:
+            App.cancel_diverse_azkar(other)
+
+
+class TestDiverseBatchQueries(unittest.TestCase):
+    """Test the batched diverse settings queries against SQLite"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patches = [patch.object(App, "DB_FILE", os.path.join(self.tmp.name, "wheel.db")),
+                        patch.object(App, "DATABASE_URL", None)]
+        for p in self.patches:
+            p.start()
+        App.migrate_sqlite_schema()
+
+    def tearDown(self):
+        App.close_query_connection()
+        App.sqlite_writer.close()
+        for p in reversed(self.patches):
+            p.stop()
+        self.tmp.cleanup()
+
+    def test_batch_load_and_next_due_roundtrip(self):
+        """Test that next_due is saved in one batch and loaded with chat_enabled"""
+        chat_ids = [-1009200000001, -1009200000002]
+        for chat_id in chat_ids:
+            App.get_chat_settings(chat_id)
+            App.update_diverse_azkar_setting(chat_id, "enabled", 1)
+        App.update_chat_setting(chat_ids[1], "is_enabled", 0)
+        App.save_diverse_next_due({chat_ids[0]: 1234560, chat_ids[1]: None})
+
+        batch = App.get_diverse_azkar_settings_batch(chat_ids + [-1])
+        self.assertEqual(set(batch), set(chat_ids))
+        self.assertEqual(batch[chat_ids[0]]["next_due"], 1234560)
+        self.assertTrue(batch[chat_ids[0]]["chat_enabled"])
+        self.assertFalse(batch[chat_ids[1]]["chat_enabled"])
+        self.assertIsNone(batch[chat_ids[1]]["next_due"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Tests for per-update timing, segment breakdown and the slow-update log.
+"""
+
+import json
+import os
+import sys
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+
+def make_update(text="/status", chat_type="private"):
+    return App.types.Update.de_json(json.dumps({
+        "update_id": 77,
+        "message": {
+            "message_id": 1,
+            "date": 0,
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+            "chat": {"id": 555, "type": chat_type},
+            "from": {"id": 555, "is_bot": False, "first_name": "T"},
+        },
+    }))
+
+
+def slow_api_response(delay):
+    def request(method, url, **kwargs):
+        time.sleep(delay)
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = {
+            "ok": True,
+            "result": {"message_id": 2, "date": 0, "chat": {"id": 555, "type": "private"}},
+        }
+        return response
+    return request
+
+
+class TestRecentLatencySummary(unittest.TestCase):
+    """Test the ring-buffer percentile summary"""
+
+    def setUp(self):
+        self.registry = list(App.metrics_registry)
+
+    def tearDown(self):
+        App.metrics_registry[:] = self.registry
+
+    def test_window_evicts_old_samples(self):
+        """Test that only the most recent samples contribute to percentiles"""
+        summary = App.RecentLatencySummary("test_recent", "Recent", ("handler",), window=10)
+        for _ in range(10):
+            summary.observe(5.0, "h")
+        for value in range(10):
+            summary.observe(value / 100, "h")
+        quantiles = summary.percentiles()[("h",)]
+        self.assertEqual(quantiles[0.5], 0.05)
+        self.assertEqual(quantiles[0.99], 0.09)
+        lines = summary.collect()
+        self.assertIn('azkar_test_recent{handler="h",quantile="0.5"} 0.05', lines)
+        self.assertIn('azkar_test_recent_count{handler="h"} 20', lines)
+
+
+class TestUpdateTiming(unittest.TestCase):
+    """Test end-to-end update timing"""
+
+    def setUp(self):
+        App.instrument_bot_handlers()
+        App.api_sessions.session = MagicMock()
+        App.api_sessions.session.request.side_effect = slow_api_response(0.02)
+
+    def tearDown(self):
+        App.api_sessions.session = None
+
+    def test_update_attributed_to_handler_with_api_segment(self):
+        """Test that an update is attributed to its handler and API time is split out"""
+        with patch.object(App, "record_update_timing") as record:
+            App.process_update_timed(make_update())
+        update, handler, total, segments = record.call_args.args
+        self.assertEqual(handler, "cmd_status")
+        self.assertGreaterEqual(segments["api"], 0.02)
+        self.assertGreaterEqual(total, segments["api"])
+        self.assertIsNone(App.update_timing.segments)
+
+    def test_slow_update_logged_with_breakdown(self):
+        """Test that updates over the threshold are logged with their breakdown"""
+        with patch.object(App, "SLOW_UPDATE_THRESHOLD_SECONDS", 0.0), \
+             self.assertLogs(App.logger, "WARNING") as logs:
+            App.process_update_timed(make_update())
+        line = next(l for l in logs.output if "Slow update" in l)
+        self.assertIn("handled by cmd_status", line)
+        for part in ("handler=", "db=", "api="):
+            self.assertIn(part, line)
+
+    def test_fast_update_not_logged(self):
+        """Test that updates under the threshold are not logged as slow"""
+        with patch.object(App, "SLOW_UPDATE_THRESHOLD_SECONDS", 60.0), \
+             patch.object(App.logger, "warning") as warning:
+            App.process_update_timed(make_update())
+        self.assertFalse(any("Slow update" in str(c) for c in warning.call_args_list))
+
+    def test_nested_db_time_counted_once(self):
+        """Test that nested timed DB calls only count toward the outermost call"""
+        @App.timed_db_query
+        def inner():
+            time.sleep(0.02)
+
+        @App.timed_db_query
+        def outer():
+            inner()
+
+        App.update_timing.segments = {"db": 0.0, "api": 0.0}
+        try:
+            start = time.perf_counter()
+            outer()
+            elapsed = time.perf_counter() - start
+            self.assertLessEqual(App.update_timing.segments["db"], elapsed)
+            self.assertGreaterEqual(App.update_timing.segments["db"], 0.02)
+        finally:
+            App.update_timing.segments = None
+
+    def test_no_attribution_outside_updates(self):
+        """Test that DB time on threads without an active update is not recorded"""
+        App.update_timing.segments = None
+        App.add_timing_segment("db", 1.0)
+        self.assertIsNone(App.update_timing.segments)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Tests for the batched write-behind of diverse azkar deliveries.
+"""
+
+import os
+import sqlite3
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("BOT_TOKEN", "123456:TEST_TOKEN")
+
+import App
+
+
+class TestDeliveryWriteBehind(unittest.TestCase):
+    """Test coalescing and flushing of buffered deliveries"""
+
+    CHAT_IDS = (-1009300000001, -1009300000002)
+
+    def setUp(self):
+        # Keep the periodic flush from racing the assertions
+        App.scheduler.pause_job("delivery_flush")
+        App.flush_delivery_buffer()
+        for chat_id in self.CHAT_IDS:
+            App.get_diverse_azkar_settings(chat_id)
+            App.update_diverse_azkar_setting(chat_id, "last_sent_timestamp", 0)
+
+    def tearDown(self):
+        App.flush_delivery_buffer()
+        App.scheduler.resume_job("delivery_flush")
+
+    def row(self, chat_id):
+        conn, c, _ = App.get_db_connection()
+        try:
+            c.execute("SELECT last_sent_timestamp, sent_count FROM diverse_azkar_settings WHERE chat_id = ?", (chat_id,))
+            return c.fetchone()
+        finally:
+            conn.close()
+
+    def test_deliveries_coalesce_per_chat(self):
+        """Test that repeated deliveries keep the latest timestamp and a count"""
+        App.record_diverse_delivery(self.CHAT_IDS[0], 200)
+        App.record_diverse_delivery(self.CHAT_IDS[0], 100)
+        App.record_diverse_delivery(self.CHAT_IDS[0], 300)
+        self.assertEqual(App.delivery_buffer[self.CHAT_IDS[0]], [300, 3])
+
+    def test_flush_writes_one_batch(self):
+        """Test that a flush writes every buffered chat in one write"""
+        count_before = self.row(self.CHAT_IDS[0])[1]
+        App.record_diverse_delivery(self.CHAT_IDS[0], 1000)
+        App.record_diverse_delivery(self.CHAT_IDS[0], 1001)
+        App.record_diverse_delivery(self.CHAT_IDS[1], 2000)
+        with patch.object(App, "db_write", wraps=App.db_write) as db_write:
+            self.assertEqual(App.flush_delivery_buffer(), 2)
+        db_write.assert_called_once()
+        self.assertEqual(self.row(self.CHAT_IDS[0]), (1001, count_before + 2))
+        self.assertEqual(self.row(self.CHAT_IDS[1])[0], 2000)
+        self.assertEqual(App.delivery_buffer, {})
+
+    def test_flush_never_moves_timestamp_backwards(self):
+        """Test that an older buffered timestamp does not overwrite a newer row"""
+        App.update_diverse_azkar_setting(self.CHAT_IDS[0], "last_sent_timestamp", 5000)
+        App.record_diverse_delivery(self.CHAT_IDS[0], 4000)
+        App.flush_delivery_buffer()
+        self.assertEqual(self.row(self.CHAT_IDS[0])[0], 5000)
+
+    def test_failed_flush_keeps_entries(self):
+        """Test that entries survive a failed flush and merge with new ones"""
+        App.record_diverse_delivery(self.CHAT_IDS[0], 10)
+        with patch.object(App, "db_write", side_effect=sqlite3.OperationalError("database is locked")):
+            self.assertEqual(App.flush_delivery_buffer(), 0)
+        App.record_diverse_delivery(self.CHAT_IDS[0], 20)
+        self.assertEqual(App.delivery_buffer[self.CHAT_IDS[0]], [20, 2])
+
+    def test_getter_sees_buffered_timestamp(self):
+        """Test that reads include deliveries that have not been flushed yet"""
+        App.record_diverse_delivery(self.CHAT_IDS[0], 7777)
+        self.assertEqual(App.get_diverse_azkar_settings(self.CHAT_IDS[0])["last_sent_timestamp"], 7777)
+
+    def test_send_buffers_instead_of_updating(self):
+        """Test that a successful diverse send does not write to the database"""
+        settings = {"enabled": True, "interval_minutes": 5, "chat_enabled": True,
+                    "enable_audio": False, "enable_images": False, "enable_pdf": False, "enable_text": True}
+        with patch.object(App.bot, "send_message"), \
+             patch.object(App, "update_diverse_azkar_setting") as update:
+            App.send_diverse_azkar(self.CHAT_IDS[1], settings)
+        update.assert_not_called()
+        self.assertEqual(App.delivery_buffer[self.CHAT_IDS[1]][1], 1)
+
+    def test_periodic_flush_job_registered(self):
+        """Test that the buffer is flushed on a short interval"""
+        job = App.scheduler.get_job("delivery_flush")
+        self.assertIsNotNone(job)
+        self.assertLessEqual(job.trigger.interval.total_seconds(), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()